@@ -52,12 +52,29 @@ import inspect
 import types
 import threading
 
+from pox.lib.util import str_to_bool
+
+
+def _unthreaded_selecthub ():
+  """
+  Checks the POX options for --unthreaded-sh
+
+  The scheduler is created along with core, which is before the options
+  are otherwise parsed, so this one is looked for early.
+  """
+  for arg in sys.argv[1:]:
+    if not arg.startswith("-"): break
+    name,_,value = arg.lstrip("-").partition("=")
+    if name.replace("-", "_") == "unthreaded_sh":
+      return True if value == "" else str_to_bool(value)
+  return False
+
+
 import pox.core
-core = pox.core.initialize()
+core = pox.core.initialize(threaded_selecthub = not _unthreaded_selecthub())
 
 import pox.openflow
 import pox.openflow.of_01
-from pox.lib.util import str_to_bool
 
 # Function to run on main thread
 _main_thread_function = None
@@ -353,6 +370,8 @@ Notable POX options include:
   --no-openflow   Don't automatically load the OpenFlow module
   --log-config=F  Load a Python log configuration file (if you include the
                   option without specifying F, it defaults to logging.cfg)
+  --unthreaded-sh Run the scheduler's I/O and timer waiting on the
+                  scheduler's own thread instead of a separate one
 
 C1, C2, etc. are component names (e.g., Python modules).  Options they
 support are up to the module.  As an example, you can load a learning
@@ -397,6 +416,10 @@ class POXOptions (Options):
       value = os.path.join(p, "..", "logging.cfg")
     self.log_config = value
 
+  def _set_unthreaded_sh (self, given_name, name, value):
+    # Handled before core is initialized; see _unthreaded_selecthub()
+    pass
+
   def _set_debug (self, given_name, name, value):
     value = str_to_bool(value)
     if value:
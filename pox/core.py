@@ -182,7 +182,7 @@ class POXCore (EventMixin):
     ComponentRegistered
   ])
 
-  def __init__ (self):
+  def __init__ (self, threaded_selecthub = True):
     self.debug = False
     self.running = True
     self.starting_up = True
@@ -195,7 +195,8 @@ class POXCore (EventMixin):
     self.version_name = "carp"
     print(self.banner)
 
-    self.scheduler = recoco.Scheduler(daemon=True)
+    self.scheduler = recoco.Scheduler(daemon=True,
+                                      threadedSelectHub=threaded_selecthub)
 
     self._waiters = [] # List of waiting components
 
@@ -556,9 +557,9 @@ class POXCore (EventMixin):
 
 core = None
 
-def initialize ():
+def initialize (threaded_selecthub = True):
   global core
-  core = POXCore()
+  core = POXCore(threaded_selecthub = threaded_selecthub)
   return core
 
 # The below is a big hack to make tests and doc tools work.
@@ -0,0 +1,140 @@
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Fixed-size pool of packet buffers for software datapaths
+
+Packets sent to the controller in PacketIns get buffered so that a later
+flow_mod or packet_out can refer to them by buffer_id.  The pool has a
+fixed number of fixed-size slots carved out of one preallocated bytearray,
+so its memory use is bounded no matter how many table misses there are.
+When it's full, the oldest buffered packet is evicted to make room.
+
+Each buffer_id carries the slot number in its low bits and a generation
+number in its high bits.  A slot's generation goes up each time it's
+reused, so a buffer_id which refers to an evicted packet can be told
+apart from one that's still valid.
+"""
+
+from collections import deque
+
+
+# Result codes for BufferPool.pop() failures
+UNKNOWN = "unknown"     # Never handed out, or evicted since
+EMPTY = "empty"         # Already used
+
+
+class BufferPool (object):
+  """
+  A bounded pool of packet buffers
+  """
+  def __init__ (self, capacity, slot_size = 2048, evict = True):
+    """
+    capacity is the number of packets which can be buffered at once.
+    slot_size is the largest packet which can be buffered.
+    If evict is True, buffering a packet when the pool is full evicts the
+    oldest one; otherwise, the new one isn't buffered.
+    """
+    self.capacity = max(0, capacity)
+    self.slot_size = slot_size
+    self.evict = evict
+
+    self._slot_bits = max(1, (self.capacity - 1).bit_length())
+    # Generations wrap before all 32 bits could be set, which would look
+    # like OpenFlow's "no buffer" ID.
+    self._max_generation = (1 << (32 - self._slot_bits)) - 2
+
+    self._arena = bytearray(self.capacity * slot_size)
+    self._lengths = [0] * self.capacity
+    self._in_ports = [None] * self.capacity
+    self._generations = [0] * self.capacity
+    self._used = [False] * self.capacity
+    self._free = range(self.capacity - 1, -1, -1)
+    self._order = deque() # (slot, generation) in the order buffered
+
+    self.evictions = 0
+
+  def __len__ (self):
+    """
+    Number of packets currently buffered
+    """
+    return self.capacity - len(self._free)
+
+  def _split (self, buffer_id):
+    slot = buffer_id & ((1 << self._slot_bits) - 1)
+    return slot, buffer_id >> self._slot_bits
+
+  def _evict_oldest (self):
+    order = self._order
+    while order:
+      slot,gen = order.popleft()
+      if self._used[slot] and self._generations[slot] == gen:
+        self._used[slot] = False
+        self._free.append(slot)
+        self.evictions += 1
+        return True
+    return False
+
+  def put (self, data, in_port = None):
+    """
+    Buffers a packed packet and returns its buffer_id
+
+    Returns None if the packet can't be buffered.
+    """
+    size = len(data)
+    if size > self.slot_size: return None
+    if not self._free:
+      if not self.evict or not self._evict_oldest():
+        return None
+    slot = self._free.pop()
+    gen = self._generations[slot] % self._max_generation + 1
+    self._generations[slot] = gen
+    self._used[slot] = True
+    self._lengths[slot] = size
+    self._in_ports[slot] = in_port
+    offset = slot * self.slot_size
+    self._arena[offset:offset+size] = data
+    self._order.append((slot, gen))
+    if len(self._order) > 2 * self.capacity:
+      # Lots of released buffers; throw their entries away
+      self._order = deque(o for o in self._order
+                          if self._used[o[0]]
+                          and self._generations[o[0]] == o[1])
+    return (gen << self._slot_bits) | slot
+
+  def check (self, buffer_id):
+    """
+    Returns None if buffer_id is valid, or else UNKNOWN or EMPTY
+    """
+    slot,gen = self._split(buffer_id)
+    if gen == 0 or slot >= self.capacity or self._generations[slot] != gen:
+      return UNKNOWN
+    if not self._used[slot]:
+      return EMPTY
+    return None
+
+  def pop (self, buffer_id):
+    """
+    Releases a buffer and returns (data, in_port)
+
+    If buffer_id isn't valid, returns (None, UNKNOWN) or (None, EMPTY).
+    """
+    err = self.check(buffer_id)
+    if err is not None: return (None, err)
+    slot = buffer_id & ((1 << self._slot_bits) - 1)
+    self._used[slot] = False
+    self._free.append(slot)
+    offset = slot * self.slot_size
+    data = bytes(self._arena[offset:offset+self._lengths[slot]])
+    return (data, self._in_ports[slot])
@@ -15,8 +15,14 @@
 """
 Software switch with PCap ports
 
+Ports use pxpcap by default.  On Linux, prefixing an interface name with
+"ring:" uses an AF_PACKET socket with mmap'd rings instead (see
+pox.lib.afpacket), which doesn't need pxpcap and reads packets straight
+out of memory shared with the kernel.
+
 Example:
 ./pox.py --no-openflow datapaths.pcap_switch --address=localhost
+./pox.py --no-openflow datapaths.pcap_switch --ports=ring:veth0,ring:veth2
 """
 
 from pox.core import core
@@ -24,10 +30,10 @@ from pox.datapaths import do_launch
 from pox.datapaths.switch import SoftwareSwitchBase, OFConnection
 from pox.datapaths.switch import ExpireMixin
 import pox.lib.pxpcap as pxpcap
+import pox.lib.afpacket as afpacket
 from Queue import Queue
 from threading import Thread
 import pox.openflow.libopenflow_01 as of
-from pox.lib.packet import ethernet
 import logging
 
 log = core.getLogger()
@@ -102,8 +108,10 @@ def launch (address = '127.0.0.1', port = 6633, max_retry_delay = 16,
   Launches a switch
   """
 
-  if not pxpcap.enabled:
-    raise RuntimeError("You need PXPCap to use this component")
+  _ports = ports.strip()
+  for p in _ports.split(","):
+    if p and _split_backend(p)[0] == "pcap" and not pxpcap.enabled:
+      raise RuntimeError("You need PXPCap to use pcap ports")
 
   if ctl_port:
     if core.hasComponent('ctld'):
@@ -116,7 +124,6 @@ def launch (address = '127.0.0.1', port = 6633, max_retry_delay = 16,
     ctl.server(ctl_port)
     core.ctld.addListenerByName("CommandEvent", _do_ctl)
 
-  _ports = ports.strip()
   def up (event):
     ports = [p for p in _ports.split(",") if p]
 
@@ -127,17 +134,33 @@ def launch (address = '127.0.0.1', port = 6633, max_retry_delay = 16,
   core.addListenerByName("UpEvent", up)
 
 
+def _split_backend (name):
+  """
+  Splits a port spec like "ring:eth0" into (backend, interface name)
+  """
+  if ":" in name:
+    backend,name = name.split(":", 1)
+    if backend not in ("pcap", "ring"):
+      raise RuntimeError("Unknown port backend '%s'" % (backend,))
+    return backend,name
+  return "pcap",name
+
+
 class PCapSwitch (ExpireMixin, SoftwareSwitchBase):
   # Default level for loggers of this class
   default_log_level = logging.INFO
 
+  # Most packets to take from a pcap port at once
+  pcap_batch_size = 100
+
   def __init__ (self, **kw):
     """
     Create a switch instance
 
     Additional options over superclass:
     log_level (default to default_log_level) is level for this instance
-    ports is a list of interface names
+    ports is a list of interface names (optionally prefixed by "pcap:" or
+      "ring:" to pick the backend)
     """
     log_level = kw.pop('log_level', self.default_log_level)
 
@@ -165,20 +188,40 @@ class PCapSwitch (ExpireMixin, SoftwareSwitchBase):
     self.t.start()
 
   def add_interface (self, name, port_no=-1, on_error=None, start=False):
+    """
+    Adds a port for an interface
+
+    name may be prefixed by "pcap:" or "ring:" to pick the backend.
+    """
     if on_error is None:
       on_error = log.error
 
-    devs = pxpcap.PCap.get_devices()
-    if name not in devs:
-      on_error("Device %s not available -- ignoring", name)
-      return
-    dev = devs[name]
-    if dev.get('addrs',{}).get('ethernet',{}).get('addr') is None:
-      on_error("Device %s has no ethernet address -- ignoring", name)
-      return
-    if dev.get('addrs',{}).get('AF_INET') != None:
-      on_error("Device %s has an IP address -- ignoring", name)
-      return
+    backend,name = _split_backend(name)
+    if backend == "ring":
+      if not afpacket.enabled:
+        on_error("AF_PACKET rings aren't available -- ignoring %s", name)
+        return
+      hw_addr = afpacket.get_hw_addr(name)
+      if hw_addr is None:
+        on_error("Device %s not available or has no ethernet address "
+                 "-- ignoring", name)
+        return
+      if afpacket.has_ipv4_addr(name):
+        on_error("Device %s has an IP address -- ignoring", name)
+        return
+    else:
+      devs = pxpcap.PCap.get_devices()
+      if name not in devs:
+        on_error("Device %s not available -- ignoring", name)
+        return
+      dev = devs[name]
+      hw_addr = dev.get('addrs',{}).get('ethernet',{}).get('addr')
+      if hw_addr is None:
+        on_error("Device %s has no ethernet address -- ignoring", name)
+        return
+      if dev.get('addrs',{}).get('AF_INET') != None:
+        on_error("Device %s has an IP address -- ignoring", name)
+        return
     for no,p in self.px.iteritems():
       if p.device == name:
         on_error("Device %s already added", name)
@@ -195,7 +238,7 @@ class PCapSwitch (ExpireMixin, SoftwareSwitchBase):
 
     phy = of.ofp_phy_port()
     phy.port_no = port_no
-    phy.hw_addr = dev['addrs']['ethernet']['addr']
+    phy.hw_addr = hw_addr
     phy.name = name
     # Fill in features sort of arbitrarily
     phy.curr = of.OFPPF_10MB_HD
@@ -205,7 +248,12 @@ class PCapSwitch (ExpireMixin, SoftwareSwitchBase):
 
     self.add_port(phy)
 
-    px = pxpcap.PCap(name, callback = self._pcap_rx, start = False)
+    if backend == "ring":
+      px = afpacket.PacketRing(name, callback = self._ring_rx, start = False)
+    else:
+      px = pxpcap.PCap(name, callback = self._pcap_rx, start = False,
+                       batch_callback = self._pcap_rx_batch,
+                       batch_size = self.pcap_batch_size)
     px.port_no = phy.port_no
     self.px[phy.port_no] = px
 
@@ -240,25 +288,56 @@ class PCapSwitch (ExpireMixin, SoftwareSwitchBase):
       if data is None:
         # Signal to quit
         break
+      # Drain whatever else is waiting into the same batch.  Packets are
+      # left unparsed; rx_packets() only parses the ones it has to.
       batch = []
       while True:
         self.q.task_done()
-        port_no,data = data
-        data = ethernet(data)
-        batch.append((data,port_no))
+        if isinstance(data, list):
+          batch.extend(data)
+        else:
+          batch.append(data)
         try:
           data = self.q.get(block=False)
         except:
           break
+        if data is None:
+          self.q.put(None)
+          break
       core.callLater(self.rx_batch, batch)
 
   def rx_batch (self, batch):
-    for data,port_no in batch:
-      self.rx_packet(data, port_no)
+    """
+    Processes a batch of (packet, port_no, data) tuples
+    """
+    self.rx_packets(batch)
 
   def _pcap_rx (self, px, data, sec, usec, length):
     if px.port_no is None: return
-    self.q.put((px.port_no, data))
+    self.q.put((None, px.port_no, data))
+
+  def _pcap_rx_batch (self, px, data, records):
+    port_no = px.port_no
+    if port_no is None: return
+    self.q.put([(None, port_no, d)
+                for d in pxpcap.split_batch(data, records)])
+
+  def _ring_rx (self, px, packets):
+    port_no = px.port_no
+    if port_no is None: return
+    self.q.put([(None, port_no, data) for data in packets])
+
+  def _output_packets_physical (self, packets, port_no):
+    """
+    send a list of packets out a single physical port
+    """
+    px = self.px.get(port_no)
+    if not px: return
+    if hasattr(px, 'inject_many'):
+      px.inject_many(packets)
+      return
+    for packet in packets:
+      px.inject(packet)
 
   def _output_packet_physical (self, packet, port_no):
     """
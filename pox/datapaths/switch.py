@@ -35,9 +35,12 @@ from pox.lib.util import assert_type, initHelper, dpid_to_str
 from pox.lib.revent import Event, EventMixin
 from pox.lib.recoco import Timer
 from pox.openflow.libopenflow_01 import *
+from pox.openflow.libopenflow_01 import _raw_tcp_options_ok
 import pox.openflow.libopenflow_01 as of
 from pox.openflow.util import make_type_to_unpacker_table
 from pox.openflow.flow_table import FlowTable, TableEntry
+from pox.datapaths.buffer_pool import BufferPool
+from pox.datapaths.buffer_pool import EMPTY as _BUFFER_EMPTY
 from pox.lib.packet import *
 
 import logging
@@ -49,27 +52,299 @@ import time
 _STP_MAC = EthAddr('01:80:c2:00:00:00')
 
 
+def _microflow_key (data, in_port):
+  """
+  Returns a microflow cache key for a raw packet, or None
+
+  The key is the in_port plus the header bytes that ofp_match.from_raw()
+  builds a match from, so packets with the same key always get the same
+  match (and hence the same table entry).  Fields which vary from packet
+  to packet within a flow (IP ID, TTL, checksums, sequence numbers) are
+  left out.  Only simple, well-formed packets get a key; IP fragments,
+  IP options, LLC and anything truncated don't.
+  """
+  dlen = len(data)
+  l3 = 14
+  if dlen < l3: return None
+  dl_type = data[12:14]
+  if dl_type == '\x81\x00':
+    l3 = 18
+    if dlen < l3: return None
+    dl_type = data[16:18]
+  if dl_type < '\x06\x00': return None # LLC
+
+  if dl_type == '\x08\x00':
+    if dlen < l3 + 20 or data[l3] != '\x45': return None
+    iplen = (ord(data[l3+2]) << 8) | ord(data[l3+3])
+    if iplen <= 20: return None
+    if ord(data[l3+6]) & 0x3f or data[l3+7] != '\x00': return None # Fragment
+    tlen = min(iplen, dlen - l3) - 20
+    l4 = l3 + 20
+    proto = data[l3+9]
+    if proto == '\x06':
+      if tlen < 20: return None
+      thlen = (ord(data[l4+12]) >> 4) * 4
+      if thlen < 20 or thlen > tlen: return None
+      if thlen > 20 and not _raw_tcp_options_ok(data, l4, l4 + thlen,
+                                                l4 + tlen):
+        return None
+      tp = data[l4:l4+4]
+    elif proto == '\x11':
+      if tlen < 8: return None
+      tp = data[l4:l4+4]
+    elif proto == '\x01':
+      if tlen < 4: return None
+      tp = data[l4:l4+2]
+    else:
+      tp = None
+    return (in_port, data[:l3], data[l3+1], proto, data[l3+12:l3+20], tp)
+  elif dl_type == '\x08\x06' or dl_type == '\x80\x35':
+    if dlen < l3 + 28: return None
+    if data[l3:l3+6] != '\x00\x01\x08\x00\x06\x04': return None
+    return (in_port, data[:l3], data[l3+6:l3+8], data[l3+14:l3+18],
+            data[l3+24:l3+28])
+  return (in_port, data[:l3])
+
+
+def _csum_update (buf, offset, changes, udp=False):
+  """
+  Incrementally updates the checksum at buf[offset] (RFC 1624)
+
+  changes is a sequence of (old, new) 16-bit words which were replaced in
+  the data the checksum covers.  If udp is True, a zero checksum (meaning
+  there isn't one) is left alone.
+  """
+  c = (buf[offset] << 8) | buf[offset+1]
+  if udp and c == 0: return
+  s = ~c & 0xffff
+  for old,new in changes:
+    s += (~old & 0xffff) + new
+  s = (s & 0xffff) + (s >> 16)
+  s = (s & 0xffff) + (s >> 16)
+  c = ~s & 0xffff
+  if udp and c == 0: c = 0xffff
+  buf[offset] = c >> 8
+  buf[offset+1] = c & 0xff
+
+def _raw_ipv4_offset (buf):
+  """
+  Returns the offset of the IPv4 header in raw ethernet data, or None
+
+  None is also returned if the header looks bad.
+  """
+  l3 = 14
+  if len(buf) < l3: return None
+  t = (buf[12] << 8) | buf[13]
+  if t == 0x8100:
+    l3 = 18
+    if len(buf) < l3: return None
+    t = (buf[16] << 8) | buf[17]
+  if t != 0x0800: return None
+  if len(buf) < l3 + 20: return None
+  if (buf[l3] >> 4) != 4 or (buf[l3] & 0x0f) < 5: return None
+  return l3
+
+def _raw_l4_checksum (buf, l3):
+  """
+  Returns (offset of the TCP/UDP checksum, is UDP) for raw IPv4 data
+
+  Returns (None, False) if there's no TCP/UDP header to update (because it
+  isn't TCP or UDP, it's truncated, or this is a non-first fragment).
+  """
+  if ((buf[l3+6] & 0x1f) << 8) | buf[l3+7]: return (None, False)
+  l4 = l3 + (buf[l3] & 0x0f) * 4
+  proto = buf[l3+9]
+  if proto == ipv4.TCP_PROTOCOL:
+    if len(buf) >= l4 + 18: return (l4 + 16, False)
+  elif proto == ipv4.UDP_PROTOCOL:
+    if len(buf) >= l4 + 8: return (l4 + 6, True)
+  return (None, False)
+
+def _compile_set_vlan (vid=None, pcp=None):
+  if vid is not None:
+    keep,value = 0xf000,vid & 0x0fff
+  else:
+    keep,value = 0x1fff,(pcp & 0x07) << 13
+  def set_vlan (buf):
+    if len(buf) < 14: return
+    if buf[12] == 0x81 and buf[13] == 0x00 and len(buf) >= 16:
+      tci = (((buf[14] << 8) | buf[15]) & keep) | value
+      buf[14] = tci >> 8
+      buf[15] = tci & 0xff
+    else:
+      buf[12:12] = struct.pack("!HH", ethernet.VLAN_TYPE, value)
+  return set_vlan
+
+def _compile_set_vlan_vid (action):
+  return _compile_set_vlan(vid=action.vlan_vid)
+
+def _compile_set_vlan_pcp (action):
+  return _compile_set_vlan(pcp=action.vlan_pcp)
+
+def _compile_strip_vlan (action):
+  def strip_vlan (buf):
+    if len(buf) >= 16 and buf[12] == 0x81 and buf[13] == 0x00:
+      del buf[12:16]
+  return strip_vlan
+
+def _compile_set_dl_addr (offset):
+  def make (action):
+    addr = action.dl_addr.toRaw()
+    def set_dl_addr (buf):
+      if len(buf) >= 14:
+        buf[offset:offset+6] = addr
+    return set_dl_addr
+  return make
+
+def _compile_set_nw_addr (offset):
+  def make (action):
+    new = action.nw_addr.toUnsigned()
+    new_words = (new >> 16, new & 0xffff)
+    def set_nw_addr (buf):
+      l3 = _raw_ipv4_offset(buf)
+      if l3 is None: return
+      o = l3 + offset
+      old_words = ((buf[o] << 8) | buf[o+1], (buf[o+2] << 8) | buf[o+3])
+      struct.pack_into("!L", buf, o, new)
+      changes = zip(old_words, new_words)
+      _csum_update(buf, l3 + 10, changes)
+      # TCP and UDP checksums cover the addresses too (pseudo-header)
+      csum,is_udp = _raw_l4_checksum(buf, l3)
+      if csum is not None:
+        _csum_update(buf, csum, changes, is_udp)
+    return set_nw_addr
+  return make
+
+def _compile_set_nw_tos (action):
+  tos = action.nw_tos
+  def set_nw_tos (buf):
+    l3 = _raw_ipv4_offset(buf)
+    if l3 is None: return
+    old = (buf[l3] << 8) | buf[l3+1]
+    buf[l3+1] = tos
+    _csum_update(buf, l3 + 10, [(old, (buf[l3] << 8) | tos)])
+  return set_nw_tos
+
+def _compile_set_tp_port (offset):
+  def make (action):
+    new = action.tp_port
+    def set_tp_port (buf):
+      l3 = _raw_ipv4_offset(buf)
+      if l3 is None: return
+      csum,is_udp = _raw_l4_checksum(buf, l3)
+      if csum is None: return
+      o = l3 + (buf[l3] & 0x0f) * 4 + offset
+      old = (buf[o] << 8) | buf[o+1]
+      buf[o] = new >> 8
+      buf[o+1] = new & 0xff
+      _csum_update(buf, csum, [(old, new)], is_udp)
+    return set_tp_port
+  return make
+
+# Action type -> function which takes an action and returns a function
+# which applies it to a bytearray in place
+_action_compilers = {
+  OFPAT_SET_VLAN_VID : _compile_set_vlan_vid,
+  OFPAT_SET_VLAN_PCP : _compile_set_vlan_pcp,
+  OFPAT_STRIP_VLAN : _compile_strip_vlan,
+  OFPAT_SET_DL_SRC : _compile_set_dl_addr(6),
+  OFPAT_SET_DL_DST : _compile_set_dl_addr(0),
+  OFPAT_SET_NW_SRC : _compile_set_nw_addr(12),
+  OFPAT_SET_NW_DST : _compile_set_nw_addr(16),
+  OFPAT_SET_NW_TOS : _compile_set_nw_tos,
+  OFPAT_SET_TP_SRC : _compile_set_tp_port(0),
+  OFPAT_SET_TP_DST : _compile_set_tp_port(2),
+}
+
+def _compile_actions (actions):
+  """
+  Compiles a list of actions into a program which runs on raw packets
+
+  The program is a function which takes a packed packet and returns a
+  list of (out_port, max_len, data) tuples, one for each output action,
+  where data is the packet as it was at that point.  Header rewrites are
+  done in place on a bytearray, with checksums updated incrementally
+  rather than recomputed, so packets never need to be parsed or repacked.
+
+  Returns None if some action can't be compiled.
+  """
+  steps = []
+  for action in actions:
+    if action.type == OFPAT_OUTPUT:
+      steps.append((None, (action.port, action.max_len)))
+      continue
+    make = _action_compilers.get(action.type)
+    if make is None: return None
+    steps.append((make(action), None))
+
+  if all(f is None for f,_ in steps):
+    outputs = [arg for _,arg in steps]
+    def output_program (data):
+      return [(port, max_len, data) for port,max_len in outputs]
+    return output_program
+
+  def program (data):
+    out = []
+    buf = None
+    current = data
+    for f,arg in steps:
+      if f is None:
+        if current is None: current = bytes(buf)
+        out.append((arg[0], arg[1], current))
+      else:
+        if buf is None: buf = bytearray(data)
+        f(buf)
+        current = None
+    return out
+  return program
+
+
 class DpPacketOut (Event):
   """
   Event raised when a dataplane packet is sent out a port
   """
   def __init__ (self, node, packet, port):
-    assert assert_type("packet", packet, ethernet, none_ok=False)
+    assert assert_type("packet", packet, (ethernet, bytes), none_ok=False)
     Event.__init__(self)
     self.node = node
-    self.packet = packet
+    self._packet = packet
     self.port = port
     self.switch = node # For backwards compatability
 
+  @property
+  def packet (self):
+    """
+    The packet as an instance of ethernet (parsed on demand)
+    """
+    if not isinstance(self._packet, ethernet):
+      self._packet = ethernet(self._packet)
+    return self._packet
+
+  @property
+  def data (self):
+    """
+    The packed packet
+    """
+    if isinstance(self._packet, ethernet):
+      return self._packet.pack()
+    return self._packet
+
 
 class SoftwareSwitchBase (object):
+  # Maximum number of microflows to cache (0 disables the cache)
+  microflow_cache_size = 16384
+
+  # Largest packet which can be buffered for a PacketIn
+  max_buffer_size = 2048
+
   def __init__ (self, dpid, name=None, ports=4, miss_send_len=128,
                 max_buffers=100, max_entries=0x7fFFffFF, features=None):
     """
     Initialize switch
      - ports is a list of ofp_phy_ports or a number of ports
      - miss_send_len is number of bytes to send to controller on table miss
-     - max_buffers is number of buffered packets to store
+     - max_buffers is number of buffered packets to store (when all are in
+       use, the oldest one gets evicted)
      - max_entries is max flows entries per table
     """
     if name is None: name = dpid_to_str(dpid)
@@ -92,11 +367,21 @@ class SoftwareSwitchBase (object):
     self._lookup_count = 0
     self._matched_count = 0
 
+    # Microflow cache: _microflow_key() -> TableEntry (or None for a miss).
+    # Cleared whenever the table changes.
+    self._microflows = {}
+    self.microflow_hits = 0
+    self.microflow_misses = 0
+
+    # While rx_packets() is running, a dict of port_no -> [packet] which
+    # physical output is queued up in
+    self._tx_batch = None
+
     self.log = logging.getLogger(self.name)
     self._connection = None
 
     # buffer for packets during packet_in
-    self._packet_buffer = []
+    self._packet_buffer = BufferPool(max_buffers, self.max_buffer_size)
 
     # Map port_no -> openflow.pylibopenflow_01.ofp_phy_ports
     self.ports = {}
@@ -154,6 +439,14 @@ class SoftwareSwitchBase (object):
       if getattr(self.features, "act_" + name) is False: continue
       self.action_handlers[value] = h
 
+    # Actions which can be compiled into programs that run on raw packets.
+    # If a subclass overrides an action's handler, it's run the slow way.
+    self._compilable_actions = set()
+    for value,h in self.action_handlers.iteritems():
+      base = getattr(SoftwareSwitchBase, h.__name__, None)
+      if base is not None and h.im_func is base.im_func:
+        self._compilable_actions.add(value)
+
     # Set up handlers for stats handlers
     # That is, self.stats_handlers[OFPST_FOO] = self._stats_foo
     #TODO: Refactor this with above
@@ -216,7 +509,10 @@ class SoftwareSwitchBase (object):
     """
     Handle flow table modification events
     """
-    # Currently, we only use this for sending flow_removed messages
+    # Any change may change which entry a microflow maps to
+    self._microflows.clear()
+
+    # Otherwise, we only use this for sending flow_removed messages
     if not event.removed: return
 
     if event.reason in (OFPRR_IDLE_TIMEOUT,OFPRR_HARD_TIMEOUT,OFPRR_DELETE):
@@ -282,7 +578,7 @@ class SoftwareSwitchBase (object):
     self.log.debug("Send features reply")
     msg = ofp_features_reply(datapath_id = self.dpid,
                              xid = ofp.xid,
-                             n_buffers = self.max_buffers,
+                             n_buffers = self._packet_buffer.capacity,
                              n_tables = 1,
                              capabilities = self.features.capability_bits,
                              actions = self.features.action_bits,
@@ -465,6 +761,79 @@ class SoftwareSwitchBase (object):
       err.data = data
     self.send(err, connection = connection)
 
+  def _is_dropped_fragment (self, packet):
+    """
+    Applies the fragment handling mode to a packet
+
+    Returns True if the packet is a fragment which should be dropped.
+    """
+    ipp = packet.find(ipv4)
+    if ipp:
+      if (ipp.flags & ipv4.MF_FLAG) or ipp.frag != 0:
+        frag_mode = self.config_flags & OFPC_FRAG_MASK
+        if frag_mode == OFPC_FRAG_DROP:
+          # Drop fragment
+          return True
+        elif frag_mode == OFPC_FRAG_REASM:
+          if self.features.cap_ip_reasm:
+            #TODO: Implement fragment reassembly
+            self.log.info("Can't reassemble fragment: not implemented")
+        else:
+          self.log.warn("Illegal fragment processing mode: %i", frag_mode)
+    return False
+
+  def _lookup_entry (self, packet, in_port, packet_data = None):
+    """
+    Finds the table entry for a packet, going through the microflow cache
+
+    Returns None on a table miss.
+    """
+    key = None
+    if packet_data is not None and self.microflow_cache_size:
+      key = _microflow_key(packet_data, in_port)
+    if key is not None:
+      entry = self._microflows.get(key, False)
+      if entry is False:
+        self.microflow_misses += 1
+        entry = self.table.entry_for_packet(packet_data, in_port)
+        if len(self._microflows) >= self.microflow_cache_size:
+          self._microflows.clear()
+        self._microflows[key] = entry
+      else:
+        self.microflow_hits += 1
+      return entry
+    elif packet_data is not None:
+      return self.table.entry_for_packet(packet_data, in_port)
+    return self.table.entry_for_packet(packet, in_port)
+
+  def _compile_actions (self, actions):
+    """
+    Returns a compiled program for a list of actions, or False
+
+    See _compile_actions() at module level.  False means the actions have
+    to be run by _process_actions_for_packet() instead.
+    """
+    for action in actions:
+      if action.type not in self._compilable_actions: return False
+    return _compile_actions(actions) or False
+
+  def _entry_program (self, entry):
+    """
+    Returns an entry's compiled program (or False), compiling if needed
+    """
+    program = entry.program
+    if program is None:
+      program = self._compile_actions(entry.actions)
+      entry.program = program
+    return program
+
+  def _run_program (self, program, packet_data, in_port):
+    """
+    Runs a compiled program on a packet and sends the results
+    """
+    for out_port,max_len,data in program(packet_data):
+      self._output_packet(data, out_port, in_port, max_len, len(data))
+
   def rx_packet (self, packet, in_port, packet_data = None):
     """
     process a dataplane packet
@@ -490,19 +859,8 @@ class SoftwareSwitchBase (object):
       return
 
     if self.config_flags & OFPC_FRAG_MASK:
-      ipp = packet.find(ipv4)
-      if ipp:
-        if (ipp.flags & ipv4.MF_FLAG) or ipp.frag != 0:
-          frag_mode = self.config_flags & OFPC_FRAG_MASK
-          if frag_mode == OFPC_FRAG_DROP:
-            # Drop fragment
-            return
-          elif frag_mode == OFPC_FRAG_REASM:
-            if self.features.cap_ip_reasm:
-              #TODO: Implement fragment reassembly
-              self.log.info("Can't reassemble fragment: not implemented")
-          else:
-            self.log.warn("Illegal fragment processing mode: %i", frag_mode)
+      if self._is_dropped_fragment(packet):
+        return
 
     self.port_stats[in_port].rx_packets += 1
     if packet_data is not None:
@@ -511,21 +869,145 @@ class SoftwareSwitchBase (object):
       self.port_stats[in_port].rx_bytes += len(packet.pack()) # Expensive
 
     self._lookup_count += 1
-    entry = self.table.entry_for_packet(packet, in_port)
+    entry = self._lookup_entry(packet, in_port, packet_data)
     if entry is not None:
       self._matched_count += 1
-      entry.touch_packet(len(packet))
+      if packet_data is not None:
+        entry.touch_packet(len(packet_data))
+        program = self._entry_program(entry)
+        if program:
+          self._run_program(program, packet_data, in_port)
+          return
+      else:
+        entry.touch_packet(len(packet)) # Expensive
       self._process_actions_for_packet(entry.actions, packet, in_port)
     else:
       # no matching entry
       if port.config & OFPPC_NO_PACKET_IN:
         return
-      buffer_id = self._buffer_packet(packet, in_port)
       if packet_data is None:
         packet_data = packet.pack()
+      buffer_id = self._buffer_packet(packet_data, in_port)
       self.send_packet_in(in_port, buffer_id, packet_data,
                           reason=OFPR_NO_MATCH, data_length=self.miss_send_len)
 
+  def rx_packets (self, batch):
+    """
+    process a batch of dataplane packets
+
+    batch is a sequence of (packet, in_port, packet_data) tuples.  Either
+    packet (an instance of ethernet) or packet_data (its packed form) may
+    be None, but not both; a missing packet is only parsed if something
+    actually needs it.
+
+    The result is the same as calling rx_packet() on each one, except that
+    the whole batch is classified before any actions are run, the port and
+    entry counters are updated once per port and entry, and packets sent
+    out the same physical port are passed to _output_packets_physical()
+    together at the end.  Packets matching the same entry are processed in
+    arrival order, but packets matching different entries may be reordered
+    relative to each other.
+    """
+    ports = self.ports
+    check_frags = self.config_flags & OFPC_FRAG_MASK
+    stp_mac = _STP_MAC.raw
+
+    rx = {}      # in_port -> [packets, bytes]
+    groups = {}  # id(entry) -> [entry, byte count, items]
+    order = []   # groups in the order they were first hit
+    misses = []
+    for item in batch:
+      packet,in_port,packet_data = item
+      port = ports.get(in_port)
+      if port is None:
+        self.log.warn("Got packet on missing port %i", in_port)
+        continue
+
+      config = port.config
+      if config & (OFPPC_NO_RECV | OFPPC_NO_RECV_STP):
+        if packet_data is not None:
+          is_stp = packet_data[:6] == stp_mac
+        else:
+          is_stp = packet.dst == _STP_MAC
+        if (config & OFPPC_NO_RECV) and not is_stp:
+          # Drop all except STP
+          continue
+        if (config & OFPPC_NO_RECV_STP) and is_stp:
+          # Drop STP
+          continue
+
+      if check_frags:
+        if packet is None:
+          packet = ethernet(packet_data)
+        if self._is_dropped_fragment(packet):
+          continue
+
+      if packet_data is None:
+        packet_data = packet.pack()
+      size = len(packet_data)
+      item = (packet, in_port, packet_data)
+
+      r = rx.get(in_port)
+      if r is None:
+        rx[in_port] = [1, size]
+      else:
+        r[0] += 1
+        r[1] += size
+
+      entry = self._lookup_entry(packet, in_port, packet_data)
+      if entry is None:
+        misses.append(item)
+        continue
+      g = groups.get(id(entry))
+      if g is None:
+        g = [entry, size, [item]]
+        groups[id(entry)] = g
+        order.append(g)
+      else:
+        g[1] += size
+        g[2].append(item)
+
+    port_stats = self.port_stats
+    for in_port,(count,size) in rx.iteritems():
+      stats = port_stats[in_port]
+      stats.rx_packets += count
+      stats.rx_bytes += size
+    matched = sum(len(g[2]) for g in order)
+    self._lookup_count += matched + len(misses)
+    self._matched_count += matched
+
+    outer = self._tx_batch
+    if outer is None:
+      self._tx_batch = {}
+    try:
+      now = time.time()
+      for entry,size,items in order:
+        entry.touch_packets(len(items), size, now)
+        program = self._entry_program(entry)
+        if program:
+          for packet,in_port,packet_data in items:
+            self._run_program(program, packet_data, in_port)
+          continue
+        actions = entry.actions
+        for packet,in_port,packet_data in items:
+          if packet is None:
+            packet = ethernet(packet_data)
+          self._process_actions_for_packet(actions, packet, in_port)
+
+      for packet,in_port,packet_data in misses:
+        if ports[in_port].config & OFPPC_NO_PACKET_IN:
+          continue
+        buffer_id = self._buffer_packet(packet_data, in_port)
+        self.send_packet_in(in_port, buffer_id, packet_data,
+                            reason=OFPR_NO_MATCH,
+                            data_length=self.miss_send_len)
+    finally:
+      if outer is None:
+        tx = self._tx_batch
+        self._tx_batch = None
+        for port_no,packets in tx.iteritems():
+          self._output_packets_physical(packets, port_no)
+
   def delete_port (self, port):
     """
     Removes a port
@@ -621,17 +1103,32 @@ class SoftwareSwitchBase (object):
     """
     self.log.info("Sending packet %s out port %s", str(packet), port_no)
 
-  def _output_packet (self, packet, out_port, in_port, max_len=None):
+  def _output_packets_physical (self, packets, port_no):
+    """
+    send a list of packets out a single physical port
+
+    This is called at the end of rx_packets() for each port that it sent
+    packets out of.  By default, it just calls _output_packet_physical()
+    on each one; override it if there's a cheaper way to send several.
+    """
+    for packet in packets:
+      self._output_packet_physical(packet, port_no)
+
+  def _output_packet (self, packet, out_port, in_port, max_len=None,
+                      packet_len=None):
     """
     send a packet out some port
 
     This handles virtual ports and does validation.
 
-    packet: instance of ethernet
+    packet: instance of ethernet, or a packed one
     out_port, in_port: the integer port number
     max_len: maximum packet payload length to send to controller
+    packet_len: length of the packed packet, if known
     """
-    assert assert_type("packet", packet, ethernet, none_ok=False)
+    assert assert_type("packet", packet, (ethernet, bytes), none_ok=False)
+    if packet_len is None and not isinstance(packet, ethernet):
+      packet_len = len(packet)
 
     def real_send (port_no, allow_in_port=False):
       if type(port_no) == ofp_phy_port:
@@ -653,8 +1150,14 @@ class SoftwareSwitchBase (object):
         self.log.debug("Dropping packet sent on port %i: Link down", port_no)
         return
       self.port_stats[port_no].tx_packets += 1
-      self.port_stats[port_no].tx_bytes += len(packet.pack()) #FIXME: Expensive
-      self._output_packet_physical(packet, port_no)
+      if packet_len is None:
+        self.port_stats[port_no].tx_bytes += len(packet.pack()) #FIXME: Expensive
+      else:
+        self.port_stats[port_no].tx_bytes += packet_len
+      if self._tx_batch is not None:
+        self._tx_batch.setdefault(port_no, []).append(packet)
+      else:
+        self._output_packet_physical(packet, port_no)
 
     if out_port < OFPP_MAX:
       real_send(out_port)
@@ -678,7 +1181,10 @@ class SoftwareSwitchBase (object):
       # Do we disable send-to-controller when performing this?
       # (Currently, there's the possibility that a table miss from this
       # will result in a send-to-controller which may send back to table...)
-      self.rx_packet(packet, in_port)
+      if isinstance(packet, ethernet):
+        self.rx_packet(packet, in_port)
+      else:
+        self.rx_packet(ethernet(packet), in_port, packet)
     else:
       self.log.warn("Unsupported virtual output port: %d", out_port)
 
@@ -686,20 +1192,12 @@ class SoftwareSwitchBase (object):
     """
     Buffer packet and return buffer ID
 
-    If no buffer is available, return None.
-    """
-    # Do we have an empty slot?
-    for (i, value) in enumerate(self._packet_buffer):
-      if value is None:
-        # Yes -- use it
-        self._packet_buffer[i] = (packet, in_port)
-        return i + 1
-    # No -- create a new slow
-    if len(self._packet_buffer) >= self.max_buffers:
-      # No buffers available!
-      return None
-    self._packet_buffer.append( (packet, in_port) )
-    return len(self._packet_buffer)
+    packet may be an instance of ethernet or a packed one.
+    If the packet can't be buffered, return None.
+    """
+    if isinstance(packet, ethernet):
+      packet = packet.pack()
+    return self._packet_buffer.put(packet, in_port)
 
   def _process_actions_for_packet_from_buffer (self, actions, buffer_id,
                                                ofp=None):
@@ -709,16 +1207,17 @@ class SoftwareSwitchBase (object):
     ofp is the message which triggered this processing, if any (used for error
     generation)
     """
-    buffer_id = buffer_id - 1
-    if (buffer_id >= len(self._packet_buffer)) or (buffer_id < 0):
-      self.log.warn("Invalid output buffer id: %d", buffer_id + 1)
-      return
-    if self._packet_buffer[buffer_id] is None:
-      self.log.warn("Buffer %d has already been flushed", buffer_id + 1)
+    (packet, in_port) = self._packet_buffer.pop(buffer_id)
+    if packet is None:
+      if in_port == _BUFFER_EMPTY:
+        self.log.warn("Buffer %d has already been flushed", buffer_id)
+        code = OFPBRC_BUFFER_EMPTY
+      else:
+        self.log.warn("Invalid or expired output buffer id: %d", buffer_id)
+        code = OFPBRC_BUFFER_UNKNOWN
+      self.send_error(type=OFPET_BAD_REQUEST, code=code, ofp=ofp)
       return
-    (packet, in_port) = self._packet_buffer[buffer_id]
     self._process_actions_for_packet(actions, packet, in_port, ofp)
-    self._packet_buffer[buffer_id] = None
 
   def _process_actions_for_packet (self, actions, packet, in_port, ofp=None):
     """
@@ -776,6 +1275,7 @@ class SoftwareSwitchBase (object):
       return
 
     new_entry = TableEntry.from_flow_mod(flow_mod)
+    new_entry.program = self._compile_actions(new_entry.actions)
 
     if flow_mod.flags & OFPFF_CHECK_OVERLAP:
       if table.check_for_overlapping_entry(new_entry):
@@ -805,11 +1305,15 @@ class SoftwareSwitchBase (object):
     priority = flow_mod.priority
 
     modified = False
-    for entry in table.entries:
+    program = None
+    for entry in table.matching_entries(match, priority=priority,
+                                        strict=strict):
       # update the actions field in the matching flows
-      if entry.is_matched_by(match, priority=priority, strict=strict):
-        entry.actions = flow_mod.actions
-        modified = True
+      table.modify_entry(entry, flow_mod.actions)
+      if program is None:
+        program = self._compile_actions(flow_mod.actions)
+      entry.program = program
+      modified = True
 
     if not modified:
       # if no matching entry is found, modify acts as add
@@ -0,0 +1,68 @@
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Profiles the recoco scheduler
+
+Unlike recoco_spy, this tells you which tasks are using up the
+scheduler: it keeps each task's total run time, number of slices and
+longest slice, and samples how many tasks are waiting to run.  It's
+cheap enough to leave on.
+
+Options:
+ --slow=<seconds>     Log slices which take at least this long, along
+                      with where the task was (default: don't)
+ --interval=<seconds> How often to sample the ready-queue depth
+ --history=<samples>  How many depth samples to keep
+
+From the py console:
+  print core.recoco_profile.report()
+  core.recoco_profile.reset()
+
+If webcore is running, it's also a JSON-RPC service at /recoco/ with
+methods get_stats, get_tasks and reset, e.g.:
+  curl -d '{"method":"get_stats","params":{"count":10}}' \\
+    http://127.0.0.1:8000/recoco/
+"""
+
+from pox.core import core
+from pox.web.jsonrpc import JSONRPCHandler
+
+log = core.getLogger()
+
+
+class RecocoProfileHandler (JSONRPCHandler):
+  def _exec_get_stats (self, count = None):
+    return {'result':core.recoco_profile.stats(count)}
+
+  def _exec_get_tasks (self, count = None):
+    return {'result':core.recoco_profile.task_stats(count)}
+
+  def _exec_reset (self):
+    core.recoco_profile.reset()
+    return {'result':True}
+
+
+def _handle_GoingUpEvent (event):
+  if core.hasComponent("WebServer"):
+    core.WebServer.set_handler("/recoco/", RecocoProfileHandler, {}, True)
+
+
+def launch (slow = None, interval = 1, history = 300):
+  if slow is not None: slow = float(slow)
+  profile = core.scheduler.enable_profiling(slow_slice = slow,
+                                            depth_interval = float(interval),
+                                            history = int(history))
+  core.register("recoco_profile", profile)
+  core.addListenerByName("GoingUpEvent", _handle_GoingUpEvent)
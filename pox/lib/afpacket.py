@@ -0,0 +1,381 @@
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Packet capture and injection using Linux AF_PACKET rings
+
+PacketRing sets up a TPACKET_V3 receive ring and a transmit ring which
+are shared with the kernel through mmap.  The kernel fills whole blocks
+of received frames, and a block is handed to the callback as a list of
+packets, so there's no system call per packet.  Packets to send are
+written into the transmit ring, and one send() flushes however many are
+waiting.
+
+This is Linux-only and needs CAP_NET_RAW.  If the kernel can't do a
+TPACKET_V3 transmit ring (it needs 4.11 or newer), sending falls back to
+an ordinary send() per packet.
+
+It's meant to look enough like pxpcap's PCap that PCapSwitch can use
+either one for a port.
+"""
+
+import socket
+import select
+import struct
+import mmap
+import errno
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+from threading import Thread
+import pox.lib.packet as pkt
+from pox.lib.addresses import EthAddr
+
+import logging
+log = logging.getLogger("afpacket")
+
+enabled = hasattr(socket, "AF_PACKET") and fcntl is not None
+
+
+SOL_PACKET = 263
+PACKET_ADD_MEMBERSHIP = 1
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+PACKET_TX_RING = 13
+PACKET_IGNORE_OUTGOING = 23
+PACKET_MR_PROMISC = 1
+TPACKET_V3 = 2
+ETH_P_ALL = 0x0003
+SIOCGIFINDEX = 0x8933
+SIOCGIFADDR = 0x8915
+
+PACKET_OUTGOING = 4
+
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+TP_STATUS_VLAN_VALID = 0x10
+TP_STATUS_VLAN_TPID_VALID = 0x40
+TP_STATUS_AVAILABLE = 0
+TP_STATUS_SEND_REQUEST = 1
+TP_STATUS_WRONG_FORMAT = 4
+
+# Offsets into struct tpacket_block_desc
+_BLOCK_STATUS = 8
+_BLOCK_NUM_PKTS = 12
+
+# struct tpacket3_hdr
+_hdr_struct = struct.Struct("=IIIIIIHHIIH")
+_HDR_LEN = 48 # TPACKET_ALIGN(sizeof(struct tpacket3_hdr))
+_SLL_PKTTYPE = _HDR_LEN + 10 # In the sockaddr_ll after the header
+_OUTGOING = chr(PACKET_OUTGOING)
+_TX_STATUS = 20
+
+_req3_struct = struct.Struct("=IIIIIII")
+_stats_struct = struct.Struct("=III")
+
+
+def get_ifindex (device):
+  s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  try:
+    r = fcntl.ioctl(s.fileno(), SIOCGIFINDEX, struct.pack("16sI", device, 0))
+  finally:
+    s.close()
+  return struct.unpack("16sI", r)[1]
+
+def get_hw_addr (device):
+  """
+  Returns a device's ethernet address or None if it doesn't have one
+  """
+  try:
+    with open("/sys/class/net/%s/address" % (device,)) as f:
+      addr = f.read().strip()
+  except IOError:
+    return None
+  if len(addr) != 17: return None
+  return EthAddr(addr)
+
+def has_ipv4_addr (device):
+  """
+  Returns True if a device has an IPv4 address
+  """
+  s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  try:
+    fcntl.ioctl(s.fileno(), SIOCGIFADDR, struct.pack("16s16x", device))
+  except IOError:
+    return False
+  finally:
+    s.close()
+  return True
+
+
+
+class PacketRing (object):
+  """
+  An AF_PACKET socket with mmap'd receive and transmit rings
+
+  The callback is called from the receive thread with this object and a
+  list of packets (as bytes) for every block the kernel hands over.
+  """
+  def __init__ (self, device = None, promiscuous = True, start = True,
+                callback = None, block_size = 1 << 18, block_count = 16,
+                frame_size = 2048, block_timeout = 4, tx_block_count = 4,
+                **kw):
+    """
+    Initialize this instance
+
+    block_size and block_count size the receive ring.  The kernel hands a
+    block over when it's full or when it's been block_timeout milliseconds
+    since the first packet went into it.  The transmit ring has
+    tx_block_count blocks of block_size, split into frame_size frames.
+    """
+    self.device = None
+    self.promiscuous = promiscuous
+    self.block_size = block_size
+    self.block_count = block_count
+    self.frame_size = frame_size
+    self.block_timeout = block_timeout
+    self.tx_block_count = tx_block_count
+    self.packets_received = 0
+    self.packets_dropped = 0
+    self.tx_dropped = 0
+    self._sock = None
+    self._ring = None
+    self._thread = None
+    self._quitting = False
+    if callback is None:
+      self.callback = self.__class__._handle_rx
+    else:
+      self.callback = callback
+
+    for k,v in kw.items():
+      assert not hasattr(self, k)
+      setattr(self, k, v)
+
+    if device is not None:
+      self.open(device)
+      if start:
+        self.start()
+
+  def _handle_rx (self, packets):
+    pass
+
+  def open (self, device):
+    assert self.device is None
+    s = socket.socket(socket.AF_PACKET, socket.SOCK_RAW,
+                      socket.htons(ETH_P_ALL))
+    try:
+      s.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+      try:
+        # Don't see our own transmissions (Linux 4.20+; we also filter
+        # them out by packet type below)
+        s.setsockopt(SOL_PACKET, PACKET_IGNORE_OUTGOING, 1)
+      except socket.error:
+        pass
+
+      rx_frames = (self.block_size // self.frame_size) * self.block_count
+      s.setsockopt(SOL_PACKET, PACKET_RX_RING,
+                   _req3_struct.pack(self.block_size, self.block_count,
+                                     self.frame_size, rx_frames,
+                                     self.block_timeout, 0, 0))
+      self._tx_frames = 0
+      if self.tx_block_count:
+        tx_frames = (self.block_size // self.frame_size) * self.tx_block_count
+        try:
+          s.setsockopt(SOL_PACKET, PACKET_TX_RING,
+                       _req3_struct.pack(self.block_size, self.tx_block_count,
+                                         self.frame_size, tx_frames, 0, 0, 0))
+          self._tx_frames = tx_frames
+        except socket.error as e:
+          log.info("%s: No TPACKET_V3 transmit ring (%s); sending directly",
+                   device, e)
+
+      rx_size = self.block_size * self.block_count
+      size = rx_size + self._tx_frames * self.frame_size
+      self._ring = mmap.mmap(s.fileno(), size, mmap.MAP_SHARED,
+                             mmap.PROT_READ | mmap.PROT_WRITE)
+      self._rx_size = rx_size
+      self._rx_block = 0
+      self._tx_frame = 0
+
+      s.bind((device, ETH_P_ALL))
+      if self.promiscuous:
+        mreq = struct.pack("iHH8s", get_ifindex(device), PACKET_MR_PROMISC,
+                           0, b'')
+        s.setsockopt(SOL_PACKET, PACKET_ADD_MEMBERSHIP, mreq)
+    except:
+      if self._ring is not None:
+        self._ring.close()
+        self._ring = None
+      s.close()
+      raise
+
+    self._sock = s
+    self._poll = select.poll()
+    self._poll.register(s.fileno(), select.POLLIN | select.POLLERR)
+    self.device = device
+
+  def fileno (self):
+    if self._sock is None:
+      raise RuntimeError("PacketRing not open")
+    return self._sock.fileno()
+
+  def read_block (self, timeout = None):
+    """
+    Returns the packets in the next block, or None if there isn't one yet
+
+    Waits up to timeout seconds for one (or forever if timeout is None).
+    """
+    ring = self._ring
+    offset = self._rx_block * self.block_size
+    status = struct.unpack_from("=I", ring, offset + _BLOCK_STATUS)[0]
+    if not (status & TP_STATUS_USER):
+      if timeout == 0: return None
+      self._poll.poll(None if timeout is None else timeout * 1000)
+      status = struct.unpack_from("=I", ring, offset + _BLOCK_STATUS)[0]
+      if not (status & TP_STATUS_USER): return None
+
+    count,pos = struct.unpack_from("=II", ring, offset + _BLOCK_NUM_PKTS)
+    pos += offset
+    packets = []
+    unpack_hdr = _hdr_struct.unpack_from
+    for i in xrange(count):
+      (next_offset, sec, nsec, snaplen, length, pstatus, mac, net, rxhash,
+       tci, tpid) = unpack_hdr(ring, pos)
+      if ring[pos + _SLL_PKTTYPE] != _OUTGOING:
+        start = pos + mac
+        if pstatus & TP_STATUS_VLAN_VALID:
+          # The kernel took the tag off; put it back
+          if not (pstatus & TP_STATUS_VLAN_TPID_VALID) or not tpid:
+            tpid = pkt.ethernet.VLAN_TYPE
+          packets.append(ring[start:start+12] + struct.pack("!HH", tpid, tci)
+                         + ring[start+12:start+snaplen])
+        else:
+          packets.append(ring[start:start+snaplen])
+      pos += next_offset
+
+    # Give the block back to the kernel
+    struct.pack_into("=I", ring, offset + _BLOCK_STATUS, TP_STATUS_KERNEL)
+    self._rx_block = (self._rx_block + 1) % self.block_count
+    self.packets_received += len(packets)
+    return packets
+
+  def _thread_func (self):
+    while not self._quitting:
+      try:
+        packets = self.read_block(0.5)
+      except select.error as e:
+        if e.args[0] == errno.EINTR: continue
+        raise
+      if packets:
+        self.callback(self, packets)
+    self._quitting = False
+    self._thread = None
+
+  def _handle_GoingDownEvent (self, event):
+    self.close()
+
+  def start (self):
+    assert self._thread is None
+    from pox.core import core
+    core.addListeners(self, weak=True)
+    self._thread = Thread(target=self._thread_func)
+    self._thread.start()
+
+  def stop (self):
+    t = self._thread
+    if t is not None:
+      self._quitting = True
+      t.join()
+
+  def close (self):
+    if self._sock is None: return
+    self.stop()
+    self._ring.close()
+    self._ring = None
+    self._sock.close()
+    self._sock = None
+
+  def __del__ (self):
+    self.close()
+
+  def stats (self):
+    """
+    Returns (packets, drops) since the last call, according to the kernel
+    """
+    r = self._sock.getsockopt(SOL_PACKET, PACKET_STATISTICS,
+                              _stats_struct.size)
+    packets,drops,_ = _stats_struct.unpack(r)
+    self.packets_dropped += drops
+    return packets,drops
+
+  def _queue (self, data):
+    """
+    Puts a packet into the transmit ring (without flushing)
+
+    Returns False if the ring is full.
+    """
+    ring = self._ring
+    offset = self._rx_size + self._tx_frame * self.frame_size
+    status = struct.unpack_from("=I", ring, offset + _TX_STATUS)[0]
+    if status == TP_STATUS_WRONG_FORMAT:
+      log.warn("%s: Kernel rejected a transmitted frame", self.device)
+    elif status != TP_STATUS_AVAILABLE:
+      return False
+    size = min(len(data), self.frame_size - _HDR_LEN)
+    ring[offset+_HDR_LEN:offset+_HDR_LEN+size] = bytes(data[:size])
+    struct.pack_into("=IIIIII", ring, offset, 0, 0, 0, size, size,
+                     TP_STATUS_SEND_REQUEST)
+    self._tx_frame = (self._tx_frame + 1) % self._tx_frames
+    return True
+
+  def _flush (self):
+    try:
+      self._sock.send(b'', socket.MSG_DONTWAIT)
+    except socket.error as e:
+      if e.args[0] not in (errno.EAGAIN, errno.ENOBUFS): raise
+
+  def inject_many (self, packets):
+    """
+    Sends a list of packets with one system call (if possible)
+    """
+    if not self._tx_frames:
+      for p in packets:
+        self.inject(p)
+      return
+    for p in packets:
+      if isinstance(p, pkt.ethernet):
+        p = p.pack()
+      if not self._queue(p):
+        # Full; kick the kernel and try once more
+        self._flush()
+        if not self._queue(p):
+          self.tx_dropped += 1
+    self._flush()
+
+  def inject (self, data):
+    if isinstance(data, pkt.ethernet):
+      data = data.pack()
+    if self._tx_frames:
+      self.inject_many([data])
+      return
+    try:
+      self._sock.send(data)
+    except socket.error as e:
+      if e.args[0] not in (errno.EAGAIN, errno.ENOBUFS): raise
+      self.tx_dropped += 1
+
+  def __str__ (self):
+    return "PacketRing(device=%s)" % (self.device)
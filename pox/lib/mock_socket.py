@@ -48,6 +48,18 @@ class MockSocket (object):
     """
     return self.receiving.recv(max_size)
 
+  def recv_into (self, buf, nbytes=0):
+    """
+    receive data on this socket into a writable buffer.
+
+    Returns the number of bytes received (see recv() for behavior when
+    no data is available).
+    """
+    if not nbytes: nbytes = len(buf)
+    data = self.receiving.recv(nbytes)
+    buf[:len(data)] = data
+    return len(data)
+
   def set_on_ready_to_recv (self, on_ready):
     """
     set a handler function on_ready(socket, size) to be called when
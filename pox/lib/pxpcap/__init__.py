@@ -33,11 +33,59 @@ import parser
 from threading import Thread, Lock
 import pox.lib.packet as pkt
 import copy
+from array import array
+from itertools import izip
 
 # pcap's filter compiling function isn't threadsafe, so we use this
 # lock when compiling filters.
 _compile_lock = Lock()
 
+# Number of unsigned ints per packet in a batch's records (see next_batch())
+BATCH_RECORD_FIELDS = 5
+
+
+def iter_batch (data, records):
+  """
+  Iterates over the packets in a batch from next_batch()
+
+  Yields tuples of (data, timestamp_seconds, timestamp_useconds, total
+  length) -- the same things a per-packet callback gets.
+  """
+  n = BATCH_RECORD_FIELDS
+  for offset,caplen,sec,usec,length in izip(records[0::n], records[1::n],
+                                            records[2::n], records[3::n],
+                                            records[4::n]):
+    yield data[offset:offset+caplen], sec, usec, length
+
+
+def split_batch (data, records):
+  """
+  Returns a list of the packet data in a batch from next_batch()
+  """
+  n = BATCH_RECORD_FIELDS
+  return [data[offset:offset+caplen]
+          for offset,caplen in izip(records[0::n], records[1::n])]
+
+
+def _dispatch_batch (ppcap, max_count, use_bytearray, release_thread):
+  """
+  Pure Python version of pcapc.dispatch_batch()
+
+  For builds of the C module from before it had one.
+  """
+  chunks = []
+  records = array('I')
+  offset = [0]
+  def cb (obj, data, sec, usec, length):
+    records.extend((offset[0], len(data), sec, usec, length))
+    offset[0] += len(data)
+    chunks.append(data)
+  rv = pcapc.dispatch(ppcap, max_count, cb, None, use_bytearray,
+                      release_thread)
+  data = (bytearray if use_bytearray else bytes)().join(chunks)
+  return data, records.tostring(), rv
+
+
 class PCap (object):
   use_select = False # Falls back to non-select
 
@@ -93,11 +141,17 @@ class PCap (object):
 
   def __init__ (self, device = None, promiscuous = True, period = 10,
                 start = True, callback = None, filter = None,
-                use_bytearray = False, **kw):
+                use_bytearray = False, batch_callback = None,
+                batch_size = 100, **kw):
     """
     Initialize this instance
 
     use_bytearray: specifies capturing to bytearray buffers instead of bytes
+    batch_callback: if set, packets are captured in batches (see
+                    next_batch()) and passed to this instead of callback.
+                    It's called with this PCap, the batch's data, and its
+                    records.
+    batch_size: the most packets to capture in one batch
     """
 
     if filter is not None:
@@ -111,6 +165,9 @@ class PCap (object):
     self.promiscuous = promiscuous
     self.device = None
     self.use_bytearray = use_bytearray
+    self.batch_callback = batch_callback
+    self.batch_size = batch_size
+    self.offline = False
     self.period = period
     self.netmask = IPAddr("0.0.0.0")
     self._quitting = False
@@ -156,6 +213,20 @@ class PCap (object):
       self.set_filter(*self.deferred_filter)
       self.deferred_filter = None
 
+  def open_offline (self, filename):
+    """
+    Opens a capture file instead of a device
+    """
+    assert self.device is None
+    self.device = filename
+    self.offline = True
+    self.pcap = pcapc.open_offline(filename)
+    self.packets_received = 0
+    self.packets_dropped = 0
+    if self.deferred_filter is not None:
+      self.set_filter(*self.deferred_filter)
+      self.deferred_filter = None
+
   def set_direction (self, incoming, outgoing):
     pcapc.setdirection(self._pcap, incoming, outgoing)
 
@@ -183,6 +254,26 @@ class PCap (object):
     """
     return pcapc.next_ex(self._pcap, bool(self.use_bytearray), allow_threads)
 
+  def next_batch (self, max_count = None, allow_threads = True):
+    """
+    Get up to max_count packets (default is batch_size) at once
+
+    Returns tuple with:
+      data -- the packets' data back to back in one buffer
+      records -- an array of unsigned ints, BATCH_RECORD_FIELDS per
+                 packet: offset into data, captured length, timestamp
+                 seconds, timestamp useconds, and total length
+      the pcap_dispatch return value -- the number of packets, 0 if none
+        were ready (or at the end of a capture file), or -2 if the
+        capture was stopped with breakloop
+
+    iter_batch() unpacks a batch into per-packet tuples.
+    """
+    if max_count is None: max_count = self.batch_size
+    data,records,rv = _batch_func(self._pcap, max_count,
+                                  bool(self.use_bytearray), allow_threads)
+    return data, array('I', records), rv
+
   def _select_thread_func (self):
     try:
       import select
@@ -201,6 +292,12 @@ class PCap (object):
         # Apparently we're done here.
         break
       if rr:
+        if self.batch_callback is not None:
+          data,records,rv = self.next_batch(allow_threads = False)
+          if records:
+            self.batch_callback(self, data, records)
+          if rv < 0: break
+          continue
         r = self.next_packet(allow_threads = False)
         if r[-1] == 0: continue
         if r[-1] == 1:
@@ -213,7 +310,16 @@ class PCap (object):
 
   def _thread_func (self):
     while not self._quitting:
-      pcapc.dispatch(self.pcap,100,self.callback,self,bool(self.use_bytearray),True)
+      if self.batch_callback is not None:
+        data,records,rv = self.next_batch()
+        if records:
+          self.batch_callback(self, data, records)
+      else:
+        rv = pcapc.dispatch(self.pcap,100,self.callback,self,
+                            bool(self.use_bytearray),True)
+      if self.offline:
+        if rv == 0: break # End of file
+        continue
       self.packets_received,self.packets_dropped = pcapc.stats(self.pcap)
 
     self._quitting = False
@@ -290,6 +396,12 @@ class PCap (object):
     return "PCap(device=%s)" % (self.device)
 
 
+try:
+  _batch_func = pcapc.dispatch_batch
+except:
+  _batch_func = _dispatch_batch
+
+
 class Filter (object):
   def __init__ (self, filter, optimize = True, netmask = None,
                 pcap_obj = None, link_type = 1, snaplen = 65535):
@@ -426,19 +538,30 @@ def interfaces (verbose = False):
   core.quit()
 
 
-def launch (interface, no_incoming=False, no_outgoing=False):
+def launch (interface, no_incoming=False, no_outgoing=False, batch=None):
   """
   pxshark -- prints packets
+
+  --batch[=N] captures up to N (default 100) packets at a time.
   """
   def cb (obj, data, sec, usec, length):
     p = pkt.ethernet(data)
     print p.dump()
 
+  def batch_cb (obj, data, records):
+    for r in iter_batch(data, records):
+      cb(obj, *r)
+
   if interface.startswith("#"):
     interface = int(interface[1:])
     interface = PCap.get_device_names()[interface]
 
-  p = PCap(interface, callback = cb, start=False)
+  if batch:
+    batch_size = 100 if batch is True else int(batch)
+    p = PCap(interface, callback = cb, start=False,
+             batch_callback = batch_cb, batch_size = batch_size)
+  else:
+    p = PCap(interface, callback = cb, start=False)
   p.set_direction(not no_incoming, not no_outgoing)
   #p.use_select = False
   p.start()
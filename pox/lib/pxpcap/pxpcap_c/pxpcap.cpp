@@ -276,6 +276,24 @@ static PyObject * p_open_live (PyObject *self, PyObject *args)
   return Py_BuildValue("l", (long)ppcap);
 }
 
+static PyObject * p_open_offline (PyObject *self, PyObject *args)
+{
+  char * filename;
+  char errbuf[PCAP_ERRBUF_SIZE];
+
+  if (!PyArg_ParseTuple(args, "s", &filename)) return NULL;
+
+  pcap_t * ppcap = pcap_open_offline(filename, errbuf);
+
+  if (!ppcap)
+  {
+    PyErr_SetString(PyExc_RuntimeError, errbuf);
+    return NULL;
+  }
+
+  return Py_BuildValue("l", (long)ppcap);
+}
+
 static PyObject * p_get_selectable_fd (PyObject *self, PyObject *args)
 {
 #ifdef HAVE_PCAP_GET_SELECTABLE_FD
@@ -385,6 +403,125 @@ static PyObject * p_dispatch (PyObject *self, PyObject *args)
   return p_loop_or_dispatch(1, self, args);
 }
 
+/*
+Batch capture.
+
+Packets are copied back to back into one growable buffer while the GIL
+is released, and each gets a record of BATCH_RECORD_FIELDS unsigned ints
+in a second buffer: offset into the data, captured length, timestamp
+seconds, timestamp microseconds, and original length.  Python then only
+gets involved once per batch instead of once per packet.
+*/
+#define BATCH_RECORD_FIELDS 5
+#define BATCH_INITIAL_SIZE (64 * 1024)
+
+struct batch_state
+{
+  char * data;
+  size_t size;
+  size_t capacity;
+  unsigned int * records;
+  int count;
+  int max_count;
+  int failed;
+};
+
+static void batch_callback (u_char * my_batch_state, const struct pcap_pkthdr * h, const u_char * data)
+{
+  batch_state * bs = (batch_state *)my_batch_state;
+  if (bs->failed || bs->count >= bs->max_count) return;
+
+  if (bs->size + h->caplen > bs->capacity)
+  {
+    size_t capacity = bs->capacity * 2;
+    while (capacity < bs->size + h->caplen) capacity *= 2;
+    char * d = (char *)realloc(bs->data, capacity);
+    if (!d)
+    {
+      bs->failed = 1;
+      return;
+    }
+    bs->data = d;
+    bs->capacity = capacity;
+  }
+
+  memcpy(bs->data + bs->size, data, h->caplen);
+  unsigned int * r = bs->records + bs->count * BATCH_RECORD_FIELDS;
+  r[0] = (unsigned int)bs->size;
+  r[1] = h->caplen;
+  r[2] = (unsigned int)h->ts.tv_sec;
+  r[3] = (unsigned int)h->ts.tv_usec;
+  r[4] = h->len;
+  bs->size += h->caplen;
+  bs->count++;
+}
+
+static PyObject * p_dispatch_batch (PyObject *self, PyObject *args)
+{
+  pcap_t * ppcap;
+  batch_state bs;
+  int use_bytearray;
+  int release_thread;
+  int rv;
+  if (!PyArg_ParseTuple(args, "liii", &ppcap, &bs.max_count, &use_bytearray, &release_thread)) return NULL;
+
+  if (bs.max_count <= 0)
+  {
+    PyErr_SetString(PyExc_ValueError, "Batch size must be positive");
+    return NULL;
+  }
+
+  bs.size = 0;
+  bs.count = 0;
+  bs.failed = 0;
+  bs.capacity = BATCH_INITIAL_SIZE;
+  bs.data = (char *)malloc(bs.capacity);
+  bs.records = (unsigned int *)malloc(sizeof(unsigned int) * BATCH_RECORD_FIELDS * bs.max_count);
+  if (!bs.data || !bs.records)
+  {
+    free(bs.data);
+    free(bs.records);
+    return PyErr_NoMemory();
+  }
+
+  if (release_thread)
+  {
+    Py_BEGIN_ALLOW_THREADS;
+    rv = pcap_dispatch(ppcap, bs.max_count, batch_callback, (u_char *)&bs);
+    Py_END_ALLOW_THREADS;
+  }
+  else
+  {
+    rv = pcap_dispatch(ppcap, bs.max_count, batch_callback, (u_char *)&bs);
+  }
+
+  PyObject * result = NULL;
+  if (bs.failed)
+  {
+    PyErr_NoMemory();
+  }
+  else if (rv == -1)
+  {
+    PyErr_SetString(PyExc_RuntimeError, pcap_geterr(ppcap));
+  }
+  else
+  {
+    PyObject * data;
+#ifndef NO_BYTEARRAYS
+    if (use_bytearray)
+      data = PyByteArray_FromStringAndSize(bs.data, bs.size);
+    else
+#endif
+      data = PyString_FromStringAndSize(bs.data, bs.size);
+    result = Py_BuildValue("Ns#i", data, (const char *)bs.records,
+        (int)(sizeof(unsigned int) * BATCH_RECORD_FIELDS * bs.count), rv);
+  }
+
+  free(bs.data);
+  free(bs.records);
+  return result;
+}
+
 static PyObject * p_next_ex (PyObject *self, PyObject *args)
 {
   pcap_t * ppcap;
@@ -618,7 +755,9 @@ static PyMethodDef pxpcapmethods[] =
   {"close", p_close, METH_VARARGS, "Close capture device or file\nPass it a ppcap"},
   {"loop", p_loop, METH_VARARGS, "Capture packets\nPass it a ppcap, a count, a callback, opaque 'user data', whether you want it to capture bytearrays, and whether you want it to let other threads run.\nCallback params are same as first four of next_ex()'s return value"},
   {"dispatch", p_dispatch, METH_VARARGS, "Capture packets\nVery similar to loop()."},
+  {"dispatch_batch", p_dispatch_batch, METH_VARARGS, "Capture a batch of packets\nPass it a ppcap, the most packets to capture, whether you want it to capture a bytearray, and whether you want it to let other threads run.\nReturns tuple (data, records, pcap_dispatch return value).  data holds the packets back to back.  records holds BATCH_RECORD_FIELDS native unsigned ints per packet: offset into data, captured length, timestamp seconds, timestamp microseconds, and total length."},
   {"open_live", p_open_live, METH_VARARGS, "Open a capture device\nPass it dev name, snaplen (max capture length), promiscuous flag (1 for on, 0 for off), timeout milliseconds.\nReturns ppcap."},
+  {"open_offline", p_open_offline, METH_VARARGS, "Open a capture file\nPass it a filename.\nReturns ppcap."},
   {"open_dead", p_open_dead, METH_VARARGS, "Open a dummy capture device\nPass it a linktype and snaplen (max cap length).\nReturns ppcap."},
   {"getnonblock", p_getnonblock, METH_VARARGS, "Returns whether a given ppcap is in blocking mode."},
   {"setnonblock", p_setnonblock, METH_VARARGS, "Controls whether a ppcap is in blocking mode.\nTakes two parameters: a ppcap and a bool."},
@@ -668,5 +807,7 @@ PyMODINIT_FUNC initpxpcap (void)
   ADD_CONST(DLT_ARCNET_LINUX);
   ADD_CONST(DLT_LINUX_IRDA);
   ADD_CONST(DLT_LINUX_LAPD);
+
+  ADD_CONST(BATCH_RECORD_FIELDS);
 }
 
@@ -23,9 +23,10 @@ import select
 import traceback
 import os
 import socket
+import errno
+import heapq
+import math
 import pox.lib.util
-import random
-from pox.lib.epoll_select import EpollSelect
 
 CYCLE_MAXIMUM = 2
 
@@ -44,8 +45,20 @@ def generateTaskID ():
 class BaseTask  (object):
   id = None
   #running = False
+
+  # Tasks with priority 1 all get an equal share of the scheduler.  Lower
+  # priorities get proportionally less (e.g., a task with priority 0.5 runs
+  # half as often as one with priority 1 when both are ready).  Higher
+  # priorities are treated just like 1.  Tasks with priority 0 or less only
+  # run when nothing else is ready.
   priority = 1
 
+  # True while the task is in a scheduler's ready queue
+  _scheduled = False
+
+  # The task's registration with a SelectHub, if it has had one
+  _selectWaiter = None
+
   @classmethod
   def new (cls, *args, **kw):
     """
@@ -128,20 +141,70 @@ class Task (BaseTask):
     return "<" + self.__class__.__name__ + "/tid" + str(self.name) + ">"
 
 
+class _ReadyLevel (object):
+  """
+  The ready queue for tasks of one priority
+
+  Levels take turns by virtual time.  Each slice a level runs advances
+  its virtual time by 1/(priority * number of ready tasks), so each task
+  gets a share of the scheduler proportional to its priority, and a level
+  which has been passed over always ends up with the lowest virtual time
+  eventually.  A level which was empty starts again at the current
+  virtual time, so it can't bank credit while it has nothing to run.
+  Priorities above 1 share the level for 1.
+  """
+  __slots__ = ('priority', 'stride', 'tasks', 'vtime', 'idle',
+               'scheduled', 'max_ready')
+
+  def __init__ (self, priority):
+    self.priority = priority
+    self.stride = 1.0 / priority if priority > 0 else None
+    self.tasks = deque()
+    self.vtime = 0.0
+    self.idle = True
+    # Number of times a task of this level was readied (the ones which
+    # aren't ready any more have been run)
+    self.scheduled = 0
+    self.max_ready = 0 # Most tasks ever ready at once
+
+
 class Scheduler (object):
   """ Scheduler for Tasks """
+  # When the SelectHub isn't threaded, it's polled after this many
+  # slices in a row (so busy tasks can't keep I/O from being noticed)
+  inline_poll_slices = 16
+
   def __init__ (self, isDefaultScheduler = None, startInThread = True,
-                daemon = False, useEpoll=False):
-    self._ready = deque()
+                daemon = False, useEpoll=None, threadedSelectHub = True):
+    """
+    useEpoll picks whether the SelectHub uses epoll or select();
+    None means epoll if it's available.
+
+    If threadedSelectHub is False, the SelectHub doesn't get a thread of
+    its own.  The scheduler waits in it directly when no task is ready,
+    so waking a task for I/O or a timer doesn't mean handing it from one
+    thread to another.
+    """
+    self._first = deque() # Tasks scheduled with first=True
+    self._levels = [] # _ReadyLevels, highest priority first
+    self._levelMap = {} # priority -> _ReadyLevel
+    self._single = None # The only _ReadyLevel, while there's just one
+    self._vtime = 0.0
     self._hasQuit = False
-    self._selectHub = SelectHub(self, useEpoll=useEpoll)
+    self._selectHub = SelectHub(self, useEpoll=useEpoll,
+                                threaded=threadedSelectHub)
     self._thread = None
     self._event = threading.Event()
 
     self._lock = threading.Lock()
+    self._levelLock = threading.Lock()
     self._callLaterTask = None
+    self._timers = None
     self._allDone = False
 
+    # A SchedulerProfile while profiling is enabled
+    self.profile = None
+
     global defaultScheduler
     if isDefaultScheduler or (isDefaultScheduler is None and
                               defaultScheduler is None):
@@ -168,6 +231,19 @@ class Scheduler (object):
 
     self._callLaterTask.callLater(func, *args, **kw)
 
+  @property
+  def timers (self):
+    """
+    This scheduler's TimerWheel
+    """
+    if self._timers is None:
+      wheel = None
+      with self._lock:
+        if self._timers is None:
+          self._timers = wheel = TimerWheel(self)
+      if wheel is not None: wheel.start()
+    return self._timers
+
   def runThreaded (self, daemon = False):
     self._thread = Thread(target = self.run)
     self._thread.daemon = daemon
@@ -188,20 +264,10 @@ class Scheduler (object):
     """
     if threading.current_thread() is self._thread:
       # We're know we're good.
-      #TODO: Refactor the following with ScheduleTask
-      if task in self._ready:
-        # It might make sense to keep a flag on the task, since checking
-        # if it's in the ready list is not very efficient.
-        # Not sure if it makes sense to print out a message here or not.
-        import logging
-        logging.getLogger("recoco").info("Task %s scheduled multiple " +
-                                         "times", task)
-        return False
-      self.fast_schedule(task, first)
-      return True
+      return self._schedule_once(task, first)
 
     st = ScheduleTask(self, task)
-    st.start(fast=True)
+    st.start(self, fast=True)
 
   def fast_schedule (self, task, first = False):
     """
@@ -225,23 +291,167 @@ class Scheduler (object):
     """
 
     # Sanity check.  Won't catch all cases.
-    assert task not in self._ready
+    assert not task._scheduled
+
+    self._enqueue(task, first)
+    if self._selectHub.threaded:
+      self._event.set()
+    elif threading.current_thread() is not self._thread:
+      # The scheduler may be waiting in the hub
+      self._selectHub._poke()
+
+  def _schedule_once (self, task, first = False):
+    """
+    Schedules task unless it's already scheduled
+
+    Only safe on the scheduler's thread (which is also why it doesn't
+    need to wake the scheduler up).
+    """
+    if task._scheduled:
+      # Not sure if it makes sense to print out a message here or not.
+      import logging
+      logging.getLogger("recoco").info("Task %s scheduled multiple " +
+                                       "times", task)
+      return False
+    self._enqueue(task, first)
+    return True
 
+  def _add_level (self, priority):
+    with self._levelLock:
+      level = self._levelMap.get(priority)
+      if level is None:
+        # Priorities above 1 are treated as 1
+        key = min(priority, 1)
+        level = self._levelMap.get(key)
+        if level is None:
+          level = _ReadyLevel(key)
+          self._levels = sorted(self._levels + [level],
+                                key=lambda l: l.priority, reverse=True)
+          self._levelMap[key] = level
+          self._single = level if len(self._levels) == 1 else None
+        self._levelMap[priority] = level
+    return level
+
+  def _enqueue (self, task, first = False):
+    task._scheduled = True
     if first:
-      self._ready.appendleft(task)
-    else:
-      self._ready.append(task)
+      self._first.appendleft(task)
+      return
+    level = self._levelMap.get(task.priority)
+    if level is None: level = self._add_level(task.priority)
+    level.scheduled += 1
+    tasks = level.tasks
+    tasks.append(task)
+    if len(tasks) > level.max_ready: level.max_ready = len(tasks)
+
+  def _has_ready (self):
+    if self._first: return True
+    for level in self._levels:
+      if level.tasks: return True
+    return False
+
+  def _next_task (self):
+    """
+    Takes the next task to run off the ready queues
 
-    self._event.set()
+    Returns None if there isn't one.
+    """
+    if self._first:
+      t = self._first.popleft()
+      t._scheduled = False
+      return t
+
+    best = self._single
+    if best is not None:
+      # Only one priority in use, so there's no need to keep time
+      if not best.tasks: return None
+      t = best.tasks.popleft()
+      t._scheduled = False
+      return t
+
+    best = None
+    background = None
+    contenders = 0
+    for level in self._levels:
+      if not level.tasks:
+        level.idle = True
+        continue
+      if level.idle:
+        level.idle = False
+        if level.vtime < self._vtime: level.vtime = self._vtime
+      if level.stride is None:
+        if background is None: background = level
+      else:
+        contenders += 1
+        if best is None or level.vtime < best.vtime:
+          best = level
+
+    if best is None:
+      best = background
+      if best is None: return None
+    elif contenders > 1:
+      # (A level with nothing to compete with doesn't need to keep time)
+      self._vtime = best.vtime
+      best.vtime += best.stride / len(best.tasks)
+
+    t = best.tasks.popleft()
+    t._scheduled = False
+    return t
+
+  def _ready_count (self):
+    return len(self._first) + sum(len(l.tasks) for l in self._levels)
+
+  def enable_profiling (self, slow_slice = None, depth_interval = 1,
+                        history = 300):
+    """
+    Starts keeping run time statistics for tasks
+
+    Returns the SchedulerProfile; see it for the meaning of the arguments.
+    If profiling is already on, starts over with a new one.
+    """
+    self.profile = SchedulerProfile(self, slow_slice=slow_slice,
+                                    depth_interval=depth_interval,
+                                    history=history)
+    return self.profile
+
+  def disable_profiling (self):
+    self.profile = None
+
+  def priority_stats (self):
+    """
+    Returns run statistics for each priority level
+
+    The result maps each task priority seen so far (with priorities above
+    1 counted as 1) to a dict with:
+     ready     - number of tasks currently ready
+     max_ready - most tasks ever ready at once
+     scheduled - number of times a task was made ready
+     slices    - number of times a task was run
+    Tasks scheduled with first=True aren't counted.
+    """
+    return dict((l.priority, dict(ready=len(l.tasks), max_ready=l.max_ready,
+                                  scheduled=l.scheduled,
+                                  slices=l.scheduled - len(l.tasks)))
+                for l in self._levels)
 
   def quit (self):
     self._hasQuit = True
+    self._event.set()
+    if not self._selectHub.threaded:
+      self._selectHub._poke()
 
   def run (self):
+    if self._thread is None:
+      self._thread = threading.current_thread()
     try:
+      if not self._selectHub.threaded:
+        self._run_inline()
+        return
       while self._hasQuit == False:
-        if len(self._ready) == 0:
-          self._event.wait(CYCLE_MAXIMUM) # Wait for a while
+        if not self._has_ready():
+          # No timeout, since in Python 2 waiting with one polls (with
+          # sleeps of up to 50ms).  fast_schedule() and quit() set it.
+          self._event.wait()
           self._event.clear()
           if self._hasQuit: break
         r = self.cycle()
@@ -251,35 +461,49 @@ class Scheduler (object):
       self._selectHub._cycle()
       self._allDone = True
 
-  def cycle (self):
-    #if len(self._ready) == 0: return False
-
-    # Patented hilarious priority system
-    #TODO: Replace it with something better
-    t = None
-    try:
-      while True:
-        t = self._ready.popleft()
-        if t.priority >= 1: break
-        if len(self._ready) == 0: break
-        if t.priority >= random.random(): break
-        self._ready.append(t)
-    except IndexError:
-      return False
+  def _run_inline (self):
+    """
+    The run loop when the SelectHub doesn't have its own thread
+    """
+    hub = self._selectHub
+    slices = 0
+    while self._hasQuit == False:
+      if not self._has_ready():
+        slices = 0
+        hub._run_once()
+        continue
+      self.cycle()
+      slices += 1
+      if slices >= self.inline_poll_slices:
+        slices = 0
+        hub._run_once(0)
 
-    #print(len(self._ready), "tasks")
+  def cycle (self):
+    level = self._single
+    if level is not None and level.tasks and not self._first:
+      # The common case, inline
+      t = level.tasks.popleft()
+      t._scheduled = False
+    else:
+      t = self._next_task()
+      if t is None: return False
 
+    profile = self.profile
+    if profile is not None: start = time.time()
     try:
       rv = t.execute()
     except StopIteration:
+      if profile is not None: profile._record(t, start, True)
       return True
     except:
+      if profile is not None: profile._record(t, start, True)
       try:
         print("Task", t, "caused exception and was de-scheduled")
         traceback.print_exc()
       except:
         pass
       return True
+    if profile is not None: profile._record(t, start, False)
 
     if isinstance(rv, BlockingOperation):
       try:
@@ -296,7 +520,17 @@ class Scheduler (object):
       # Sleep time
       if rv == 0:
         #print "sleep 0"
-        self._ready.append(t)
+        if not t._scheduled:
+          # Inline _enqueue() for the common case
+          level = self._levelMap.get(t.priority)
+          if level is None:
+            self._enqueue(t)
+          else:
+            t._scheduled = True
+            level.scheduled += 1
+            tasks = level.tasks
+            tasks.append(t)
+            if len(tasks) > level.max_ready: level.max_ready = len(tasks)
       else:
         self._selectHub.registerTimer(t, rv)
     elif rv == None:
@@ -305,6 +539,169 @@ class Scheduler (object):
     return True
 
 
+class _TaskProfile (object):
+  __slots__ = ('name', 'time', 'slices', 'max', 'slow')
+
+  def __init__ (self, name):
+    self.name = name
+    self.time = 0.0  # Total time spent running
+    self.slices = 0  # Times run
+    self.max = 0.0   # Longest single slice
+    self.slow = 0    # Slices at least slow_slice long
+
+  def as_dict (self):
+    return dict(name=self.name, time=self.time, slices=self.slices,
+                max=self.max, slow=self.slow,
+                avg=self.time / self.slices if self.slices else 0.0)
+
+
+def _task_frame (task):
+  """
+  Returns the frame a task's generator is stopped in (or None)
+  """
+  frame = getattr(getattr(task, 'gen', None), 'gi_frame', None)
+  if frame is not None and frame.f_code is Task.run.im_func.func_code:
+    # A Task just passes things along to its target's generator
+    inner = getattr(frame.f_locals.get('g'), 'gi_frame', None)
+    if inner is not None: frame = inner
+  return frame
+
+
+class SchedulerProfile (object):
+  """
+  Run time statistics for a Scheduler's tasks
+
+  Made by Scheduler.enable_profiling().  Every slice is timed and added
+  to the running task's totals, which costs a couple of clock reads and
+  a dict lookup per slice.  Tasks which end are folded into a total for
+  their class.
+
+  The ready-queue depth is sampled at most every depth_interval seconds
+  (when a slice ends), and the last history samples are kept.
+
+  If slow_slice is set, a slice which runs for at least that many
+  seconds is logged along with where the task's generator stopped.
+
+  The query methods can be called from any thread.
+  """
+  def __init__ (self, scheduler, slow_slice = None, depth_interval = 1,
+                history = 300):
+    self._scheduler = scheduler
+    self.slow_slice = slow_slice
+    self.depth_interval = depth_interval
+    self._history = history
+    self.reset()
+
+  def reset (self):
+    self._tasks = {} # Task -> _TaskProfile
+    self._finished = {} # Class name -> _TaskProfile of finished tasks
+    self.depth_history = deque(maxlen=self._history) # (time, depth)
+    self._next_depth = 0
+    self.started = time.time()
+    self.slow = 0
+
+  def _record (self, task, start, done):
+    end = time.time()
+    elapsed = end - start
+    p = self._tasks.get(task)
+    if p is None:
+      p = self._tasks[task] = _TaskProfile(str(task))
+    p.time += elapsed
+    p.slices += 1
+    if elapsed > p.max: p.max = elapsed
+
+    if self.slow_slice is not None and elapsed >= self.slow_slice:
+      p.slow += 1
+      self.slow += 1
+      self._log_slow(task, elapsed, done)
+
+    if done:
+      self._tasks.pop(task, None) # (May have been reset meanwhile)
+      name = type(task).__name__
+      f = self._finished.get(name)
+      if f is None:
+        f = self._finished[name] = _TaskProfile(name + " (finished)")
+      f.time += p.time
+      f.slices += p.slices
+      f.slow += p.slow
+      if p.max > f.max: f.max = p.max
+
+    if end >= self._next_depth:
+      self._next_depth = end + self.depth_interval
+      self.depth_history.append((end, self._scheduler._ready_count()))
+
+  def _log_slow (self, task, elapsed, done):
+    frame = None if done else _task_frame(task)
+    if frame is None:
+      where = " and ended"
+    else:
+      # Where it yielded at the end of the slice
+      where = ", then yielded at:\n"
+      where += "".join(traceback.format_stack(frame, 1)).rstrip()
+    import logging
+    logging.getLogger("recoco").warning("Slow slice: %s ran for %.3fs%s",
+                                        task, elapsed, where)
+
+  @property
+  def busy (self):
+    """
+    Total time spent running tasks
+    """
+    return sum(p.time for p in self._tasks.values() + self._finished.values())
+
+  @property
+  def slices (self):
+    """
+    Total number of slices run
+    """
+    return sum(p.slices for p in self._tasks.values()
+                                 + self._finished.values())
+
+  def task_stats (self, count = None):
+    """
+    Returns a list of per-task dicts, most total time first
+
+    Each has name, time (total seconds), slices, avg, max (longest
+    slice), and slow (slices over slow_slice).
+    """
+    entries = self._tasks.values() + self._finished.values()
+    r = sorted((p.as_dict() for p in entries),
+               key=lambda d: d['time'], reverse=True)
+    if count is not None: r = r[:count]
+    return r
+
+  def stats (self, count = None):
+    """
+    Returns everything as a dict (suitable for turning into JSON)
+    """
+    elapsed = time.time() - self.started
+    busy = self.busy
+    return dict(elapsed=elapsed, busy=busy,
+                utilization=busy / elapsed if elapsed else 0.0,
+                slices=self.slices, slow=self.slow,
+                slow_slice=self.slow_slice,
+                ready=self._scheduler._ready_count(),
+                depth=list(self.depth_history),
+                tasks=self.task_stats(count))
+
+  def report (self, count = 10):
+    """
+    Returns a human-readable summary of the top tasks
+    """
+    s = self.stats(count)
+    depths = [d for t,d in s['depth']]
+    lines = ["%.1fs elapsed, %.1f%% busy, %i slices, %i slow, ready now %i, "
+             "max %i" % (s['elapsed'], s['utilization'] * 100, s['slices'],
+                        s['slow'], s['ready'], max(depths or [0]))]
+    lines.append("%10s %8s %10s %10s %5s  %s" % ("time", "slices", "avg",
+                                                 "max", "slow", "task"))
+    for t in s['tasks']:
+      lines.append("%9.3fs %8i %8.1fus %8.1fms %5i  %s"
+                   % (t['time'], t['slices'], t['avg'] * 1e6,
+                      t['max'] * 1e3, t['slow'], t['name']))
+    return "\n".join(lines)
+
+
 #TODO: Read() and Write() BlockingOperations that use nonblocking sockets with
 #      SelectHub and do post-processing of the return value.
 
@@ -482,131 +879,403 @@ class Send (BlockingOperation):
     task.rf = self._sendReturnFunc
     scheduler._selectHub.registerSelect(task, None, [self._fd], [self._fd])
 
+_EPOLLIN = getattr(select, 'EPOLLIN', 0)
+_EPOLLOUT = getattr(select, 'EPOLLOUT', 0)
+_EPOLLPRI = getattr(select, 'EPOLLPRI', 0)
+_EPOLLERR = getattr(select, 'EPOLLERR', 0) | getattr(select, 'EPOLLHUP', 0)
+
+
+class _SelectWaiter (object):
+  """
+  A task's Select() registration with a SelectHub
+
+  The fd maps go from file descriptor to the object the task passed in,
+  since that's what it gets back.  A waiter stays attached to its task
+  after it fires, so that when the task selects on the same things again
+  (the usual case), the hub can just reactivate it.  Several waiters can
+  wait on the same fd; they're all woken when it's ready.
+  """
+  __slots__ = ('task', 'lists', 'rfds', 'wfds', 'xfds', 'bad', 'deadline',
+               'active', 'timer_seq', 'disarmed')
+
+  def __init__ (self, task, lists):
+    self.task = task
+    self.lists = lists
+    self.bad = []
+    self.rfds = self._fd_map(lists[0])
+    self.wfds = self._fd_map(lists[1])
+    self.xfds = self._fd_map(lists[2])
+    self.deadline = None
+    self.active = False
+    self.timer_seq = None
+    self.disarmed = set() # fds unregistered while we weren't waiting
+
+  def _fd_map (self, objs):
+    m = {}
+    for o in objs:
+      try:
+        fd = o if isinstance(o, (int,long)) else o.fileno()
+      except Exception:
+        fd = -1
+      if fd < 0:
+        # Probably closed
+        self.bad.append(o)
+      else:
+        m[fd] = o
+    return m
+
+
 #TODO: just merge this in with Scheduler?
 class SelectHub (object):
   """
   This class is a single select() loop that handles all Select() requests for
   a scheduler as well as timed wakes (i.e., Sleep()).
+
+  Which tasks are waiting on which file descriptor is kept in maps that
+  are updated as tasks start and stop waiting, rather than rebuilt from
+  every waiting task on each pass, and deadlines are kept in a heap.
+  With epoll (the default where it's available), file descriptors also
+  stay registered with the kernel between a task's Select()s; one is only
+  unregistered if it becomes ready while nobody is waiting on it.  Waiters
+  which aren't waiting any more are then dropped from the maps, and put
+  back if they wait again.
   """
-  def __init__ (self, scheduler, useEpoll=False):
-    # We store tuples of (elapse-time, task)
-    self._sleepers = [] # Sleeping items stored as a heap
-    self._incoming = Queue() # Threadsafe queue for new items
+  def __init__ (self, scheduler, useEpoll=None, threaded=True):
+    """
+    If threaded is False, the hub doesn't get its own thread; instead,
+    the scheduler calls _run_once() on its own thread.
+    """
+    if useEpoll is None: useEpoll = hasattr(select, 'epoll')
+    self._incoming = deque() # (task, rlist, wlist, xlist, deadline)
+    self._pinged = False
+    self._rets = {} # _SelectWaiter -> (rlist,wlist,xlist) to wake with
+
+    # Heap of (deadline, seq, waiter).  Entries for waiters which have
+    # since been woken some other way are skipped when they come up.
+    self._sleepers = []
+    self._timer_seq = 0
+    self._live_timers = 0
+
+    # fd -> set of _SelectWaiters
+    self._readers = {}
+    self._writers = {}
+    self._excepters = {}
+
+    self._failed = set() # fds which couldn't be waited on
 
     self._scheduler = scheduler
     self._pinger = pox.lib.util.makePinger()
-    self.epoll = EpollSelect() if useEpoll else None
+    self._pinger_fd = self._pinger.fileno()
+    if useEpoll:
+      self.epoll = select.epoll()
+      self._armed = {} # fd -> event mask registered with epoll
+      self.epoll.register(self._pinger_fd, _EPOLLIN)
+    else:
+      self.epoll = None
 
     self._ready = False
 
-    self._thread = Thread(target = self._threadProc)
-    self._thread.daemon = True
-    self._thread.start()
-
-    # Ugly busy wait for initialization
-    #while self._ready == False:
+    self.threaded = threaded
+    if threaded:
+      self._thread = Thread(target = self._threadProc)
+      self._thread.daemon = True
+      self._thread.start()
+    else:
+      self._thread = None
 
   def _threadProc (self):
-    tasks = {}
-    timeouts = []
-    rets = {}
-
     while self._scheduler._hasQuit == False:
-      #print("SelectHub cycle")
+      self._run_once()
 
-      if len(timeouts) == 0:
-        timeout = None
-      else:
-        timeout = self._sleepers[0][0] - time.time()
-        if timeout < 0: timeout = 0
+  def _run_once (self, timeout = CYCLE_MAXIMUM):
+    """
+    Waits up to timeout for I/O or a deadline and wakes whoever is ready
 
-      #NOTE: Everything you select on eventually boils down to file descriptors,
-      #      which are unique, obviously.  It might be possible to leverage this
-      #      to reduce hashing cost (i.e. by picking a really good hashing
-      #      function), though this is complicated by wrappers, etc...
-      rl = {}
-      wl = {}
-      xl = {}
+    Returns early if pinged (e.g., for a new Select() from another thread).
+    """
+    rets = self._rets
+    if rets: timeout = 0
+
+    sleepers = self._sleepers
+    while sleepers:
+      deadline,seq,w = sleepers[0]
+      if w.active and w.timer_seq == seq:
+        timeout = max(0, min(timeout, deadline - time.time()))
+        break
+      heapq.heappop(sleepers)
+
+    poll = self._poll_epoll if self.epoll else self._poll_select
+    if poll(timeout, rets):
+      # Clear the flag only after ponging so that a ping which comes in
+      # between isn't lost; anything queued before it is picked up below.
+      self._pinger.pongAll()
+      self._pinged = False
+      incoming = self._incoming
+      while incoming:
+        self._add(rets, *incoming.popleft())
 
-      timeout = None
-      timeoutTask = None
+    if self._failed:
+      self._report_failed(rets)
 
+    if sleepers:
       now = time.time()
+      while sleepers and sleepers[0][0] <= now:
+        deadline,seq,w = heapq.heappop(sleepers)
+        if w.active and w.timer_seq == seq and w not in rets:
+          rets[w] = ([],[],[])
+      if len(sleepers) > 2 * self._live_timers + 1024:
+        self._sleepers = [s for s in sleepers
+                          if s[2].active and s[2].timer_seq == s[1]]
+        heapq.heapify(self._sleepers)
+
+    if rets:
+      for w,v in rets.iteritems():
+        self._wake(w, v)
+      rets.clear()
+
+  def _poll_epoll (self, timeout, rets):
+    """
+    Waits on epoll and adds ready waiters to rets
 
-      expired = None
-
-      for t,trl,twl,txl,tto in tasks.itervalues():
-        if tto != None:
-          if tto <= now:
-            # Already expired
-            if expired is None: expired = []
-            expired.append(t)
-            if tto-now > 0.1: print("preexpired",tto,now,tto-now)
-            continue
-          tt = tto - now
-          if tt < timeout or timeout is None:
-            timeout = tt
-            timeoutTask = t
-
-        if trl:
-          for i in trl: rl[i] = t
-        if twl:
-          for i in twl: wl[i] = t
-        if txl:
-          for i in txl: xl[i] = t
-
-      if expired:
-        for t in expired:
-          del tasks[t]
-          self._return(t, ([],[],[]))
-
-      if timeout is None: timeout = CYCLE_MAXIMUM
-      if self.epoll:
-        ro, wo, xo = self.epoll.select( rl.keys() + [self._pinger],
-                                  wl.keys(),
-                                  xl.keys(), timeout )
-      else:
-        ro, wo, xo = select.select( rl.keys() + [self._pinger],
-                                  wl.keys(),
-                                  xl.keys(), timeout )
-
-      if len(ro) == 0 and len(wo) == 0 and len(xo) == 0 and timeoutTask != None:
-        # IO is idle - dispatch timers / release timeouts
-        del tasks[timeoutTask]
-        self._return(timeoutTask, ([],[],[]))
+    Returns whether the pinger went off.
+    """
+    if timeout > 0:
+      # epoll only has millisecond resolution and rounds down
+      timeout = (int(timeout * 1000) + 1) / 1000.0
+    try:
+      events = self.epoll.poll(timeout)
+    except IOError as e:
+      if e.errno == errno.EINTR: return False
+      raise
+
+    pinged = False
+    readers = self._readers
+    writers = self._writers
+    excepters = self._excepters
+    for fd,ev in events:
+      if fd == self._pinger_fd:
+        pinged = True
+        continue
+      stale = False
+      reported = False
+      if ev & (_EPOLLIN | _EPOLLERR):
+        for w in readers.get(fd, ()):
+          if w.active:
+            r = rets.get(w)
+            if r is None: r = rets[w] = ([],[],[])
+            r[0].append(w.rfds[fd])
+            reported = True
+          else:
+            stale = True
+      if ev & (_EPOLLOUT | _EPOLLERR):
+        for w in writers.get(fd, ()):
+          if w.active:
+            r = rets.get(w)
+            if r is None: r = rets[w] = ([],[],[])
+            r[1].append(w.wfds[fd])
+            reported = True
+          else:
+            stale = True
+      if (ev & _EPOLLPRI) or (ev & _EPOLLERR and not reported):
+        for w in excepters.get(fd, ()):
+          if w.active:
+            r = rets.get(w)
+            if r is None: r = rets[w] = ([],[],[])
+            r[2].append(w.xfds[fd])
+            reported = True
+          else:
+            stale = True
+      if stale or not reported:
+        # Ready, but nobody (or not everybody) is waiting on it any more.
+        # Level triggering means it'll keep being ready, so stop asking.
+        self._arm(fd)
+
+    return pinged
+
+  def _poll_select (self, timeout, rets):
+    """
+    Waits on select() and adds ready waiters to rets
+
+    Only active waiters are in the maps when using select().  Returns
+    whether the pinger went off.
+    """
+    rl = list(self._readers)
+    rl.append(self._pinger_fd)
+    try:
+      ro,wo,xo = select.select(rl, list(self._writers),
+                               list(self._excepters), timeout)
+    except (select.error, ValueError, TypeError):
+      self._find_bad_fds()
+      return False
+
+    for i,fds,owners in ((0, ro, self._readers), (1, wo, self._writers),
+                         (2, xo, self._excepters)):
+      for fd in fds:
+        ws = owners.get(fd)
+        if ws is None: continue # The pinger
+        for w in ws:
+          r = rets.get(w)
+          if r is None: r = rets[w] = ([],[],[])
+          r[i].append((w.rfds, w.wfds, w.xfds)[i][fd])
+
+    return self._pinger_fd in ro
+
+  def _find_bad_fds (self):
+    for owners in (self._readers, self._writers, self._excepters):
+      for fd in owners:
+        try:
+          select.select([fd], [], [], 0)
+        except Exception:
+          self._failed.add(fd)
+
+  def _report_failed (self, rets):
+    """
+    Reports fds which can't be waited on as ready
+
+    The tasks waiting on them should find out what's wrong when they
+    try to use them.
+    """
+    for fd in self._failed:
+      for i,owners in enumerate((self._readers, self._writers,
+                                 self._excepters)):
+        for w in owners.get(fd, ()):
+          if not w.active: continue
+          r = rets.get(w)
+          if r is None: r = rets[w] = ([],[],[])
+          r[i].append((w.rfds, w.wfds, w.xfds)[i][fd])
+    self._failed.clear()
+
+  def _arm (self, fd):
+    """
+    Brings fd's epoll registration in line with who's waiting on it
+
+    Waiters which aren't active any more are dropped from fd's sets and
+    have fd added to their disarmed sets, so that they're put back (and
+    fd is armed again) if they're reactivated.
+    """
+    mask = 0
+    for owners,bit in ((self._readers, _EPOLLIN), (self._writers, _EPOLLOUT),
+                       (self._excepters, _EPOLLPRI)):
+      ws = owners.get(fd)
+      if ws is None: continue
+      for w in list(ws):
+        if w.active:
+          mask |= bit
+        else:
+          ws.discard(w)
+          w.disarmed.add(fd)
+      if not ws: del owners[fd]
+    want = mask != 0
+
+    cur = self._armed.get(fd)
+    try:
+      if not want:
+        if cur is not None:
+          del self._armed[fd]
+          self.epoll.unregister(fd)
+      elif cur is None:
+        self._armed[fd] = mask
+        try:
+          self.epoll.register(fd, mask)
+        except IOError as e:
+          if e.errno != errno.EEXIST: raise
+          self.epoll.modify(fd, mask)
+      elif cur != mask:
+        self._armed[fd] = mask
+        try:
+          self.epoll.modify(fd, mask)
+        except IOError as e:
+          # Closed (which removes it from epoll), and maybe reused
+          if e.errno != errno.ENOENT: raise
+          self.epoll.register(fd, mask)
+    except (IOError, ValueError):
+      if not want: return # Unregistering something already closed
+      # Closed, or something epoll can't wait on (e.g., a regular file)
+      self._armed.pop(fd, None)
+      self._failed.add(fd)
+
+  def _attach (self, w, only = None):
+    """
+    Adds w to the waiters for all of its fds (or just those in only)
+    """
+    for fds,owners in ((w.rfds, self._readers), (w.wfds, self._writers),
+                       (w.xfds, self._excepters)):
+      for fd in fds:
+        if only is not None and fd not in only: continue
+        ws = owners.get(fd)
+        if ws is None: ws = owners[fd] = set()
+        ws.add(w)
+    if self.epoll:
+      if only is None: only = set(w.rfds).union(w.wfds, w.xfds)
+      for fd in list(only):
+        self._arm(fd)
+    w.disarmed.clear()
+
+  def _detach (self, w):
+    """
+    Removes w from the waiters for its fds
+    """
+    changed = []
+    for fds,owners in ((w.rfds, self._readers), (w.wfds, self._writers),
+                       (w.xfds, self._excepters)):
+      for fd in fds:
+        ws = owners.get(fd)
+        if ws is not None and w in ws:
+          ws.discard(w)
+          if not ws: del owners[fd]
+          changed.append(fd)
+    if self.epoll:
+      for fd in changed:
+        self._arm(fd)
+
+  def _add (self, rets, task, rlist, wlist, xlist, deadline):
+    lists = (tuple(rlist) if rlist else (), tuple(wlist) if wlist else (),
+             tuple(xlist) if xlist else ())
+    w = task._selectWaiter
+    if w is not None and w.active:
+      # Woken some other way without its Select() returning
+      self._deactivate(w)
+    if w is not None and w.lists == lists:
+      # Same as last time
+      w.active = True
+      if not self.epoll:
+        self._attach(w)
+      elif w.disarmed:
+        # Only the fds it was dropped from while it wasn't waiting
+        self._attach(w, w.disarmed)
+    else:
+      old = w
+      w = _SelectWaiter(task, lists)
+      task._selectWaiter = w
+      w.active = True
+      self._attach(w)
+      if old is not None and self.epoll:
+        # After attaching the new one so shared fds aren't touched
+        self._detach(old)
+      if w.bad:
+        rets[w] = ([],[],list(w.bad))
+
+    w.deadline = deadline
+    if deadline is not None:
+      if deadline <= time.time():
+        if w not in rets: rets[w] = ([],[],[])
       else:
-        # We have IO events
-        if self._pinger in ro:
-          self._pinger.pongAll()
-          while not self._incoming.empty():
-            stuff = self._incoming.get(True)
-            task = stuff[0]
-            assert task not in tasks
-            tasks[task] = stuff
-            self._incoming.task_done()
-          if len(ro) == 1 and len(wo) == 0 and len(xo) == 0:
-            # Just recycle
-            continue
-          ro.remove(self._pinger)
-
-        # At least one thread is going to be resumed
-        for i in ro:
-          task = rl[i]
-          if task not in rets: rets[task] = ([],[],[])
-          rets[task][0].append(i)
-        for i in wo:
-          task = wl[i]
-          if task not in rets: rets[task] = ([],[],[])
-          rets[task][1].append(i)
-        for i in xo:
-          task = xl[i]
-          if task not in rets: rets[task] = ([],[],[])
-          rets[task][2].append(i)
-
-        for t,v in rets.iteritems():
-          del tasks[t]
-          self._return(t, v)
-        rets.clear()
+        self._timer_seq += 1
+        w.timer_seq = self._timer_seq
+        self._live_timers += 1
+        heapq.heappush(self._sleepers, (deadline, w.timer_seq, w))
+
+  def _deactivate (self, w):
+    w.active = False
+    if w.timer_seq is not None:
+      w.timer_seq = None
+      self._live_timers -= 1
+    if not self.epoll:
+      self._detach(w)
+
+  def _wake (self, w, rv):
+    self._deactivate(w)
+    self._return(w.task, rv)
 
   def registerSelect (self, task, rlist = None, wlist = None, xlist = None,
                       timeout = None, timeIsAbsolute = False):
@@ -614,8 +1283,22 @@ class SelectHub (object):
       if timeout != None:
         timeout += time.time()
 
-    self._incoming.put((task, rlist, wlist, xlist, timeout))
-    self._cycle()
+    if (not self.threaded and
+        threading.current_thread() is self._scheduler._thread):
+      # We're on the thread which runs the hub, so just do it
+      self._add(self._rets, task, rlist, wlist, xlist, timeout)
+      return
+
+    self._incoming.append((task, rlist, wlist, xlist, timeout))
+    self._poke()
+
+  def _poke (self):
+    """
+    Wakes the hub up if it's waiting
+    """
+    if not self._pinged:
+      self._pinged = True
+      self._pinger.ping()
 
   def _cycle (self):
     """
@@ -655,16 +1338,7 @@ class ScheduleTask (BaseTask):
     self._task = task
 
   def run (self):
-    #TODO: Refactor the following, since it is copy/pasted from schedule().
-    if self._task in self._scheduler._ready:
-      # It might make sense to keep a flag on the task, since checking
-      # if it's in the ready list is not very efficient.
-      # Not sure if it makes sense to print out a message here or not.
-      import logging
-      logging.getLogger("recoco").info("Task %s scheduled multiple " +
-                                       "times", self._task)
-    else:
-      self._scheduler.fast_schedule(self._task, True)
+    self._scheduler._schedule_once(self._task, True)
     yield False
 
 
@@ -703,7 +1377,7 @@ class Synchronizer (object):
       self.syncer.outlock.release()
 
 
-class Timer (Task):
+class Timer (object):
   """
   A simple timer.
 
@@ -715,13 +1389,16 @@ class Timer (Task):
   scheduler      The recoco scheduler to use (None means default scheduler)
   started        If False, requires you to call .start() to begin timer
   selfStoppable  If True, the callback can return False to cancel the timer
+
+  Timers live in their scheduler's TimerWheel rather than each being a
+  Task, so they're cheap to have lots of.  They fire at the wheel's tick
+  granularity (TimerWheel.tick seconds) or a bit later.
   """
   def __init__ (self, timeToWake, callback, absoluteTime = False,
                 recurring = False, args = (), kw = {}, scheduler = None,
                 started = True, selfStoppable = True):
     if absoluteTime and recurring:
       raise RuntimeError("Can't have a recurring timer for an absolute time!")
-    Task.__init__(self)
     self._self_stoppable = selfStoppable
     self._next = timeToWake
     self._interval = timeToWake if recurring else 0
@@ -729,6 +1406,8 @@ class Timer (Task):
       self._next += time.time()
 
     self._cancelled = False
+    self._wheel = None
+    self._tick = None # Set by the TimerWheel
 
     self._recurring = recurring
     self._callback = callback
@@ -737,18 +1416,280 @@ class Timer (Task):
 
     if started: self.start(scheduler)
 
+  def start (self, scheduler = None, priority = None, fast = False):
+    """
+    Starts the timer
+
+    (priority and fast are accepted for compatibility with Task.start().)
+    """
+    if scheduler is None: scheduler = defaultScheduler
+    self._wheel = scheduler.timers
+    self._wheel.add(self)
+
   def cancel (self):
+    if self._cancelled: return
     self._cancelled = True
+    if self._wheel is not None:
+      self._wheel.discard(self)
+
+  def __str__ (self):
+    return "<%s %s>" % (self.__class__.__name__, self._callback)
+
+  def _fire (self, now):
+    """
+    Called by the TimerWheel when it's time
+    """
+    self._next = now + self._interval
+    rv = self._callback(*self._args,**self._kw)
+    if self._self_stoppable and (rv is False): return
+    if not self._recurring or self._cancelled: return
+    self._wheel.add(self)
+
+
+class TimerWheel (object):
+  """
+  A hierarchical timing wheel for a scheduler's Timers
+
+  Timers are kept in buckets by tick (tick seconds long).  The first
+  level has one bucket per tick for the next `slots` ticks, the next
+  level has one per `slots` ticks for the next `slots`**2 ticks, and so
+  on.  When the first level wraps around, the next bucket of the level
+  above is spread out ("cascaded") into the levels below it.  Adding
+  and cancelling a timer are O(1); cancelled timers are just skipped
+  when their bucket comes up.
+
+  A single task drives the wheel, sleeping until the next bucket which
+  has something in it (or the next cascade), so there's no per-timer
+  task.  Timers may be added from any thread.
+
+  Anything with _next (its deadline), _cancelled, and _fire(now) can go
+  in the wheel; usually that's a Timer.  The wheel sets its _tick while
+  it's waiting in the wheel and None otherwise.
+  """
+  tick = 0.01
+  slot_bits = 6
+  levels = 4
+
+  def __init__ (self, scheduler):
+    self._lock = threading.Lock()
+    self._mask = (1 << self.slot_bits) - 1
+    self._wheels = [[[] for s in range(self._mask + 1)]
+                    for l in range(self.levels)]
+    self._counts = [0] * self.levels # Entries in each level (even cancelled)
+    self._overflow = [] # Beyond the top level
+    self._due = [] # Already due when added
+    self._now = int(time.time() / self.tick) # Next tick to process
+
+    self._pending = 0
+    self.fired = 0
+    self.lag_total = 0.0
+    self.lag_max = 0.0
+
+    self._wake_tick = None # When the driver task will wake
+    self._running = False # Driver is firing timers
+    self._pinger = pox.lib.util.makePinger()
+    self._scheduler = scheduler
+    self._task = None
+
+  def start (self):
+    """
+    Starts the task which drives the wheel
+    """
+    assert self._task is None
+    self._task = _TimerWheelTask(self)
+    self._task.start(self._scheduler, fast=True)
+
+  def __len__ (self):
+    """
+    Number of pending timers
+    """
+    return self._pending
+
+  def stats (self):
+    """
+    Returns a dict of timer statistics
+
+    lag is how long after its deadline a timer was actually fired.
+    """
+    return dict(pending=self._pending, fired=self.fired,
+                lag_avg=self.lag_total / self.fired if self.fired else 0.0,
+                lag_max=self.lag_max)
+
+  def reset_stats (self):
+    self.fired = 0
+    self.lag_total = 0.0
+    self.lag_max = 0.0
+
+  def add (self, timer):
+    """
+    Adds a timer to fire at its _next
+    """
+    tick = int(math.ceil(timer._next / self.tick))
+    with self._lock:
+      # It may have been cancelled from another thread meanwhile
+      if timer._cancelled: return
+      timer._tick = tick
+      self._pending += 1
+      self._insert(timer)
+      wake = self._wake_tick
+      if self._running:
+        # The driver works out when to wake when it's done firing
+        ping = False
+      elif wake is None or tick < wake:
+        self._wake_tick = tick
+        ping = True
+      else:
+        ping = False
+    if ping:
+      self._pinger.ping()
+
+  def discard (self, timer):
+    """
+    Notes that a timer has been cancelled
+    """
+    with self._lock:
+      if timer._tick is not None:
+        timer._tick = None
+        self._pending -= 1
+
+  def _insert (self, timer):
+    tick = timer._tick
+    delta = tick - self._now
+    if delta < 0:
+      self._due.append(timer)
+      return
+    bits = self.slot_bits
+    for level in range(self.levels):
+      if delta >> (bits * (level + 1)) == 0:
+        self._wheels[level][(tick >> (bits * level)) & self._mask].append(timer)
+        self._counts[level] += 1
+        return
+    self._overflow.append(timer)
+
+  def _cascade (self, tick):
+    """
+    Spreads out the buckets of the upper levels which start at tick
+    """
+    bits = self.slot_bits
+    for level in range(1, self.levels):
+      index = (tick >> (bits * level)) & self._mask
+      bucket = self._wheels[level][index]
+      if bucket:
+        self._wheels[level][index] = []
+        self._counts[level] -= len(bucket)
+        for timer in bucket:
+          if not timer._cancelled: self._insert(timer)
+      if index != 0: return
+    overflow = self._overflow
+    self._overflow = []
+    for timer in overflow:
+      if not timer._cancelled: self._insert(timer)
+
+  def _advance (self, now):
+    """
+    Collects the timers due by now
+    """
+    target = int(now / self.tick)
+    bits = self.slot_bits
+    mask = self._mask
+    wheel = self._wheels[0]
+    counts = self._counts
+    due = self._due
+    self._due = []
+    while self._now <= target:
+      tick = self._now
+      if tick & mask == 0: self._cascade(tick)
+      bucket = wheel[tick & mask]
+      if bucket:
+        wheel[tick & mask] = []
+        counts[0] -= len(bucket)
+        due.extend(bucket)
+      self._now = tick + 1
+      if counts[0] == 0:
+        # Skip straight to the next cascade that could matter
+        for level in range(1, self.levels):
+          if counts[level]: break
+        else:
+          level = self.levels
+          if not self._overflow:
+            self._now = target + 1
+            break
+        nxt = ((tick >> (bits * level)) + 1) << (bits * level)
+        self._now = min(nxt, target + 1)
+    return due
+
+  def _next_wake (self):
+    """
+    Returns the tick the driver should wake at, or None
+    """
+    if self._due: return self._now - 1
+    now = self._now
+    mask = self._mask
+    if self._counts[0]:
+      wheel = self._wheels[0]
+      for tick in range(now, now + mask + 1):
+        if wheel[tick & mask]: return tick
+    for level in range(1, self.levels + 1):
+      if level == self.levels:
+        if not self._overflow: return None
+      elif not self._counts[level]:
+        continue
+      # The first tick at or after now where this level cascades
+      bits = self.slot_bits * level
+      return ((now + (1 << bits) - 1) >> bits) << bits
+
+  def _run_once (self):
+    """
+    Fires whatever is due, and returns the time to wake next (or None)
+    """
+    now = time.time()
+    with self._lock:
+      due = self._advance(now)
+      self._wake_tick = None
+      self._running = True
+      due = [timer for timer in due if not timer._cancelled]
+      for timer in due:
+        timer._tick = None
+      fired = len(due)
+      self._pending -= fired
+    for timer in due:
+      if timer._cancelled: continue # By an earlier one
+      lag = now - timer._next
+      self.lag_total += lag
+      if lag > self.lag_max: self.lag_max = lag
+      try:
+        timer._fire(now)
+      except:
+        import logging
+        logging.getLogger("recoco").exception("Exception in timer %s", timer)
+    with self._lock:
+      self._running = False
+      self.fired += fired
+      tick = self._next_wake()
+      if tick is not None and (self._wake_tick is None
+                               or tick < self._wake_tick):
+        self._wake_tick = tick
+      tick = self._wake_tick
+    if tick is None: return None
+    return tick * self.tick
+
+
+class _TimerWheelTask (BaseTask):
+  """
+  Drives a TimerWheel
+  """
+  def __init__ (self, wheel):
+    BaseTask.__init__(self)
+    self._wheel = wheel
 
   def run (self):
-    while not self._cancelled:
-      yield Sleep(timeToWake=self._next, absoluteTime=True)
-      if self._cancelled: break
-      self._next = time.time() + self._interval
-      rv = self._callback(*self._args,**self._kw)
-      if self._self_stoppable and (rv is False): break
-      if not self._recurring: break
-    yield False # Quit
+    wheel = self._wheel
+    pinger = wheel._pinger
+    while True:
+      wake = wheel._run_once()
+      timeout = None if wake is None else max(0, wake - time.time())
+      rl,wl,xl = yield Select([pinger], None, None, timeout)
+      if rl: pinger.pongAll()
 
 
 class CallLaterTask (BaseTask):
@@ -95,6 +95,7 @@ class Source (EventMixin):
 from __future__ import print_function
 
 import operator
+import time
 
 # weakrefs are used for some event handlers so that just having an event
 # handler set will not keep the source (publisher) alive.
@@ -148,6 +149,10 @@ class Event (object):
   """
   Superclass for events
   """
+  # Fields listeners can filter on, as (attribute name, function to convert
+  # filter values with) pairs; see EventMixin.addListener()
+  _filter_fields = ()
+
   def __init__ (self):
     self.halt = False
     self.source = None
@@ -194,6 +199,15 @@ class EventMixin (object):
   # to True in which all events are acceptable.
   _eventMixin_events = set()
 
+  # Per-instance cache of eventType -> _Dispatch, built from
+  # _eventMixin_handlers as events are raised and thrown away whenever
+  # the listeners (or the events) change.  None until _eventMixin_init().
+  _eventMixin_dispatch = None
+
+  # True if this source's dispatch entries time their handlers; see
+  # enable_handler_profiling()
+  _eventMixin_profiling = False
+
   def _eventMixin_addEvents (self, events):
     for e in events:
       self._eventMixin_addEvent(e)
@@ -209,15 +223,38 @@ class EventMixin (object):
     elif self._eventMixin_events == None:
       self._eventMixin_events = set()
     self._eventMixin_events.add(eventType)
+    self._eventMixin_dispatch = {}
 
   def __init__ (self):
     self._eventMixin_init()
 
   def _eventMixin_init (self):
+    if self._eventMixin_dispatch is not None: return
     if not hasattr(self, "_eventMixin_events"):
       setattr(self, "_eventMixin_events", True)
     if not hasattr(self, "_eventMixin_handlers"):
       setattr(self, "_eventMixin_handlers", {})
+    self._eventMixin_dispatch = {}
+
+  def _eventMixin_compile (self, eventType):
+    """
+    Builds (and caches) the _Dispatch for eventType
+
+    Raises an exception unless eventType may be raised by this object.
+    """
+    if (self._eventMixin_events is not True
+        and eventType not in self._eventMixin_events):
+      raise RuntimeError("Event %s not defined on object of type %s"
+                         % (eventType, type(self)))
+    wrap = None
+    if self._eventMixin_profiling:
+      source = type(self).__name__
+      name = getattr(eventType, "__name__", str(eventType))
+      wrap = lambda h: _TimedHandler(h, (source, name, _handler_name(h)))
+    d = _Dispatch(eventType, self._eventMixin_handlers.get(eventType, ()),
+                  wrap)
+    self._eventMixin_dispatch[eventType] = d
+    return d
 
   def raiseEventNoErrors (self, event, *args, **kw):
     """
@@ -243,19 +280,24 @@ class EventMixin (object):
     Returns the event object, unless it was never created (because there
     were no listeners) in which case returns None.
     """
-    self._eventMixin_init()
+    dispatch = self._eventMixin_dispatch
+    if dispatch is None:
+      self._eventMixin_init()
+      dispatch = self._eventMixin_dispatch
 
-    classCall = False
     if isinstance(event, Event):
       eventType = event.__class__
+      d = dispatch.get(eventType)
+      if d is None: d = self._eventMixin_compile(eventType)
       classCall = True
       if event.source is None: event.source = self
     elif issubclass(event, Event):
-      # Check for early-out
-      if event not in self._eventMixin_handlers:
-        return None
-      if len(self._eventMixin_handlers[event]) == 0:
-        return None
+      d = dispatch.get(event)
+      if d is None:
+        # Check for early-out
+        if not self._eventMixin_handlers.get(event): return None
+        d = self._eventMixin_compile(event)
+      if not d.handlers and d.index is None: return None
 
       classCall = True
       eventType = event
@@ -264,40 +306,58 @@ class EventMixin (object):
       kw = {}
       if event.source is None:
         event.source = self
-    #print("raise",event,eventType)
-    if (self._eventMixin_events is not True
-        and eventType not in self._eventMixin_events):
-      raise RuntimeError("Event %s not defined on object of type %s"
-                         % (eventType, type(self)))
+    else:
+      eventType = event
+      d = dispatch.get(eventType)
+      if d is None: d = self._eventMixin_compile(eventType)
+      classCall = False
+
+    # The handlers are a tuple, so listeners can be added and removed
+    # freely while they're being called (it takes effect next time).
+    handlers = d.handlers
+    if d.index is not None: handlers = d.select(event)
+    if not (d.once or (classCall and d.invoke)):
+      # Fast path: just call them until one returns something
+      for handler, once, eid in handlers:
+        rv = handler(event, *args, **kw)
+        if rv is not None:
+          if self._eventMixin_returned(rv, eid, event, classCall): break
+      return event
 
-    # Create a copy so that it can be modified freely during event
-    # processing.  It might make sense to change this.
-    handlers = self._eventMixin_handlers.get(eventType, [])
-    for (priority, handler, once, eid) in handlers:
+    for handler, once, eid in handlers:
       if classCall:
         rv = event._invoke(handler, *args, **kw)
       else:
         rv = handler(event, *args, **kw)
       if once: self.removeListener(eid)
       if rv is None: continue
-      if rv is False:
+      if self._eventMixin_returned(rv, eid, event, classCall): break
+    return event
+
+  def _eventMixin_returned (self, rv, eid, event, classCall):
+    """
+    Acts on a handler's (non-None) return value
+
+    Returns True if no more handlers should be called.
+    """
+    if rv is False:
+      self.removeListener(eid)
+    if rv is True:
+      if classCall: event.halt = True
+      return True
+    if type(rv) == tuple:
+      if len(rv) >= 2 and rv[1] == True:
         self.removeListener(eid)
-      if rv is True:
+      if len(rv) >= 1 and rv[0]:
         if classCall: event.halt = True
-        break
-      if type(rv) == tuple:
-        if len(rv) >= 2 and rv[1] == True:
-          self.removeListener(eid)
-        if len(rv) >= 1 and rv[0]:
-          if classCall: event.halt = True
-          break
-        if len(rv) == 0:
-          if classCall: event.halt = True
-          break
-      #if classCall and hasattr(event, "halt") and event.halt:
-      if classCall and event.halt:
-        break
-    return event
+        return True
+      if len(rv) == 0:
+        if classCall: event.halt = True
+        return True
+    #if classCall and hasattr(event, "halt") and event.halt:
+    if classCall and event.halt:
+      return True
+    return False
 
   def removeListeners (self, listeners):
     altered = False
@@ -342,11 +402,11 @@ class EventMixin (object):
                                               if x[3] != handler]
           altered = altered or l != len(self._eventMixin_handlers[event])
       else:
-        l = len(handlers)
         handlers = self._eventMixin_handlers[eventType]
+        l = len(handlers)
         self._eventMixin_handlers[eventType] = [x for x in handlers
                                                 if x[3] != handler]
-        altered = altered or l != len(self._eventMixin_handlers[event])
+        altered = altered or l != len(self._eventMixin_handlers[eventType])
     else:
       if eventType == None:
         for event in self._eventMixin_handlers:
@@ -362,6 +422,7 @@ class EventMixin (object):
                                                 if x[1] != handler]
         altered = altered or l != len(self._eventMixin_handlers[eventType])
 
+    if altered: self._eventMixin_dispatch = {}
     return altered
 
   def addListenerByName (self, *args, **kw):
@@ -375,7 +436,7 @@ class EventMixin (object):
     return self.addListener(*args,**kw)
 
   def addListener (self, eventType, handler, once=False, weak=False,
-                   priority=None, byName=False):
+                   priority=None, byName=False, filter=None):
     """
     Add an event handler for an event triggered by this object (subscribe).
 
@@ -394,6 +455,12 @@ class EventMixin (object):
                where higher means to call it earlier.  Do not specify if
                you don't care.
     byName : True if eventType is a string name, else an Event subclass
+    filter : A dict of field=value(s), where the fields are ones the event
+             type lists in its _filter_fields (e.g., PacketIn's dl_type).
+             The handler is only called for events whose fields have the
+             given value (or one of them, if a list or set is given).
+             Sources index filters, so handlers that won't match are
+             skipped without being looked at.
 
     Raises an exception unless eventType is in the source's
     _eventMixin_events set (or, alternately, _eventMixin_events must
@@ -425,12 +492,16 @@ class EventMixin (object):
     else:
       handlers = self._eventMixin_handlers[eventType]
 
+    if filter: filter = _make_filter(eventType, filter)
+    else: filter = None
+
     eid = _generateEventID()
 
     if weak: handler = CallProxy(self, handler, (eventType, eid))
 
-    entry = (priority, handler, once, eid)
+    entry = (priority, handler, once, eid, filter)
 
+    self._eventMixin_dispatch = {}
     handlers.append(entry)
     if priority is not None:
       # If priority is specified, sort the event handlers
@@ -449,7 +520,8 @@ class EventMixin (object):
     """
     return autoBindEvents(self, source, *args, **kv)
 
-  def addListeners (self, sink, prefix='', weak=False, priority=None):
+  def addListeners (self, sink, prefix='', weak=False, priority=None,
+                    filters=None):
     """
     Automatically subscribe sink to our events.
 
@@ -458,16 +530,111 @@ class EventMixin (object):
 
     See also: listenTo(), autoBindEvents()
     """
-    return autoBindEvents(sink, self, prefix, weak, priority)
+    return autoBindEvents(sink, self, prefix, weak, priority, filters)
 
   def clearHandlers(self):
     """
     Remove all handlers from this object
     """
+    self._eventMixin_init()
     self._eventMixin_handlers = {}
+    self._eventMixin_dispatch = {}
+
+
+class _Dispatch (object):
+  """
+  Internal use.
+
+  What EventMixin.raiseEvent() needs to call the handlers for one type of
+  event on one source.
+  """
+  __slots__ = ['handlers', 'once', 'invoke', 'index', '_plain']
 
+  def __init__ (self, eventType, handlers, wrap = None):
+    """
+    handlers is the source's list of (priority, handler, once, eid, filter)
 
-def autoBindEvents (sink, source, prefix='', weak=False, priority=None):
+    If wrap is given, it's called on each handler, and what it returns is
+    called instead.
+    """
+    if wrap is not None:
+      handlers = [(p,wrap(h),once,eid,f) for (p,h,once,eid,f) in handlers]
+    self.once = any(h[2] for h in handlers) # Any once handlers?
+    try:
+      # Does the event type override _invoke()?
+      self.invoke = eventType._invoke.im_func is not Event._invoke.im_func
+    except AttributeError:
+      self.invoke = False
+    self.index = None
+
+    if not any(h[4] for h in handlers):
+      self.handlers = tuple((h,once,eid) for (p,h,once,eid,f) in handlers)
+      return
+
+    # Each filtered handler goes in the index under the first field its
+    # filter uses (in _filter_fields order), once for each of the values
+    # it allows.  The rest of the filter is checked by select().
+    plain = []
+    index = {} # field -> {value -> [(position, entry, rest of filter)]}
+    for pos,(p,h,once,eid,f) in enumerate(handlers):
+      entry = (h,once,eid)
+      if not f:
+        plain.append((pos, entry))
+        continue
+      field,values = f[0]
+      buckets = index.setdefault(field, {})
+      for v in values:
+        buckets.setdefault(v, []).append((pos, entry, f[1:]))
+    self._plain = plain
+    self.handlers = tuple(entry for pos,entry in plain) # Unfiltered ones
+    self.index = tuple((n, index[n]) for n,c in eventType._filter_fields
+                       if n in index)
+
+  def select (self, event):
+    """
+    Returns the handlers which should get the given event
+    """
+    matched = None
+    for field,buckets in self.index:
+      bucket = buckets.get(getattr(event, field))
+      if bucket is None: continue
+      for pos,entry,rest in bucket:
+        for f,values in rest:
+          if getattr(event, f) not in values: break
+        else:
+          if matched is None: matched = list(self._plain)
+          matched.append((pos, entry))
+    if matched is None: return self.handlers
+    matched.sort(key = operator.itemgetter(0))
+    return tuple(entry for pos,entry in matched)
+
+
+def _make_filter (eventType, filter):
+  """
+  Turns an addListener() filter dict into a tuple of (field, frozenset of
+  values) pairs, in the order of eventType's _filter_fields
+  """
+  fields = getattr(eventType, "_filter_fields", None)
+  if not fields:
+    raise RuntimeError("Event %s can't be filtered" % (eventType,))
+  filter = dict(filter)
+  r = []
+  for name,convert in fields:
+    if name not in filter: continue
+    values = filter.pop(name)
+    if not isinstance(values, (list, tuple, set, frozenset)):
+      values = [values]
+    if convert is not None:
+      values = [v if v is None else convert(v) for v in values]
+    r.append((name, frozenset(values)))
+  if filter:
+    raise RuntimeError("Event %s can't be filtered on %s"
+                       % (eventType.__name__, ", ".join(sorted(filter))))
+  return tuple(r)
+
+
+def autoBindEvents (sink, source, prefix='', weak=False, priority=None,
+                    filters=None):
   """
   Automatically set up listeners on sink for events raised by source.
 
@@ -487,6 +654,11 @@ def autoBindEvents (sink, source, prefix='', weak=False, priority=None):
 
   "weak" has the same meaning as with addListener().
 
+  "filters" is a dict mapping event names (or types) to the filter to use
+  when listening to them; see addListener().  For example:
+    autoBindEvents(mySink, core.openflow,
+                   filters={'PacketIn':{'dl_type':0x0806}})
+
   Returns the added listener IDs (so that you can remove them later).
   """
   if len(prefix) > 0 and prefix[0] != '_': prefix = '_' + prefix
@@ -515,8 +687,13 @@ def autoBindEvents (sink, source, prefix='', weak=False, priority=None):
         # and it is one of the events our source triggers
         if event in events:
           # append the listener
+          kw = {}
+          if filters:
+            # (Only passed if given, since sources may override addListener)
+            f = filters.get(event, filters.get(events[event]))
+            if f: kw['filter'] = f
           listeners.append(source.addListener(events[event], a, weak=weak,
-                                              priority=priority))
+                                              priority=priority, **kw))
           #print("autoBind: ",source,m,"to",sink)
         elif len(prefix) > 0 and "_" not in event:
           print("Warning: %s found in %s, but %s not raised by %s" %
@@ -563,3 +740,180 @@ class CallProxy (object):
     raise RuntimeError("callProxy object is gone!")
   def __str__ (self):
     return "<CallProxy for " + self.name + ">"
+
+
+def _handler_name (handler):
+  """
+  Returns a readable name for an event handler
+  """
+  if isinstance(handler, CallProxy):
+    o = handler.obj() if handler.obj is not None else None
+    return "%s.%s" % (type(o).__name__, handler.method.__name__)
+  o = getattr(handler, "im_self", None)
+  if o is not None:
+    return "%s.%s" % (type(o).__name__, handler.__name__)
+  name = getattr(handler, "__name__", None)
+  if name is None: return str(handler)
+  module = getattr(handler, "__module__", None)
+  return "%s.%s" % (module, name) if module else name
+
+
+class _TimedHandler (object):
+  """
+  Internal use.
+
+  Wraps an event handler while profiling, recording how it did.
+  """
+  __slots__ = ['handler', 'key']
+
+  def __init__ (self, handler, key):
+    self.handler = handler
+    self.key = key # (source class, event type, handler) names
+
+  def __call__ (self, *args, **kw):
+    profile = _profile
+    if profile is None: return self.handler(*args, **kw)
+    failed = True
+    start = time.time()
+    try:
+      rv = self.handler(*args, **kw)
+      failed = False
+      return rv
+    finally:
+      profile._record(self.key, time.time() - start, failed)
+
+
+class _HandlerStats (object):
+  __slots__ = ('calls', 'time', 'max', 'exceptions')
+
+  def __init__ (self):
+    self.calls = 0
+    self.time = 0.0 # Total time spent in the handler
+    self.max = 0.0 # Longest single call
+    self.exceptions = 0
+
+
+class HandlerProfile (object):
+  """
+  Call statistics for event handlers
+
+  Made by enable_handler_profiling().  Handlers are counted by the source's
+  class, the event type and the handler's name, so (for example) all
+  the LearningSwitch._handle_PacketIn handlers for all the switches'
+  Connections add up together.
+  """
+  def __init__ (self):
+    self.reset()
+
+  def reset (self):
+    self._stats = {} # (source, event, handler) -> _HandlerStats
+    self.started = time.time()
+
+  def _record (self, key, t, failed):
+    s = self._stats.get(key)
+    if s is None: s = self._stats[key] = _HandlerStats()
+    s.calls += 1
+    s.time += t
+    if t > s.max: s.max = t
+    if failed: s.exceptions += 1
+
+  def handler_stats (self, count = None):
+    """
+    Returns a list of per-handler dicts, most total time first
+
+    Each has source, event, handler, calls, time (total seconds), avg,
+    max (longest call) and exceptions.
+    """
+    r = [dict(source=k[0], event=k[1], handler=k[2], calls=s.calls,
+              time=s.time, avg=s.time / s.calls if s.calls else 0.0,
+              max=s.max, exceptions=s.exceptions)
+         for k,s in self._stats.items()]
+    r.sort(key=lambda d: d['time'], reverse=True)
+    if count is not None: r = r[:count]
+    return r
+
+  def stats (self, count = None):
+    """
+    Returns everything as a dict (suitable for turning into JSON)
+    """
+    handlers = self.handler_stats()
+    return dict(elapsed=time.time() - self.started,
+                calls=sum(h['calls'] for h in handlers),
+                time=sum(h['time'] for h in handlers),
+                handlers=handlers[:count] if count is not None else handlers)
+
+  def report (self, count = 10):
+    """
+    Returns a human-readable summary of the top handlers
+    """
+    s = self.stats(count)
+    lines = ["%.1fs elapsed, %i calls, %.3fs in handlers"
+             % (s['elapsed'], s['calls'], s['time'])]
+    lines.append("%10s %8s %10s %10s %5s  %s" % ("time", "calls", "avg",
+                                                 "max", "exc", "handler"))
+    for h in s['handlers']:
+      lines.append("%9.3fs %8i %8.1fus %8.1fms %5i  %s!%s %s"
+                   % (h['time'], h['calls'], h['avg'] * 1e6, h['max'] * 1e3,
+                      h['exceptions'], h['source'], h['event'], h['handler']))
+    return "\n".join(lines)
+
+
+# The HandlerProfile while profiling is on
+_profile = None
+
+# Sources whose handlers are being timed, as id -> weakref (or the source
+# itself, if it can't be weakly referenced)
+_profiled_sources = {}
+
+_raiseEvent = EventMixin.raiseEvent.im_func
+
+
+def _profilingRaiseEvent (self, event, *args, **kw):
+  """
+  Takes the place of EventMixin.raiseEvent() while profiling is on
+
+  The first time a source raises something, its cached handlers are
+  thrown away so that they're rebuilt with timing.
+  """
+  if not self._eventMixin_profiling and _profile is not None:
+    self._eventMixin_init()
+    try:
+      _profiled_sources[id(self)] = weakref.ref(self,
+          lambda r, key = id(self): _profiled_sources.pop(key, None))
+    except TypeError:
+      _profiled_sources[id(self)] = self
+    self._eventMixin_profiling = True
+    self._eventMixin_dispatch = {}
+  return _raiseEvent(self, event, *args, **kw)
+
+
+def enable_handler_profiling ():
+  """
+  Starts timing event handlers
+
+  Returns the HandlerProfile.  If profiling is already on, returns the
+  existing one.  While it's off, raiseEvent() isn't affected at all.
+  """
+  global _profile
+  if _profile is None:
+    _profile = HandlerProfile()
+    EventMixin.raiseEvent = _profilingRaiseEvent
+  return _profile
+
+
+def disable_handler_profiling ():
+  """
+  Stops timing event handlers
+  """
+  global _profile
+  if _profile is None: return
+  _profile = None
+  EventMixin.raiseEvent = _raiseEvent
+  sources = _profiled_sources.values()
+  _profiled_sources.clear()
+  for s in sources:
+    if isinstance(s, weakref.ref):
+      s = s()
+      if s is None: continue
+    s._eventMixin_profiling = False
+    s._eventMixin_dispatch = {}
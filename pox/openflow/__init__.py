@@ -37,6 +37,35 @@ from pox.lib.revent import *
 from pox.lib.util import dpidToStr
 import libopenflow_01 as of
 from pox.lib.packet.ethernet import ethernet
+from pox.lib.packet.ipv4 import ipv4
+from pox.lib.addresses import EthAddr, IPAddr
+import struct
+
+_packet_in_struct = struct.Struct("!LHHB")
+_uint16 = struct.Struct("!H")
+_uint16x2 = struct.Struct("!HH")
+
+# Outbound message classes for Connection.send().  These only matter once
+# a switch falls behind and messages start queueing: queued messages are
+# sent in this order, and each class has its own byte limit.
+SEND_CONTROL = 0    # Hello, echo, barrier, features/config requests
+SEND_FLOW_SETUP = 1 # Flow mods, port mods, vendor messages
+SEND_PACKET_OUT = 2 # Packet outs
+SEND_BULK = 3       # Stats requests, and anything else marked bulk
+
+send_class_names = {
+  SEND_CONTROL : "control",
+  SEND_FLOW_SETUP : "flow_setup",
+  SEND_PACKET_OUT : "packet_out",
+  SEND_BULK : "bulk",
+}
+
+class SendQueueFull (RuntimeError):
+  """
+  Raised by Connection.send() when a message class with the 'reject'
+  policy is over its limit
+  """
+  pass
 
 class ConnectionUp (Event):
   """
@@ -164,15 +193,67 @@ class PacketIn (Event):
   port (int) - number of port the packet came in on
   data (bytes) - raw packet data
   parsed (packet subclasses) - pox.lib.packet's parsed version
+  ofp (ofp_packet_in) - the OpenFlow message
+
+  ofp may be given either as an ofp_packet_in or as the raw message.  In
+  the latter case, neither the ofp_packet_in nor the parsed packet is
+  built until something asks for it.  Handlers which only need a few
+  header fields can get them straight from the raw bytes instead:
+  buffer_id, reason, dl_src, dl_dst, dl_type, dl_vlan, nw_src, nw_dst,
+  nw_proto, tp_src and tp_dst.  These have the same meaning as in
+  ofp_match (e.g., dl_type is the type after any 802.1Q tag), and are None
+  when the packet doesn't have them (or was truncated before them).
+
+  Listeners which only want some packets can say so with a filter on
+  dl_type, nw_proto, tp_dst, dl_dst and dpid, so that they aren't called
+  for the others at all, e.g.:
+    core.openflow.addListenerByName("PacketIn", handler,
+                                    filter={'dl_type':ethernet.ARP_TYPE})
   """
+  # Filters are indexed on the first of these they use, so the one most
+  # listeners are likely to use comes first.
+  _filter_fields = (('dl_type', int), ('nw_proto', int), ('tp_dst', int),
+                    ('dl_dst', EthAddr), ('dpid', int))
+
   def __init__ (self, connection, ofp):
     Event.__init__(self)
     self.connection = connection
-    self.ofp = ofp
-    self.port = ofp.in_port
-    self.data = ofp.data
-    self._parsed = None
     self.dpid = connection.dpid
+    self._parsed = None
+    self._l3 = None # Offset of the L3 header in _pkt
+    if isinstance(ofp, bytes):
+      self._ofp = None
+      self._data = None
+      self._pkt = ofp
+      self._pkt_offset = 18
+      (buffer_id, self.total_len, self.port,
+       self.reason) = _packet_in_struct.unpack_from(ofp, 8)
+      if buffer_id == of.NO_BUFFER: buffer_id = None
+      self.buffer_id = buffer_id
+    else:
+      self._ofp = ofp
+      self._data = self._pkt = ofp.data
+      self._pkt_offset = 0
+      self.port = ofp.in_port
+      self.buffer_id = ofp.buffer_id
+      self.total_len = ofp.total_len
+      self.reason = ofp.reason
+
+  @property
+  def ofp (self):
+    """
+    The ofp_packet_in
+    """
+    if self._ofp is None:
+      self._ofp = of.ofp_packet_in()
+      self._ofp.unpack(self._pkt)
+    return self._ofp
+
+  @property
+  def data (self):
+    if self._data is None:
+      self._data = self._pkt[self._pkt_offset:]
+    return self._data
 
   def parse (self):
     if self._parsed is None:
@@ -186,6 +267,114 @@ class PacketIn (Event):
     """
     return self.parse()
 
+  @property
+  def dl_dst (self):
+    o = self._pkt_offset
+    if len(self._pkt) < o + 6: return None
+    return EthAddr(self._pkt[o:o+6])
+
+  @property
+  def dl_src (self):
+    o = self._pkt_offset
+    if len(self._pkt) < o + 12: return None
+    return EthAddr(self._pkt[o+6:o+12])
+
+  def _find_l3 (self):
+    """
+    Finds the L3 header, setting _dl_type, _dl_vlan and _l3
+    """
+    pkt = self._pkt
+    o = self._pkt_offset + 12
+    self._dl_type = self._dl_vlan = None
+    self._l3 = -1
+    if len(pkt) < o + 2: return
+    t = _uint16.unpack_from(pkt, o)[0]
+    o += 2
+    if t == ethernet.VLAN_TYPE:
+      if len(pkt) < o + 4: return
+      self._dl_vlan,t = _uint16x2.unpack_from(pkt, o)
+      self._dl_vlan &= 0xfff
+      o += 4
+    else:
+      self._dl_vlan = of.OFP_VLAN_NONE
+    self._dl_type = t
+    self._l3 = o
+
+  @property
+  def dl_type (self):
+    if self._l3 is None: self._find_l3()
+    return self._dl_type
+
+  @property
+  def dl_vlan (self):
+    if self._l3 is None: self._find_l3()
+    return self._dl_vlan
+
+  def _ip_or_arp (self):
+    """
+    Returns (L3 offset, is_ip) if the packet is a complete-enough IPv4 or
+    ARP packet, else None
+    """
+    if self._l3 is None: self._find_l3()
+    o = self._l3
+    t = self._dl_type
+    if t == ethernet.IP_TYPE:
+      if len(self._pkt) >= o + 20: return o,True
+    elif t == ethernet.ARP_TYPE:
+      if len(self._pkt) >= o + 28: return o,False
+    return None
+
+  @property
+  def nw_proto (self):
+    r = self._ip_or_arp()
+    if r is None: return None
+    o,is_ip = r
+    if is_ip: return ord(self._pkt[o+9])
+    opcode = _uint16.unpack_from(self._pkt, o+6)[0]
+    return opcode if opcode <= 255 else None
+
+  @property
+  def nw_src (self):
+    r = self._ip_or_arp()
+    if r is None: return None
+    o,is_ip = r
+    o += 12 if is_ip else 14
+    return IPAddr(self._pkt[o:o+4])
+
+  @property
+  def nw_dst (self):
+    r = self._ip_or_arp()
+    if r is None: return None
+    o,is_ip = r
+    o += 16 if is_ip else 24
+    return IPAddr(self._pkt[o:o+4])
+
+  def _tp (self):
+    r = self._ip_or_arp()
+    if r is None or r[1] is False: return None
+    o = r[0]
+    pkt = self._pkt
+    if _uint16.unpack_from(pkt, o+6)[0] & 0x1fff: return None # Fragment
+    proto = ord(pkt[o+9])
+    o += (ord(pkt[o]) & 0x0f) * 4
+    if proto == ipv4.TCP_PROTOCOL or proto == ipv4.UDP_PROTOCOL:
+      if len(pkt) < o + 4: return None
+      return _uint16x2.unpack_from(pkt, o)
+    elif proto == ipv4.ICMP_PROTOCOL:
+      if len(pkt) < o + 2: return None
+      return ord(pkt[o]),ord(pkt[o+1])
+    return None
+
+  @property
+  def tp_src (self):
+    r = self._tp()
+    return None if r is None else r[0]
+
+  @property
+  def tp_dst (self):
+    r = self._tp()
+    return None if r is None else r[1]
+
 class ErrorIn (Event):
   def __init__ (self, connection, ofp):
     Event.__init__(self)
@@ -240,6 +429,27 @@ class BarrierIn (Event):
     self.dpid = connection.dpid
     self.xid = ofp.xid
 
+class SendCongestion (Event):
+  """
+  Fired when one of a connection's outbound message classes goes over its
+  queue limit (congested is True), and again when it has drained to half
+  of the limit (congested is False).
+
+  Applications sending lots of a class of message (e.g., bulk flow_mods or
+  LLDP packet_outs) can use this to back off.
+
+  send_class (int) - One of the SEND_x classes
+  congested (bool) - Whether the class is now congested
+  queued (int) - Bytes of this class queued on the connection
+  """
+  def __init__ (self, connection, send_class, congested, queued):
+    Event.__init__(self)
+    self.connection = connection
+    self.dpid = connection.dpid
+    self.send_class = send_class
+    self.congested = congested
+    self.queued = queued
+
 class ConnectionIn (Event):
   def __init__ (self, connection):
     super(ConnectionIn,self).__init__()
@@ -320,6 +530,7 @@ class OpenFlowNexus (EventMixin):
     PortStatsReceived,
     QueueStatsReceived,
     FlowRemoved,
+    SendCongestion,
   ])
 
   # Bytes to send to controller when a packet misses all flows
@@ -345,12 +556,14 @@ class OpenFlowNexus (EventMixin):
     """
     return self._connections.get(dpid, None)
 
-  def sendToDPID (self, dpid, data):
+  def sendToDPID (self, dpid, data, priority = None):
     """
     Send data to a specific DPID.
+
+    See Connection.send() for the meaning of priority.
     """
     if dpid in self._connections:
-      self._connections[dpid].send(data)
+      self._connections[dpid].send(data, priority=priority)
       return True
     else:
       import logging
@@ -265,9 +265,14 @@ class Discovery (EventMixin):
     self.adjacency = {} # From Link to time.time() stamp
     self._sender = LLDPSender(self.send_cycle_time)
 
-    # Listen with a high priority (mostly so we get PacketIns early)
-    core.listen_to_dependencies(self,
-        listen_args={'openflow':{'priority':0xffffffff}})
+    # Listen with a high priority (mostly so we get PacketIns early).
+    # Unless we're eating early packets, we only want our LLDP ones.
+    listen_args = {'priority':0xffffffff}
+    if not eat_early_packets:
+      listen_args['filters'] = {'PacketIn':{
+          'dl_type':pkt.ethernet.LLDP_TYPE,
+          'dl_dst':pkt.ETHERNET.NDP_MULTICAST}}
+    core.listen_to_dependencies(self, listen_args={'openflow':listen_args})
 
     Timer(self._timeout_check_period, self._expire_links, recurring=True)
 
@@ -18,9 +18,11 @@ Implementation of an OpenFlow flow table
 
 from libopenflow_01 import *
 from pox.lib.revent import *
+from pox.lib.addresses import EthAddr, IPAddr
 
 import time
 import math
+import heapq
 
 # FlowTable Entries:
 #   match - ofp_match (13-tuple)
@@ -52,6 +54,9 @@ class TableEntry (object):
     self.match = match
     self.actions = actions
     self.buffer_id = buffer_id
+    # Datapaths may cache a compiled form of the actions here (None means
+    # there isn't one).  FlowTable.modify_entry() clears it.
+    self.program = None
 
   @staticmethod
   def from_flow_mod (flow_mod):
@@ -99,6 +104,13 @@ class TableEntry (object):
     else:
       return port_matches and match.matches_with_wildcards(self.match)
 
+  @property
+  def output_ports (self):
+    """
+    The set of ports this entry's ofp_action_outputs send to
+    """
+    return set(a.port for a in self.actions if isinstance(a, ofp_action_output))
+
   def touch_packet (self, byte_count, now=None):
     """
     Updates information of this entry based on encountering a packet.
@@ -111,6 +123,15 @@ class TableEntry (object):
     self.packet_count += 1
     self.last_touched = now
 
+  def touch_packets (self, packet_count, byte_count, now=None):
+    """
+    Like touch_packet(), but for several packets at once.
+    """
+    if now is None: now = time.time()
+    self.byte_count += byte_count
+    self.packet_count += packet_count
+    self.last_touched = now
+
   def is_idle_timed_out (self, now=None):
     if now is None: now = time.time()
     if self.idle_timeout > 0:
@@ -125,6 +146,23 @@ class TableEntry (object):
         return True
     return False
 
+  @property
+  def next_deadline (self):
+    """
+    The earliest time this entry could time out (or None if never)
+
+    For idle timeouts, this is based on when the entry was last touched,
+    so it may move later.
+    """
+    deadline = None
+    if self.hard_timeout > 0:
+      deadline = self.created + self.hard_timeout
+    if self.idle_timeout > 0:
+      idle = self.last_touched + self.idle_timeout
+      if deadline is None or idle < deadline:
+        deadline = idle
+    return deadline
+
   def is_expired (self, now=None):
     """
     Tests whether this flow entry is expired due to its idle or hard timeout
@@ -193,6 +231,230 @@ class FlowTableModification (Event):
     self.reason = reason
 
 
+# Fields (and their wildcard bits) that the classifier hashes on, in the
+# order they appear in a "values" tuple.  nw_src and nw_dst are appended
+# as unsigned integers (or None).
+_classifier_fields = (
+  ('_in_port', OFPFW_IN_PORT),
+  ('_dl_vlan', OFPFW_DL_VLAN),
+  ('_dl_src', OFPFW_DL_SRC),
+  ('_dl_dst', OFPFW_DL_DST),
+  ('_dl_type', OFPFW_DL_TYPE),
+  ('_nw_proto', OFPFW_NW_PROTO),
+  ('_tp_src', OFPFW_TP_SRC),
+  ('_tp_dst', OFPFW_TP_DST),
+  ('_dl_vlan_pcp', OFPFW_DL_VLAN_PCP),
+  ('_nw_tos', OFPFW_NW_TOS),
+)
+_classifier_nw_bits = OFPFW_NW_SRC_MASK | OFPFW_NW_DST_MASK
+
+
+def _eth_value (addr):
+  if type(addr) is EthAddr: return addr.toRaw()
+  return EthAddr(addr).toRaw()
+
+def _ip_value (addr):
+  if type(addr) is IPAddr: return addr.toUnsigned()
+  return IPAddr(addr).toUnsigned()
+
+def _match_values (match):
+  """
+  Returns the values of a match's fields in _classifier_fields order
+
+  Wildcarded fields are None.  Addresses are normalized so that they hash
+  the same however they were set.  The last two items are nw_src and
+  nw_dst as integers.
+  """
+  d = match.__dict__
+  w = d['wildcards']
+  values = [None if w & bit else d[attr] for attr,bit in _classifier_fields]
+  if values[2] is not None: values[2] = _eth_value(values[2])
+  if values[3] is not None: values[3] = _eth_value(values[3])
+  nw_src = match.get_nw_src()[0]
+  nw_dst = match.get_nw_dst()[0]
+  values.append(None if nw_src is None else _ip_value(nw_src))
+  values.append(None if nw_dst is None else _ip_value(nw_dst))
+  return tuple(values)
+
+def _match_mask (match):
+  """
+  Returns the "shape" of a match: its wildcards and nw prefix lengths
+  """
+  return (match.wildcards & OFPFW_ALL & ~_classifier_nw_bits,
+          match.get_nw_src()[1], match.get_nw_dst()[1])
+
+
+class _MaskGroup (object):
+  """
+  The entries in a FlowTable that share a wildcard mask
+
+  Entries are hashed on the fields the mask doesn't wildcard.  Each bucket
+  is ordered the same way as the table (highest priority first, newest
+  first among equals).
+  """
+  def __init__ (self, mask):
+    wildcards,nw_src_bits,nw_dst_bits = mask
+    self.mask = mask
+    self._indexes = [i for i,(attr,bit) in enumerate(_classifier_fields)
+                     if not wildcards & bit]
+    self._nw_src_mask = _prefix_mask(nw_src_bits)
+    self._nw_dst_mask = _prefix_mask(nw_dst_bits)
+    self.buckets = {} # key -> [TableEntry]
+    self.priorities = {} # priority -> count
+    self.max_priority = None
+
+  def key (self, values):
+    """
+    Returns the bucket key for a packet's values (from _match_values())
+    """
+    k = [values[i] for i in self._indexes]
+    if self._nw_src_mask:
+      nw = values[10]
+      k.append(None if nw is None else nw & self._nw_src_mask)
+    if self._nw_dst_mask:
+      nw = values[11]
+      k.append(None if nw is None else nw & self._nw_dst_mask)
+    return tuple(k)
+
+  def entry_key (self, values):
+    """
+    Returns the bucket key for an entry's values
+
+    The addresses aren't masked: like matches_with_wildcards(), an entry
+    whose address has host bits set doesn't match anything.
+    """
+    k = [values[i] for i in self._indexes]
+    if self._nw_src_mask: k.append(values[10])
+    if self._nw_dst_mask: k.append(values[11])
+    return tuple(k)
+
+  def add (self, entry, values):
+    """
+    Adds an entry to the group
+
+    Returns True if the group's max_priority changed.
+    """
+    bucket = self.buckets.setdefault(self.entry_key(values), [])
+    _insert_by_priority(bucket, entry)
+    p = entry.priority
+    self.priorities[p] = self.priorities.get(p, 0) + 1
+    if self.max_priority is None or p > self.max_priority:
+      self.max_priority = p
+      return True
+    return False
+
+  def remove (self, entry, values):
+    """
+    Removes an entry from the group
+
+    Returns True if the group's max_priority changed.
+    """
+    key = self.entry_key(values)
+    bucket = self.buckets[key]
+    bucket.remove(entry)
+    if not bucket: del self.buckets[key]
+    p = entry.priority
+    count = self.priorities[p] - 1
+    if count:
+      self.priorities[p] = count
+      return False
+    del self.priorities[p]
+    if p != self.max_priority: return False
+    self.max_priority = max(self.priorities) if self.priorities else None
+    return True
+
+
+class _PrefixTrie (object):
+  """
+  Binary trie of entries keyed on an IP address prefix
+
+  Each node is a list of [zero child, one child, set of entries].
+  """
+  def __init__ (self):
+    self._root = [None, None, None]
+
+  def add (self, addr, bits, entry):
+    node = self._root
+    for i in xrange(bits):
+      bit = (addr >> (31 - i)) & 1
+      child = node[bit]
+      if child is None:
+        child = [None, None, None]
+        node[bit] = child
+      node = child
+    if node[2] is None: node[2] = set()
+    node[2].add(entry)
+
+  def remove (self, addr, bits, entry):
+    node = self._root
+    path = []
+    for i in xrange(bits):
+      bit = (addr >> (31 - i)) & 1
+      path.append((node, bit))
+      node = node[bit]
+    node[2].discard(entry)
+    if not node[2]: node[2] = None
+    # Prune nodes which have become empty
+    while path and node[0] is None and node[1] is None and node[2] is None:
+      parent,bit = path.pop()
+      parent[bit] = None
+      node = parent
+
+  def within (self, addr, bits):
+    """
+    Returns the entries whose prefixes are within addr/bits
+    """
+    node = self._root
+    for i in xrange(bits):
+      node = node[(addr >> (31 - i)) & 1]
+      if node is None: return []
+    r = []
+    stack = [node]
+    while stack:
+      node = stack.pop()
+      if node[2]: r.extend(node[2])
+      if node[0] is not None: stack.append(node[0])
+      if node[1] is not None: stack.append(node[1])
+    return r
+
+
+# Positions in a values tuple (from _match_values()) of the fields that
+# FlowTable keeps secondary indexes for
+_indexed_fields = (0, 2, 3, 6, 7) # in_port, dl_src, dl_dst, tp_src, tp_dst
+
+def _discard (index, key, entry):
+  """
+  Removes entry from the set at index[key], dropping the set if empty
+  """
+  entries = index[key]
+  entries.discard(entry)
+  if not entries: del index[key]
+
+def _prefix_mask (bits):
+  if not bits: return 0
+  return (0xffFFffFF << (32 - bits)) & 0xffFFffFF
+
+def _insert_by_priority (table, entry):
+  """
+  Inserts entry into a list sorted by descending effective_priority
+
+  Entries go in front of existing entries with the same priority.
+  """
+  # Use binary search to insert at correct place
+  # This is faster even for modest table sizes, and way, way faster
+  # as the tables grow larger.
+  priority = entry.effective_priority
+  low = 0
+  high = len(table)
+  while low < high:
+      middle = (low + high) // 2
+      if priority >= table[middle].effective_priority:
+        high = middle
+        continue
+      low = middle + 1
+  table.insert(low, entry)
+
+
 class FlowTable (EventMixin):
   """
   General model of a flow table.
@@ -208,6 +470,29 @@ class FlowTable (EventMixin):
     # Table is a list of TableEntry sorted by descending effective_priority.
     self._table = []
 
+    # Classifier index for entry_for_packet().  Exact-match entries are
+    # hashed on all their fields; the rest are grouped by wildcard mask
+    # (tuple space search).
+    self._exact = {} # values -> [TableEntry]
+    self._groups = {} # mask -> _MaskGroup
+    self._group_order = None # _MaskGroups by descending max_priority
+    self._sequence = {} # TableEntry -> insertion number (for ties)
+    self._next_sequence = 0
+
+    # Heap of (deadline, token, entry) for entries with timeouts.  Removed
+    # entries are left in the heap; only the item whose token is in
+    # _deadline_tokens is live.
+    self._deadlines = []
+    self._deadline_tokens = {} # TableEntry -> token
+
+    # Secondary indexes for matching_entries()
+    self._by_port = {} # output port -> set(TableEntry)
+    self._entry_ports = {} # TableEntry -> ports it's indexed under
+    self._by_cookie = {} # cookie -> set(TableEntry)
+    self._by_field = dict((i, {}) for i in _indexed_fields) # i -> value -> set
+    self._nw_src_trie = _PrefixTrie()
+    self._nw_dst_trie = _PrefixTrie()
+
   def _dirty (self):
     """
     Call when table changes
@@ -227,20 +512,9 @@ class FlowTable (EventMixin):
     #self._table.append(entry)
     #self._table.sort(key=lambda e: e.effective_priority, reverse=True)
 
-    # Use binary search to insert at correct place
-    # This is faster even for modest table sizes, and way, way faster
-    # as the tables grow larger.
-    priority = entry.effective_priority
-    table = self._table
-    low = 0
-    high = len(table)
-    while low < high:
-        middle = (low + high) // 2
-        if priority >= table[middle].effective_priority:
-          high = middle
-          continue
-        low = middle + 1
-    table.insert(low, entry)
+    _insert_by_priority(self._table, entry)
+    self._index(entry)
+    self._schedule(entry)
 
     self._dirty()
 
@@ -249,12 +523,168 @@ class FlowTable (EventMixin):
   def remove_entry (self, entry, reason=None):
     assert isinstance(entry, TableEntry)
     self._table.remove(entry)
+    self._unindex(entry)
     self._dirty()
     self.raiseEvent(FlowTableModification(removed=[entry], reason=reason))
 
-  def matching_entries (self, match, priority=0, strict=False, out_port=None):
+  def _index (self, entry):
+    """
+    Adds an entry to the classifier and secondary indexes
+    """
+    self._sequence[entry] = self._next_sequence
+    self._next_sequence += 1
+    values = _match_values(entry.match)
+
+    self._index_ports(entry)
+    self._by_cookie.setdefault(entry.cookie, set()).add(entry)
+    for i,index in self._by_field.iteritems():
+      if values[i] is not None:
+        index.setdefault(values[i], set()).add(entry)
+    if values[10] is not None:
+      self._nw_src_trie.add(values[10], entry.match.get_nw_src()[1], entry)
+    if values[11] is not None:
+      self._nw_dst_trie.add(values[11], entry.match.get_nw_dst()[1], entry)
+
+    if entry.match.is_exact:
+      _insert_by_priority(self._exact.setdefault(values, []), entry)
+      return
+    mask = _match_mask(entry.match)
+    group = self._groups.get(mask)
+    if group is None:
+      group = _MaskGroup(mask)
+      self._groups[mask] = group
+    if group.add(entry, values):
+      self._group_order = None
+
+  def _unindex (self, entry):
+    """
+    Removes an entry from the classifier index (and the deadlines)
+    """
+    del self._sequence[entry]
+    self._deadline_tokens.pop(entry, None)
+    values = _match_values(entry.match)
+
+    self._unindex_ports(entry)
+    _discard(self._by_cookie, entry.cookie, entry)
+    for i,index in self._by_field.iteritems():
+      if values[i] is not None:
+        _discard(index, values[i], entry)
+    if values[10] is not None:
+      self._nw_src_trie.remove(values[10], entry.match.get_nw_src()[1], entry)
+    if values[11] is not None:
+      self._nw_dst_trie.remove(values[11], entry.match.get_nw_dst()[1], entry)
+
+    if entry.match.is_exact:
+      bucket = self._exact[values]
+      bucket.remove(entry)
+      if not bucket: del self._exact[values]
+      return
+    mask = _match_mask(entry.match)
+    group = self._groups[mask]
+    if group.remove(entry, values):
+      if group.max_priority is None:
+        del self._groups[mask]
+      self._group_order = None
+
+  def _index_ports (self, entry):
+    ports = entry.output_ports
+    self._entry_ports[entry] = ports
+    for port in ports:
+      self._by_port.setdefault(port, set()).add(entry)
+
+  def _unindex_ports (self, entry):
+    for port in self._entry_ports.pop(entry):
+      _discard(self._by_port, port, entry)
+
+  def modify_entry (self, entry, actions):
+    """
+    Replaces an entry's actions
+
+    Use this rather than setting entry.actions directly so that the table's
+    index of output ports stays right and any compiled program is dropped.
+    """
+    self._unindex_ports(entry)
+    entry.actions = actions
+    entry.program = None
+    self._index_ports(entry)
+
+  def _schedule (self, entry):
+    """
+    Puts an entry with timeouts into the deadline heap
+    """
+    deadline = entry.next_deadline
+    if deadline is None: return
+    token = self._next_sequence
+    self._next_sequence += 1
+    self._deadline_tokens[entry] = token
+    heapq.heappush(self._deadlines, (deadline, token, entry))
+
+    if len(self._deadlines) > 2 * len(self._deadline_tokens) + 64:
+      # Lots of removed entries; throw their items away
+      tokens = self._deadline_tokens
+      self._deadlines = [d for d in self._deadlines if tokens.get(d[2])==d[1]]
+      heapq.heapify(self._deadlines)
+
+  def matching_entries (self, match, priority=0, strict=False, out_port=None,
+                        cookie=None):
+    """
+    Returns the entries matched by match (in table order)
+
+    See TableEntry.is_matched_by().  If cookie is not None, only entries
+    with that cookie are returned.
+    """
     entry_match = lambda e: e.is_matched_by(match, priority, strict, out_port)
-    return [ entry for entry in self._table if entry_match(entry) ]
+    if cookie is not None:
+      _entry_match = entry_match
+      entry_match = lambda e: e.cookie == cookie and _entry_match(e)
+
+    candidates = self._candidates(match, strict, out_port, cookie)
+    if candidates is None:
+      return [ entry for entry in self._table if entry_match(entry) ]
+    r = [ entry for entry in candidates if entry_match(entry) ]
+    if len(r) > 1:
+      # Newer entries come first among equal priorities
+      sequence = self._sequence
+      r.sort(key=lambda e: (e.effective_priority, sequence[e]), reverse=True)
+    return r
+
+  def _candidates (self, match, strict, out_port, cookie):
+    """
+    Uses the indexes to narrow down the entries match might match
+
+    Returns a collection which includes every entry matching_entries()
+    could return, or None if there's nothing to narrow it down with.
+    """
+    values = _match_values(match)
+    if strict:
+      # Strict matches are equal, so they're in the same classifier bucket
+      if match.is_exact:
+        return self._exact.get(values, ())
+      group = self._groups.get(_match_mask(match))
+      if group is None: return ()
+      return group.buckets.get(group.entry_key(values), ())
+
+    # Non-strict: entries must have every field match has, so any one
+    # index gives a superset.  Use the smallest.
+    sets = []
+    if out_port is not None:
+      sets.append(self._by_port.get(out_port, ()))
+    if cookie is not None:
+      sets.append(self._by_cookie.get(cookie, ()))
+    for i,index in self._by_field.iteritems():
+      if values[i] is not None:
+        sets.append(index.get(values[i], ()))
+    best = min(sets, key=len) if sets else None
+    if best is None or len(best) > 64:
+      # Prefix lookups have to walk the trie, so only bother if needed
+      if values[10] is not None:
+        sets.append(self._nw_src_trie.within(values[10],
+                                             match.get_nw_src()[1]))
+      if values[11] is not None:
+        sets.append(self._nw_dst_trie.within(values[11],
+                                             match.get_nw_dst()[1]))
+      if sets: best = min(sets, key=len)
+    return best
 
   def flow_stats (self, match, out_port=None, now=None):
     mc_es = self.matching_entries(match=match, strict=False, out_port=out_port)
@@ -279,34 +709,69 @@ class FlowTable (EventMixin):
     #self._table = [entry for entry in self._table if entry not in flows]
     if not flows: return
     self._dirty()
-    remove_flows = set(flows)
-    i = 0
-    while i < len(self._table):
-      entry = self._table[i]
-      if entry in remove_flows:
-        del self._table[i]
-        remove_flows.remove(entry)
-        if not remove_flows: break
-      else:
-        i += 1
-    assert len(remove_flows) == 0
+    table = self._table
+    if len(flows) * 64 <= len(table):
+      # Find each one starting from where its priority begins
+      for entry in flows:
+        del table[self._position(entry)]
+    else:
+      remove_flows = set(flows)
+      count = len(table)
+      table[:] = [entry for entry in table if entry not in remove_flows]
+      assert count - len(table) == len(remove_flows)
+    for entry in flows:
+      self._unindex(entry)
     self.raiseEvent(FlowTableModification(removed=flows, reason=reason))
 
+  def _position (self, entry):
+    """
+    Returns the index of entry in the table
+
+    The table is ordered by descending effective_priority and then by
+    descending insertion number, so this is a binary search.
+    """
+    sequence = self._sequence
+    key = (entry.effective_priority, sequence[entry])
+    table = self._table
+    low = 0
+    high = len(table)
+    while low < high:
+      middle = (low + high) // 2
+      e = table[middle]
+      if key >= (e.effective_priority, sequence[e]):
+        high = middle
+      else:
+        low = middle + 1
+    assert table[low] is entry
+    return low
+
   def remove_expired_entries (self, now=None):
     idle = []
     hard = []
     if now is None: now = time.time()
-    for entry in self._table:
+    deadlines = self._deadlines
+    tokens = self._deadline_tokens
+    reschedule = []
+    # Only look at entries whose deadline has passed.  Idle deadlines may
+    # have moved since they were scheduled, so those get rescheduled.
+    while deadlines and deadlines[0][0] < now:
+      deadline,token,entry = heapq.heappop(deadlines)
+      if tokens.get(entry) != token: continue # Removed or rescheduled
       if entry.is_idle_timed_out(now):
         idle.append(entry)
       elif entry.is_hard_timed_out(now):
         hard.append(entry)
+      else:
+        reschedule.append(entry)
+    for entry in reschedule:
+      self._schedule(entry)
     self._remove_specific_entries(idle, OFPRR_IDLE_TIMEOUT)
     self._remove_specific_entries(hard, OFPRR_HARD_TIMEOUT)
 
   def remove_matching_entries (self, match, priority=0, strict=False,
-                               out_port=None, reason=None):
-    remove_flows = self.matching_entries(match, priority, strict, out_port)
+                               out_port=None, reason=None, cookie=None):
+    remove_flows = self.matching_entries(match, priority, strict, out_port,
+                                         cookie)
     self._remove_specific_entries(remove_flows, reason=reason)
     return remove_flows
 
@@ -316,15 +781,45 @@ class FlowTable (EventMixin):
 
     Returns the highest priority flow table entry that matches the given packet
     on the given in_port, or None if no matching entry is found.
-    """
-    packet_match = ofp_match.from_packet(packet, in_port, spec_frags = True)
-
-    for entry in self._table:
-      if entry.match.matches_with_wildcards(packet_match,
-                                            consider_other_wildcards=False):
-        return entry
 
-    return None
+    packet may be an ethernet instance or the raw packet data.
+    """
+    if isinstance(packet, bytes):
+      packet_match = ofp_match.from_raw(packet, in_port, spec_frags = True)
+    else:
+      packet_match = ofp_match.from_packet(packet, in_port, spec_frags = True)
+
+    values = _match_values(packet_match)
+
+    if self._exact:
+      bucket = self._exact.get(values)
+      if bucket:
+        # Exact matches beat everything else
+        return bucket[0]
+
+    groups = self._group_order
+    if groups is None:
+      groups = sorted(self._groups.itervalues(),
+                      key=lambda g: g.max_priority, reverse=True)
+      self._group_order = groups
+
+    best = None
+    best_rank = None
+    for group in groups:
+      if best is not None and group.max_priority < best.priority:
+        # Nothing left can beat what we've got
+        break
+      bucket = group.buckets.get(group.key(values))
+      if bucket:
+        entry = bucket[0]
+        # Among equal priorities, the newest entry wins (as it's first in
+        # the table)
+        rank = (entry.priority, self._sequence[entry])
+        if best is None or rank > best_rank:
+          best = entry
+          best_rank = rank
+
+    return best
 
   def check_for_overlapping_entry (self, in_entry):
     """
@@ -28,7 +28,7 @@ from pox.lib.packet.vlan import vlan
 from pox.lib.packet.llc import llc
 from pox.lib.packet.ipv4 import ipv4
 from pox.lib.packet.udp import udp
-from pox.lib.packet.tcp import tcp
+from pox.lib.packet.tcp import tcp, tcp_opt
 from pox.lib.packet.icmp import icmp
 from pox.lib.packet.arp import arp
 
@@ -108,6 +108,14 @@ def _unpack (fmt, data, offset):
   if (len(data)-offset) < size: raise UnderrunError()
   return (offset+size, struct.unpack_from(fmt, data, offset))
 
+def _unpack_struct (st, data, offset):
+  """
+  Like _unpack(), but with a precompiled struct.Struct
+  """
+  size = st.size
+  if (len(data)-offset) < size: raise UnderrunError()
+  return (offset+size, st.unpack_from(data, offset))
+
 def _skip (data, offset, num):
   offset += num
   if offset > len(data): raise UnderrunError()
@@ -126,6 +134,14 @@ def _readzs (data, offset, length):
   assert True if (len(d) == 1) else (len(d[1].replace("\x00", "")) == 0)
   return (offset, d[0])
 
+def _unzs (d):
+  """
+  Strips the padding from a zero-padded string (see _readzs())
+  """
+  d = d.split("\x00", 1)
+  assert True if (len(d) == 1) else (len(d[1].replace("\x00", "")) == 0)
+  return d[0]
+
 def _readether (data, offset):
   (offset, d) = _read(data, offset, 6)
   return (offset, EthAddr(d))
@@ -537,6 +553,8 @@ NO_BUFFER = 4294967295
 # ----------------------------------------------------------------------
 
 #1. Openflow Header
+_header_struct = struct.Struct("!BBHL")
+
 class ofp_header (ofp_base):
   _MIN_LENGTH = 8
   def __init__ (self, **kw):
@@ -565,10 +583,8 @@ class ofp_header (ofp_base):
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += struct.pack("!BBHL", self.version, self.header_type,
-        len(self), self.xid)
-    return packed
+    return _header_struct.pack(self.version, self.header_type, len(self),
+                               self.xid)
 
   def unpack (self, raw, offset=0):
     offset,length = self._unpack_header(raw, offset)
@@ -576,7 +592,7 @@ class ofp_header (ofp_base):
 
   def _unpack_header (self, raw, offset):
     offset,(self.version, self.header_type, length, self.xid) = \
-        _unpack("!BBHL", raw, offset)
+        _unpack_struct(_header_struct, raw, offset)
     return offset,length
 
   def __eq__ (self, other):
@@ -655,6 +671,9 @@ class ofp_queue_prop_base (ofp_base):
 
 #2. Common Structures
 ##2.1 Port Structures
+# The 16s is OFP_MAX_PORT_NAME_LEN (which isn't defined until later)
+_phy_port_struct = struct.Struct("!H6s16sLLLLLL")
+
 class ofp_phy_port (ofp_base):
   def __init__ (self, **kw):
     self.port_no = 0
@@ -706,23 +725,18 @@ class ofp_phy_port (ofp_base):
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += struct.pack("!H", self.port_no)
-    packed += (self.hw_addr if isinstance(self.hw_addr, bytes) else
-               self.hw_addr.toRaw())
-    packed += self.name.ljust(OFP_MAX_PORT_NAME_LEN,'\0')
-    packed += struct.pack("!LLLLLL", self.config, self.state, self.curr,
-                          self.advertised, self.supported, self.peer)
-    return packed
+    return _phy_port_struct.pack(self.port_no,
+        (self.hw_addr if isinstance(self.hw_addr, bytes) else
+         self.hw_addr.toRaw()),
+        str(self.name), self.config, self.state, self.curr, self.advertised,
+        self.supported, self.peer)
 
   def unpack (self, raw, offset=0):
-    _offset = offset
-    offset,(self.port_no,) = _unpack("!H", raw, offset)
-    offset,self.hw_addr = _readether(raw, offset)
-    offset,self.name = _readzs(raw, offset, OFP_MAX_PORT_NAME_LEN)
-    offset,(self.config, self.state, self.curr, self.advertised,
-            self.supported, self.peer) = _unpack("!LLLLLL", raw, offset)
-    assert offset - _offset == len(self)
+    offset,(self.port_no, hw_addr, name, self.config, self.state,
+            self.curr, self.advertised, self.supported, self.peer) = \
+        _unpack_struct(_phy_port_struct, raw, offset)
+    self.hw_addr = EthAddr(hw_addr)
+    self.name = _unzs(name)
     return offset
 
   @staticmethod
@@ -917,6 +931,56 @@ class ofp_queue_prop_min_rate (ofp_base):
 
 
 ##2.3 Flow Match Structures
+# IP addresses are packed from integers, but unpacked as raw bytes for
+# IPAddr (as _readip() does)
+_match_struct = struct.Struct("!LH6s6sHBxHBBxxLLHH")
+_match_unpack_struct = struct.Struct("!LH6s6sHBxHBBxx4s4sHH")
+
+# Headers read by ofp_match.from_raw()
+_raw_eth_struct = struct.Struct("!6s6sH")
+_raw_vlan_struct = struct.Struct("!HH")
+_raw_ipv4_struct = struct.Struct("!BBHxxHxBxxLL")
+_raw_arp_struct = struct.Struct("!HHBBH")
+_raw_ports_struct = struct.Struct("!HH")
+_raw_icmp_struct = struct.Struct("!BB")
+
+def _raw_tcp_options_ok (data, start, hdr_end, end):
+  """
+  Checks TCP options the same way tcp.parse_options() does
+
+  start is the offset of the TCP header, hdr_end the end of the header
+  (including options) and end the end of the TCP segment.
+  """
+  i = start + 20
+  while i < hdr_end:
+    kind = ord(data[i])
+    if kind == tcp_opt.EOL: break
+    if kind == tcp_opt.NOP:
+      i += 1
+      continue
+    if i + 2 > end: return False
+    length = ord(data[i+1])
+    if i + length > end or length < 2: return False
+    if kind == tcp_opt.MSS:
+      if length != 4: return False
+    elif kind == tcp_opt.WSOPT:
+      if length != 3: return False
+    elif kind == tcp_opt.SACKPERM:
+      if length != 2: return False
+    elif kind == tcp_opt.SACK:
+      # parse_options() unpacks the rest of the segment as SACK blocks
+      if (length - 2) % 8 or i + length != end: return False
+    elif kind == tcp_opt.TSOPT:
+      if length != 10: return False
+    i += length
+  return True
+
+def _fix_ip (addr):
+  if addr is None: return 0
+  if type(addr) is int: return addr & 0xffFFffFF
+  if type(addr) is long: return addr & 0xffFFffFF
+  return addr.toUnsigned()
+
 class ofp_match (ofp_base):
   adjust_wildcards = True # Set to true to "fix" outgoing wildcards
 
@@ -989,6 +1053,124 @@ class ofp_match (ofp_base):
 
     return match
 
+  @classmethod
+  def from_raw (cls, data, in_port = None, spec_frags = False):
+    """
+    Constructs an exact match for the given raw packet
+
+    This gives the same result as from_packet(ethernet(data), ...), but
+    reads the header fields straight out of the bytes rather than parsing
+    the whole packet first.  Packets it isn't sure about (truncated or
+    malformed headers, LLC, and so on) are handed to from_packet().
+
+    @param data       The raw packet (starting at the Ethernet header)
+    @param in_port    The switch port the packet arrived on if you want
+                      the resulting match to have its in_port set.
+    @param spec_frags Handle IP fragments as specified in the spec.
+    """
+    dlen = len(data)
+    if dlen < 14:
+      return cls.from_packet(ethernet(data), in_port, spec_frags)
+    dl_dst,dl_src,dl_type = _raw_eth_struct.unpack_from(data, 0)
+    if dl_type < 1536:
+      return cls.from_packet(ethernet(data), in_port, spec_frags)
+
+    match = cls.__new__(cls)
+    d = match.__dict__
+    d['_locked'] = False
+    d.update(_match_defaults)
+    wildcards = _raw_wildcards_all & ~_raw_wildcards_dl
+
+    if in_port is not None:
+      d['_in_port'] = in_port
+      wildcards &= ~OFPFW_IN_PORT
+
+    d['_dl_src'] = EthAddr(dl_src)
+    d['_dl_dst'] = EthAddr(dl_dst)
+    offset = 14
+    if dl_type == ethernet.VLAN_TYPE:
+      if dlen < 18:
+        return cls.from_packet(ethernet(data), in_port, spec_frags)
+      pcpid,dl_type = _raw_vlan_struct.unpack_from(data, 14)
+      if dl_type < 1536:
+        return cls.from_packet(ethernet(data), in_port, spec_frags)
+      d['_dl_vlan'] = pcpid & 0x0fff
+      d['_dl_vlan_pcp'] = pcpid >> 13
+      offset = 18
+    else:
+      d['_dl_vlan'] = OFP_VLAN_NONE
+      d['_dl_vlan_pcp'] = 0
+    d['_dl_type'] = dl_type
+
+    if dl_type == ethernet.IP_TYPE:
+      # The same sanity checks that ipv4.parse() does
+      plen = dlen - offset
+      if plen < 20:
+        return cls.from_packet(ethernet(data), in_port, spec_frags)
+      (vhl, tos, iplen, frag, proto,
+       nw_src, nw_dst) = _raw_ipv4_struct.unpack_from(data, offset)
+      hlen = (vhl & 0x0f) * 4
+      if (vhl >> 4) != 4 or hlen < 20 or iplen < 20 or hlen >= iplen:
+        return cls.from_packet(ethernet(data), in_port, spec_frags)
+      if hlen > plen:
+        return cls.from_packet(ethernet(data), in_port, spec_frags)
+      d['_nw_src'] = IPAddr(nw_src)
+      d['_nw_dst'] = IPAddr(nw_dst)
+      d['_nw_proto'] = proto
+      d['_nw_tos'] = tos
+      wildcards &= ~(_raw_wildcards_nw | OFPFW_NW_TOS)
+
+      if spec_frags and (frag & 0x3fff):
+        # MF flag or nonzero fragment offset
+        d['_tp_src'] = 0
+        d['_tp_dst'] = 0
+        d['wildcards'] = wildcards & ~_raw_wildcards_tp
+        return match
+
+      # Transport header length, clamped to what we've got
+      tlen = min(iplen, plen) - hlen
+      offset += hlen
+      if proto == ipv4.TCP_PROTOCOL or proto == ipv4.UDP_PROTOCOL:
+        if proto == ipv4.TCP_PROTOCOL:
+          # tcp.parse() gives up on bad offsets and options
+          if tlen < 20:
+            return cls.from_packet(ethernet(data), in_port, spec_frags)
+          thlen = (ord(data[offset+12]) >> 4) * 4
+          if thlen < 20 or thlen > tlen:
+            return cls.from_packet(ethernet(data), in_port, spec_frags)
+          if thlen > 20 and not _raw_tcp_options_ok(data, offset,
+                                                    offset + thlen,
+                                                    offset + tlen):
+            return cls.from_packet(ethernet(data), in_port, spec_frags)
+        elif tlen < 8:
+          return cls.from_packet(ethernet(data), in_port, spec_frags)
+        d['_tp_src'],d['_tp_dst'] = _raw_ports_struct.unpack_from(data,
+                                                                  offset)
+        wildcards &= ~_raw_wildcards_tp
+      elif proto == ipv4.ICMP_PROTOCOL:
+        if tlen < 4:
+          return cls.from_packet(ethernet(data), in_port, spec_frags)
+        d['_tp_src'],d['_tp_dst'] = _raw_icmp_struct.unpack_from(data,
+                                                                 offset)
+        wildcards &= ~_raw_wildcards_tp
+    elif dl_type == ethernet.ARP_TYPE or dl_type == ethernet.RARP_TYPE:
+      # The same sanity checks that arp.parse() does
+      if dlen - offset < 28:
+        return cls.from_packet(ethernet(data), in_port, spec_frags)
+      (hwtype, prototype, hwlen, protolen,
+       opcode) = _raw_arp_struct.unpack_from(data, offset)
+      if (hwtype != arp.HW_TYPE_ETHERNET or prototype != arp.PROTO_TYPE_IP
+          or hwlen != 6 or protolen != 4):
+        return cls.from_packet(ethernet(data), in_port, spec_frags)
+      if opcode <= 255:
+        d['_nw_proto'] = opcode
+        d['_nw_src'] = IPAddr(data[offset+14:offset+18])
+        d['_nw_dst'] = IPAddr(data[offset+24:offset+28])
+        wildcards &= ~_raw_wildcards_nw
+
+    d['wildcards'] = wildcards
+    return match
+
   def clone (self):
     n = ofp_match()
     for k,v in ofp_match_data.iteritems():
@@ -1014,10 +1196,11 @@ class ofp_match (ofp_base):
     return reversed
 
   def __init__ (self, **kw):
-    self._locked = False
-
-    for k,v in ofp_match_data.iteritems():
-      setattr(self, '_' + k, v[0])
+    # Set the defaults straight into __dict__ (which is what __setattr__
+    # would do with them anyway)
+    d = self.__dict__
+    d['_locked'] = False
+    d.update(_match_defaults)
 
     self.wildcards = self._normalize_wildcards(OFPFW_ALL)
 
@@ -1160,53 +1343,54 @@ class ofp_match (ofp_base):
     return True # Always; we don't actually want an assertion error
 
   def pack (self, flow_mod=False):
+    return _match_struct.pack(*self._pack_fields(flow_mod))
+
+  def _pack_fields (self, flow_mod=False):
+    """
+    Returns a tuple of the wire values of the fields (for _match_struct)
+
+    Wildcarded fields, and fields whose prerequisites aren't met, are
+    zero.
+    """
     assert self._assert()
 
-    packed = b""
     if self.adjust_wildcards and flow_mod:
       wc = self._wire_wildcards(self.wildcards)
       assert self._prereq_warning()
     else:
       wc = self.wildcards
-    packed += struct.pack("!LH", wc, self.in_port or 0)
-    if self.dl_src is None:
-      packed += EMPTY_ETH.toRaw()
-    elif type(self.dl_src) is bytes:
-      packed += self.dl_src
-    else:
-      packed += self.dl_src.toRaw()
-    if self.dl_dst is None:
-      packed += EMPTY_ETH.toRaw()
-    elif type(self.dl_dst) is bytes:
-      packed += self.dl_dst
-    else:
-      packed += self.dl_dst.toRaw()
-
-    def check_ip(val):
-      return (val or 0) if self.dl_type == 0x0800 else 0
-    def check_ip_or_arp(val):
-      return (val or 0) if self.dl_type == 0x0800 \
-                           or self.dl_type == 0x0806 else 0
-    def check_tp(val):
-      return (val or 0) if self.dl_type == 0x0800 \
-                           and self.nw_proto in (1,6,17) else 0
-
-    packed += struct.pack("!HB", self.dl_vlan or 0, self.dl_vlan_pcp or 0)
-    packed += _PAD # Hardcode padding
-    packed += struct.pack("!HBB", self.dl_type or 0,
-        check_ip(self.nw_tos), check_ip_or_arp(self.nw_proto))
-    packed += _PAD2 # Hardcode padding
-    def fix (addr):
-      if addr is None: return 0
-      if type(addr) is int: return addr & 0xffFFffFF
-      if type(addr) is long: return addr & 0xffFFffFF
-      return addr.toUnsigned()
-
-    packed += struct.pack("!LLHH", check_ip_or_arp(fix(self.nw_src)),
-        check_ip_or_arp(fix(self.nw_dst)),
-        check_tp(self.tp_src), check_tp(self.tp_dst))
 
-    return packed
+    # This is what the properties (__getattr__) would give us, but
+    # without going through them for every field.
+    w = self.wildcards
+    d = self.__dict__
+
+    in_port = 0 if w & OFPFW_IN_PORT else (d['_in_port'] or 0)
+    dl_src = EMPTY_ETH if w & OFPFW_DL_SRC else d['_dl_src']
+    if type(dl_src) is not bytes: dl_src = (dl_src or EMPTY_ETH).toRaw()
+    dl_dst = EMPTY_ETH if w & OFPFW_DL_DST else d['_dl_dst']
+    if type(dl_dst) is not bytes: dl_dst = (dl_dst or EMPTY_ETH).toRaw()
+    dl_vlan = 0 if w & OFPFW_DL_VLAN else (d['_dl_vlan'] or 0)
+    dl_vlan_pcp = 0 if w & OFPFW_DL_VLAN_PCP else (d['_dl_vlan_pcp'] or 0)
+    dl_type = None if w & OFPFW_DL_TYPE else d['_dl_type']
+
+    nw_tos = nw_proto = nw_src = nw_dst = tp_src = tp_dst = 0
+    if dl_type == 0x0800 or dl_type == 0x0806:
+      if not w & OFPFW_NW_PROTO:
+        nw_proto = d['_nw_proto'] or 0
+      if (w & OFPFW_NW_SRC_ALL) != OFPFW_NW_SRC_ALL:
+        nw_src = _fix_ip(d['_nw_src'])
+      if (w & OFPFW_NW_DST_ALL) != OFPFW_NW_DST_ALL:
+        nw_dst = _fix_ip(d['_nw_dst'])
+      if dl_type == 0x0800:
+        if not w & OFPFW_NW_TOS:
+          nw_tos = d['_nw_tos'] or 0
+        if not w & OFPFW_NW_PROTO and d['_nw_proto'] in (1,6,17):
+          if not w & OFPFW_TP_SRC: tp_src = d['_tp_src'] or 0
+          if not w & OFPFW_TP_DST: tp_dst = d['_tp_dst'] or 0
+
+    return (wc, in_port, dl_src, dl_dst, dl_vlan, dl_vlan_pcp,
+            dl_type or 0, nw_tos, nw_proto, nw_src, nw_dst, tp_src, tp_dst)
 
   def _normalize_wildcards (self, wildcards):
     """
@@ -1324,25 +1508,29 @@ class ofp_match (ofp_base):
     return not self.is_wildcarded
 
   def unpack (self, raw, offset=0, flow_mod=False):
-    _offset = offset
-    offset,(wildcards, self._in_port) = _unpack("!LH",raw, offset)
-    offset,self._dl_src = _readether(raw, offset)
-    offset,self._dl_dst = _readether(raw, offset)
-    offset,(self._dl_vlan, self._dl_vlan_pcp) = \
-        _unpack("!HB", raw, offset)
-    offset = _skip(raw, offset, 1)
-    offset,(self._dl_type, self._nw_tos, self._nw_proto) = \
-        _unpack("!HBB", raw, offset)
-    offset = _skip(raw, offset, 2)
-    offset,self._nw_src = _readip(raw, offset)
-    offset,self._nw_dst = _readip(raw, offset)
-    offset,(self._tp_src, self._tp_dst) = _unpack("!HH", raw, offset)
+    offset,(wildcards, in_port, dl_src, dl_dst, dl_vlan, dl_vlan_pcp,
+            dl_type, nw_tos, nw_proto, nw_src, nw_dst, tp_src, tp_dst) = \
+        _unpack_struct(_match_unpack_struct, raw, offset)
+    if self._locked:
+      raise AttributeError('match object is locked')
+    d = self.__dict__
+    d['_in_port'] = in_port
+    d['_dl_src'] = EthAddr(dl_src)
+    d['_dl_dst'] = EthAddr(dl_dst)
+    d['_dl_vlan'] = dl_vlan
+    d['_dl_vlan_pcp'] = dl_vlan_pcp
+    d['_dl_type'] = dl_type
+    d['_nw_tos'] = nw_tos
+    d['_nw_proto'] = nw_proto
+    d['_nw_src'] = IPAddr(nw_src, networkOrder = True)
+    d['_nw_dst'] = IPAddr(nw_dst, networkOrder = True)
+    d['_tp_src'] = tp_src
+    d['_tp_dst'] = tp_dst
 
     # Only unwire wildcards for flow_mod
     self.wildcards = self._normalize_wildcards(
         self._unwire_wildcards(wildcards) if flow_mod else wildcards)
 
-    assert offset - _offset == len(self)
     return offset
 
   @staticmethod
@@ -1541,6 +1729,8 @@ class ofp_action_generic (ofp_action_base):
     return outstr
 
 
+_action_output_struct = struct.Struct("!HHHH")
+
 @openflow_action('OFPAT_OUTPUT', 0)
 class ofp_action_output (ofp_action_base):
   def __init__ (self, **kw):
@@ -1555,16 +1745,11 @@ class ofp_action_output (ofp_action_base):
 
     assert self._assert()
 
-    packed = b""
-    packed += struct.pack("!HHHH", self.type, len(self), self.port,
-                          self.max_len)
-    return packed
+    return _action_output_struct.pack(self.type, 8, self.port, self.max_len)
 
   def unpack (self, raw, offset=0):
-    _offset = offset
     offset,(self.type, length, self.port, self.max_len) = \
-        _unpack("!HHHH", raw, offset)
-    assert offset - _offset == len(self)
+        _unpack_struct(_action_output_struct, raw, offset)
     return offset
 
   @staticmethod
@@ -1588,6 +1773,8 @@ class ofp_action_output (ofp_action_base):
     return outstr
 
 
+_action_enqueue_struct = struct.Struct("!HHH6xL")
+
 @openflow_action('OFPAT_ENQUEUE', 11)
 class ofp_action_enqueue (ofp_action_base):
   def __init__ (self, **kw):
@@ -1599,18 +1786,12 @@ class ofp_action_enqueue (ofp_action_base):
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += struct.pack("!HHH", self.type, len(self), self.port)
-    packed += _PAD6 # Pad
-    packed += struct.pack("!L", self.queue_id)
-    return packed
+    return _action_enqueue_struct.pack(self.type, 16, self.port,
+                                       self.queue_id)
 
   def unpack (self, raw, offset=0):
-    _offset = offset
-    offset,(self.type, length, self.port) = _unpack("!HHH", raw, offset)
-    offset = _skip(raw, offset, 6)
-    offset,(self.queue_id,) = _unpack("!L", raw, offset)
-    assert offset - _offset == len(self)
+    offset,(self.type, length, self.port, self.queue_id) = \
+        _unpack_struct(_action_enqueue_struct, raw, offset)
     return offset
 
   @staticmethod
@@ -1634,20 +1815,19 @@ class ofp_action_enqueue (ofp_action_base):
     return outstr
 
 
+_action_strip_vlan_struct = struct.Struct("!HH4x")
+
 @openflow_action('OFPAT_STRIP_VLAN', 3)
 class ofp_action_strip_vlan (ofp_action_base):
   def __init__ (self):
     pass
 
   def pack (self):
-    packed = struct.pack("!HHi", self.type, len(self), 0)
-    return packed
+    return _action_strip_vlan_struct.pack(self.type, 8)
 
   def unpack (self, raw, offset=0):
-    _offset = offset
-    offset,(self.type, length) = _unpack("!HH", raw, offset)
-    offset = _skip(raw, offset, 4)
-    assert offset - _offset == len(self)
+    offset,(self.type, length) = \
+        _unpack_struct(_action_strip_vlan_struct, raw, offset)
     return offset
 
   @staticmethod
@@ -1667,6 +1847,10 @@ class ofp_action_strip_vlan (ofp_action_base):
     return outstr
 
 
+# For actions with a single 16 or 8 bit argument
+_action_short_struct = struct.Struct("!HHH2x")
+_action_byte_struct = struct.Struct("!HHB3x")
+
 @openflow_action('OFPAT_SET_VLAN_VID', 1)
 class ofp_action_vlan_vid (ofp_action_base):
   def __init__ (self, **kw):
@@ -1677,18 +1861,12 @@ class ofp_action_vlan_vid (ofp_action_base):
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += struct.pack("!HHH", self.type, len(self), self.vlan_vid)
-    packed += _PAD2 # Pad
-    return packed
+    return _action_short_struct.pack(self.type, 8, self.vlan_vid)
 
   def unpack (self, raw, offset=0):
-    _offset = offset
     offset,(self.type, length, self.vlan_vid) = \
-        _unpack("!HHH", raw, offset)
-    offset = _skip(raw, offset, 2)
+        _unpack_struct(_action_short_struct, raw, offset)
     #TODO: check length for this and other actions
-    assert offset - _offset == len(self)
     return offset
 
   @staticmethod
@@ -1721,17 +1899,11 @@ class ofp_action_vlan_pcp (ofp_action_base):
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += struct.pack("!HHB", self.type, len(self), self.vlan_pcp)
-    packed += _PAD3 # Pad
-    return packed
+    return _action_byte_struct.pack(self.type, 8, self.vlan_pcp)
 
   def unpack (self, raw, offset=0):
-    _offset = offset
     offset,(self.type, length, self.vlan_pcp) = \
-        _unpack("!HHB", raw, offset)
-    offset = _skip(raw, offset, 3)
-    assert offset - _offset == len(self)
+        _unpack_struct(_action_byte_struct, raw, offset)
     return offset
 
   @staticmethod
@@ -1754,6 +1926,8 @@ class ofp_action_vlan_pcp (ofp_action_base):
 ofp_action_set_vlan_pcp = ofp_action_vlan_pcp
 
 
+_action_dl_addr_struct = struct.Struct("!HH6s6x")
+
 @openflow_action('OFPAT_SET_DL_DST', 5)
 @openflow_action('OFPAT_SET_DL_SRC', 4)
 class ofp_action_dl_addr (ofp_action_base):
@@ -1785,21 +1959,16 @@ class ofp_action_dl_addr (ofp_action_base):
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += struct.pack("!HH", self.type, len(self))
     if isinstance(self.dl_addr, EthAddr):
-      packed += self.dl_addr.toRaw()
+      dl_addr = self.dl_addr.toRaw()
     else:
-      packed += self.dl_addr
-    packed += _PAD6
-    return packed
+      dl_addr = self.dl_addr
+    return _action_dl_addr_struct.pack(self.type, 16, dl_addr)
 
   def unpack (self, raw, offset=0):
-    _offset = offset
-    offset,(self.type, length) = _unpack("!HH", raw, offset)
-    offset,self.dl_addr = _readether(raw, offset)
-    offset = _skip(raw, offset, 6)
-    assert offset - _offset == len(self)
+    offset,(self.type, length, dl_addr) = \
+        _unpack_struct(_action_dl_addr_struct, raw, offset)
+    self.dl_addr = EthAddr(dl_addr)
     return offset
 
   @staticmethod
@@ -1821,6 +1990,9 @@ class ofp_action_dl_addr (ofp_action_base):
     return outstr
 
 
+_action_nw_addr_struct = struct.Struct("!HHl")
+_action_nw_addr_unpack_struct = struct.Struct("!HH4s")
+
 @openflow_action('OFPAT_SET_NW_DST', 7)
 @openflow_action('OFPAT_SET_NW_SRC', 6)
 class ofp_action_nw_addr (ofp_action_base):
@@ -1845,16 +2017,13 @@ class ofp_action_nw_addr (ofp_action_base):
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += struct.pack("!HHl", self.type, len(self),
-                          self.nw_addr.toSigned())
-    return packed
+    return _action_nw_addr_struct.pack(self.type, 8,
+                                       self.nw_addr.toSigned())
 
   def unpack (self, raw, offset=0):
-    _offset = offset
-    offset,(self.type, length) = _unpack("!HH", raw, offset)
-    offset,self.nw_addr = _readip(raw, offset)
-    assert offset - _offset == len(self)
+    offset,(self.type, length, nw_addr) = \
+        _unpack_struct(_action_nw_addr_unpack_struct, raw, offset)
+    self.nw_addr = IPAddr(nw_addr, networkOrder = True)
     return offset
 
   @staticmethod
@@ -1884,16 +2053,11 @@ class ofp_action_nw_tos (ofp_action_base):
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += struct.pack("!HHB", self.type, len(self), self.nw_tos)
-    packed += _PAD3
-    return packed
+    return _action_byte_struct.pack(self.type, 8, self.nw_tos)
 
   def unpack (self, raw, offset=0):
-    _offset = offset
-    offset,(self.type, length, self.nw_tos) = _unpack("!HHB", raw, offset)
-    offset = _skip(raw, offset, 3)
-    assert offset - _offset == len(self)
+    offset,(self.type, length, self.nw_tos) = \
+        _unpack_struct(_action_byte_struct, raw, offset)
     return offset
 
   @staticmethod
@@ -1935,17 +2099,11 @@ class ofp_action_tp_port (ofp_action_base):
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += struct.pack("!HHH", self.type, len(self), self.tp_port)
-    packed += _PAD2
-    return packed
+    return _action_short_struct.pack(self.type, 8, self.tp_port)
 
   def unpack (self, raw, offset=0):
-    _offset = offset
     offset,(self.type, length, self.tp_port) = \
-        _unpack("!HHH", raw, offset)
-    offset = _skip(raw, offset, 2)
-    assert offset - _offset == len(self)
+        _unpack_struct(_action_short_struct, raw, offset)
     return offset
 
   @staticmethod
@@ -2237,6 +2395,10 @@ class ofp_set_config (ofp_header): # uses ofp_switch_config
 
 
 ##3.3 Modify State Messages
+_flow_mod_struct = struct.Struct("!BBHL" + _match_struct.format[1:]
+                                 + "QHHHHLHH")
+_flow_mod_body_struct = struct.Struct("!QHHHHLHH")
+
 @openflow_c_message("OFPT_FLOW_MOD", 14)
 class ofp_flow_mod (ofp_header):
   _MIN_LENGTH = 72
@@ -2311,15 +2473,15 @@ class ofp_flow_mod (ofp_header):
       buffer_id = NO_BUFFER
 
     assert self._assert()
-    packed = b""
-    packed += ofp_header.pack(self)
-    packed += self.match.pack(flow_mod=True)
-    packed += struct.pack("!QHHHHLHH", self.cookie, self.command,
-                          self.idle_timeout, self.hard_timeout,
-                          self.priority, buffer_id, self.out_port,
-                          self.flags)
-    for i in self.actions:
-      packed += i.pack()
+    packed = _flow_mod_struct.pack(self.version, self.header_type,
+                                   len(self), self.xid,
+                                   *(self.match._pack_fields(flow_mod=True)
+                                     + (self.cookie, self.command,
+                                        self.idle_timeout, self.hard_timeout,
+                                        self.priority, buffer_id,
+                                        self.out_port, self.flags)))
+    if self.actions:
+      packed += b''.join([i.pack() for i in self.actions])
 
     if po:
       packed += ofp_barrier_request().pack()
@@ -2332,7 +2494,7 @@ class ofp_flow_mod (ofp_header):
     offset,(self.cookie, self.command, self.idle_timeout,
             self.hard_timeout, self.priority, self._buffer_id,
             self.out_port, self.flags) = \
-            _unpack("!QHHHHLHH", raw, offset)
+            _unpack_struct(_flow_mod_body_struct, raw, offset)
     offset,self.actions = _unpack_actions(raw,
         length-(32 + len(self.match)), offset)
     assert length == len(self)
@@ -2885,6 +3047,11 @@ class ofp_table_stats_request (_empty_stats_request_body):
   pass
 
 
+# Used for both flow and aggregate stats requests
+_flow_stats_request_struct = struct.Struct("!" + _match_struct.format[1:]
+                                           + "BBH")
+_flow_stats_request_body_struct = struct.Struct("!BBH")
+
 @openflow_stats_request('OFPST_FLOW', 1)
 class ofp_flow_stats_request (ofp_stats_body_base):
   def __init__ (self, **kw):
@@ -2901,18 +3068,15 @@ class ofp_flow_stats_request (ofp_stats_body_base):
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += self.match.pack()
-    packed += struct.pack("!BBH", self.table_id, 0, self.out_port)
-    return packed
+    return _flow_stats_request_struct.pack(*(self.match._pack_fields()
+                                             + (self.table_id, 0,
+                                                self.out_port)))
 
   def unpack (self, raw, offset, avail):
-    _offset = offset
     offset = self.match.unpack(raw, offset)
     offset,(self.table_id, pad, self.out_port) = \
-        _unpack("!BBH", raw, offset)
+        _unpack_struct(_flow_stats_request_body_struct, raw, offset)
     assert pad == 0
-    assert offset - _offset == len(self)
     return offset
 
   @staticmethod
@@ -2935,6 +3099,11 @@ class ofp_flow_stats_request (ofp_stats_body_base):
     return outstr
 
 
+_flow_stats_struct = struct.Struct("!HBB" + _match_struct.format[1:]
+                                   + "LLHHH6xQQQ")
+_flow_stats_head_struct = struct.Struct("!HBB")
+_flow_stats_body_struct = struct.Struct("!LLHHH6xQQQ")
+
 @openflow_stats_reply('OFPST_FLOW', is_list = True)
 class ofp_flow_stats (ofp_stats_body_base):
   _MIN_LENGTH = 88
@@ -2961,31 +3130,28 @@ class ofp_flow_stats (ofp_stats_body_base):
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += struct.pack("!HBB", len(self), self.table_id, 0)
-    packed += self.match.pack()
-    packed += struct.pack("!LLHHH", self.duration_sec,
-                          self.duration_nsec, self.priority,
-                          self.idle_timeout, self.hard_timeout)
-    packed += _PAD6 # Pad
-    packed += struct.pack("!QQQ", self.cookie, self.packet_count,
-                          self.byte_count)
-    for i in self.actions:
-      packed += i.pack()
+    packed = _flow_stats_struct.pack(len(self), self.table_id, 0,
+                                     *(self.match._pack_fields()
+                                       + (self.duration_sec,
+                                          self.duration_nsec, self.priority,
+                                          self.idle_timeout,
+                                          self.hard_timeout, self.cookie,
+                                          self.packet_count,
+                                          self.byte_count)))
+    if self.actions:
+      packed += b''.join([i.pack() for i in self.actions])
     return packed
 
   def unpack (self, raw, offset, avail):
     _offset = offset
-    offset,(length, self.table_id, pad) = _unpack("!HBB", raw, offset)
+    offset,(length, self.table_id, pad) = \
+        _unpack_struct(_flow_stats_head_struct, raw, offset)
     assert pad == 0
     offset = self.match.unpack(raw, offset)
     offset,(self.duration_sec, self.duration_nsec, self.priority,
-            self.idle_timeout, self.hard_timeout) = \
-            _unpack("!LLHHH", raw, offset)
-    offset = _skip(raw, offset, 6)
-    offset,(self.cookie, self.packet_count, self.byte_count) = \
-        _unpack("!QQQ", raw, offset)
-    assert (offset - _offset) == 48 + len(self.match)
+            self.idle_timeout, self.hard_timeout, self.cookie,
+            self.packet_count, self.byte_count) = \
+            _unpack_struct(_flow_stats_body_struct, raw, offset)
     offset,self.actions = _unpack_actions(raw,
         length - (48 + len(self.match)), offset)
     assert offset - _offset == len(self)
@@ -3051,18 +3217,15 @@ class ofp_aggregate_stats_request (ofp_stats_body_base):
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += self.match.pack()
-    packed += struct.pack("!BBH", self.table_id, 0, self.out_port)
-    return packed
+    return _flow_stats_request_struct.pack(*(self.match._pack_fields()
+                                             + (self.table_id, 0,
+                                                self.out_port)))
 
   def unpack (self, raw, offset, avail):
-    _offset = offset
     offset = self.match.unpack(raw, offset)
     offset,(self.table_id, pad, self.out_port) = \
-        _unpack("!BBH", raw, offset)
+        _unpack_struct(_flow_stats_request_body_struct, raw, offset)
     assert pad == 0
-    assert offset - _offset == len(self)
     return offset
 
   @staticmethod
@@ -3085,6 +3248,8 @@ class ofp_aggregate_stats_request (ofp_stats_body_base):
     return outstr
 
 
+_aggregate_stats_struct = struct.Struct("!QQL4x")
+
 @openflow_stats_reply('OFPST_AGGREGATE')
 class ofp_aggregate_stats (ofp_stats_body_base):
   def __init__ (self, **kw):
@@ -3097,18 +3262,12 @@ class ofp_aggregate_stats (ofp_stats_body_base):
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += struct.pack("!QQL", self.packet_count, self.byte_count,
-                          self.flow_count)
-    packed += _PAD4 # Pad
-    return packed
+    return _aggregate_stats_struct.pack(self.packet_count, self.byte_count,
+                                        self.flow_count)
 
   def unpack (self, raw, offset, avail):
-    _offset = offset
     offset,(self.packet_count, self.byte_count, self.flow_count) = \
-        _unpack("!QQL", raw, offset)
-    offset = _skip(raw, offset, 4)
-    assert offset - _offset == len(self)
+        _unpack_struct(_aggregate_stats_struct, raw, offset)
     return offset
 
   @staticmethod
@@ -3131,6 +3290,9 @@ class ofp_aggregate_stats (ofp_stats_body_base):
 ofp_aggregate_stats_reply = ofp_aggregate_stats
 
 
+# The 32s is OFP_MAX_TABLE_NAME_LEN
+_table_stats_struct = struct.Struct("!B3x32sLLLQQ")
+
 @openflow_stats_reply('OFPST_TABLE', 3, is_list = True)
 class ofp_table_stats (ofp_stats_body_base):
   def __init__ (self, **kw):
@@ -3154,24 +3316,16 @@ class ofp_table_stats (ofp_stats_body_base):
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += struct.pack("!B", self.table_id)
-    packed += _PAD3
-    packed += self.name.ljust(OFP_MAX_TABLE_NAME_LEN,'\0')
-    packed += struct.pack("!LLLQQ", self.wildcards, self.max_entries,
-                          self.active_count, self.lookup_count,
-                          self.matched_count)
-    return packed
+    return _table_stats_struct.pack(self.table_id, self.name,
+                                    self.wildcards, self.max_entries,
+                                    self.active_count, self.lookup_count,
+                                    self.matched_count)
 
   def unpack (self, raw, offset, avail):
-    _offset = offset
-    offset,(self.table_id,) = _unpack("!B", raw, offset)
-    offset = _skip(raw, offset, 3)
-    offset,self.name = _readzs(raw, offset, OFP_MAX_TABLE_NAME_LEN)
-    offset,(self.wildcards, self.max_entries, self.active_count,
-            self.lookup_count, self.matched_count) = \
-            _unpack("!LLLQQ", raw, offset)
-    assert offset - _offset == len(self)
+    offset,(self.table_id, name, self.wildcards, self.max_entries,
+            self.active_count, self.lookup_count, self.matched_count) = \
+            _unpack_struct(_table_stats_struct, raw, offset)
+    self.name = _unzs(name)
     return offset
 
   @staticmethod
@@ -3202,6 +3356,8 @@ class ofp_table_stats (ofp_stats_body_base):
 ofp_table_stats_reply = ofp_table_stats
 
 
+_port_stats_request_struct = struct.Struct("!H6x")
+
 @openflow_stats_request("OFPST_PORT", 4)
 class ofp_port_stats_request (ofp_stats_body_base):
   def __init__ (self, **kw):
@@ -3211,16 +3367,11 @@ class ofp_port_stats_request (ofp_stats_body_base):
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += struct.pack("!H", self.port_no)
-    packed += _PAD6
-    return packed
+    return _port_stats_request_struct.pack(self.port_no)
 
   def unpack (self, raw, offset, avail):
-    _offset = offset
-    offset,(self.port_no,) = _unpack("!H", raw, offset)
-    offset = _skip(raw, offset, 6)
-    assert offset - _offset == len(self)
+    offset,(self.port_no,) = \
+        _unpack_struct(_port_stats_request_struct, raw, offset)
     return offset
 
   @staticmethod
@@ -3238,6 +3389,8 @@ class ofp_port_stats_request (ofp_stats_body_base):
     return outstr
 
 
+_port_stats_struct = struct.Struct("!H6xQQQQQQQQQQQQ")
+
 @openflow_stats_reply("OFPST_PORT", is_list = True)
 class ofp_port_stats (ofp_stats_body_base):
   def __init__ (self, **kw):
@@ -3260,27 +3413,20 @@ class ofp_port_stats (ofp_stats_body_base):
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += struct.pack("!H", self.port_no)
-    packed += _PAD6
-    packed += struct.pack("!QQQQQQQQQQQQ", self.rx_packets,
-                          self.tx_packets, self.rx_bytes, self.tx_bytes,
-                          self.rx_dropped, self.tx_dropped,
-                          self.rx_errors, self.tx_errors,
-                          self.rx_frame_err, self.rx_over_err,
-                          self.rx_crc_err, self.collisions)
-    return packed
+    return _port_stats_struct.pack(self.port_no, self.rx_packets,
+                                   self.tx_packets, self.rx_bytes,
+                                   self.tx_bytes, self.rx_dropped,
+                                   self.tx_dropped, self.rx_errors,
+                                   self.tx_errors, self.rx_frame_err,
+                                   self.rx_over_err, self.rx_crc_err,
+                                   self.collisions)
 
   def unpack (self, raw, offset, avail):
-    _offset = offset
-    offset,(self.port_no,) = _unpack("!H", raw, offset)
-    offset = _skip(raw, offset, 6)
-    offset,(self.rx_packets, self.tx_packets, self.rx_bytes,
+    offset,(self.port_no, self.rx_packets, self.tx_packets, self.rx_bytes,
             self.tx_bytes, self.rx_dropped, self.tx_dropped,
             self.rx_errors, self.tx_errors, self.rx_frame_err,
             self.rx_over_err, self.rx_crc_err, self.collisions) = \
-            _unpack("!QQQQQQQQQQQQ", raw, offset)
-    assert offset - _offset == len(self)
+            _unpack_struct(_port_stats_struct, raw, offset)
     return offset
 
   @staticmethod
@@ -3343,6 +3489,8 @@ class ofp_port_stats (ofp_stats_body_base):
 ofp_port_stats_reply = ofp_port_stats
 
 
+_queue_stats_request_struct = struct.Struct("!HHL")
+
 @openflow_stats_request("OFPST_QUEUE", 5)
 class ofp_queue_stats_request (ofp_stats_body_base):
   def __init__ (self, **kw):
@@ -3354,17 +3502,12 @@ class ofp_queue_stats_request (ofp_stats_body_base):
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += struct.pack("!H", self.port_no)
-    packed += _PAD2
-    packed += struct.pack("!L", self.queue_id)
-    return packed
+    return _queue_stats_request_struct.pack(self.port_no, 0, self.queue_id)
 
   def unpack (self, raw, offset, avail):
-    _offset = offset
-    offset,(self.port_no,pad,self.queue_id) = _unpack("!HHL", raw, offset)
+    offset,(self.port_no,pad,self.queue_id) = \
+        _unpack_struct(_queue_stats_request_struct, raw, offset)
     assert pad == 0
-    assert offset - _offset == len(self)
     return offset
 
   @staticmethod
@@ -3384,6 +3527,8 @@ class ofp_queue_stats_request (ofp_stats_body_base):
     return outstr
 
 
+_queue_stats_struct = struct.Struct("!H2xLQQQ")
+
 @openflow_stats_reply("OFPST_QUEUE", is_list = True)
 class ofp_queue_stats (ofp_stats_body_base):
   def __init__ (self, **kw):
@@ -3398,19 +3543,14 @@ class ofp_queue_stats (ofp_stats_body_base):
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += struct.pack("!H", self.port_no)
-    packed += _PAD2
-    packed += struct.pack("!LQQQ", self.queue_id, self.tx_bytes,
-                          self.tx_packets, self.tx_errors)
-    return packed
+    return _queue_stats_struct.pack(self.port_no, self.queue_id,
+                                    self.tx_bytes, self.tx_packets,
+                                    self.tx_errors)
 
   def unpack (self, raw, offset, avail):
-    _offset = offset
-    offset,(self.port_no, pad, self.queue_id, self.tx_bytes,
+    offset,(self.port_no, self.queue_id, self.tx_bytes,
             self.tx_packets, self.tx_errors) = \
-            _unpack("!HHLQQQ", raw, offset)
-    assert offset - _offset == len(self)
+            _unpack_struct(_queue_stats_struct, raw, offset)
     return offset
 
   @staticmethod
@@ -3524,6 +3664,8 @@ class ofp_generic_stats_body (ofp_stats_body_base):
     return outstr
 
 
+_packet_out_struct = struct.Struct("!BBHLLHH")
+
 @openflow_c_message("OFPT_PACKET_OUT", 13)
 class ofp_packet_out (ofp_header):
   _MIN_LENGTH = 16
@@ -3590,20 +3732,19 @@ class ofp_packet_out (ofp_header):
     actions = b''.join((i.pack() for i in self.actions))
     actions_len = len(actions)
 
+    header = _packet_out_struct.pack(self.version, self.header_type,
+                                     len(self), self.xid, self._buffer_id,
+                                     self.in_port, actions_len)
     if self.data is not None:
-      return b''.join((ofp_header.pack(self),
-        struct.pack("!LHH", self._buffer_id, self.in_port, actions_len),
-        actions, self.data))
+      return b''.join((header, actions, self.data))
     else:
-      return b''.join((ofp_header.pack(self),
-      struct.pack("!LHH", self._buffer_id, self.in_port, actions_len),
-      actions))
+      return header + actions
 
   def unpack (self, raw, offset=0):
     _offset = offset
-    offset,length = self._unpack_header(raw, offset)
-    offset,(self._buffer_id, self.in_port, actions_len) = \
-        _unpack("!LHH", raw, offset)
+    offset,(self.version, self.header_type, length, self.xid,
+            self._buffer_id, self.in_port, actions_len) = \
+        _unpack_struct(_packet_out_struct, raw, offset)
     offset,self.actions = _unpack_actions(raw, actions_len, offset)
 
     remaining = length - (offset - _offset)
@@ -3716,6 +3857,8 @@ class ofp_barrier_request (ofp_header):
 
 
 #4 Asynchronous Messages
+_packet_in_struct = struct.Struct("!BBHLLHHBx")
+
 @openflow_s_message("OFPT_PACKET_IN", 10)
 class ofp_packet_in (ofp_header):
   _MIN_LENGTH = 18
@@ -3772,10 +3915,10 @@ class ofp_packet_in (ofp_header):
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += ofp_header.pack(self)
-    packed += struct.pack("!LHHBB", self._buffer_id, self.total_len,
-                          self.in_port, self.reason, 0)
+    packed = _packet_in_struct.pack(self.version, self.header_type,
+                                    len(self), self.xid, self._buffer_id,
+                                    self.total_len, self.in_port,
+                                    self.reason)
     packed += self.data
     #TODO: Padding?  See __len__
     return packed
@@ -3786,9 +3929,9 @@ class ofp_packet_in (ofp_header):
     return len(self.data) == self.total_len
 
   def unpack (self, raw, offset=0):
-    offset,length = self._unpack_header(raw, offset)
-    offset,(self._buffer_id, self._total_len, self.in_port, self.reason,
-            pad) = _unpack("!LHHBB", raw, offset)
+    offset,(self.version, self.header_type, length, self.xid,
+            self._buffer_id, self._total_len, self.in_port, self.reason) = \
+        _unpack_struct(_packet_in_struct, raw, offset)
     offset,self.data = _read(raw, offset, length-18)
     assert length == len(self)
     return offset,length
@@ -3822,6 +3965,10 @@ class ofp_packet_in (ofp_header):
     return outstr
 
 
+_flow_removed_struct = struct.Struct("!BBHL" + _match_struct.format[1:]
+                                     + "QHBxLLH2xQQ")
+_flow_removed_body_struct = struct.Struct("!QHBxLLH2xQQ")
+
 @openflow_s_message("OFPT_FLOW_REMOVED", 11)
 class ofp_flow_removed (ofp_header):
   def __init__ (self, **kw):
@@ -3845,28 +3992,23 @@ class ofp_flow_removed (ofp_header):
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += ofp_header.pack(self)
-    packed += self.match.pack()
-    packed += struct.pack("!QHB", self.cookie, self.priority, self.reason)
-    packed += _PAD
-    packed += struct.pack("!LLH", self.duration_sec, self.duration_nsec,
-                          self.idle_timeout)
-    packed += _PAD2
-    packed += struct.pack("!QQ", self.packet_count, self.byte_count)
-    return packed
+    return _flow_removed_struct.pack(self.version, self.header_type,
+                                     len(self), self.xid,
+                                     *(self.match._pack_fields()
+                                       + (self.cookie, self.priority,
+                                          self.reason, self.duration_sec,
+                                          self.duration_nsec,
+                                          self.idle_timeout,
+                                          self.packet_count,
+                                          self.byte_count)))
 
   def unpack (self, raw, offset=0):
     offset,length = self._unpack_header(raw, offset)
     offset = self.match.unpack(raw, offset)
-    offset,(self.cookie, self.priority, self.reason) = \
-        _unpack("!QHB", raw, offset)
-    offset = _skip(raw, offset, 1)
-    offset,(self.duration_sec, self.duration_nsec, self.idle_timeout) = \
-        _unpack("!LLH", raw, offset)
-    offset = _skip(raw, offset, 2)
-    offset,(self.packet_count, self.byte_count) = \
-        _unpack("!QQ", raw, offset)
+    offset,(self.cookie, self.priority, self.reason, self.duration_sec,
+            self.duration_nsec, self.idle_timeout, self.packet_count,
+            self.byte_count) = \
+        _unpack_struct(_flow_removed_body_struct, raw, offset)
     assert length == len(self)
     return offset,length
 
@@ -3905,6 +4047,8 @@ class ofp_flow_removed (ofp_header):
     return outstr
 
 
+_port_status_struct = struct.Struct("!BBHLB7x")
+
 @openflow_s_message("OFPT_PORT_STATUS", 12)
 class ofp_port_status (ofp_header):
   def __init__ (self, **kw):
@@ -3922,17 +4066,13 @@ class ofp_port_status (ofp_header):
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += ofp_header.pack(self)
-    packed += struct.pack("!B", self.reason)
-    packed += _PAD * 7 # Pad
-    packed += self.desc.pack()
-    return packed
+    return (_port_status_struct.pack(self.version, self.header_type,
+                                     len(self), self.xid, self.reason)
+            + self.desc.pack())
 
   def unpack (self, raw, offset=0):
-    offset,length = self._unpack_header(raw, offset)
-    offset,(self.reason,) = _unpack("!B", raw, offset)
-    offset = _skip(raw, offset, 7)
+    offset,(self.version, self.header_type, length, self.xid,
+            self.reason) = _unpack_struct(_port_status_struct, raw, offset)
     offset = self.desc.unpack(raw, offset)
     assert length == len(self)
     return offset,length
@@ -4452,3 +4592,14 @@ ofp_match_data = {
   'tp_src' : (0, OFPFW_TP_SRC),
   'tp_dst' : (0, OFPFW_TP_DST),
 }
+
+_match_defaults = dict(('_' + k, v[0]) for k,v in ofp_match_data.iteritems())
+
+# Wildcards for the groups of fields from_raw() sets all at once
+_raw_wildcards_all = ((OFPFW_ALL & ~(OFPFW_NW_SRC_MASK | OFPFW_NW_DST_MASK))
+                      | (32 << OFPFW_NW_SRC_SHIFT)
+                      | (32 << OFPFW_NW_DST_SHIFT))
+_raw_wildcards_dl = (OFPFW_DL_SRC | OFPFW_DL_DST | OFPFW_DL_TYPE
+                     | OFPFW_DL_VLAN | OFPFW_DL_VLAN_PCP)
+_raw_wildcards_nw = OFPFW_NW_SRC_MASK | OFPFW_NW_DST_MASK | OFPFW_NW_PROTO
+_raw_wildcards_tp = OFPFW_TP_SRC | OFPFW_TP_DST
@@ -40,24 +40,27 @@ import select
 # type into a message object.
 unpackers = make_type_to_unpacker_table()
 
-try:
-  PIPE_BUF = select.PIPE_BUF
-except:
-  try:
-    # Try to get it from where PyPy (sometimes) has it
-    import IN
-    PIPE_BUF = IN.PIPE_BUF
-  except:
-    # (Hopefully) reasonable default
-    PIPE_BUF = 512
-
 import pox.openflow.libopenflow_01 as of
 
+def _unpack_packet_in_raw (raw, offset = 0):
+  """
+  Leaves packet-ins in wire format
+
+  They're copied out of the receive buffer as bytes, and PacketIn decodes
+  what it needs from them.
+  """
+  length = ord(raw[offset+2]) << 8 | ord(raw[offset+3])
+  return offset+length,raw[offset:offset+length]
+
+unpackers[of.OFPT_PACKET_IN] = _unpack_packet_in_raw
+
 import threading
 import os
 import sys
 import exceptions
+from collections import deque
 from errno import EAGAIN, ECONNRESET, EADDRINUSE, EADDRNOTAVAIL
+from errno import EWOULDBLOCK, EINTR, EMFILE, ENFILE, ENOBUFS, ENOMEM
 
 
 import traceback
@@ -173,6 +176,7 @@ def handle_PORT_STATUS (con, msg): #A
     con.raiseEventNoErrors(PortStatus, con, msg)
 
 def handle_PACKET_IN (con, msg): #A
+  # msg is either an ofp_packet_in or the raw message
   e = con.ofnexus.raiseEventNoErrors(PacketIn, con, msg)
   if e is None or e.halt != True:
     con.raiseEventNoErrors(PacketIn, con, msg)
@@ -270,113 +274,6 @@ statsHandlerMap = {
   of.OFPST_QUEUE : handle_OFPST_QUEUE,
 }
 
-# Deferred sending should be unusual, so don't worry too much about
-# efficiency
-class DeferredSender (threading.Thread):
-  """
-  Class that handles sending when a socket write didn't complete
-  """
-  def __init__ (self):
-    threading.Thread.__init__(self)
-    core.addListeners(self)
-    self._dataForConnection = {}
-    self._lock = threading.RLock()
-    self._waker = pox.lib.util.makePinger()
-    self.sending = False
-
-    self.start()
-
-  def _handle_GoingDownEvent (self, event):
-    self._waker.ping()
-
-  def _sliceup (self, data):
-    """
-    Takes an array of data bytes, and slices into elements of
-    PIPE_BUF bytes each
-    """
-    out = []
-    while len(data) > PIPE_BUF:
-      out.append(data[0:PIPE_BUF])
-      data = data[PIPE_BUF:]
-    if len(data) > 0:
-      out.append(data)
-    return out
-
-  def send (self, con, data):
-    with self._lock:
-      self.sending = True
-
-      data = self._sliceup(data)
-
-      if con not in self._dataForConnection:
-        self._dataForConnection[con] = data
-      else:
-        self._dataForConnection[con].extend(data)
-
-      self._waker.ping()
-
-  def kill (self, con):
-    with self._lock:
-      try:
-        del self._dataForConnection[con]
-      except:
-        pass
-
-      self._waker.ping()
-
-  def run (self):
-    while core.running:
-
-      with self._lock:
-        cons = self._dataForConnection.keys()
-
-      rlist, wlist, elist = select.select([self._waker], cons, cons, 5)
-      if not core.running: break
-
-      with self._lock:
-        if len(rlist) > 0:
-          self._waker.pongAll()
-
-        for con in elist:
-          try:
-            del self._dataForConnection[con]
-          except:
-            pass
-
-        for con in wlist:
-          try:
-            alldata = self._dataForConnection[con]
-            while len(alldata):
-              data = alldata[0]
-              try:
-                l = con.sock.send(data)
-                if l != len(data):
-                  alldata[0] = data[l:]
-                  break
-                del alldata[0]
-              except socket.error as (errno, strerror):
-                if errno != EAGAIN:
-                  con.msg("DeferredSender/Socket error: " + strerror)
-                  con.disconnect()
-                  del self._dataForConnection[con]
-                break
-              except:
-                con.msg("Unknown error doing deferred sending")
-                break
-            if len(alldata) == 0:
-              try:
-                del self._dataForConnection[con]
-                if len(self._dataForConnection) == 0:
-                  self.sending = False
-                  break
-              except:
-                pass
-          except:
-            try:
-              del self._dataForConnection[con]
-            except:
-              pass
-
 class DummyOFNexus (object):
   def raiseEventNoErrors (self, event, *args, **kw):
     log.warning("%s raised on dummy OpenFlow nexus" % event)
@@ -584,11 +481,42 @@ class Connection (EventMixin):
     PortStatsReceived,
     QueueStatsReceived,
     FlowRemoved,
+    SendCongestion,
   ])
 
   # Globally unique identifier for the Connection instance
   ID = 0
 
+  # Maximum number of bytes to pull off the socket with each recv.
+  # Can be set with openflow.of_01 --read_size=X.
+  read_size = 8192
+
+  # When flushing the send queue, up to this many bytes of queued messages
+  # are gathered into a single send().
+  send_gather_size = 0x10000
+
+  # Maximum bytes queued per outbound message class (None is unlimited).
+  # When a class goes over, a SendCongestion event is raised and the class'
+  # policy applies to further messages until it drains:
+  #  'queue'  - queue it anyway
+  #  'drop'   - silently drop it (send() returns False)
+  #  'reject' - raise SendQueueFull
+  # Everything is queued by default; 'drop' and 'reject' are opt-in.
+  # These are shared by all connections; to change them for a single
+  # connection, assign it its own copies.
+  send_limits = {
+    SEND_CONTROL : None,
+    SEND_FLOW_SETUP : 8 * 1024 * 1024,
+    SEND_PACKET_OUT : 2 * 1024 * 1024,
+    SEND_BULK : 1024 * 1024,
+  }
+  send_policies = {
+    SEND_CONTROL : 'queue',
+    SEND_FLOW_SETUP : 'queue',
+    SEND_PACKET_OUT : 'queue',
+    SEND_BULK : 'queue',
+  }
+
   def msg (self, m):
     #print str(self), m
     log.debug(str(self) + " " + str(m))
@@ -600,12 +528,48 @@ class Connection (EventMixin):
     #print str(self), m
     log.info(str(self) + " " + str(m))
 
-  def __init__ (self, sock):
+  def __init__ (self, sock, reactor = None, hello = True):
+    """
+    sock is the switch's (nonblocking) socket
+
+    reactor is the listener loop which owns the connection.  If the socket
+    can't take everything we send, the rest is queued on the connection
+    and reactor._write_pending(connection) is called.  The reactor should
+    then call _flush() whenever the socket is writable until it returns
+    True.
+
+    hello is False if we've already sent the switch a HELLO (i.e., when
+    the connection was started somewhere else and handed to us).
+    """
     self._previous_stats = []
 
     self.ofnexus = _dummyOFNexus
     self.sock = sock
-    self.buf = ''
+    self._reactor = reactor
+
+    # Outbound messages the socket hasn't taken yet, one queue per class.
+    # _send_partial is the rest of a message which only partly went out;
+    # it has to go before anything else.
+    self._send_queues = [deque() for _ in send_class_names]
+    self._class_queued = [0] * len(send_class_names) # Bytes per class
+    self._send_partial = b''
+    self._send_queued = 0 # Total bytes waiting, including _send_partial
+    self._congested = [False] * len(send_class_names)
+    self.send_drops = [0] * len(send_class_names) # Messages dropped
+    # While a queued barrier hasn't gone out, [class, n], where class is
+    # the one it was queued in and it's the nth message to be sent from
+    # that class or the ones ahead of it.  Nothing later may pass it.
+    self._send_fence = None
+
+    # Receive buffer.  Data is read straight into this preallocated arena.
+    # Unconsumed data lives in _rbuf[_rstart:_rend].  It is only moved back
+    # to the front of the arena when there's no longer room for another
+    # read_size bytes at the end.  The arena is big enough to always hold
+    # a maximum-length OpenFlow message plus one read.
+    self._rbuf = bytearray(0x10000 + 2 * self.read_size)
+    self._rview = memoryview(self._rbuf)
+    self._rstart = 0
+    self._rend = 0
     Connection.ID += 1
     self.ID = Connection.ID
     # TODO: dpid and features don't belong here; they should be eventually
@@ -617,7 +581,8 @@ class Connection (EventMixin):
     self.connect_time = None
     self.idle_time = time.time()
 
-    self.send(of.ofp_hello())
+    if hello:
+      self.send(of.ofp_hello())
 
     self.original_ports = PortCollection()
     self.ports = PortCollection()
@@ -661,11 +626,12 @@ class Connection (EventMixin):
         self.ofnexus.raiseEventNoErrors(ConnectionDown, self)
         self.raiseEventNoErrors(ConnectionDown, self)
 
-    try:
-      #deferredSender.kill(self)
-      pass
-    except:
-      pass
+    for q in self._send_queues:
+      q.clear()
+    self._class_queued = [0] * len(self._class_queued)
+    self._send_partial = b''
+    self._send_queued = 0
+    self._send_fence = None
     try:
       self.sock.shutdown(socket.SHUT_RDWR)
     except:
@@ -676,12 +642,30 @@ class Connection (EventMixin):
     except:
       pass
 
-  def send (self, data):
+  def send (self, data, priority = None):
     """
     Send data to the switch.
 
     Data should probably either be raw bytes in OpenFlow wire format, or
     an OpenFlow controller-to-switch message object from libopenflow.
+
+    priority is one of the SEND_x classes from pox.openflow; if it's not
+    given, it's picked based on the message type.  It only matters when
+    the switch isn't keeping up and messages have to be queued.  Queued
+    messages are then sent class by class (so, e.g., echo replies don't
+    wait behind megabytes of flow_mods), and each class is subject to its
+    send_limits/send_policies entry.  Messages of the same class always
+    stay in order.  Barrier requests are queued behind everything already
+    queued, whatever its class, and until a queued barrier has gone out,
+    nothing sent after it is moved ahead of it (later messages are queued
+    in the barrier's class if theirs would go first).
+
+    If data is raw bytes holding several messages, they are queued as a
+    single unit and classified by the first one's header only; pass
+    priority explicitly if that's not right, and send barriers on their
+    own so that they're recognized.
+
+    Returns False if the message was dropped.
     """
     if self.disconnected: return
     if type(data) is not bytes:
@@ -691,66 +675,279 @@ class Connection (EventMixin):
       assert isinstance(data, of.ofp_header)
       data = data.pack()
 
-    if deferredSender.sending:
-      log.debug("deferred sender is sending!")
-      deferredSender.send(self, data)
-      return
+    if self._send_queued:
+      # Already backed up
+      return self._queue_send(data, priority)
     try:
       l = self.sock.send(data)
       if l != len(data):
         self.msg("Didn't send complete buffer.")
-        data = data[l:]
-        deferredSender.send(self, data)
+        self._send_partial = data[l:]
+        self._send_queued = len(self._send_partial)
+        if self._reactor is not None:
+          self._reactor._write_pending(self)
     except socket.error as (errno, strerror):
       if errno == EAGAIN:
         self.msg("Out of send buffer space.  " +
                  "Consider increasing SO_SNDBUF.")
-        deferredSender.send(self, data)
+        return self._queue_send(data, priority)
       else:
         self.msg("Socket error: " + strerror)
         self.disconnect(defer_event=True)
+    return True
+
+  def _queue_send (self, data, priority):
+    """
+    Queues a message the socket didn't take to be sent when it's writable
+    """
+    ofp_type = ord(data[1]) # Only the first message of a multi-message send
+    if priority is None:
+      priority = _default_send_class.get(ofp_type, SEND_FLOW_SETUP)
+    fence = self._send_fence
+    if fence is not None and priority < fence[0]:
+      # Don't let anything overtake a barrier sent before it
+      priority = fence[0]
+    barrier = ofp_type == of.OFPT_BARRIER_REQUEST
+    if barrier:
+      # Don't let a barrier overtake anything sent before it
+      for c in range(len(self._send_queues)-1, priority, -1):
+        if self._send_queues[c]:
+          priority = c
+          break
+
+    limit = self.send_limits.get(priority)
+    queued = self._class_queued[priority]
+    if limit is not None and queued + len(data) > limit:
+      policy = self.send_policies.get(priority, 'queue')
+      if policy == 'drop':
+        self.send_drops[priority] += 1
+        self._set_congested(priority, True)
+        return False
+      elif policy == 'reject':
+        self._set_congested(priority, True)
+        raise SendQueueFull("%s queue full on %s"
+                            % (send_class_names[priority], self))
+
+    was_empty = not self._send_queued
+    if barrier:
+      # Everything queued is in this class or ahead of it
+      self._send_fence = [priority,
+                          1 + sum(len(q) for q in self._send_queues)]
+    self._send_queues[priority].append(data)
+    self._class_queued[priority] += len(data)
+    self._send_queued += len(data)
+    if limit is not None and self._class_queued[priority] > limit:
+      self._set_congested(priority, True)
+    if was_empty and self._reactor is not None:
+      self._reactor._write_pending(self)
+    return True
+
+  def _pass_fence (self, parts, l):
+    """
+    Lifts the barrier fence once the barrier has (at least partly) gone out
+
+    parts are the (class, message) pairs gathered by _flush(), of which
+    the first l bytes were sent.  Anything partly sent is finished before
+    whatever is queued, so it counts as gone.
+    """
+    fence = self._send_fence
+    for c,chunk in parts:
+      if l <= 0: break
+      l -= len(chunk)
+      if c > fence[0]: continue
+      fence[1] -= 1
+      if fence[1] == 0:
+        self._send_fence = None
+        break
+
+  def _set_congested (self, send_class, congested):
+    if self._congested[send_class] == congested: return
+    self._congested[send_class] = congested
+    if congested:
+      self.msg("%s messages congested (%s bytes queued)"
+               % (send_class_names[send_class],
+                  self._class_queued[send_class]))
+    queued = self._class_queued[send_class]
+    e = self.ofnexus.raiseEventNoErrors(SendCongestion, self, send_class,
+                                        congested, queued)
+    if e is None or e.halt != True:
+      self.raiseEventNoErrors(SendCongestion, self, send_class, congested,
+                              queued)
+
+  def is_congested (self, send_class = None):
+    """
+    Whether the given class (or any class if None) is over its limit
+    """
+    if send_class is None: return any(self._congested)
+    return self._congested[send_class]
+
+  @property
+  def send_pending (self):
+    """
+    Number of bytes queued waiting for the socket to be writable
+    """
+    return self._send_queued
+
+  def _flush (self):
+    """
+    Sends as much queued data as the socket will take
+
+    Several queued messages are gathered into each send() (Python 2's
+    socket has no sendmsg()/writev, so they are joined).
+
+    Returns True if there's nothing left to send.
+    """
+    queues = self._send_queues
+    class_queued = self._class_queued
+    gather = self.send_gather_size
+    while self._send_queued:
+      parts = None
+      if self._send_partial:
+        data = self._send_partial
+      else:
+        # Gather messages, highest priority class first
+        parts = []
+        n = 0
+        for c,q in enumerate(queues):
+          while q and n < gather:
+            chunk = q.popleft()
+            class_queued[c] -= len(chunk)
+            parts.append((c,chunk))
+            n += len(chunk)
+          if n >= gather: break
+        if len(parts) == 1:
+          data = parts[0][1]
+        else:
+          data = b''.join(chunk for c,chunk in parts)
+
+      try:
+        l = self.sock.send(data)
+      except socket.error as (errno, strerror):
+        if errno == EAGAIN:
+          l = 0
+        else:
+          self.msg("Socket error: " + strerror)
+          self.disconnect(defer_event=True)
+          return True
+
+      self._send_queued -= l
+      if parts is not None and self._send_fence is not None:
+        self._pass_fence(parts, l)
+      if parts is None:
+        self._send_partial = data[l:]
+      elif l != len(data):
+        # Put back whatever didn't go out
+        for i,(c,chunk) in enumerate(parts):
+          if l >= len(chunk):
+            l -= len(chunk)
+            continue
+          if l:
+            self._send_partial = chunk[l:]
+            i += 1
+          for c,chunk in reversed(parts[i:]):
+            queues[c].appendleft(chunk)
+            class_queued[c] += len(chunk)
+          break
+        l = 0
+        data = None
+
+      if True in self._congested:
+        for c,congested in enumerate(self._congested):
+          if not congested: continue
+          limit = self.send_limits.get(c)
+          if limit is None or class_queued[c] <= limit // 2:
+            self._set_congested(c, False)
+
+      if data is None or l != len(data):
+        # Socket is full
+        return False
+    return True
+
+  def _compact_rbuf (self):
+    """
+    Moves unconsumed data to the front of the receive buffer
+
+    Returns the number of bytes moved.
+    """
+    start = self._rstart
+    n = self._rend - start
+    if n:
+      self._rbuf[0:n] = self._rbuf[start:start+n]
+    self._rstart = 0
+    self._rend = n
+    return n
 
   def read (self):
     """
     Read data from this connection.  Generally this is just called by the
     main OpenFlow loop below.
 
-    Note: This function will block if data is not available.
+    The socket is nonblocking, so this should only be called when it's
+    readable.  Returns False if the connection should be thrown away.
     """
+    if len(self._rbuf) - self._rend < self.read_size:
+      self._compact_rbuf()
     try:
-      d = self.sock.recv(2048)
+      l = self.sock.recv_into(self._rview[self._rend:], self.read_size)
     except:
       return False
-    if len(d) == 0:
+    if l == 0:
       return False
-    self.buf += d
-    buf_len = len(self.buf)
+    self._rend += l
+    return self._process()
+
+  def _feed (self, data):
+    """
+    Handles data that someone else already read from our socket
 
+    Returns False if the connection should be thrown away (like read()).
+    """
+    while data:
+      if len(self._rbuf) - self._rend < self.read_size:
+        self._compact_rbuf()
+      n = min(len(data), len(self._rbuf) - self._rend)
+      self._rbuf[self._rend:self._rend+n] = data[:n]
+      self._rend += n
+      data = data[n:]
+      if self._process() is False: return False
+    return True
 
-    offset = 0
+  def _process (self):
+    """
+    Handles all the complete messages in the receive buffer
+    """
+    buf = self._rbuf
+    buf_len = self._rend
+    offset = self._rstart
     while buf_len - offset >= 8: # 8 bytes is minimum OF message size
       # We pull the first four bytes of the OpenFlow header off by hand
-      # (using ord) to find the version/length/type so that we can
-      # correctly call libopenflow to unpack it.
+      # to find the version/length/type so that we can correctly call
+      # libopenflow to unpack it.
 
-      ofp_type = ord(self.buf[offset+1])
+      ofp_type = buf[offset+1]
 
-      if ord(self.buf[offset]) != of.OFP_VERSION:
+      if buf[offset] != of.OFP_VERSION:
         if ofp_type == of.OFPT_HELLO:
           # We let this through and hope the other side switches down.
           pass
         else:
           log.warning("Bad OpenFlow version (0x%02x) on connection %s"
-                      % (ord(self.buf[offset]), self))
+                      % (buf[offset], self))
           return False # Throw connection away
 
-      msg_length = ord(self.buf[offset+2]) << 8 | ord(self.buf[offset+3])
+      msg_length = buf[offset+2] << 8 | buf[offset+3]
 
       if buf_len - offset < msg_length: break
 
-      new_offset,msg = unpackers[ofp_type](self.buf, offset)
-      assert new_offset - offset == msg_length
-      offset = new_offset
+      # The unpacker decodes straight out of the receive buffer.  A buffer
+      # object (unlike a memoryview slice) gives back plain strings when
+      # sliced, so fields like packet data come out as normal bytes.
+      # Unpackers take (raw, offset) -- others (e.g., openflow.nicira's)
+      # get plugged into the table -- and here the offset is always 0.
+      new_offset,msg = unpackers[ofp_type](buffer(buf, offset, msg_length),
+                                           0)
+      assert new_offset == msg_length
+      offset += msg_length
 
       try:
         h = handlers[ofp_type]
@@ -761,8 +958,12 @@ class Connection (EventMixin):
                       ("\n" + str(self) + " ").join(str(msg).split('\n')))
         continue
 
-    if offset != 0:
-      self.buf = self.buf[offset:]
+    if offset == buf_len:
+      # Everything consumed; start over at the front of the arena for free
+      self._rstart = 0
+      self._rend = 0
+    else:
+      self._rstart = offset
 
     return True
 
@@ -810,6 +1011,25 @@ class Connection (EventMixin):
     return "[%s %i]" % (d, self.ID)
 
 
+# Default outbound class for each message type (see Connection.send())
+_default_send_class = {
+  of.OFPT_HELLO : SEND_CONTROL,
+  of.OFPT_ERROR : SEND_CONTROL,
+  of.OFPT_ECHO_REQUEST : SEND_CONTROL,
+  of.OFPT_ECHO_REPLY : SEND_CONTROL,
+  of.OFPT_FEATURES_REQUEST : SEND_CONTROL,
+  of.OFPT_GET_CONFIG_REQUEST : SEND_CONTROL,
+  of.OFPT_SET_CONFIG : SEND_CONTROL,
+  of.OFPT_BARRIER_REQUEST : SEND_CONTROL,
+  of.OFPT_QUEUE_GET_CONFIG_REQUEST : SEND_CONTROL,
+  of.OFPT_FLOW_MOD : SEND_FLOW_SETUP,
+  of.OFPT_PORT_MOD : SEND_FLOW_SETUP,
+  of.OFPT_VENDOR : SEND_FLOW_SETUP,
+  of.OFPT_PACKET_OUT : SEND_PACKET_OUT,
+  of.OFPT_STATS_REQUEST : SEND_BULK,
+}
+
+
 def wrap_socket (new_sock):
   fname = datetime.datetime.now().strftime("%Y-%m-%d-%I%M%p")
   fname += "_" + new_sock.getpeername()[0].replace(".", "_")
@@ -831,12 +1051,40 @@ class OpenFlow_01_Task (Task):
   """
   The main recoco thread for listening to openflow messages
   """
-  def __init__ (self, port = 6633, address = '0.0.0.0'):
+  # When we can't accept a connection because we're out of file
+  # descriptors (or memory), the connection stays in the listen backlog,
+  # so the listener stays readable.  Rather than spin on it, we stop
+  # polling it for this many seconds.
+  accept_backoff = 0.5
+
+  # Failures to accept connections are logged at most this often (in
+  # seconds); the rest are just counted.
+  accept_warning_interval = 10
+
+  def __init__ (self, port = 6633, address = '0.0.0.0', listen = True):
+    """
+    If listen is False, we don't accept connections ourselves and only
+    handle those given to adopt().
+    """
     Task.__init__(self)
     self.port = int(port)
     self.address = address
+    self.listen = listen
     self.started = False
 
+    # Open sockets/connections to select on
+    self._sockets = []
+
+    # Connections with queued outbound data
+    self._writers = set()
+    self._waker = pox.lib.util.makePinger()
+    self._waiting = False
+
+    # While we're not polling the listener, when to start again
+    self._accept_resume = None
+    self._accept_warned = None # When we last warned about accept()
+    self._accept_failures = 0 # Failures since then
+
     core.addListener(pox.core.GoingUpEvent, self._handle_GoingUpEvent)
 
   def _handle_GoingUpEvent (self, event):
@@ -848,10 +1096,12 @@ class OpenFlow_01_Task (Task):
     self.started = True
     return super(OpenFlow_01_Task,self).start()
 
-  def run (self):
-    # List of open sockets/connections to select on
-    sockets = []
+  def _make_listener (self):
+    """
+    Creates and binds the listening socket
 
+    Returns None (after logging the reason) if we couldn't bind.
+    """
     listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     try:
@@ -865,25 +1115,133 @@ class OpenFlow_01_Task (Task):
         log.error(" You may have another controller running.")
         log.error(" Use openflow.of_01 --port=<port> to run POX on "
                   "another port.")
-      return
+      return None
 
     listener.listen(16)
-    sockets.append(listener)
+    return listener
 
-    log.debug("Listening on %s:%s" %
-              (self.address, self.port))
+  def _accept (self, listener):
+    """
+    Accepts a new switch connection and returns its Connection
+
+    Returns None if there wasn't one after all or it couldn't be set up
+    (e.g., we're out of file descriptors).  These are logged but leave
+    the listener alone, so we go on accepting later connections.  If
+    we're out of file descriptors, _accept_resume is set to when the
+    reactor should try again, and until then it shouldn't poll the
+    listener.
+    """
+    try:
+      new_sock = listener.accept()[0]
+    except socket.error as e:
+      if e.errno in (EAGAIN, EWOULDBLOCK, EINTR):
+        return None
+      now = time.time()
+      if e.errno in (EMFILE, ENFILE, ENOBUFS, ENOMEM):
+        self._accept_resume = now + self.accept_backoff
+      self._accept_failures += 1
+      if (self._accept_warned is None
+          or now - self._accept_warned >= self.accept_warning_interval):
+        if self._accept_failures > 1:
+          log.warn("Couldn't accept OpenFlow connection: %s "
+                   "(%i failures since last warning)", e,
+                   self._accept_failures)
+        else:
+          log.warn("Couldn't accept OpenFlow connection: %s", e)
+        self._accept_warned = now
+        self._accept_failures = 0
+      return None
+    try:
+      if pox.openflow.debug.pcap_traces:
+        new_sock = wrap_socket(new_sock)
+      new_sock.setblocking(0)
+      # Note that instantiating a Connection object fires a
+      # ConnectionUp event (after negotation has completed)
+      return Connection(new_sock, reactor=self)
+    except Exception:
+      log.exception("Couldn't set up new OpenFlow connection")
+      try:
+        new_sock.close()
+      except Exception:
+        pass
+      return None
+
+  def _accept_timeout (self, timeout):
+    """
+    Returns how long the reactor should wait, at most timeout
+
+    If the listener is paused, this is until it should be polled again;
+    0 means to start polling it now.
+    """
+    if self._accept_resume is None: return timeout
+    return max(0, min(timeout, self._accept_resume - time.time()))
+
+  def adopt (self, sock, data = b''):
+    """
+    Takes over a switch connection which was accepted somewhere else
+
+    We must already have sent the switch a HELLO, and data is anything
+    which has already been read from it (after its HELLO).  Returns the
+    new Connection, or None if it was thrown away.
+    """
+    sock.setblocking(0)
+    con = Connection(sock, reactor=self, hello=False)
+    if data and con._feed(data) is False:
+      con.close()
+      return None
+    self._add_connection(con)
+    return con
+
+  def _add_connection (self, con):
+    self._sockets.append(con)
+    if self._waiting:
+      # Have the select pick up the new socket
+      self._waker.ping()
+
+  def _write_pending (self, con):
+    """
+    Called by a Connection when it has queued data to send
+    """
+    if con in self._writers: return
+    self._writers.add(con)
+    if self._waiting:
+      # Have the select pick up the new write list
+      self._waker.ping()
+
+  def run (self):
+    sockets = self._sockets
+
+    listener = None
+    if self.listen:
+      listener = self._make_listener()
+      if listener is None: return
+      sockets.append(listener)
+      log.debug("Listening on %s:%s" %
+                (self.address, self.port))
+
+    waker = self._waker
+    sockets.append(waker)
 
     con = None
     while core.running:
       try:
         while True:
           con = None
-          rlist, wlist, elist = yield Select(sockets, [], sockets, 5)
+          timeout = self._accept_timeout(5)
+          if timeout == 0:
+            # Done backing off; poll the listener again
+            self._accept_resume = None
+            sockets.append(listener)
+            timeout = 5
+          self._waiting = True
+          rlist, wlist, elist = yield Select(sockets, list(self._writers),
+                                             sockets, timeout)
+          self._waiting = False
           if len(rlist) == 0 and len(wlist) == 0 and len(elist) == 0:
             if not core.running: break
 
           for con in elist:
-            if con is listener:
+            if con is listener or con is waker:
               raise RuntimeError("Error on listener socket")
             else:
               try:
@@ -894,37 +1252,43 @@ class OpenFlow_01_Task (Task):
                 sockets.remove(con)
               except:
                 pass
+              self._writers.discard(con)
+
+          for con in wlist:
+            if con._flush():
+              self._writers.discard(con)
 
           timestamp = time.time()
           for con in rlist:
             if con is listener:
-              new_sock = listener.accept()[0]
-              if pox.openflow.debug.pcap_traces:
-                new_sock = wrap_socket(new_sock)
-              new_sock.setblocking(0)
-              # Note that instantiating a Connection object fires a
-              # ConnectionUp event (after negotation has completed)
-              newcon = Connection(new_sock)
-              sockets.append( newcon )
+              newcon = self._accept(listener)
+              if newcon is not None:
+                sockets.append( newcon )
+              elif self._accept_resume is not None:
+                # Out of descriptors; leave the listener alone for a bit
+                sockets.remove(listener)
               #print str(newcon) + " connected"
+            elif con is waker:
+              waker.pongAll()
             else:
               con.idle_time = timestamp
               if con.read() is False:
                 con.close()
                 sockets.remove(con)
+                self._writers.discard(con)
       except exceptions.KeyboardInterrupt:
         break
       except:
         doTraceback = True
         if sys.exc_info()[0] is socket.error:
-          if sys.exc_info()[1][0] == ECONNRESET:
+          if sys.exc_info()[1][0] == ECONNRESET and con is not None:
             con.info("Connection reset")
             doTraceback = False
 
         if doTraceback:
           log.exception("Exception reading connection " + str(con))
 
-        if con is listener:
+        if con is not None and (con is listener or con is waker):
           log.error("Exception on OpenFlow listener.  Aborting.")
           break
         try:
@@ -935,12 +1299,154 @@ class OpenFlow_01_Task (Task):
           sockets.remove(con)
         except:
           pass
+        self._writers.discard(con)
 
     log.debug("No longer listening for connections")
 
     #pox.core.quit()
 
 
+class OpenFlow_01_EpollTask (OpenFlow_01_Task):
+  """
+  An epoll-based variant of the OpenFlow listener loop
+
+  The plain task hands the whole list of sockets to the SelectHub on every
+  iteration, so the cost of each wakeup grows with the number of switches
+  (and select() can't handle more than FD_SETSIZE of them anyway).  This
+  one keeps a persistent epoll interest set which is only changed when
+  switches connect or disconnect.  The SelectHub just waits on the epoll
+  descriptor itself, and when it's readable, we dispatch only the ready
+  connections.
+
+  Connections with queued outbound data additionally get EPOLLOUT interest
+  until their queue has been flushed.
+
+  Linux only.
+  """
+  def __init__ (self, *args, **kw):
+    OpenFlow_01_Task.__init__(self, *args, **kw)
+    self._epoll = select.epoll()
+    self._connections = {} # fd -> Connection
+
+  def _add_connection (self, con):
+    mask = select.EPOLLIN
+    if con.send_pending: mask |= select.EPOLLOUT
+    self._connections[con.fileno()] = con
+    self._epoll.register(con.fileno(), mask)
+
+  def _write_pending (self, con):
+    """
+    Called by a Connection when it has queued data to send
+    """
+    fd = con.fileno()
+    if fd in self._connections:
+      self._epoll.modify(fd, select.EPOLLIN | select.EPOLLOUT)
+
+  def run (self):
+    ep = self._epoll
+    connections = self._connections
+
+    listener = None
+    listener_fd = None
+    if self.listen:
+      listener = self._make_listener()
+      if listener is None: return
+      listener_fd = listener.fileno()
+      ep.register(listener_fd, select.EPOLLIN)
+      log.debug("Listening on %s:%s (epoll)" %
+                (self.address, self.port))
+
+    def drop (fd):
+      c = connections.pop(fd, None)
+      try:
+        ep.unregister(fd)
+      except:
+        pass
+      if c is not None:
+        try:
+          c.close()
+        except:
+          pass
+
+    con = None
+    fd = None
+    while core.running:
+      try:
+        while True:
+          con = None
+          fd = None
+          timeout = self._accept_timeout(5)
+          if timeout == 0:
+            # Done backing off; poll the listener again
+            self._accept_resume = None
+            ep.register(listener_fd, select.EPOLLIN)
+            timeout = 5
+          rlist, wlist, elist = yield Select([ep], [], [ep], timeout)
+          if len(rlist) == 0 and len(elist) == 0:
+            if not core.running: break
+            continue
+
+          timestamp = time.time()
+          for fd, event in ep.poll(0):
+            if fd == listener_fd:
+              if event & (select.EPOLLERR | select.EPOLLHUP):
+                con = listener
+                raise RuntimeError("Error on listener socket")
+              newcon = self._accept(listener)
+              if newcon is not None:
+                self._add_connection(newcon)
+              elif self._accept_resume is not None:
+                # Out of descriptors; leave the listener alone for a bit
+                ep.unregister(listener_fd)
+              continue
+
+            con = connections.get(fd)
+            if con is None:
+              # Already gone
+              continue
+            if event & select.EPOLLIN:
+              con.idle_time = timestamp
+              if con.read() is False:
+                drop(fd)
+                continue
+            elif event & (select.EPOLLERR | select.EPOLLHUP):
+              drop(fd)
+              continue
+            if event & select.EPOLLOUT:
+              if con._flush() and fd in connections:
+                ep.modify(fd, select.EPOLLIN)
+      except exceptions.KeyboardInterrupt:
+        break
+      except:
+        doTraceback = True
+        if sys.exc_info()[0] is socket.error:
+          if sys.exc_info()[1][0] == ECONNRESET and con is not None:
+            con.info("Connection reset")
+            doTraceback = False
+
+        if doTraceback:
+          log.exception("Exception reading connection " + str(con))
+
+        if con is not None and con is listener:
+          log.error("Exception on OpenFlow listener.  Aborting.")
+          break
+        if fd is not None and fd != listener_fd:
+          drop(fd)
+
+    for fd in connections.keys():
+      drop(fd)
+    ep.close()
+
+    log.debug("No longer listening for connections")
+
+
+# Listener loop implementations selectable with --reactor
+_reactors = {
+  'select' : OpenFlow_01_Task,
+  'epoll' : OpenFlow_01_EpollTask,
+}
+
+
 def _set_handlers ():
   handlers.extend([None] * (1 + sorted(handlerMap.keys(),reverse=True)[0]))
   for h in handlerMap:
@@ -949,19 +1455,38 @@ def _set_handlers ():
 _set_handlers()
 
 
-# Used by the Connection class
-deferredSender = None
+def launch (port = 6633, address = "0.0.0.0", reactor = "select",
+            read_size = None, listen = True):
+  """
+  Listen for OpenFlow 1.0 switches
+
+  --reactor=epoll uses an epoll interest set instead of handing every
+  socket to select() on each wakeup.  This scales much better to large
+  numbers of switches, but is only available on Linux.
+
+  --read_size=X sets the maximum number of bytes read from a switch's
+  socket at once.
 
-def launch (port = 6633, address = "0.0.0.0"):
+  --listen=False doesn't accept connections; they have to be given to
+  the task's adopt() (e.g., by the shard component).
+  """
   if core.hasComponent('of_01'):
     return None
 
-  global deferredSender
-  deferredSender = DeferredSender()
+  if read_size is not None:
+    Connection.read_size = int(read_size)
+
+  task_class = _reactors.get(reactor)
+  if task_class is None:
+    raise RuntimeError("Unknown reactor '%s' (expected one of: %s)"
+                       % (reactor, ", ".join(sorted(_reactors))))
+  if reactor == 'epoll' and not hasattr(select, 'epoll'):
+    raise RuntimeError("The epoll reactor is not available on this platform")
 
   if of._logger is None:
     of._logger = core.getLogger('libopenflow_01')
 
-  l = OpenFlow_01_Task(port = int(port), address = address)
+  l = task_class(port = int(port), address = address,
+                 listen = pox.lib.util.str_to_bool(listen))
   core.register("of_01", l)
   return l
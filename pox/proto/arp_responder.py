@@ -147,7 +147,8 @@ class ARPResponder (object):
     core.addListeners(self)
 
   def _handle_GoingUpEvent (self, event):
-    core.openflow.addListeners(self)
+    core.openflow.addListeners(self,
+        filters={'PacketIn':{'dl_type':ethernet.ARP_TYPE}})
     log.debug("Up...")
 
   def _handle_ConnectionUp (self, event):
@@ -259,7 +259,11 @@ class DHCPD (EventMixin):
       log.debug("Removing my own IP (%s) from address pool", self.ip_addr)
       self.pool.remove(self.ip_addr)
 
-    core.openflow.addListeners(self)
+    # We only want DHCP requests
+    core.openflow.addListeners(self, filters={'PacketIn':{
+        'dl_type':pkt.ethernet.IP_TYPE,
+        'nw_proto':pkt.ipv4.UDP_PROTOCOL,
+        'tp_dst':pkt.dhcp.SERVER_PORT}})
 
   def _handle_ConnectionUp (self, event):
     if self._install_flow:
@@ -0,0 +1,596 @@
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Runs POX as several processes with switches sharded among them by DPID
+
+Normally everything in POX runs on one recoco scheduler, which ties it
+to one core.  This starts a number of worker processes, each of which is
+a separate POX (with its own scheduler) running its own copy of the
+components you give it.  The main process accepts OpenFlow connections,
+does the start of the handshake to find out the switch's DPID, and then
+hands the socket over to worker number DPID % workers.  So a given switch
+always ends up on the same worker, where it's handled just as if that
+worker had accepted it.
+
+This suits per-switch components which don't share state between
+switches, like forwarding.l2_learning or misc.cbench:
+  ./pox.py shard --workers=4 --components="forwarding.l2_learning"
+
+--components is a POX commandline (components and their options) which
+each worker runs.  Components given the usual way run in the main
+process only.  --port and --address are where to listen for switches
+(like openflow.of_01's), and --reactor is the of_01 reactor the workers
+use.  --workers defaults to the number of CPUs.
+
+For state which does need to be shared, core.shards (in the main process
+and in each worker) can send messages between processes; see
+Shards.send().  core.shards.index tells a component which worker it's
+running in.
+
+Unix only.
+"""
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+import pox.openflow.of_01
+from pox.lib.revent import Event, EventMixin
+from pox.lib.recoco import Task, Select
+import pox.lib.util
+
+import os
+import sys
+import time
+import shlex
+import struct
+import socket
+import cPickle as pickle
+import _multiprocessing # For sendfd()/recvfd()
+from errno import EAGAIN, EADDRINUSE
+
+log = core.getLogger()
+
+# Besides a worker number, Shards.send() can send to...
+PARENT = "parent" # The main process
+ALL = None        # Every other process
+
+# How long a new switch has to get as far as telling us its DPID
+HANDSHAKE_TIMEOUT = 30
+
+
+class ShardMessage (Event):
+  """
+  A message from another process
+
+  sender is the worker number it came from, or PARENT.  (It isn't called
+  source, since that's the Event attribute for what raised it.)
+  """
+  def __init__ (self, sender, msg):
+    super(ShardMessage, self).__init__()
+    self.sender = sender
+    self.msg = msg
+
+
+class _Channel (object):
+  """
+  Passes pickled objects over a nonblocking stream socket
+
+  Each object is framed by its 32 bit length.  If the socket won't take
+  everything right away, the rest waits until flush(), and waker (if
+  there is one) is pinged so that the task looking after the channel
+  notices.
+  """
+  def __init__ (self, sock, waker = None):
+    sock.setblocking(0)
+    self.sock = sock
+    self.waker = waker
+    self.closed = False
+    self._rbuf = b''
+    self._wbuf = b''
+
+  def fileno (self):
+    return self.sock.fileno()
+
+  @property
+  def send_pending (self):
+    return len(self._wbuf) != 0
+
+  def send (self, obj):
+    if self.closed: return
+    data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    was_pending = self.send_pending
+    self._wbuf += struct.pack("!L", len(data)) + data
+    if was_pending: return
+    if not self.flush() and self.waker is not None:
+      self.waker.ping()
+
+  def flush (self):
+    """
+    Sends as much as the socket will take
+
+    Returns True if there's nothing left to send.
+    """
+    while self._wbuf:
+      try:
+        l = self.sock.send(self._wbuf)
+      except socket.error as e:
+        if e.errno == EAGAIN: return False
+        self.close()
+        return True
+      self._wbuf = self._wbuf[l:]
+    return True
+
+  def read (self):
+    """
+    Returns a list of the objects received, or None if it's closed
+    """
+    try:
+      data = self.sock.recv(0x10000)
+    except socket.error as e:
+      if e.errno == EAGAIN: return []
+      data = b''
+    if not data:
+      self.close()
+      return None
+    buf = self._rbuf + data
+    r = []
+    offset = 0
+    while len(buf) - offset >= 4:
+      length = struct.unpack_from("!L", buf, offset)[0]
+      if len(buf) - offset - 4 < length: break
+      r.append(pickle.loads(buf[offset+4:offset+4+length]))
+      offset += 4 + length
+    self._rbuf = buf[offset:]
+    return r
+
+  def close (self):
+    self.closed = True
+    self._wbuf = b''
+    try:
+      self.sock.close()
+    except:
+      pass
+
+
+class _Handshake (object):
+  """
+  A new switch connection which we don't know the DPID of yet
+
+  We send a HELLO, answer the switch's HELLO with a features request,
+  and stop once the features reply shows up.  data is then everything
+  the worker needs to see: the features reply, anything after it, and
+  anything other than HELLOs and echoes before it.
+  """
+  def __init__ (self, sock):
+    sock.setblocking(0)
+    self.sock = sock
+    self.deadline = time.time() + HANDSHAKE_TIMEOUT
+    self.dpid = None
+    self.data = b''
+    self._buf = b''
+    self._send(of.ofp_hello().pack())
+
+  def fileno (self):
+    return self.sock.fileno()
+
+  def _send (self, data):
+    # These are tiny and the socket is new, so it will take them
+    self.sock.sendall(data)
+
+  def read (self):
+    """
+    Reads from the switch
+
+    Returns False if the connection should be dropped.  Once this has
+    seen the features reply, dpid is set.
+    """
+    try:
+      d = self.sock.recv(8192)
+    except socket.error as e:
+      return e.errno == EAGAIN
+    if not d: return False
+    buf = self._buf + d
+    try:
+      while len(buf) >= 8:
+        length = struct.unpack_from("!H", buf, 2)[0]
+        if length < 8: return False
+        if len(buf) < length: break
+        t = ord(buf[1])
+        if t == of.OFPT_FEATURES_REPLY:
+          if length < 16: return False
+          self.dpid = struct.unpack_from("!Q", buf, 8)[0]
+          self.data += buf
+          buf = b''
+          break
+        elif t == of.OFPT_HELLO:
+          self._send(of.ofp_features_request().pack())
+        elif t == of.OFPT_ECHO_REQUEST:
+          self._send(buf[0] + chr(of.OFPT_ECHO_REPLY) + buf[2:length])
+        else:
+          self.data += buf[:length]
+        buf = buf[length:]
+    except socket.error:
+      return False
+    self._buf = buf
+    return True
+
+  def close (self):
+    try:
+      self.sock.close()
+    except:
+      pass
+
+
+class Shards (EventMixin):
+  """
+  Where this process fits into a sharded POX
+
+  Registered as core.shards in the main process and in every worker.
+  index is this worker's number (0 to count-1), or PARENT in the main
+  process.
+
+  This is abstract; _MainShards and _WorkerShards implement _forward()
+  for their end of the channels.
+  """
+  _eventMixin_events = set([ShardMessage])
+
+  def __init__ (self, index, count):
+    self.index = index
+    self.count = count
+
+  def shard_for (self, dpid):
+    """
+    Returns the number of the worker which handles the given switch
+    """
+    return dpid % self.count
+
+  def send (self, msg, shard = ALL):
+    """
+    Sends a message to another process
+
+    msg can be anything which can be pickled.  shard is a worker number,
+    PARENT, or ALL for every other process.  It's raised there as a
+    ShardMessage on core.shards.  Messages from one process to another
+    arrive in the order they were sent.
+
+    Call this from the scheduler's thread (e.g., use core.callLater()).
+    """
+    if shard == self.index:
+      self._deliver(self.index, msg)
+    else:
+      self._forward(msg, shard)
+
+  def _forward (self, msg, shard):
+    """
+    Passes a message from send() on to other processes
+
+    shard is as for send(), but is never this process.
+    """
+
+  def _deliver (self, sender, msg):
+    self.raiseEventNoErrors(ShardMessage, sender, msg)
+
+
+class _Worker (object):
+  """
+  The main process's end of a worker process
+  """
+  def __init__ (self, index, channel, fd_sock, pid):
+    self.index = index
+    self.channel = channel
+    self.fd_sock = fd_sock # Switch sockets are passed over this
+    self.pid = pid
+    self.switches = 0 # Switches handed to it
+
+  def fileno (self):
+    return self.channel.fileno()
+
+  @property
+  def alive (self):
+    return not self.channel.closed
+
+
+class _MainShards (Shards):
+  """
+  core.shards in the main process
+  """
+  def __init__ (self, count, components, reactor):
+    Shards.__init__(self, PARENT, count)
+    self.workers = []
+    self._components = components
+    self._reactor = reactor
+    self._waker = pox.lib.util.makePinger()
+    core.addListeners(self)
+
+  def _handle_GoingDownEvent (self, event):
+    # Workers quit when their channel closes
+    for w in self.workers:
+      w.channel.close()
+      w.fd_sock.close()
+
+  def _handle_DownEvent (self, event):
+    deadline = time.time() + 3
+    for w in self.workers:
+      while True:
+        try:
+          if os.waitpid(w.pid, os.WNOHANG)[0]: break
+        except OSError:
+          break
+        if time.time() > deadline:
+          log.warning("Killing worker %i", w.index)
+          os.kill(w.pid, 9)
+          os.waitpid(w.pid, 0)
+          break
+        time.sleep(0.05)
+
+  def _worker_command (self, index, ctl, fds):
+    cmd = [sys.executable, os.path.abspath(sys.argv[0])]
+    boot = sys.modules.get("pox.boot")
+    if boot is not None:
+      if boot._options.verbose: cmd.append("--verbose")
+      if boot._options.log_config:
+        cmd.append("--log-config=" + boot._options.log_config)
+    cmd += ["shard:worker", "--index=%i" % (index,),
+            "--count=%i" % (self.count,), "--ctl=%i" % (ctl,),
+            "--fds=%i" % (fds,), "--reactor=" + self._reactor]
+    cmd += shlex.split(self._components)
+    return cmd
+
+  def start_workers (self):
+    for index in range(self.count):
+      ctl,child_ctl = socket.socketpair()
+      fds,child_fds = socket.socketpair()
+      keep = (child_ctl.fileno(), child_fds.fileno())
+      cmd = self._worker_command(index, *keep)
+      pid = os.fork()
+      if pid == 0:
+        # Don't leak anything else (especially the other workers'
+        # channels) into the worker
+        try:
+          fd = 3
+          for k in sorted(keep):
+            os.closerange(fd, k)
+            fd = k + 1
+          os.closerange(fd, os.sysconf("SC_OPEN_MAX"))
+          os.execv(cmd[0], cmd)
+        finally:
+          os._exit(127)
+      child_ctl.close()
+      child_fds.close()
+      channel = _Channel(ctl, self._waker)
+      self.workers.append(_Worker(index, channel, fds, pid))
+    log.info("Started %i workers", self.count)
+
+  def hand_off (self, handshake):
+    """
+    Gives a switch connection to its worker
+    """
+    w = self.workers[self.shard_for(handshake.dpid)]
+    if not w.alive:
+      log.warning("Dropping %s because worker %i is gone",
+                  pox.lib.util.dpidToStr(handshake.dpid), w.index)
+      handshake.close()
+      return
+    try:
+      _multiprocessing.sendfd(w.fd_sock.fileno(), handshake.sock.fileno())
+    except OSError:
+      log.exception("Couldn't pass switch to worker %i", w.index)
+      handshake.close()
+      return
+    w.channel.send(('switch', handshake.data))
+    w.switches += 1
+    handshake.close() # Our copy of it, anyway
+    log.debug("%s -> worker %i", pox.lib.util.dpidToStr(handshake.dpid),
+              w.index)
+
+  def _forward (self, msg, shard):
+    for w in self.workers:
+      if shard is ALL or shard == w.index:
+        w.channel.send(('msg', PARENT, msg))
+
+  def _handle_message (self, worker, m):
+    kind = m[0]
+    if kind == 'msg':
+      _,dest,msg = m
+      if dest is ALL or dest == PARENT:
+        self._deliver(worker.index, msg)
+      for w in self.workers:
+        if dest == w.index or (dest is ALL and w is not worker):
+          w.channel.send(('msg', worker.index, msg))
+    else:
+      log.error("Unknown message from worker %i: %s", worker.index, kind)
+
+  def _worker_gone (self, worker):
+    log.error("Worker %i has exited", worker.index)
+    worker.fd_sock.close()
+    try:
+      os.waitpid(worker.pid, os.WNOHANG)
+    except OSError:
+      pass
+
+
+class _Dispatcher (Task):
+  """
+  Accepts switches, finds out their DPIDs, and hands them to workers
+
+  Also passes messages between the workers.
+  """
+  def __init__ (self, shards, port, address):
+    Task.__init__(self)
+    self.shards = shards
+    self.port = port
+    self.address = address
+
+  def _make_listener (self):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+      listener.bind((self.address, self.port))
+    except socket.error as e:
+      log.error("Error %i while binding socket: %s", e.errno, e.strerror)
+      if e.errno == EADDRINUSE:
+        log.error(" You may have another controller running.")
+      return None
+    listener.listen(128)
+    return listener
+
+  def run (self):
+    shards = self.shards
+    waker = shards._waker
+    listener = self._make_listener()
+    if listener is None: return
+    log.debug("Listening on %s:%s", self.address, self.port)
+
+    pending = []
+    while core.running:
+      workers = [w for w in shards.workers if w.alive]
+      writers = [w for w in workers if w.channel.send_pending]
+      rlist,wlist,elist = yield Select([listener, waker] + workers + pending,
+                                       writers, [], 1)
+
+      for w in wlist:
+        w.channel.flush()
+
+      for s in rlist:
+        if s is listener:
+          try:
+            pending.append(_Handshake(listener.accept()[0]))
+          except socket.error:
+            log.exception("Error accepting switch")
+        elif s is waker:
+          waker.pongAll()
+        elif isinstance(s, _Worker):
+          msgs = s.channel.read()
+          if msgs is None:
+            shards._worker_gone(s)
+            continue
+          for m in msgs:
+            shards._handle_message(s, m)
+        elif not s.read():
+          s.close()
+          pending.remove(s)
+        elif s.dpid is not None:
+          pending.remove(s)
+          shards.hand_off(s)
+
+      if pending:
+        now = time.time()
+        for h in [h for h in pending if h.deadline < now]:
+          log.info("Switch didn't finish handshake in time")
+          h.close()
+          pending.remove(h)
+
+    listener.close()
+    for h in pending:
+      h.close()
+
+
+class _WorkerShards (Shards):
+  """
+  core.shards in a worker process
+  """
+  def __init__ (self, index, count, channel, fd_sock):
+    Shards.__init__(self, index, count)
+    self._channel = channel
+    self._fd_sock = fd_sock
+    self.switches = 0 # Switches handed to us
+
+  def _forward (self, msg, shard):
+    self._channel.send(('msg', shard, msg))
+
+  def _handle_message (self, m):
+    kind = m[0]
+    if kind == 'switch':
+      fd = _multiprocessing.recvfd(self._fd_sock.fileno())
+      sock = socket.fromfd(fd, socket.AF_INET, socket.SOCK_STREAM)
+      os.close(fd)
+      self.switches += 1
+      core.of_01.adopt(sock, m[1])
+    elif kind == 'msg':
+      _,sender,msg = m
+      self._deliver(sender, msg)
+    else:
+      log.error("Unknown message from main process: %s", kind)
+
+
+class _WorkerTask (Task):
+  """
+  Looks after a worker's channel to the main process
+  """
+  def __init__ (self, shards):
+    Task.__init__(self)
+    self.shards = shards
+
+  def run (self):
+    channel = self.shards._channel
+    waker = channel.waker
+    while core.running:
+      w = [channel] if channel.send_pending else []
+      rlist,wlist,elist = yield Select([channel, waker], w, [], 5)
+      if wlist:
+        channel.flush()
+      if waker in rlist:
+        waker.pongAll()
+      if channel in rlist:
+        msgs = channel.read()
+        if msgs is None:
+          log.info("Main process is gone")
+          core.quit()
+          return
+        for m in msgs:
+          self.shards._handle_message(m)
+
+
+def worker (index, count, ctl, fds, reactor = "select"):
+  """
+  Makes this POX a shard worker (the main process runs this for you)
+  """
+  index = int(index)
+  ctl = int(ctl)
+  fds = int(fds)
+  channel = _Channel(socket.fromfd(ctl, socket.AF_UNIX, socket.SOCK_STREAM),
+                     pox.lib.util.makePinger())
+  fd_sock = socket.fromfd(fds, socket.AF_UNIX, socket.SOCK_STREAM)
+  os.close(ctl)
+  os.close(fds)
+
+  # Switches come from the main process, so don't listen for them
+  pox.openflow.of_01.launch(reactor = reactor, listen = False)
+
+  shards = _WorkerShards(index, int(count), channel, fd_sock)
+  core.register("shards", shards)
+  task = _WorkerTask(shards)
+  core.addListenerByName("GoingUpEvent", lambda event: task.start())
+
+
+def launch (workers = None, components = "", port = 6633,
+            address = "0.0.0.0", reactor = "select"):
+  if workers is None:
+    import multiprocessing
+    workers = multiprocessing.cpu_count()
+  workers = int(workers)
+  if workers < 1:
+    raise RuntimeError("Need at least one worker")
+
+  # The dispatcher does the listening in this process
+  pox.openflow.of_01.launch(listen = False)
+
+  shards = _MainShards(workers, components, reactor)
+  core.register("shards", shards)
+  dispatcher = _Dispatcher(shards, int(port), address)
+
+  def start (event):
+    shards.start_workers()
+    dispatcher.start()
+  core.addListenerByName("GoingUpEvent", start)
@@ -240,7 +240,7 @@ class Topology (EventMixin):
       return [x for x in self._entities.itervalues() if isinstance(x, t)]
 
   def addListener(self, eventType, handler, once=False, weak=False,
-                  priority=None, byName=False):
+                  priority=None, byName=False, filter=None):
     """
     We interpose on EventMixin.addListener to check if the eventType is
     in our promise list. If so, trigger the handler for all previously
@@ -251,7 +251,7 @@ class Topology (EventMixin):
 
     return EventMixin.addListener(self, eventType, handler, once=once,
                                   weak=weak, priority=priority,
-                                  byName=byName)
+                                  byName=byName, filter=filter)
 
   def raiseEvent (self, event, *args, **kw):
     """
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from pox.datapaths.buffer_pool import BufferPool, UNKNOWN, EMPTY
+
+
+class BufferPoolTest (unittest.TestCase):
+  def test_put_pop (self):
+    pool = BufferPool(4, slot_size=16)
+    a = pool.put(b'a' * 16, 1)
+    b = pool.put(b'bb', 2)
+    self.assertNotEqual(a, b)
+    self.assertEqual(len(pool), 2)
+    self.assertEqual(pool.pop(b), (b'bb', 2))
+    self.assertEqual(pool.pop(a), (b'a' * 16, 1))
+    self.assertEqual(len(pool), 0)
+    self.assertEqual(pool.pop(a), (None, EMPTY))
+    self.assertEqual(pool.pop(12345), (None, UNKNOWN))
+    # Too big
+    self.assertEqual(pool.put(b'c' * 17), None)
+
+  def test_evict_oldest (self):
+    pool = BufferPool(3, slot_size=8)
+    ids = [pool.put(b'%i' % i, i) for i in range(3)]
+    self.assertEqual(pool.pop(ids[1]), (b'1', 1))
+    ids.append(pool.put(b'3', 3))
+    ids.append(pool.put(b'4', 4)) # Evicts 0
+    self.assertEqual(len(pool), 3)
+    self.assertEqual(pool.evictions, 1)
+    self.assertEqual(pool.pop(ids[0]), (None, UNKNOWN))
+    self.assertEqual([pool.pop(i) for i in ids[2:]],
+                     [(b'2', 2), (b'3', 3), (b'4', 4)])
+
+    pool = BufferPool(1, slot_size=8, evict=False)
+    self.assertNotEqual(pool.put(b'x'), None)
+    self.assertEqual(pool.put(b'y'), None)
+
+  def test_stale_ids (self):
+    pool = BufferPool(2, slot_size=8)
+    old = pool.put(b'old')
+    pool.pop(old)
+    new = pool.put(b'new')
+    new2 = pool.put(b'new2')
+    # One of them reused the old slot, but the old ID doesn't work
+    self.assertEqual(pool.check(old), UNKNOWN)
+    self.assertEqual(pool.check(new), None)
+    self.assertEqual(pool.check(new2), None)
+    for i in xrange(1000):
+      pool.pop(pool.put(b'x'))
+      self.assertNotEqual(pool.check(new), EMPTY)
+    self.assertTrue(all(0 < i < 0xffffffff for i in (old, new, new2)))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -143,10 +143,11 @@ class SwitchImplTest (unittest.TestCase):
                              ))
 
     # that should have send the packet out port 3
+    # (buffered packets are kept packed, so it's a copy)
     self.assertEqual(len(received), 1)
     event = received[0]
     self.assertEqual(event.port.port_no,3)
-    self.assertEqual(event.packet, self.packet)
+    self.assertEqual(event.packet.pack(), self.packet.pack())
 
     # now the next packet should go through on the fast path
     c.received = []
@@ -159,6 +160,170 @@ class SwitchImplTest (unittest.TestCase):
     self.assertEqual(event.port.port_no,3)
     self.assertEqual(event.packet, self.packet)
 
+  def test_microflow_cache(self):
+    c = self.conn
+    s = self.switch
+    received = []
+    s.addListener(DpPacketOut, lambda(event): received.append(event))
+    self.packet.type = ethernet.IP_TYPE
+    data = self.packet.pack()
+
+    # A miss gets cached too
+    s.rx_packet(self.packet, 1, data)
+    s.rx_packet(self.packet, 1, data)
+    self.assertEqual((s.microflow_hits, s.microflow_misses), (1, 1))
+    self.assertEqual(len(c.received), 2)
+
+    c.to_switch(ofp_flow_mod(priority=1, match=ofp_match(in_port=1),
+                             actions=[ofp_action_output(port=3)]))
+    s.rx_packet(self.packet, 1, data)
+    s.rx_packet(self.packet, 1, data)
+    self.assertEqual((s.microflow_hits, s.microflow_misses), (2, 2))
+    self.assertEqual([e.port.port_no for e in received], [3, 3])
+
+    # A new, better entry has to take effect right away
+    c.to_switch(ofp_flow_mod(priority=2, match=ofp_match(nw_src="1.2.3.4"),
+                             actions=[ofp_action_output(port=4)]))
+    s.rx_packet(self.packet, 1, data)
+    self.assertEqual(received[-1].port.port_no, 4)
+    self.assertEqual(s.table.entries[0].packet_count, 1)
+
+    # Different in_port is a different microflow
+    s.rx_packet(self.packet, 2, data)
+    self.assertEqual((s.microflow_hits, s.microflow_misses), (2, 4))
+
+  def test_rx_packets(self):
+    c = self.conn
+    s = self.switch
+    received = []
+    s.addListener(DpPacketOut, lambda(event): received.append(event))
+    self.packet.type = ethernet.IP_TYPE
+    data = self.packet.pack()
+    other = ethernet(src=EthAddr("00:00:00:00:00:03"),
+                     dst=EthAddr("00:00:00:00:00:04"), type=0x88cc,
+                     payload="x" * 20)
+
+    c.to_switch(ofp_flow_mod(priority=1, match=ofp_match(nw_src="1.2.3.4"),
+                             actions=[ofp_action_output(port=3)]))
+    c.to_switch(ofp_flow_mod(priority=1, match=ofp_match(dl_type=0x88cc),
+                             actions=[ofp_action_output(port=4),
+                                      ofp_action_output(port=3)]))
+    s.ports[2].config |= OFPPC_NO_RECV
+    s.rx_packets([(None, 1, data), (other, 1, None), (self.packet, 2, data),
+                  (None, 2, data), (self.packet, 4, None),
+                  (None, 3, ethernet(type=0x1234, payload="y").pack())])
+
+    # Output is grouped by port, and by entry within each port
+    self.assertEqual([(e.port.port_no, e.packet.type) for e in received],
+                     [(3, ethernet.IP_TYPE), (3, ethernet.IP_TYPE), (3, 0x88cc),
+                      (4, 0x88cc)])
+    counts = sorted((e.packet_count, e.byte_count) for e in s.table.entries)
+    self.assertEqual(counts, [(1, len(other.pack())), (2, 2 * len(data))])
+    self.assertEqual(s.port_stats[1].rx_packets, 2)
+    self.assertEqual(s.port_stats[2].rx_packets, 0)
+    self.assertEqual(s.port_stats[3].tx_packets, 3)
+    self.assertEqual((s._lookup_count, s._matched_count), (4, 3))
+
+    # The miss went to the controller
+    self.assertEqual(len(c.received), 1)
+    self.assertTrue(isinstance(c.last, ofp_packet_in))
+    self.assertEqual(c.last.in_port, 3)
+
+  def test_compiled_actions(self):
+    s = self.switch
+    sent = []
+    s.addListener(DpPacketOut,
+                  lambda(event): sent.append((event.port.port_no, event.data)))
+
+    def ip (proto, payload, **kw):
+      return ipv4(srcip=IPAddr("1.2.3.4"), dstip=IPAddr("5.6.7.8"),
+                  protocol=proto, payload=payload, **kw)
+    def eth (payload, type=ethernet.IP_TYPE):
+      return ethernet(src=EthAddr("00:00:00:00:00:01"),
+                      dst=EthAddr("00:00:00:00:00:02"), type=type,
+                      payload=payload)
+    packets = [
+      eth(ip(ipv4.UDP_PROTOCOL, udp(srcport=1234, dstport=53, payload="x"))),
+      eth(ip(ipv4.TCP_PROTOCOL, tcp(srcport=80, dstport=4321, off=5,
+                                    seq=99, payload="hello"))),
+      eth(ip(ipv4.ICMP_PROTOCOL, icmp(type=8, payload="ping"), tos=4)),
+      eth(vlan(id=7, pcp=2, eth_type=ethernet.IP_TYPE,
+               payload=ip(ipv4.UDP_PROTOCOL, udp(srcport=1, dstport=2))),
+          type=ethernet.VLAN_TYPE),
+      eth(arp(protosrc=IPAddr("1.2.3.4")), type=ethernet.ARP_TYPE),
+    ]
+    action_lists = [
+      [ofp_action_output(port=2)],
+      [ofp_action_nw_addr.set_src(IPAddr("9.8.7.6")),
+       ofp_action_nw_addr.set_dst(IPAddr("10.0.0.1")),
+       ofp_action_output(port=2)],
+      [ofp_action_tp_port.set_src(1), ofp_action_output(port=2),
+       ofp_action_tp_port.set_dst(65535), ofp_action_output(port=3)],
+      [ofp_action_nw_tos(nw_tos=0x20), ofp_action_output(port=2)],
+      [ofp_action_dl_addr.set_src(EthAddr("00:00:00:00:00:09")),
+       ofp_action_dl_addr.set_dst(EthAddr("00:00:00:00:00:0a")),
+       ofp_action_output(port=2)],
+      [ofp_action_vlan_vid(vlan_vid=42), ofp_action_output(port=2),
+       ofp_action_vlan_pcp(vlan_pcp=5), ofp_action_output(port=3),
+       ofp_action_strip_vlan(), ofp_action_output(port=4)],
+    ]
+    for actions in action_lists:
+      program = s._compile_actions(actions)
+      self.assertTrue(program)
+      for packet in packets:
+        data = packet.pack()
+        del sent[:]
+        s._process_actions_for_packet(actions, ethernet(data), 1)
+        expected = [(port, ethernet(d).pack()) for port,d in sent]
+        del sent[:]
+        s._run_program(program, data, 1)
+        self.assertEqual(sent, expected)
+
+    # Compiled programs get rebuilt on MODIFY
+    c = self.conn
+    self.packet.type = ethernet.IP_TYPE
+    data = self.packet.pack()
+    c.to_switch(ofp_flow_mod(match=ofp_match(), priority=1,
+                             actions=[ofp_action_output(port=2)]))
+    entry = s.table.entries[0]
+    self.assertTrue(entry.program)
+    c.to_switch(ofp_flow_mod(command=OFPFC_MODIFY, match=ofp_match(),
+                             actions=[ofp_action_output(port=3)]))
+    self.assertTrue(entry.program)
+    del sent[:]
+    s.rx_packet(self.packet, 1, data)
+    self.assertEqual(sent, [(3, data)])
+
+    # Enqueue can't be compiled
+    self.assertFalse(s._compile_actions([ofp_action_enqueue(port=2)]))
+
+  def test_buffer_pool(self):
+    c = self.conn
+    s = SoftwareSwitch(1, name="sw2", max_buffers=2)
+    s.set_connection(c)
+    c.to_switch(ofp_features_request(xid=1))
+    self.assertEqual(c.last.n_buffers, 2)
+
+    buffer_ids = []
+    for i in range(3):
+      s.rx_packet(self.packet, in_port=1)
+      buffer_ids.append(c.last.buffer_id)
+    self.assertEqual(len(set(buffer_ids)), 3)
+
+    # The first one got evicted
+    c.to_switch(ofp_packet_out(buffer_id=buffer_ids[0], xid=7,
+                               actions=[ofp_action_output(port=2)]))
+    self.assertTrue(isinstance(c.last, ofp_error))
+    self.assertEqual((c.last.type, c.last.code, c.last.xid),
+                     (OFPET_BAD_REQUEST, OFPBRC_BUFFER_UNKNOWN, 7))
+
+    c.to_switch(ofp_packet_out(buffer_id=buffer_ids[2], xid=8,
+                               actions=[ofp_action_output(port=2)]))
+    self.assertEqual(c.last.xid, 7)
+    c.to_switch(ofp_packet_out(buffer_id=buffer_ids[2], xid=9,
+                               actions=[ofp_action_output(port=2)]))
+    self.assertEqual((c.last.code, c.last.xid), (OFPBRC_BUFFER_EMPTY, 9))
+
   def test_delete_port(self):
     c = self.conn
     s = self.switch
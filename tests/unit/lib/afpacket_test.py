@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import time
+import socket
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.lib.afpacket as afpacket
+
+
+def _can_open ():
+  if not afpacket.enabled: return False
+  try:
+    socket.socket(socket.AF_PACKET, socket.SOCK_RAW).close()
+  except socket.error:
+    return False
+  return True
+
+
+@unittest.skipUnless(_can_open(), "requires AF_PACKET and CAP_NET_RAW")
+class PacketRingTest (unittest.TestCase):
+  def test_loopback (self):
+    # Rings on the loopback device see each other's transmissions
+    rx = afpacket.PacketRing("lo", start=False, promiscuous=False,
+                             block_size=1<<16, block_count=4, block_timeout=1)
+    tx = afpacket.PacketRing("lo", start=False, promiscuous=False,
+                             block_size=1<<16, block_count=4)
+    try:
+      packets = [b'\x00' * 12 + b'\x88\xb5' + chr(i) * (50 + i)
+                 for i in range(100)]
+      tx.inject_many(packets[:50])
+      for p in packets[50:]:
+        tx.inject(p)
+
+      got = []
+      end = time.time() + 5
+      while time.time() < end:
+        block = rx.read_block(0.2)
+        if block: got.extend(p for p in block if p[12:14] == b'\x88\xb5')
+        if len(got) >= len(packets): break
+      # Each one shows up once (the outgoing copy is filtered out)
+      self.assertEqual(got, packets)
+    finally:
+      rx.close()
+      tx.close()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import tempfile
+from array import array
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.lib.pxpcap as pxpcap
+from pox.lib.pxpcap.writer import PCapRawWriter
+
+
+class BatchTest (unittest.TestCase):
+  def test_split (self):
+    data = b'aabbbc'
+    records = array('I', [0, 2, 10, 1, 60,
+                          2, 3, 10, 2, 3,
+                          5, 1, 11, 0, 1])
+    self.assertEqual(pxpcap.split_batch(data, records), ['aa','bbb','c'])
+    self.assertEqual(list(pxpcap.iter_batch(data, records)),
+                     [('aa',10,1,60), ('bbb',10,2,3), ('c',11,0,1)])
+
+  def test_empty (self):
+    self.assertEqual(pxpcap.split_batch(b'', array('I')), [])
+
+  @unittest.skipUnless(pxpcap.enabled, "requires pxpcap")
+  def test_offline (self):
+    fd,filename = tempfile.mkstemp(suffix=".pcap")
+    try:
+      with os.fdopen(fd, "wb") as f:
+        w = PCapRawWriter(f)
+        for i in range(5):
+          w.write(chr(ord('a') + i) * (i + 1), time = 100 + i)
+      p = pxpcap.PCap(start = False, batch_size = 2)
+      p.open_offline(filename)
+      got = []
+      while True:
+        data,records,rv = p.next_batch()
+        if rv <= 0: break
+        self.assertLessEqual(rv, 2)
+        got.extend(pxpcap.iter_batch(data, records))
+      p.close()
+      self.assertEqual([g[0] for g in got], ['a','bb','ccc','dddd','eeeee'])
+      self.assertEqual([g[1] for g in got], range(100, 105))
+    finally:
+      os.unlink(filename)
@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import time
+import socket
+from Queue import Queue
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from pox.lib.recoco import Scheduler, BaseTask, Select, Sleep, Timer
+
+
+class SpinTask (BaseTask):
+  """
+  Records each slice it gets and immediately yields again
+  """
+  def __init__ (self, name, log, priority = 1):
+    BaseTask.__init__(self)
+    self.name = name
+    self.log = log
+    self.priority = priority
+
+  def run (self):
+    while True:
+      self.log.append(self.name)
+      yield 0
+
+
+class GenTask (BaseTask):
+  """
+  Runs a generator function as a task
+  """
+  def __init__ (self, func):
+    self.func = func
+    BaseTask.__init__(self)
+
+  def run (self):
+    return self.func()
+
+
+class SchedulerTest (unittest.TestCase):
+  def setUp (self):
+    self.sched = Scheduler(isDefaultScheduler=False, startInThread=False)
+    self.log = []
+
+  def tearDown (self):
+    self.sched.quit()
+    self.sched._selectHub._cycle()
+
+  def _run (self, cycles):
+    for i in range(cycles):
+      self.sched.cycle()
+
+  def test_equal_priorities (self):
+    for n in "abc":
+      SpinTask(n, self.log).start(self.sched, fast=True)
+    self._run(9)
+    self.assertEqual("".join(self.log), "abcabcabc")
+
+  def test_proportional (self):
+    SpinTask("h", self.log, 1).start(self.sched, fast=True)
+    SpinTask("l", self.log, 0.25).start(self.sched, fast=True)
+    self._run(500)
+    self.assertEqual(self.log.count("h"), 400)
+    self.assertEqual(self.log.count("l"), 100)
+    # Shares are per task, not per priority level
+    SpinTask("h", self.log, 1).start(self.sched, fast=True)
+    del self.log[:]
+    self._run(900)
+    self.assertEqual(self.log.count("h"), 800)
+    self.assertEqual(self.log.count("l"), 100)
+
+  def test_above_one (self):
+    # Priorities above 1 get the same share as 1
+    SpinTask("h", self.log, 4).start(self.sched, fast=True)
+    SpinTask("n", self.log, 1).start(self.sched, fast=True)
+    SpinTask("l", self.log, 0.5).start(self.sched, fast=True)
+    self._run(500)
+    self.assertEqual(self.log.count("h"), 200)
+    self.assertEqual(self.log.count("n"), 200)
+    self.assertEqual(self.log.count("l"), 100)
+    self.assertEqual(sorted(self.sched.priority_stats()), [0.5, 1])
+
+  def test_background (self):
+    SpinTask("bg", self.log, 0).start(self.sched, fast=True)
+    fg = SpinTask("fg", self.log)
+    fg.start(self.sched, fast=True)
+    self._run(10)
+    self.assertEqual(self.log, ["fg"] * 10)
+
+  def test_schedule_once (self):
+    t = SpinTask("a", self.log)
+    self.assertTrue(self.sched._schedule_once(t))
+    self.assertFalse(self.sched._schedule_once(t))
+    self._run(3)
+    self.assertEqual(self.log, ["a"] * 3)
+    self.assertEqual(self.sched.priority_stats()[1]['slices'], 3)
+
+  def test_first (self):
+    SpinTask("a", self.log).start(self.sched, fast=True)
+    SpinTask("b", self.log).start(self.sched, fast=True)
+    self.sched._enqueue(SpinTask("c", self.log), first=True)
+    self._run(3)
+    self.assertEqual(self.log, ["c", "a", "b"])
+
+
+class ProfileTest (unittest.TestCase):
+  def setUp (self):
+    self.sched = Scheduler(isDefaultScheduler=False, startInThread=False)
+    self.log = []
+
+  def tearDown (self):
+    self.sched.quit()
+    self.sched._selectHub._cycle()
+
+  def _run (self, cycles):
+    for i in range(cycles):
+      self.sched.cycle()
+
+  def test_task_stats (self):
+    profile = self.sched.enable_profiling(depth_interval=0)
+    SpinTask("a", self.log).start(self.sched, fast=True)
+    SpinTask("b", self.log).start(self.sched, fast=True)
+    def short ():
+      yield 0
+    GenTask(short).start(self.sched, fast=True)
+    self._run(10)
+    tasks = dict((t['name'], t) for t in profile.task_stats())
+    self.assertEqual(tasks['GenTask (finished)']['slices'], 2)
+    self.assertEqual(sorted(t['slices'] for t in tasks.values()), [2, 4, 4])
+    self.assertEqual(profile.slices, 10)
+    self.assertEqual(len(profile.depth_history), 10)
+    # Sampled as a slice ends, so the task that ran isn't counted
+    self.assertEqual(profile.depth_history[-1][1], 1)
+
+    profile.reset()
+    self.assertEqual(profile.task_stats(), [])
+    self.sched.disable_profiling()
+    self._run(2)
+    self.assertEqual(profile.slices, 0)
+
+  def test_slow_slice (self):
+    import logging
+    records = []
+    class Handler (logging.Handler):
+      def emit (self, record):
+        records.append(record.getMessage())
+    handler = Handler()
+    logging.getLogger("recoco").addHandler(handler)
+    try:
+      profile = self.sched.enable_profiling(slow_slice=0.05)
+      def slow ():
+        yield 0
+        time.sleep(0.06)
+        yield 0
+      GenTask(slow).start(self.sched, fast=True)
+      self._run(3)
+    finally:
+      logging.getLogger("recoco").removeHandler(handler)
+    self.assertEqual(profile.slow, 1)
+    self.assertEqual(len(records), 1)
+    self.assertIn("in slow", records[0])
+
+
+class SelectHubTest (unittest.TestCase):
+  use_epoll = True
+  threaded = True
+
+  def setUp (self):
+    self.sched = Scheduler(isDefaultScheduler=False, daemon=True,
+                           useEpoll=self.use_epoll,
+                           threadedSelectHub=self.threaded)
+    self.out = Queue()
+
+  def tearDown (self):
+    self.sched.quit()
+    self.sched._selectHub._cycle()
+
+  def _start (self, gen):
+    GenTask(gen).start(self.sched)
+
+  def _get (self):
+    return self.out.get(timeout=5)
+
+  def test_sleep_order (self):
+    def sleeper (n, t):
+      yield Sleep(t)
+      self.out.put(n)
+    for n,t in ((3, 0.3), (1, 0.1), (2, 0.2), (0, 0)):
+      self._start(lambda n=n,t=t: sleeper(n, t))
+    self.assertEqual([self._get() for i in range(4)], [0, 1, 2, 3])
+
+  def test_select (self):
+    a,b = socket.socketpair()
+    def reader ():
+      while True:
+        r,w,x = yield Select([b], [], [b], 5)
+        if not r:
+          self.out.put(None)
+          continue
+        d = b.recv(100)
+        self.out.put(d)
+        if not d: break
+    self._start(reader)
+    for msg in ("one", "two", "three"):
+      a.send(msg)
+      self.assertEqual(self._get(), msg)
+    a.close()
+    self.assertEqual(self._get(), "")
+    b.close()
+
+  def test_timeout (self):
+    a,b = socket.socketpair()
+    def waiter ():
+      r,w,x = yield Select([b], [], [], 0.1)
+      self.out.put((r,w,x))
+    self._start(waiter)
+    self.assertEqual(self._get(), ([],[],[]))
+    a.close()
+    b.close()
+
+  def test_ready_while_busy (self):
+    # b becomes readable while the task isn't selecting on it, and the
+    # task then selects on something else for a while.
+    a,b = socket.socketpair()
+    c,d = socket.socketpair()
+    def task ():
+      r,w,x = yield Select([b], [], [])
+      self.out.put(b.recv(100))
+      r,w,x = yield Select([d], [], [], 0.3)
+      self.out.put(r)
+      r,w,x = yield Select([b], [], [])
+      self.out.put(b.recv(100))
+    self._start(task)
+    a.send("x")
+    self.assertEqual(self._get(), "x")
+    a.send("y")
+    self.assertEqual(self._get(), [])
+    self.assertEqual(self._get(), "y")
+    for s in (a,b,c,d): s.close()
+
+  def test_shared_fd (self):
+    # Both tasks waiting on the same fd get woken
+    a,b = socket.socketpair()
+    def waiter (n):
+      r,w,x = yield Select([b], [], [], 3)
+      self.out.put((n, bool(r)))
+    self._start(lambda: waiter(1))
+    time.sleep(0.1)
+    self._start(lambda: waiter(2))
+    time.sleep(0.1)
+    a.send("x")
+    start = time.time()
+    self.assertEqual(sorted([self._get(), self._get()]),
+                     [(1, True), (2, True)])
+    self.assertLess(time.time() - start, 1)
+    for s in (a,b): s.close()
+
+  def test_closed (self):
+    a,b = socket.socketpair()
+    b.close()
+    def task ():
+      r,w,x = yield Select([b], [], [b], 5)
+      self.out.put(len(r) + len(x))
+    self._start(task)
+    self.assertTrue(self._get())
+    a.close()
+
+
+class SelectHubSelectTest (SelectHubTest):
+  use_epoll = False
+
+
+class InlineSelectHubTest (SelectHubTest):
+  threaded = False
+
+  def test_busy (self):
+    # A task which never waits mustn't keep I/O from being noticed
+    a,b = socket.socketpair()
+    def spinner ():
+      while True:
+        yield 0
+    def reader ():
+      r,w,x = yield Select([b], [], [], 5)
+      self.out.put(b.recv(100))
+    self._start(spinner)
+    self._start(reader)
+    a.send("x")
+    self.assertEqual(self._get(), "x")
+    a.close()
+    b.close()
+
+
+class InlineSelectHubSelectTest (InlineSelectHubTest):
+  use_epoll = False
+
+
+class TimerWheelTest (unittest.TestCase):
+  def setUp (self):
+    # The scheduler never runs, so the wheel is only advanced by hand
+    self.sched = Scheduler(isDefaultScheduler=False, startInThread=False)
+    self.wheel = self.sched.timers
+    self.base = self.wheel._now * self.wheel.tick
+
+  def tearDown (self):
+    self.sched.quit()
+    self.sched._selectHub._cycle()
+
+  def _timer (self, offset):
+    return Timer(self.base + offset, None, absoluteTime=True,
+                 scheduler=self.sched)
+
+  def test_levels (self):
+    # One in each level of the wheel and one past the top
+    offsets = [0.05, 0.5, 30, 2000, 200000, 2000000]
+    timers = dict((self._timer(o), o) for o in offsets)
+    self.assertEqual(len(self.wheel), len(offsets))
+    got = []
+    for o in offsets:
+      self.assertEqual(self.wheel._advance(self.base + o - 0.02), [])
+      due = self.wheel._advance(self.base + o)
+      self.assertEqual([timers[t] for t in due], [o])
+      got.extend(due)
+    self.assertEqual(len(got), len(offsets))
+
+  def test_next_wake (self):
+    self.assertEqual(self.wheel._next_wake(), None)
+    self._timer(0.5)
+    tick = self.wheel._next_wake()
+    self.assertAlmostEqual(tick * self.wheel.tick, self.base + 0.5)
+
+  def test_cancel (self):
+    a = self._timer(1)
+    b = self._timer(1)
+    a.cancel()
+    self.assertEqual(len(self.wheel), 1)
+    due = self.wheel._advance(self.base + 1)
+    self.assertEqual([t for t in due if not t._cancelled], [b])
+
+
+class TimerTest (unittest.TestCase):
+  threaded = True
+
+  def setUp (self):
+    self.sched = Scheduler(isDefaultScheduler=False, daemon=True,
+                           threadedSelectHub=self.threaded)
+    self.out = Queue()
+
+  def tearDown (self):
+    self.sched.quit()
+    self.sched._selectHub._cycle()
+
+  def test_fire (self):
+    Timer(0.1, self.out.put, args=("b",), scheduler=self.sched)
+    Timer(0.05, self.out.put, args=("a",), scheduler=self.sched)
+    t = Timer(0.07, self.out.put, args=("x",), scheduler=self.sched)
+    t.cancel()
+    self.assertEqual(self.out.get(timeout=5), "a")
+    self.assertEqual(self.out.get(timeout=5), "b")
+    stats = self.sched.timers.stats()
+    self.assertEqual(stats['fired'], 2)
+    self.assertEqual(stats['pending'], 0)
+
+  def test_recurring (self):
+    n = [0]
+    def cb ():
+      n[0] += 1
+      self.out.put(n[0])
+      if n[0] == 3: return False
+    Timer(0.02, cb, recurring=True, scheduler=self.sched)
+    self.assertEqual([self.out.get(timeout=5) for i in range(3)], [1,2,3])
+
+
+class InlineTimerTest (TimerTest):
+  threaded = False
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from pox.lib.revent import *
+
+
+class Ping (Event):
+  def __init__ (self, n = 0):
+    Event.__init__(self)
+    self.n = n
+
+class Pong (Event):
+  pass
+
+class Wrapped (Event):
+  def __init__ (self, value):
+    Event.__init__(self)
+    self.value = value
+
+  def _invoke (self, handler, *args, **kw):
+    return handler(self.value, *args, **kw)
+
+
+class Packet (Event):
+  _filter_fields = (('kind', None), ('port', int))
+
+  def __init__ (self, kind, port):
+    Event.__init__(self)
+    self.kind = kind
+    self.port = port
+
+
+class Source (EventMixin):
+  _eventMixin_events = set([Ping, Pong, Wrapped, Packet])
+
+
+class RaiseTest (unittest.TestCase):
+  def setUp (self):
+    self.source = Source()
+    self.log = []
+
+  def _listen (self, name, rv = None, **kw):
+    def handler (event):
+      self.log.append(name)
+      return rv
+    return self.source.addListener(Ping, handler, **kw)
+
+  def test_no_listeners (self):
+    self.assertIsNone(self.source.raiseEvent(Ping, 1))
+    e = self.source.raiseEvent(Ping(1))
+    self.assertIs(e.source, self.source)
+
+  def test_undefined (self):
+    class Other (Event): pass
+    self.assertRaises(RuntimeError, self.source.raiseEvent, Other())
+
+  def test_order (self):
+    self._listen("a")
+    self._listen("b", priority=1)
+    self._listen("c")
+    e = self.source.raiseEvent(Ping, 5)
+    self.assertEqual(e.n, 5)
+    self.assertEqual(self.log, ["b", "a", "c"])
+
+  def test_changes (self):
+    # The cached handlers must follow additions and removals
+    a = self._listen("a")
+    self.source.raiseEvent(Ping)
+    b = self._listen("b")
+    self.source.raiseEvent(Ping)
+    self.source.removeListener(a)
+    self.source.raiseEvent(Ping)
+    self.source.clearHandlers()
+    self.assertIsNone(self.source.raiseEvent(Ping))
+    self.assertEqual(self.log, ["a", "a", "b", "b"])
+
+  def test_once (self):
+    self._listen("a", once=True)
+    self._listen("b")
+    self.source.raiseEvent(Ping)
+    self.source.raiseEvent(Ping)
+    self.assertEqual(self.log, ["a", "b", "b"])
+
+  def test_return_values (self):
+    self._listen("remove", rv=EventRemove)
+    self._listen("false", rv=False)
+    self._listen("halt", rv=EventHalt)
+    self._listen("never")
+    e = self.source.raiseEvent(Ping)
+    self.assertTrue(e.halt)
+    e = self.source.raiseEvent(Ping)
+    self.assertEqual(self.log, ["remove", "false", "halt", "halt"])
+
+  def test_add_while_raising (self):
+    def handler (event):
+      self.log.append("a")
+      self._listen("b")
+    self.source.addListener(Ping, handler)
+    self.source.raiseEvent(Ping)
+    self.assertEqual(self.log, ["a"])
+    self.source.raiseEvent(Ping)
+    self.assertEqual(self.log, ["a", "a", "b"])
+
+  def test_invoke (self):
+    got = []
+    self.source.addListener(Wrapped, got.append)
+    self.source.raiseEvent(Wrapped, "x")
+    self.assertEqual(got, ["x"])
+
+  def test_by_name (self):
+    got = []
+    self.source.addListenerByName("Pong", got.append)
+    self.source.raiseEvent(Pong)
+    self.assertEqual(len(got), 1)
+
+  def test_remove_by_eid (self):
+    t,eid = self._listen("a")
+    self._listen("b")
+    self.assertTrue(self.source.removeListener(eid, Ping))
+    self.assertFalse(self.source.removeListener(eid, Ping))
+    self.source.raiseEvent(Ping)
+    self.assertEqual(self.log, ["b"])
+
+
+class FilterTest (unittest.TestCase):
+  def setUp (self):
+    self.source = Source()
+    self.log = []
+
+  def _listen (self, name, filter = None, **kw):
+    def handler (event):
+      self.log.append(name)
+    return self.source.addListener(Packet, handler, filter=filter, **kw)
+
+  def _raise (self, kind, port):
+    del self.log[:]
+    self.source.raiseEvent(Packet, kind, port)
+    return list(self.log)
+
+  def test_filters (self):
+    self._listen("all")
+    self._listen("arp", {'kind':'arp'})
+    self._listen("ip80", {'kind':'ip', 'port':"80"})
+    self._listen("web", {'port':[80, 443]})
+    self.assertEqual(self._raise('arp', 0), ["all", "arp"])
+    self.assertEqual(self._raise('ip', 80), ["all", "ip80", "web"])
+    self.assertEqual(self._raise('ip', 443), ["all", "web"])
+    self.assertEqual(self._raise('lldp', 1), ["all"])
+
+  def test_priority (self):
+    self._listen("a", {'kind':'arp'})
+    self._listen("b", priority=1)
+    self._listen("c", {'port':1}, priority=2)
+    self._listen("d")
+    self.assertEqual(self._raise('arp', 1), ["c", "b", "a", "d"])
+
+  def test_only_filtered (self):
+    got = []
+    self.source.addListener(Packet, got.append, filter={'kind':'arp'})
+    self.source.raiseEvent(Packet, 'ip', 1)
+    self.assertEqual(got, [])
+    self.source.raiseEvent(Packet, 'arp', 1)
+    self.assertEqual(len(got), 1)
+
+  def test_bad_filter (self):
+    self.assertRaises(RuntimeError, self._listen, "x", {'color':'red'})
+    self.assertRaises(RuntimeError, self.source.addListener, Ping,
+                      lambda e: None, filter={'n':1})
+
+  def test_add_listeners (self):
+    class Sink (object):
+      def __init__ (self):
+        self.got = []
+      def _handle_Packet (self, event):
+        self.got.append(event.kind)
+      def _handle_Pong (self, event):
+        self.got.append("pong")
+    sink = Sink()
+    self.source.addListeners(sink, filters={'Packet':{'kind':'arp'}})
+    self.source.raiseEvent(Packet, 'ip', 1)
+    self.source.raiseEvent(Packet, 'arp', 1)
+    self.source.raiseEvent(Pong)
+    self.assertEqual(sink.got, ["arp", "pong"])
+
+
+class ProfileTest (unittest.TestCase):
+  def setUp (self):
+    self.source = Source()
+
+  def tearDown (self):
+    disable_handler_profiling()
+
+  def test_profile (self):
+    class Sink (object):
+      def _handle_Ping (self, event):
+        if event.n < 0: raise RuntimeError("negative")
+      def _handle_Pong (self, event):
+        pass
+    self.source.addListeners(Sink())
+    self.source.raiseEvent(Ping, 1) # Compiled before profiling starts
+    profile = enable_handler_profiling()
+    self.source.raiseEvent(Ping, 1)
+    self.source.raiseEvent(Ping, 2)
+    self.assertRaises(RuntimeError, self.source.raiseEvent, Ping, -1)
+    self.source.raiseEvent(Pong)
+    stats = dict((h['handler'], h) for h in profile.handler_stats())
+    ping = stats['Sink._handle_Ping']
+    self.assertEqual((ping['source'], ping['event']), ('Source', 'Ping'))
+    self.assertEqual(ping['calls'], 3)
+    self.assertEqual(ping['exceptions'], 1)
+    self.assertEqual(stats['Sink._handle_Pong']['calls'], 1)
+    self.assertIn("Sink._handle_Ping", profile.report())
+    self.assertEqual(profile.stats()['calls'], 4)
+
+    profile.reset()
+    self.assertEqual(profile.handler_stats(), [])
+    disable_handler_profiling()
+    self.source.raiseEvent(Ping, 1)
+    self.assertEqual(profile.handler_stats(), [])
+    # Back to calling handlers directly
+    d = self.source._eventMixin_dispatch[Ping]
+    self.assertEqual(d.handlers[0][0].__name__, "_handle_Ping")
@@ -111,6 +111,177 @@ class FlowTableTest(unittest.TestCase):
       t.remove_expired_entries(now=time)
       self.assertEqual(sorted([e.cookie for e in t.entries]), remaining)
 
+  def test_expiry_reasons(self):
+    """ test that expiry only visits due entries and reports reasons """
+    t = FlowTable()
+    events = []
+    t.addListener(FlowTableModification, events.append)
+    idle = TableEntry(now=0, cookie=1, idle_timeout=5)
+    hard = TableEntry(now=0, cookie=2, idle_timeout=5, hard_timeout=8)
+    removed = TableEntry(now=0, cookie=3, hard_timeout=2)
+    for e in (idle, hard, removed):
+      t.add_entry(e)
+    for i in range(1000):
+      t.add_entry(TableEntry(now=0, cookie=100, hard_timeout=1000))
+    t.remove_entry(removed)
+    del events[:]
+
+    checked = []
+    is_idle_timed_out = TableEntry.is_idle_timed_out
+    def spy(self, now=None):
+      checked.append(self)
+      return is_idle_timed_out(self, now)
+    TableEntry.is_idle_timed_out = spy
+    try:
+      hard.touch_packet(1, now=4)
+      t.remove_expired_entries(now=6)
+      self.assertEqual(len(checked), 2) # idle and hard only
+      self.assertEqual([(e.removed, e.reason) for e in events],
+                       [([idle], OFPRR_IDLE_TIMEOUT)])
+      del events[:]
+      del checked[:]
+      t.remove_expired_entries(now=7)
+      self.assertEqual(checked, [])
+      t.remove_expired_entries(now=8.5)
+      self.assertEqual([(e.removed, e.reason) for e in events],
+                       [([hard], OFPRR_HARD_TIMEOUT)])
+    finally:
+      TableEntry.is_idle_timed_out = is_idle_timed_out
+    self.assertEqual(len(t), 1000)
+    t.remove_expired_entries(now=1001)
+    self.assertEqual(len(t), 0)
+
+  def test_entry_for_packet(self):
+    """ test that the classifier agrees with a linear scan of the table """
+    import random
+    from pox.lib.packet import ethernet, ipv4, tcp, udp
+    rand = random.Random(42)
+    macs = [EthAddr("00:00:00:00:00:0%i" % i) for i in range(1,4)]
+
+    def packet():
+      if rand.random() < 0.5:
+        l4 = tcp(srcport=rand.choice([1000,2000]), dstport=rand.choice([80,22]))
+        l4.off = 5
+        proto = ipv4.TCP_PROTOCOL
+      else:
+        l4 = udp(srcport=rand.choice([1000,2000]), dstport=rand.choice([53,67]))
+        proto = ipv4.UDP_PROTOCOL
+      src = "10.0.%i.%i" % (rand.randint(0,2), rand.randint(1,3))
+      ip = ipv4(srcip=IPAddr(src),
+                dstip=IPAddr("10.1.0.%i" % rand.randint(1,3)),
+                protocol=proto, next=l4)
+      eth = ethernet(src=rand.choice(macs), dst=rand.choice(macs),
+                     type=ethernet.IP_TYPE, next=ip)
+      if rand.random() < 0.1:
+        eth = ethernet(src=rand.choice(macs), dst=rand.choice(macs),
+                       type=0x88cc, next=b'x' * 10)
+      return eth.pack(), rand.randint(1,3)
+
+    def entry():
+      if rand.random() < 0.2:
+        data,in_port = packet()
+        m = ofp_match.from_raw(data, in_port, spec_frags=True)
+      else:
+        m = ofp_match()
+        if rand.random() < 0.3: m.in_port = rand.randint(1,3)
+        if rand.random() < 0.3: m.dl_src = rand.choice(macs)
+        if rand.random() < 0.3: m.dl_dst = rand.choice(macs)
+        if rand.random() < 0.5: m.dl_type = ethernet.IP_TYPE
+        if rand.random() < 0.3: m.nw_proto = rand.choice([6,17])
+        if rand.random() < 0.4:
+          m.set_nw_src(IPAddr("10.0.%i.%i" % (rand.randint(0,2),
+                                              rand.randint(1,3))),
+                       rand.choice([8,16,24,31,32]))
+        if rand.random() < 0.2:
+          m.nw_dst = rand.choice(["10.0.0.0/8", "10.1.0.0/24"])
+        if rand.random() < 0.3: m.tp_dst = rand.choice([80,22,53,67])
+      return TableEntry(priority=rand.choice([0,1,5,5,10,100,65535]), match=m)
+
+    def linear(t, data, in_port):
+      pm = ofp_match.from_raw(data, in_port, spec_frags=True)
+      for e in t._table:
+        if e.match.matches_with_wildcards(pm, consider_other_wildcards=False):
+          return e
+      return None
+
+    t = FlowTable()
+    for i in range(300):
+      t.add_entry(entry())
+    for round in range(5):
+      for i in range(200):
+        data,in_port = packet()
+        self.assertTrue(t.entry_for_packet(data, in_port)
+                        is linear(t, data, in_port))
+      # Churn the table
+      for e in rand.sample(t.entries, 30):
+        t.remove_entry(e)
+      t._remove_specific_entries(rand.sample(t.entries, 30))
+      t.remove_matching_entries(ofp_match(tp_dst=rand.choice([80,22])))
+      for i in range(80):
+        t.add_entry(entry())
+
+    t.remove_matching_entries(ofp_match())
+    self.assertEqual(len(t), 0)
+    self.assertEqual(t._exact, {})
+    self.assertEqual(t._groups, {})
+    self.assertEqual(t.entry_for_packet(packet()[0], 1), None)
+
+  def test_matching_entries_indexed(self):
+    """ test that the indexes agree with checking every entry """
+    import random
+    rand = random.Random(7)
+    macs = [EthAddr("00:00:00:00:00:0%i" % i) for i in range(1,4)]
+
+    def match():
+      m = ofp_match()
+      if rand.random() < 0.3: m.in_port = rand.randint(1,3)
+      if rand.random() < 0.3: m.dl_dst = rand.choice(macs)
+      if rand.random() < 0.5: m.dl_type = 0x800
+      if rand.random() < 0.3: m.tp_dst = rand.choice([80,22])
+      if rand.random() < 0.4:
+        m.set_nw_src(IPAddr("10.%i.%i.0" % (rand.randint(0,1),
+                                            rand.randint(0,2))),
+                     rand.choice([8,16,24,32]))
+      if rand.random() < 0.3:
+        m.nw_dst = rand.choice(["10.0.0.0/8", "10.1.0.0/16", "10.1.0.1"])
+      return m
+
+    def entry():
+      actions = [ofp_action_output(port=p)
+                 for p in rand.sample(range(1,6), rand.randint(0,2))]
+      return TableEntry(priority=rand.choice([1,5,10]), match=match(),
+                        cookie=rand.randint(0,3), actions=actions)
+
+    def linear(t, m, priority, strict, out_port, cookie):
+      return [e for e in t._table
+              if e.is_matched_by(m, priority, strict, out_port)
+              and (cookie is None or e.cookie == cookie)]
+
+    t = FlowTable()
+    for i in range(400):
+      t.add_entry(entry())
+    for i in range(500):
+      if rand.random() < 0.3:
+        # Use an existing entry's match, so strict ones find something
+        e = rand.choice(t.entries)
+        m,priority = e.match,e.priority
+      else:
+        m,priority = match(),rand.choice([1,5,10])
+      strict = rand.random() < 0.3
+      out_port = rand.choice([None, None, 1, 2])
+      cookie = rand.choice([None, None, None, 1])
+      self.assertEqual(t.matching_entries(m, priority, strict, out_port,
+                                          cookie),
+                       linear(t, m, priority, strict, out_port, cookie))
+      if rand.random() < 0.1:
+        # Changing actions has to keep the port index right
+        for e in rand.sample(t.entries, 5):
+          t.modify_entry(e, [ofp_action_output(port=rand.randint(1,5))])
+      if rand.random() < 0.05:
+        t.remove_matching_entries(m, priority, strict, out_port)
+        for j in range(20):
+          t.add_entry(entry())
+
   # def test_check_for_overlap_entries(self):
 
 
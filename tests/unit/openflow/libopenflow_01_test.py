@@ -355,5 +355,38 @@ class ofp_action_test(unittest.TestCase):
 #    c(ofp_action_mpls_tc, OFPAT_SET_MPLS_TC, {'mpls_tc': 0xac}, 8)
 #    c(ofp_action_mpls_ttl, OFPAT_SET_MPLS_TTL, {'mpls_ttl': 0xaf}, 8)
 
+class ofp_struct_test(unittest.TestCase):
+  """ round trips for the fixed-layout structures and stats bodies """
+  def check(self, o, *args):
+    packed = o.pack()
+    self.assertEqual(len(packed), len(o))
+    u = type(o)()
+    u.unpack(packed, 0, *args)
+    self.assertEqual(u, o)
+    self.assertEqual(u.pack(), packed)
+
+  def test_phy_port(self):
+    self.check(ofp_phy_port(port_no=3, hw_addr=EthAddr("01:02:03:04:05:06"),
+                            name="eth3", config=1, state=2, curr=3,
+                            advertised=4, supported=5, peer=6))
+
+  def test_stats_bodies(self):
+    match = ofp_match(dl_type=0x800, nw_proto=6, nw_src="10.0.0.0/8",
+                      tp_dst=80)
+    for o in (ofp_flow_stats_request(match=match, table_id=1, out_port=2),
+              ofp_aggregate_stats_request(match=match, out_port=3),
+              ofp_flow_stats(match=match, priority=4, cookie=5,
+                             packet_count=6, byte_count=7,
+                             actions=[ofp_action_output(port=1)]),
+              ofp_aggregate_stats(packet_count=1, byte_count=2,
+                                  flow_count=3),
+              ofp_table_stats(table_id=1, name="table", max_entries=9,
+                              lookup_count=1 << 40),
+              ofp_port_stats_request(port_no=4),
+              ofp_port_stats(port_no=4, rx_packets=1, collisions=2),
+              ofp_queue_stats_request(port_no=4, queue_id=5),
+              ofp_queue_stats(port_no=4, queue_id=5, tx_errors=6)):
+      self.check(o, len(o))
+
 if __name__ == '__main__':
   unittest.main()
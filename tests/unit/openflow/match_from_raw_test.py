@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import struct
+from StringIO import StringIO
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.openflow.libopenflow_01 as of
+from pox.lib.packet import *
+from pox.lib.addresses import EthAddr, IPAddr
+from pox.lib.pxpcap.writer import PCapRawWriter
+from pox.lib.pxpcap.parser import PCapParser
+
+
+def _eth (next, type):
+  return ethernet(src=EthAddr("00:00:00:00:00:01"),
+                  dst=EthAddr("00:00:00:00:00:02"), type=type, next=next)
+
+def _ip (protocol, next, **kw):
+  return ipv4(srcip=IPAddr("10.0.0.1"), dstip=IPAddr("10.0.0.2"),
+              protocol=protocol, next=next, **kw)
+
+def _set_byte (data, offset, value):
+  return data[:offset] + chr(value) + data[offset+1:]
+
+def _packets ():
+  """
+  Yields well-formed raw packets of various sorts
+  """
+  t = tcp(srcport=1234, dstport=80, off=5, payload=b'x' * 10)
+  yield _eth(_ip(ipv4.TCP_PROTOCOL, t, tos=0x28), ethernet.IP_TYPE).pack()
+  t = tcp(srcport=1234, dstport=80, off=8, payload=b'x' * 10)
+  t.options.append(tcp_opt(tcp_opt.NOP, None))
+  t.options.append(tcp_opt(tcp_opt.NOP, None))
+  t.options.append(tcp_opt(tcp_opt.TSOPT, (1, 2)))
+  yield _eth(_ip(ipv4.TCP_PROTOCOL, t), ethernet.IP_TYPE).pack()
+  u = udp(srcport=53, dstport=5353, payload=b'y' * 3)
+  yield _eth(_ip(ipv4.UDP_PROTOCOL, u), ethernet.IP_TYPE).pack()
+  u = udp(srcport=1, dstport=2, payload=b'y' * 30)
+  yield _eth(_ip(ipv4.UDP_PROTOCOL, u, flags=ipv4.MF_FLAG),
+             ethernet.IP_TYPE).pack()
+  yield _eth(_ip(ipv4.UDP_PROTOCOL, b'y' * 30, frag=100),
+             ethernet.IP_TYPE).pack()
+  i = icmp(type=8, code=0, payload=b'')
+  yield _eth(_ip(ipv4.ICMP_PROTOCOL, i), ethernet.IP_TYPE).pack()
+  yield _eth(_ip(47, b'g' * 20), ethernet.IP_TYPE).pack()
+  for opcode in (arp.REQUEST, arp.REPLY):
+    a = arp(opcode=opcode, hwsrc=EthAddr("00:00:00:00:00:01"),
+            protosrc=IPAddr("10.0.0.1"), protodst=IPAddr("10.0.0.9"))
+    yield _eth(a, ethernet.ARP_TYPE).pack()
+    yield _eth(a, ethernet.RARP_TYPE).pack()
+  a = arp(opcode=300)
+  yield _eth(a, ethernet.ARP_TYPE).pack()
+  v = vlan(id=42, pcp=5, eth_type=ethernet.IP_TYPE,
+           next=_ip(ipv4.UDP_PROTOCOL, udp(srcport=1, dstport=2)))
+  yield _eth(v, ethernet.VLAN_TYPE).pack()
+  v = vlan(id=7, eth_type=ethernet.ARP_TYPE,
+           next=arp(protosrc=IPAddr("1.2.3.4"), protodst=IPAddr("4.3.2.1")))
+  yield _eth(v, ethernet.VLAN_TYPE).pack()
+  v = vlan(id=7, eth_type=60, next=b'\xaa\xaa\x03\0\0\0\x08\x00' + b'l' * 30)
+  yield _eth(v, ethernet.VLAN_TYPE).pack()
+  yield _eth(b'\xaa\xaa\x03\0\0\0\x08\x00' + b'l' * 30, 38).pack()
+  yield _eth(b'z' * 20, 0x88cc).pack()
+  yield _eth(b'z' * 60, ethernet.IPV6_TYPE).pack()
+
+def _mangled ():
+  """
+  Yields the packets from _packets() along with broken versions of them
+  """
+  for data in _packets():
+    yield data
+    # Every truncation
+    for i in range(len(data)):
+      yield data[:i]
+    # Mess with a few bytes in the headers
+    for offset in (14, 16, 17, 23, 26, 46):
+      if offset >= len(data): continue
+      for value in (0x00, 0x01, 0x06, 0x11, 0x40, 0x45, 0x4f, 0xff):
+        yield _set_byte(data, offset, value)
+
+
+class MatchFromRawTest (unittest.TestCase):
+  def _pcap_round_trip (self, packets):
+    """
+    Writes the packets to a pcap trace and returns what's read back
+    """
+    out = StringIO()
+    w = PCapRawWriter(out)
+    for data in packets:
+      if data: w.write(data, time=0)
+    r = []
+    p = PCapParser(lambda data, parser: r.append(data))
+    p.feed(out.getvalue())
+    return r
+
+  def _check (self, data, in_port, spec_frags):
+    try:
+      expected = of.ofp_match.from_packet(ethernet(data), in_port,
+                                          spec_frags=spec_frags)
+    except Exception:
+      # The packet library couldn't deal with it at all
+      return
+    m = of.ofp_match.from_raw(data, in_port, spec_frags=spec_frags)
+    self.assertEqual(m.wildcards, expected.wildcards,
+                     "%r: %s\n!=\n%s" % (data, m, expected))
+    for f in of.ofp_match_data:
+      self.assertEqual(getattr(m, f), getattr(expected, f),
+                       "%r: %s: %s != %s" % (data, f, getattr(m, f),
+                                             getattr(expected, f)))
+    self.assertEqual(m, expected)
+    self.assertEqual(m.pack(), expected.pack())
+
+  def test_pcap_equivalence (self):
+    packets = self._pcap_round_trip(_mangled())
+    self.assertTrue(len(packets) > 1000)
+    for data in packets:
+      for in_port in (None, 3):
+        for spec_frags in (False, True):
+          self._check(data, in_port, spec_frags)
+
+  def test_microflow_key (self):
+    # Packets which share a switch microflow key must share a match
+    from pox.datapaths.switch import _microflow_key
+    seen = {}
+    keyed = 0
+    for data in _mangled():
+      key = _microflow_key(data, 1)
+      if key is None: continue
+      keyed += 1
+      m = of.ofp_match.from_raw(data, 1, spec_frags=True)
+      if key in seen:
+        self.assertEqual(m, seen[key], repr(data))
+      else:
+        seen[key] = m
+    self.assertTrue(keyed > 100)
+
+  def test_fast_path (self):
+    # Well-formed packets shouldn't need the packet library
+    from_packet = of.ofp_match.__dict__['from_packet']
+    def fail (*args, **kw):
+      raise AssertionError("from_raw() fell back to from_packet()")
+    of.ofp_match.from_packet = classmethod(fail)
+    try:
+      for data in _packets():
+        if data[12:14] == b'\x00\x26': continue # LLC
+        if data[16:18] == b'\x00\x3c': continue # LLC inside VLAN
+        of.ofp_match.from_raw(data, 1, spec_frags=True)
+    finally:
+      of.ofp_match.from_packet = from_packet
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import socket
+import time
+from errno import EAGAIN, EMFILE
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.openflow.libopenflow_01 as of
+import pox.openflow.of_01 as of_01
+from pox.openflow.of_01 import Connection
+from pox.openflow import SEND_FLOW_SETUP, SEND_BULK
+from pox.openflow import SendCongestion, SendQueueFull
+from pox.lib.mock_socket import MockSocket
+
+
+class RecordingNexus (object):
+  def __init__ (self):
+    self.messages = []
+  def raiseEventNoErrors (self, event, con, msg, *args, **kw):
+    self.messages.append(msg)
+  def _disconnect (self, dpid):
+    pass
+
+
+class SmallReadConnection (Connection):
+  read_size = 64
+
+
+class ConnectionReadTest (unittest.TestCase):
+  def setUp (self):
+    self.switch, sock = MockSocket.pair()
+    self.con = SmallReadConnection(sock)
+    self.nexus = RecordingNexus()
+    self.con.ofnexus = self.nexus
+    self.switch.recv() # Discard hello
+
+  def _packet_ins (self, count):
+    return [of.ofp_packet_in(in_port=i % 7 + 1, buffer_id=i,
+                             data=chr(i % 256) * (i % 300 + 14))
+            for i in range(count)]
+
+  def test_split_messages (self):
+    msgs = self._packet_ins(20)
+    data = b''.join(m.pack() for m in msgs)
+    # Feed it a few bytes at a time so headers and bodies get split
+    for i in range(0, len(data), 5):
+      self.switch.send(data[i:i+5])
+      self.assertTrue(self.con.read())
+    # Packet-ins are passed on raw
+    self.assertEqual(self.nexus.messages, [m.pack() for m in msgs])
+    self.assertTrue(all(type(m) is bytes for m in self.nexus.messages))
+
+  def test_compaction (self):
+    msgs = self._packet_ins(1000)
+    data = b''.join(m.pack() for m in msgs)
+    self.assertTrue(len(data) > 2 * len(self.con._rbuf))
+    self.switch.send(data)
+    while self.switch.sending.buffer:
+      self.assertTrue(self.con.read())
+    self.assertEqual(self.nexus.messages, [m.pack() for m in msgs])
+    self.assertEqual(self.con._rstart, self.con._rend)
+
+  def test_closed (self):
+    self.assertFalse(self.con.read())
+
+  def test_feed (self):
+    # An adopted connection doesn't send a hello, and data which someone
+    # else already read is handled like anything read from the socket
+    switch, sock = MockSocket.pair()
+    con = SmallReadConnection(sock, hello=False)
+    con.ofnexus = self.nexus
+    self.assertEqual(switch.recv(), b'')
+    msgs = self._packet_ins(10)
+    self.assertTrue(con._feed(b''.join(m.pack() for m in msgs)))
+    self.assertEqual(self.nexus.messages, [m.pack() for m in msgs])
+
+  def test_vendor_unpacker (self):
+    # Other modules plug (raw, offset) unpackers into the table
+    import pox.openflow.nicira as nx
+    got = []
+    old = (of_01.unpackers[of.OFPT_VENDOR], of_01.handlers[of.OFPT_VENDOR])
+    nx._init_unpacker()
+    of_01.handlers[of.OFPT_VENDOR] = lambda con, msg: got.append(msg)
+    try:
+      reply = nx.nx_role_reply(role=nx.NX_ROLE_MASTER, xid=9)
+      self.switch.send(reply.pack())
+      self.assertTrue(self.con.read())
+    finally:
+      of_01.unpackers[of.OFPT_VENDOR], of_01.handlers[of.OFPT_VENDOR] = old
+    msg, = got
+    self.assertIsInstance(msg, nx.nx_role_reply)
+    self.assertEqual((msg.role, msg.xid), (nx.NX_ROLE_MASTER, 9))
+
+
+class TrickleSocket (object):
+  """
+  Socket which takes a few bytes at a time and is often full
+  """
+  def __init__ (self):
+    self.sent = b''
+    self.full = False
+    self.calls = 0
+  def send (self, data):
+    self.calls += 1
+    if self.full:
+      raise socket.error(EAGAIN, "Resource temporarily unavailable")
+    data = data[:7]
+    self.sent += data
+    self.full = True
+    return len(data)
+
+
+class RecordingReactor (object):
+  def __init__ (self):
+    self.pending = []
+  def _write_pending (self, con):
+    self.pending.append(con)
+
+
+class ConnectionSendTest (unittest.TestCase):
+  def setUp (self):
+    self.sock = TrickleSocket()
+    self.reactor = RecordingReactor()
+    self.con = Connection(self.sock, reactor=self.reactor)
+
+  def test_queue_and_flush (self):
+    msgs = [of.ofp_echo_request(body=b'x' * i) for i in range(10)]
+    for m in msgs:
+      self.con.send(m)
+    # The hello only partly went out, so the reactor was told once and
+    # everything else was queued behind it without touching the socket
+    self.assertEqual(self.reactor.pending, [self.con])
+    self.assertEqual(self.sock.calls, 1)
+    expected = b''.join(m.pack() for m in msgs)
+    self.assertEqual(self.con.send_pending, 8 + len(expected) - 7)
+
+    while True:
+      self.sock.full = False
+      if self.con._flush(): break
+    self.assertEqual(ord(self.sock.sent[1]), of.OFPT_HELLO)
+    self.assertEqual(self.sock.sent[8:], expected)
+    self.assertEqual(self.con.send_pending, 0)
+
+    # Once drained, sends go straight to the socket again
+    self.sock.full = False
+    self.con.send(of.ofp_barrier_request(xid=5))
+    self.assertEqual(self.con.send_pending, 1)
+    self.assertEqual(self.reactor.pending, [self.con, self.con])
+
+  def test_priority_classes (self):
+    # Hello goes out partly; everything after it is queued
+    po = of.ofp_packet_out(data=b'p' * 20).pack()
+    fm = of.ofp_flow_mod(xid=1).pack()
+    st = of.ofp_stats_request(xid=2, body=of.ofp_desc_stats_request()).pack()
+    echo = of.ofp_echo_request(xid=3).pack()
+    barrier = of.ofp_barrier_request(xid=4).pack()
+    for m in (st, po, fm, echo, barrier):
+      self.con.send(m)
+
+    while True:
+      self.sock.full = False
+      if self.con._flush(): break
+    # The rest of the hello first, then by class; the barrier doesn't
+    # pass the stats request queued before it
+    self.assertEqual(self.sock.sent[8:], echo + fm + po + st + barrier)
+
+  def test_barrier_fence (self):
+    po = of.ofp_packet_out(data=b'p' * 20).pack()
+    barrier = of.ofp_barrier_request(xid=1).pack()
+    fm = of.ofp_flow_mod(xid=2).pack()
+    echo = of.ofp_echo_request(xid=3).pack()
+    for m in (po, barrier, fm, echo):
+      self.con.send(m)
+
+    def drain ():
+      while True:
+        self.sock.full = False
+        if self.con._flush(): break
+    # Nothing sent after the barrier goes out before it
+    drain()
+    self.assertEqual(self.sock.sent[8:], po + barrier + fm + echo)
+
+    # Once it's out, classes are reordered again
+    self.sock.sent = b''
+    self.sock.full = False
+    for m in (po, po, fm):
+      self.con.send(m)
+    drain()
+    self.assertEqual(self.sock.sent, po + fm + po)
+
+  def test_limits (self):
+    events = []
+    self.con.addListener(SendCongestion, events.append)
+    self.con.send_limits = dict(self.con.send_limits)
+    self.con.send_limits[SEND_BULK] = 100
+    self.con.send_limits[SEND_FLOW_SETUP] = 100
+    self.con.send_policies = dict(self.con.send_policies)
+    self.con.send_policies[SEND_BULK] = 'drop'
+    self.con.send_policies[SEND_FLOW_SETUP] = 'reject'
+
+    st = of.ofp_stats_request(body=of.ofp_desc_stats_request()).pack()
+    results = [self.con.send(st) for i in range(10)]
+    self.assertEqual(results.count(False), 2)
+    self.assertEqual(self.con.send_drops[SEND_BULK], 2)
+    self.assertTrue(self.con.is_congested(SEND_BULK))
+    self.assertEqual([(e.send_class, e.congested) for e in events],
+                     [(SEND_BULK, True)])
+
+    fm = of.ofp_flow_mod().pack()
+    self.con.send(fm)
+    self.assertRaises(SendQueueFull, self.con.send, fm)
+    self.assertTrue(self.con.is_congested(SEND_FLOW_SETUP))
+
+    while True:
+      self.sock.full = False
+      if self.con._flush(): break
+    self.assertFalse(self.con.is_congested())
+    self.assertEqual(sorted((e.send_class, e.congested) for e in events),
+                     [(SEND_FLOW_SETUP, False), (SEND_FLOW_SETUP, True),
+                      (SEND_BULK, False), (SEND_BULK, True)])
+
+
+class FailingListener (object):
+  def __init__ (self, errno):
+    self.errno = errno
+  def accept (self):
+    raise socket.error(self.errno, "accept failed")
+
+
+class FullListener (FailingListener):
+  """
+  A listener with a connection waiting which we never manage to accept
+  """
+  def __init__ (self, errno = EMFILE):
+    FailingListener.__init__(self, errno)
+    self.sock = socket.socket()
+    self.sock.bind(("127.0.0.1", 0))
+    self.sock.listen(1)
+    self.client = socket.create_connection(self.sock.getsockname())
+    self.accepts = 0
+  def fileno (self):
+    return self.sock.fileno()
+  def accept (self):
+    self.accepts += 1
+    FailingListener.accept(self)
+  def close (self):
+    self.client.close()
+    self.sock.close()
+
+
+class AcceptTest (unittest.TestCase):
+  def _task (self, cls = of_01.OpenFlow_01_Task):
+    task = cls()
+    task._make_listener = lambda: self.listener
+    self.listener = FullListener()
+    self.addCleanup(self.listener.close)
+    return task
+
+  def test_accept_error (self):
+    # Errors accepting one connection mustn't take down the listener
+    task = self._task()
+    self.assertIsNone(task._accept(FailingListener(EAGAIN)))
+    self.assertIsNone(task._accept_resume)
+    self.assertIsNone(task._accept(FailingListener(EMFILE)))
+    self.assertIsNotNone(task._accept_resume)
+
+  def _check_backoff (self, cls):
+    # Out of descriptors, the listener stays readable; it mustn't be
+    # polled again until the back-off is over
+    task = self._task(cls)
+    listener = self.listener
+    run = task.run()
+    def step (sel):
+      # Say that everything being waited on is ready
+      rlist = sel._args[0]
+      return run.send((list(rlist), [], []))
+
+    sel = step(run.next())
+    self.assertEqual(listener.accepts, 1)
+    self.assertLessEqual(sel._args[3], task.accept_backoff)
+    sel = step(sel)
+    sel = step(sel)
+    self.assertEqual(listener.accepts, 1)
+
+    # Once it's over, it's polled again
+    task._accept_resume = time.time() - 1
+    sel = step(sel)
+    self.assertEqual(sel._args[3], 5)
+    step(sel)
+    self.assertEqual(listener.accepts, 2)
+    run.close()
+
+  def test_backoff_select (self):
+    self._check_backoff(of_01.OpenFlow_01_Task)
+
+  def test_backoff_epoll (self):
+    self._check_backoff(of_01.OpenFlow_01_EpollTask)
+
+
+if __name__ == '__main__':
+  unittest.main()
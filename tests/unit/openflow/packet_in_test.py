@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.openflow.libopenflow_01 as of
+from pox.openflow import PacketIn, OpenFlowNexus
+from pox.lib.packet import *
+from pox.lib.addresses import EthAddr, IPAddr
+
+
+class FakeConnection (object):
+  dpid = 1
+
+
+def _eth (next, type):
+  return ethernet(src=EthAddr("00:00:00:00:00:01"),
+                  dst=EthAddr("00:00:00:00:00:02"), type=type, next=next)
+
+def _ip (protocol, next, **kw):
+  return ipv4(srcip=IPAddr("10.0.0.1"), dstip=IPAddr("10.0.0.2"),
+              protocol=protocol, next=next, **kw)
+
+def _packets ():
+  """
+  Yields raw packets of various sorts
+  """
+  t = tcp(srcport=1234, dstport=80, off=5)
+  t.payload = b'x' * 10
+  yield _eth(_ip(ipv4.TCP_PROTOCOL, t), ethernet.IP_TYPE).pack()
+  u = udp(srcport=53, dstport=5353, payload=b'y' * 3)
+  yield _eth(_ip(ipv4.UDP_PROTOCOL, u), ethernet.IP_TYPE).pack()
+  i = icmp(type=8, code=0, payload=b'')
+  yield _eth(_ip(ipv4.ICMP_PROTOCOL, i), ethernet.IP_TYPE).pack()
+  a = arp(opcode=arp.REQUEST, hwsrc=EthAddr("00:00:00:00:00:01"),
+          protosrc=IPAddr("10.0.0.1"), protodst=IPAddr("10.0.0.9"))
+  yield _eth(a, ethernet.ARP_TYPE).pack()
+  v = vlan(id=42, eth_type=ethernet.IP_TYPE,
+           next=_ip(ipv4.UDP_PROTOCOL, udp(srcport=1, dstport=2)))
+  yield _eth(v, ethernet.VLAN_TYPE).pack()
+  yield _eth(b'z' * 20, 0x88cc).pack()
+
+
+class PacketInTest (unittest.TestCase):
+  def _events (self, data):
+    msg = of.ofp_packet_in(in_port=3, buffer_id=7, reason=of.OFPR_ACTION,
+                           data=data)
+    return (PacketIn(FakeConnection(), msg),
+            PacketIn(FakeConnection(), msg.pack()))
+
+  def test_fields_match (self):
+    fields = ('dl_src', 'dl_dst', 'dl_type', 'dl_vlan', 'nw_src', 'nw_dst',
+              'nw_proto', 'tp_src', 'tp_dst')
+    for data in _packets():
+      match = of.ofp_match.from_packet(ethernet(data))
+      for e in self._events(data):
+        for f in fields:
+          self.assertEqual(getattr(e, f), getattr(match, f),
+                           "%s: %s != %s" % (f, getattr(e, f),
+                                             getattr(match, f)))
+
+  def test_lazy (self):
+    data = next(_packets())
+    full,lazy = self._events(data)
+    for e in (full, lazy):
+      self.assertEqual(e.port, 3)
+      self.assertEqual(e.buffer_id, 7)
+      self.assertEqual(e.reason, of.OFPR_ACTION)
+    self.assertTrue(lazy._ofp is None)
+    self.assertEqual(lazy.data, data)
+    self.assertEqual(lazy.ofp, full.ofp)
+    self.assertEqual(lazy.parsed.raw, data)
+
+  def test_truncated (self):
+    data = next(_packets())[:20]
+    for e in self._events(data):
+      self.assertEqual(e.dl_type, ethernet.IP_TYPE)
+      self.assertEqual(e.nw_src, None)
+      self.assertEqual(e.tp_dst, None)
+
+
+if __name__ == '__main__':
+  unittest.main()
+
+
+
+class FilterTest (unittest.TestCase):
+  def test_filters (self):
+    nexus = OpenFlowNexus()
+    got = {}
+    def listen (name, filter):
+      got[name] = []
+      nexus.addListener(PacketIn, lambda e: got[name].append(e.dl_type),
+                        filter=filter)
+    listen("all", None)
+    listen("arp", {'dl_type':ethernet.ARP_TYPE})
+    listen("udp", {'dl_type':ethernet.IP_TYPE, 'nw_proto':ipv4.UDP_PROTOCOL})
+    listen("dns", {'tp_dst':5353, 'dl_dst':"00:00:00:00:00:02"})
+    listen("dpid", {'dpid':2})
+    for data in _packets():
+      msg = of.ofp_packet_in(in_port=3, data=data)
+      nexus.raiseEvent(PacketIn, FakeConnection(), msg.pack())
+    self.assertEqual(len(got["all"]), 6)
+    self.assertEqual(got["arp"], [ethernet.ARP_TYPE])
+    self.assertEqual(got["udp"], [ethernet.IP_TYPE] * 2)
+    self.assertEqual(got["dns"], [ethernet.IP_TYPE])
+    self.assertEqual(got["dpid"], [])
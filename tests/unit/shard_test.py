@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import socket
+import select
+
+sys.path.append(os.path.dirname(__file__) + "/../..")
+
+import pox.openflow.libopenflow_01 as of
+from pox.shard import _Channel, _Handshake, _MainShards, _Worker
+from pox.shard import ShardMessage, PARENT, ALL
+
+
+def drain (a, b):
+  """
+  Moves everything queued on channel a to channel b
+  """
+  got = []
+  while True:
+    done = a.flush()
+    if not select.select([b], [], [], 0)[0]:
+      if done: return got
+      continue
+    got.extend(b.read())
+
+
+class ChannelTest (unittest.TestCase):
+  def test_messages (self):
+    x,y = socket.socketpair()
+    a = _Channel(x)
+    b = _Channel(y)
+    big = "x" * 500000
+    a.send(('msg', 1, {'a':[1,2]}))
+    a.send(big)
+    a.send(None)
+    self.assertTrue(drain(a, b) == [('msg', 1, {'a':[1,2]}), big, None])
+    a.close()
+    self.assertEqual(b.read(), None)
+    self.assertTrue(b.closed)
+
+
+class HandshakeTest (unittest.TestCase):
+  def test_handshake (self):
+    switch,ctl = socket.socketpair()
+    switch.settimeout(1)
+    h = _Handshake(ctl)
+    self.assertEqual(ord(switch.recv(8)[1]), of.OFPT_HELLO)
+
+    status = of.ofp_port_status(desc=of.ofp_phy_port(port_no=1)).pack()
+    features = of.ofp_features_reply(datapath_id=0x1234, ports=[]).pack()
+    packet_in = of.ofp_packet_in(data=b'p' * 20).pack()
+    data = (of.ofp_hello().pack() + of.ofp_echo_request(xid=7).pack()
+            + status + features + packet_in)
+    # Dribble it in, a few bytes at a time
+    for i in range(0, len(data), 5):
+      switch.send(data[i:i+5])
+      self.assertTrue(h.read())
+      if h.dpid is not None: break
+    self.assertEqual(h.dpid, 0x1234)
+    # Plus maybe the start of the packet-in from the same chunk
+    self.assertTrue(h.data.startswith(status + features))
+
+    replies = switch.recv(100)
+    self.assertEqual(ord(replies[1]), of.OFPT_FEATURES_REQUEST)
+    self.assertEqual(ord(replies[9]), of.OFPT_ECHO_REPLY)
+    h.close()
+    switch.close()
+
+  def test_all_at_once (self):
+    switch,ctl = socket.socketpair()
+    h = _Handshake(ctl)
+    features = of.ofp_features_reply(datapath_id=5, ports=[]).pack()
+    packet_in = of.ofp_packet_in(data=b'p' * 20).pack()
+    switch.send(of.ofp_hello().pack() + features + packet_in)
+    self.assertTrue(h.read())
+    self.assertEqual(h.dpid, 5)
+    self.assertEqual(h.data, features + packet_in)
+    h.close()
+    switch.close()
+
+  def test_closed (self):
+    switch,ctl = socket.socketpair()
+    h = _Handshake(ctl)
+    switch.close()
+    self.assertFalse(h.read())
+    h.close()
+
+
+class RoutingTest (unittest.TestCase):
+  def setUp (self):
+    self.shards = _MainShards(3, "", "select")
+    self.ends = []
+    for i in range(3):
+      x,y = socket.socketpair()
+      self.shards.workers.append(_Worker(i, _Channel(x), None, None))
+      self.ends.append(_Channel(y))
+    self.got = []
+    def handler (e):
+      self.last = e
+      self.got.append((e.sender, e.msg))
+    self.shards.addListener(ShardMessage, handler)
+
+  def _received (self):
+    return [drain(w.channel, e) for w,e in zip(self.shards.workers,
+                                               self.ends)]
+
+  def test_from_worker (self):
+    w = self.shards.workers
+    self.shards._handle_message(w[0], ('msg', ALL, 'a'))
+    self.shards._handle_message(w[1], ('msg', 2, 'b'))
+    self.shards._handle_message(w[2], ('msg', PARENT, 'c'))
+    self.assertEqual(self.got, [(0, 'a'), (2, 'c')])
+    self.assertEqual(self._received(), [[], [('msg', 0, 'a')],
+                                         [('msg', 0, 'a'), ('msg', 1, 'b')]])
+
+  def test_from_parent (self):
+    self.shards.send('a')
+    self.shards.send('b', 1)
+    self.shards.send('c', PARENT)
+    self.assertEqual(self.got, [(PARENT, 'c')])
+    # sender doesn't hide the usual Event.source
+    self.assertIs(self.last.source, self.shards)
+    self.assertEqual(self._received(), [[('msg', PARENT, 'a')],
+                                        [('msg', PARENT, 'a'),
+                                         ('msg', PARENT, 'b')],
+                                        [('msg', PARENT, 'a')]])
+
+  def test_shard_for (self):
+    self.assertEqual([self.shards.shard_for(d) for d in range(1, 7)],
+                     [1, 2, 0, 1, 2, 0])
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark receiving with AF_PACKET rings against the other backends
+
+A separate process blasts packets into one end of a veth pair, and this
+one receives them from the other end using:
+ ring    - pox.lib.afpacket.PacketRing, a block at a time
+ socket  - a plain AF_PACKET socket, one recv() per packet
+ pxpcap  - pxpcap's PCap with a per-packet callback (if it's built)
+Reports how many packets per second the receiver could handle using all
+of one CPU (packets received divided by the receiving process's user plus
+system time), and how many were lost.
+
+Needs root.  The veth pair is created (and removed afterwards) unless
+you pass existing interfaces with --devs.
+
+Invoke from the top level:
+  sudo ./tools/bench/afpacket_ring.py --packets=200000
+"""
+
+import sys
+import os
+import time
+import socket
+import subprocess
+import multiprocessing
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+import pox.core
+core = pox.core.initialize()
+import pox.lib.afpacket as afpacket
+import pox.lib.pxpcap as pxpcap
+
+
+ETH_TYPE = b'\x88\xb5' # Local experimental
+
+def sender (dev, count, size, ready):
+  ring = afpacket.PacketRing(dev, start=False, promiscuous=False)
+  frame = b'\xff' * 6 + b'\x02\x00\x00\x00\x00\x01' + ETH_TYPE
+  frame += b'x' * (size - len(frame))
+  ready.wait()
+  burst = [frame] * 64
+  for i in xrange(count // len(burst)):
+    ring.inject_many(burst)
+  ring.close()
+
+def recv_ring (dev, count, timeout):
+  ring = afpacket.PacketRing(dev, start=False, block_timeout=1)
+  def wait (done):
+    n = 0
+    while True:
+      block = ring.read_block(timeout)
+      if block is None: break
+      n += sum(1 for p in block if p[12:14] == ETH_TYPE)
+      if n >= count: break
+    return n
+  return ring.close, wait
+
+def recv_socket (dev, count, timeout):
+  s = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(3))
+  s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 24)
+  s.bind((dev, 3))
+  s.settimeout(timeout)
+  def wait (done):
+    n = 0
+    try:
+      while n < count:
+        if s.recv(65535)[12:14] == ETH_TYPE: n += 1
+    except socket.timeout:
+      pass
+    return n
+  return s.close, wait
+
+def recv_pxpcap (dev, count, timeout):
+  got = [0]
+  def cb (px, data, sec, usec, length):
+    if data[12:14] == ETH_TYPE: got[0] += 1
+  p = pxpcap.PCap(dev, callback=cb, start=False)
+  p.set_direction(True, False)
+  def wait (done):
+    last = -1
+    while got[0] < count and got[0] != last:
+      last = got[0]
+      time.sleep(timeout)
+    return got[0]
+  p.start()
+  return p.close, wait
+
+def run (name, devs, count, size, timeout):
+  ready = multiprocessing.Event()
+  close,wait = globals()["recv_" + name](devs[1], count, timeout)
+  proc = multiprocessing.Process(target=sender,
+                                 args=(devs[0], count, size, ready))
+  proc.start()
+  time.sleep(0.2)
+  t = os.times()
+  ready.set()
+  n = wait(ready)
+  t2 = os.times()
+  proc.join()
+  close()
+  return n, (t2[0] - t[0]) + (t2[1] - t[1])
+
+def main ():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument('--packets', type=int, default=200000)
+  parser.add_argument('--size', type=int, default=64)
+  parser.add_argument('--devs', help='existing pair, e.g., veth0,veth1')
+  args = parser.parse_args()
+  count = args.packets // 64 * 64
+
+  created = False
+  if args.devs:
+    devs = args.devs.split(",")
+  else:
+    devs = ["poxbench0", "poxbench1"]
+    subprocess.check_call(["ip", "link", "add", devs[0], "type", "veth",
+                           "peer", "name", devs[1]])
+    created = True
+    for d in devs:
+      subprocess.check_call(["ip", "link", "set", d, "up"])
+    time.sleep(0.5)
+
+  try:
+    backends = ["ring", "socket"]
+    if pxpcap.enabled: backends.append("pxpcap")
+    print("%-8s %14s %10s" % ("", "packets/cpu-s", "lost"))
+    for name in backends:
+      n,cpu = run(name, devs, count, args.size, 0.5)
+      print("%-8s %14.0f %10i" % (name, n / cpu, count - n))
+    if not pxpcap.enabled:
+      print("(pxpcap isn't built, so it wasn't measured)")
+  finally:
+    if created:
+      subprocess.call(["ip", "link", "del", devs[0]])
+
+
+if __name__ == '__main__':
+  main()
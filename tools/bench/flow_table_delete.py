@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark non-strict flow_mod DELETE by output port
+
+Fills a FlowTable with entries that each output to one of a number of
+ports, then times deleting the flows for each port with a wildcard match
+and out_port set (like an OFPFC_DELETE sent when a link goes down).  The
+"scan" row checks every entry with is_matched_by(), which is what
+matching_entries() used to do.
+
+Invoke from the top level:
+  ./tools/bench/flow_table_delete.py --entries=50000
+"""
+
+import sys
+import os
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+import pox.openflow.libopenflow_01 as of
+from pox.openflow.flow_table import FlowTable, TableEntry
+from pox.lib.addresses import EthAddr, IPAddr
+
+
+def make_table (rand, entries, ports):
+  t = FlowTable()
+  for i in xrange(entries):
+    match = of.ofp_match(dl_type=0x800, nw_proto=6,
+                         nw_dst=IPAddr(0x0a000000 + i),
+                         tp_dst=rand.choice([22, 80, 443]))
+    t.add_entry(TableEntry(priority=rand.randint(100, 200), match=match,
+                           actions=[of.ofp_action_output(
+                                    port=rand.randint(1, ports))]))
+  return t
+
+def scan_matching_entries (table, match, priority=0, strict=False,
+                           out_port=None, cookie=None):
+  entry_match = lambda e: e.is_matched_by(match, priority, strict, out_port)
+  return [ entry for entry in table._table if entry_match(entry) ]
+
+def run (table, ports, deletes):
+  start = time.time()
+  for port in xrange(1, deletes + 1):
+    table.remove_matching_entries(of.ofp_match(), out_port=port,
+                                  reason=of.OFPRR_DELETE)
+  return (time.time() - start) / deletes
+
+
+def main ():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument('--entries', type=int, default=50000)
+  parser.add_argument('--ports', type=int, default=500)
+  parser.add_argument('--deletes', type=int, default=20,
+                      help='number of ports to delete flows for')
+  args = parser.parse_args()
+
+  print("%-8s %14s %10s" % ("", "ms/delete", "remaining"))
+  for name in ("scan", "indexed"):
+    table = make_table(random.Random(1), args.entries, args.ports)
+    if name == "scan":
+      table.matching_entries = lambda *args: scan_matching_entries(table,
+                                                                   *args)
+    elapsed = run(table, args.ports, args.deletes)
+    print("%-8s %14.3f %10i" % (name, elapsed * 1000, len(table)))
+
+
+if __name__ == '__main__':
+  main()
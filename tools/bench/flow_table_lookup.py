@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark FlowTable.entry_for_packet
+
+Fills a FlowTable with a mix of exact-match (microflow) entries and
+wildcarded entries spread over a handful of wildcard masks, then reports
+lookups per second for the classifier and for a linear scan of the table
+(which is what entry_for_packet used to do).
+
+Invoke from the top level:
+  ./tools/bench/flow_table_lookup.py --entries=10000 --entries=100000
+"""
+
+import sys
+import os
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+import pox.openflow.libopenflow_01 as of
+from pox.openflow.flow_table import FlowTable, TableEntry
+from pox.lib.packet import ethernet, ipv4, udp
+from pox.lib.addresses import EthAddr, IPAddr
+
+
+def _mac (n):
+  return EthAddr("02:00:%02x:%02x:%02x:%02x" % ((n >> 24) & 0xff,
+                 (n >> 16) & 0xff, (n >> 8) & 0xff, n & 0xff))
+
+def make_packet (rand, hosts):
+  src = rand.randrange(hosts)
+  dst = rand.randrange(hosts)
+  u = udp(srcport=1000 + src % 1000, dstport=53, payload=b'x' * 16)
+  ip = ipv4(srcip=IPAddr(0x0a000000 + src), dstip=IPAddr(0x0a000000 + dst),
+            protocol=ipv4.UDP_PROTOCOL, next=u)
+  eth = ethernet(src=_mac(src), dst=_mac(dst), type=ethernet.IP_TYPE, next=ip)
+  return eth.pack(), src % 48 + 1
+
+def make_table (rand, entries, hosts):
+  t = FlowTable()
+  for i in xrange(entries):
+    kind = i % 4
+    if kind == 0:
+      # Microflow
+      data,in_port = make_packet(rand, hosts)
+      match = of.ofp_match.from_raw(data, in_port, spec_frags=True)
+      priority = of.OFP_DEFAULT_PRIORITY
+    elif kind == 1:
+      # L2
+      match = of.ofp_match(dl_dst=_mac(rand.randrange(hosts)))
+      priority = 100
+    elif kind == 2:
+      # Per-port, per-destination
+      match = of.ofp_match(in_port=rand.randint(1,48),
+                           dl_dst=_mac(rand.randrange(hosts)))
+      priority = 200
+    else:
+      # IP prefixes
+      match = of.ofp_match(dl_type=0x800)
+      match.set_nw_dst(IPAddr(0x0a000000 + (rand.randrange(hosts) & ~0xff)),
+                       24)
+      match.nw_proto = rand.choice([6, 17])
+      priority = rand.randint(300, 400)
+    t.add_entry(TableEntry(priority=priority, match=match,
+                           actions=[of.ofp_action_output(port=1)]))
+  return t
+
+def linear (table, data, in_port):
+  packet_match = of.ofp_match.from_raw(data, in_port, spec_frags=True)
+  for entry in table._table:
+    if entry.match.matches_with_wildcards(packet_match,
+                                          consider_other_wildcards=False):
+      return entry
+  return None
+
+def rate (f, table, packets, seconds):
+  n = 0
+  start = time.time()
+  end = start + seconds
+  while True:
+    for data,in_port in packets:
+      f(table, data, in_port)
+    n += len(packets)
+    now = time.time()
+    if now >= end: break
+  return n / (now - start)
+
+
+def main ():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument('--entries', type=int, action='append',
+                      help='table size (may be given more than once)')
+  parser.add_argument('--hosts', type=int, default=50000)
+  parser.add_argument('--seconds', type=float, default=2)
+  args = parser.parse_args()
+  if not args.entries: args.entries = [10000, 100000]
+
+  print("%-8s %10s %14s %14s" % ("entries", "add/sec", "classifier/s",
+                                 "linear/s"))
+  for entries in args.entries:
+    rand = random.Random(entries)
+    start = time.time()
+    table = make_table(rand, entries, args.hosts)
+    adds = entries / (time.time() - start)
+    packets = [make_packet(rand, args.hosts) for i in xrange(200)]
+    for data,in_port in packets[:20]:
+      assert (table.entry_for_packet(data, in_port)
+              is linear(table, data, in_port))
+    c = rate(FlowTable.entry_for_packet, table, packets, args.seconds)
+    l = rate(linear, table, packets[:5], args.seconds)
+    print("%-8s %10.0f %14.0f %14.1f" % (entries, adds, c, l))
+
+
+if __name__ == '__main__':
+  main()
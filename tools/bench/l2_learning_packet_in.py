@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark forwarding.l2_learning on a stream of PacketIns
+
+Feeds PacketIns through of_01's Connection.read into an l2_learning
+LearningSwitch and reports PacketIns per second.  The "eager" rows unpack
+every packet-in into an ofp_packet_in and parse the whole packet up front,
+the way things worked before PacketIn decoding became lazy.
+
+Two workloads are run: "flood", where every packet is a broadcast (so
+l2_learning only looks at addresses), and "unicast", where destinations
+are known and a flow gets installed for each packet.
+
+Invoke from the top level:
+  ./tools/bench/l2_learning_packet_in.py --messages=50000
+"""
+
+import sys
+import os
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+import pox.core
+core = pox.core.initialize()
+import pox.openflow.of_01 as of_01
+import pox.openflow.libopenflow_01 as of
+import pox.forwarding.l2_learning as l2_learning
+from pox.openflow import PacketIn
+from pox.lib.packet import ethernet, ipv4, udp
+from pox.lib.addresses import EthAddr, IPAddr
+
+
+class StreamSocket (object):
+  """
+  Fake socket which hands out a canned stream and discards what's sent
+  """
+  def __init__ (self, data):
+    self.data = data
+    self.offset = 0
+  def recv_into (self, buf, size):
+    d = self.data[self.offset:self.offset+size]
+    self.offset += len(d)
+    buf[:len(d)] = d
+    return len(d)
+  def send (self, data):
+    return len(data)
+
+
+class NullNexus (object):
+  def raiseEventNoErrors (self, *args, **kw):
+    return None
+
+
+def _host_mac (n):
+  return EthAddr("02:00:00:00:%02x:%02x" % (n >> 8, n & 0xff))
+
+
+def make_stream (count, hosts, broadcast):
+  msgs = []
+  for i in xrange(count):
+    src = i % hosts
+    dst = (i * 7 + 3) % hosts
+    u = udp(srcport=1000 + i % 100, dstport=53, payload=b'x' * 64)
+    ip = ipv4(srcip=IPAddr(0x0a000000 + src),
+              dstip=IPAddr(0x0a000000 + dst),
+              protocol=ipv4.UDP_PROTOCOL, next=u)
+    eth = ethernet(src=_host_mac(src), type=ethernet.IP_TYPE, next=ip)
+    if broadcast:
+      eth.dst = EthAddr("ff:ff:ff:ff:ff:ff")
+    else:
+      eth.dst = _host_mac(dst)
+    msgs.append(of.ofp_packet_in(in_port=src % 48 + 1, buffer_id=i,
+                                 data=eth.pack()).pack())
+  return b''.join(msgs)
+
+
+def _eager_parse (event):
+  event.parsed
+
+
+def run (data, eager, warmup):
+  if eager:
+    of_01.unpackers[of.OFPT_PACKET_IN] = of.ofp_packet_in.unpack_new
+  else:
+    of_01.unpackers[of.OFPT_PACKET_IN] = of_01._unpack_packet_in_raw
+
+  con = of_01.Connection(StreamSocket(warmup + data))
+  con.ofnexus = NullNexus()
+  con.dpid = 1
+  con.connect_time = 0
+  switch = l2_learning.LearningSwitch(con, False)
+  if eager:
+    con.addListener(PacketIn, _eager_parse, priority=1)
+
+  # Learn the hosts first
+  while con.sock.offset < len(warmup):
+    con.read()
+
+  start = time.time()
+  while con.read():
+    pass
+  return time.time() - start
+
+
+def main ():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument('--messages', type=int, default=50000,
+                      help='number of PacketIns per workload')
+  parser.add_argument('--hosts', type=int, default=200)
+  args = parser.parse_args()
+
+  l2_learning.log.setLevel("WARNING")
+  warmup = make_stream(args.hosts * 2, args.hosts, True)
+
+  print("%-8s %-8s %12s" % ("", "", "PacketIn/sec"))
+  for workload in ("flood", "unicast"):
+    data = make_stream(args.messages, args.hosts, workload == "flood")
+    for name in ("eager", "lazy"):
+      elapsed = run(data, name == "eager", warmup)
+      print("%-8s %-8s %12.0f" % (workload, name, args.messages / elapsed))
+
+  of_01.unpackers[of.OFPT_PACKET_IN] = of_01._unpack_packet_in_raw
+
+
+if __name__ == '__main__':
+  main()
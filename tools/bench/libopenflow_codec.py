@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark libopenflow_01 pack/unpack
+
+Reports pack and unpack operations per second for the fixed-layout
+structures and the most common messages.
+
+Invoke from the top level:
+  ./tools/bench/libopenflow_codec.py --seconds=0.5
+"""
+
+import sys
+import os
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+import pox.openflow.libopenflow_01 as of
+from pox.lib.addresses import EthAddr, IPAddr
+
+
+def _match ():
+  return of.ofp_match(in_port=1, dl_type=0x0800,
+                      dl_src=EthAddr("00:00:00:00:00:01"),
+                      dl_dst=EthAddr("00:00:00:00:00:02"), dl_vlan=5,
+                      nw_proto=6, nw_src="10.0.0.1", nw_dst="11.0.0.1",
+                      tp_src=12345, tp_dst=80)
+
+def samples ():
+  """
+  Returns a list of (name, object, unpack function)
+  """
+  def fixed (cls):
+    # Unpacker for structures which return just the offset
+    def unpack (raw):
+      o = cls()
+      o.unpack(raw)
+      return o
+    return unpack
+  def body (cls):
+    # Unpacker for stats bodies
+    def unpack (raw):
+      o = cls()
+      o.unpack(raw, 0, len(raw))
+      return o
+    return unpack
+  def message (cls):
+    def unpack (raw):
+      return cls.unpack_new(raw)[1]
+    return unpack
+
+  r = []
+  r.append(("ofp_match", _match(), fixed(of.ofp_match)))
+  r.append(("ofp_phy_port", of.ofp_phy_port(port_no=3, name="eth3",
+            hw_addr=EthAddr("00:00:00:00:00:03"), curr=0x2ff),
+            fixed(of.ofp_phy_port)))
+  r.append(("ofp_action_output", of.ofp_action_output(port=2),
+            fixed(of.ofp_action_output)))
+  r.append(("ofp_action_dl_addr",
+            of.ofp_action_dl_addr.set_dst(EthAddr("00:00:00:00:00:09")),
+            fixed(of.ofp_action_dl_addr)))
+  r.append(("ofp_action_nw_addr",
+            of.ofp_action_nw_addr.set_src(IPAddr("1.2.3.4")),
+            fixed(of.ofp_action_nw_addr)))
+  r.append(("ofp_action_tp_port", of.ofp_action_tp_port.set_dst(80),
+            fixed(of.ofp_action_tp_port)))
+  r.append(("ofp_flow_stats", of.ofp_flow_stats(match=_match(),
+            actions=[of.ofp_action_output(port=2)], packet_count=5),
+            body(of.ofp_flow_stats)))
+  r.append(("ofp_port_stats", of.ofp_port_stats(port_no=1, rx_packets=9),
+            body(of.ofp_port_stats)))
+  r.append(("ofp_table_stats", of.ofp_table_stats(name="t"),
+            body(of.ofp_table_stats)))
+  r.append(("ofp_queue_stats", of.ofp_queue_stats(port_no=1, queue_id=2),
+            body(of.ofp_queue_stats)))
+  r.append(("ofp_flow_mod", of.ofp_flow_mod(match=_match(), xid=1,
+            actions=[of.ofp_action_output(port=2)]),
+            message(of.ofp_flow_mod)))
+  r.append(("ofp_packet_in", of.ofp_packet_in(in_port=1, buffer_id=5,
+            data=b'x' * 128, xid=1), message(of.ofp_packet_in)))
+  r.append(("ofp_packet_out", of.ofp_packet_out(buffer_id=5, in_port=1,
+            actions=[of.ofp_action_output(port=2)], xid=1),
+            message(of.ofp_packet_out)))
+  r.append(("ofp_flow_removed", of.ofp_flow_removed(match=_match(), xid=1),
+            message(of.ofp_flow_removed)))
+  r.append(("ofp_port_status", of.ofp_port_status(xid=1,
+            desc=of.ofp_phy_port(port_no=1, name="eth1")),
+            message(of.ofp_port_status)))
+  return r
+
+
+def rate (f, arg, seconds):
+  n = 0
+  batch = 200
+  start = time.time()
+  end = start + seconds
+  while True:
+    for i in xrange(batch):
+      f(arg)
+    n += batch
+    now = time.time()
+    if now >= end: break
+  return n / (now - start)
+
+
+def main ():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument('--seconds', type=float, default=0.5,
+                      help='time to spend on each measurement')
+  args = parser.parse_args()
+
+  print("%-20s %12s %12s" % ("", "pack/sec", "unpack/sec"))
+  for name,obj,unpack in samples():
+    raw = obj.pack()
+    assert unpack(raw).pack() == raw, name
+    p = rate(lambda o: o.pack(), obj, args.seconds)
+    u = rate(unpack, raw, args.seconds)
+    print("%-20s %12.0f %12.0f" % (name, p, u))
+
+
+if __name__ == '__main__':
+  main()
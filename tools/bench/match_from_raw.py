@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark building exact matches from raw packets
+
+Compares ofp_match.from_packet(ethernet(data)) with ofp_match.from_raw(data)
+for a few common kinds of packet, and reports matches per second.
+
+Invoke from the top level:
+  ./tools/bench/match_from_raw.py --seconds=0.5
+"""
+
+import sys
+import os
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+import pox.openflow.libopenflow_01 as of
+from pox.lib.packet import *
+from pox.lib.addresses import EthAddr, IPAddr
+
+
+def _eth (next, type):
+  return ethernet(src=EthAddr("00:00:00:00:00:01"),
+                  dst=EthAddr("00:00:00:00:00:02"), type=type, next=next)
+
+def _ip (protocol, next):
+  return ipv4(srcip=IPAddr("10.0.0.1"), dstip=IPAddr("10.0.0.2"),
+              protocol=protocol, next=next)
+
+def samples ():
+  r = []
+  t = tcp(srcport=1234, dstport=80, off=5, payload=b'x' * 64)
+  r.append(("tcp", _eth(_ip(ipv4.TCP_PROTOCOL, t), ethernet.IP_TYPE)))
+  u = udp(srcport=1000, dstport=2000, payload=b'x' * 64)
+  r.append(("udp", _eth(_ip(ipv4.UDP_PROTOCOL, u), ethernet.IP_TYPE)))
+  v = vlan(id=42, eth_type=ethernet.IP_TYPE,
+           next=_ip(ipv4.UDP_PROTOCOL, udp(srcport=1, dstport=2)))
+  r.append(("vlan+udp", _eth(v, ethernet.VLAN_TYPE)))
+  a = arp(opcode=arp.REQUEST, protosrc=IPAddr("10.0.0.1"),
+          protodst=IPAddr("10.0.0.9"))
+  r.append(("arp", _eth(a, ethernet.ARP_TYPE)))
+  return [(name, p.pack()) for name,p in r]
+
+
+def rate (f, arg, seconds):
+  n = 0
+  batch = 200
+  start = time.time()
+  end = start + seconds
+  while True:
+    for i in xrange(batch):
+      f(arg)
+    n += batch
+    now = time.time()
+    if now >= end: break
+  return n / (now - start)
+
+
+def main ():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument('--seconds', type=float, default=0.5,
+                      help='time to spend on each measurement')
+  args = parser.parse_args()
+
+  def from_packet (data):
+    return of.ofp_match.from_packet(ethernet(data), 1, spec_frags=True)
+  def from_raw (data):
+    return of.ofp_match.from_raw(data, 1, spec_frags=True)
+
+  print("%-10s %14s %14s" % ("", "from_packet/s", "from_raw/s"))
+  for name,data in samples():
+    assert from_packet(data) == from_raw(data), name
+    p = rate(from_packet, data, args.seconds)
+    r = rate(from_raw, data, args.seconds)
+    print("%-10s %14.0f %14.0f" % (name, p, r))
+
+
+if __name__ == '__main__':
+  main()
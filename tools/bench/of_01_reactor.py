@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark the of_01 listener loop as the number of switches grows
+
+Starts of_01 in-process with the given reactor, opens a growing number of
+idle "switch" connections to it, and measures the round trip time of echo
+requests on one active connection.  With the select reactor, the cost per
+message grows with the number of connections (and stops working entirely
+past FD_SETSIZE); with the epoll reactor it should stay flat.
+
+Invoke from the top level:
+  ./tools/bench/of_01_reactor.py --reactor=epoll 100 1000 5000 10000
+"""
+
+import sys
+import os
+import time
+import socket
+import struct
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+import pox.core
+core = pox.core.initialize()
+import pox.openflow.of_01 as of_01
+import pox.openflow.libopenflow_01 as of
+
+
+def raise_fd_limit ():
+  try:
+    import resource
+    soft,hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard,hard))
+    return hard
+  except Exception:
+    return None
+
+
+def recv_message (sock):
+  """
+  Reads one OpenFlow message and returns its type
+  """
+  data = b''
+  while len(data) < 8:
+    d = sock.recv(8 - len(data))
+    if not d: raise RuntimeError("Connection closed")
+    data += d
+  _,t,length,_ = struct.unpack("!BBHL", data)
+  length -= 8
+  while length:
+    d = sock.recv(length)
+    if not d: raise RuntimeError("Connection closed")
+    length -= len(d)
+  return t
+
+
+def connect (port):
+  s = socket.create_connection(("127.0.0.1", port))
+  s.settimeout(10)
+  s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+  assert recv_message(s) == of.OFPT_HELLO
+  return s
+
+
+def measure (sock, count):
+  er = of.ofp_echo_request().pack()
+  start = time.time()
+  for i in xrange(count):
+    sock.sendall(er)
+    while recv_message(sock) != of.OFPT_ECHO_REPLY:
+      pass
+  return (time.time() - start) / count
+
+
+def main ():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument('counts', metavar='N', type=int, nargs='*',
+                      default=[10, 100, 500, 1000],
+                      help='numbers of idle connections to measure with')
+  parser.add_argument('--reactor', default='select',
+                      help='of_01 reactor (select or epoll)')
+  parser.add_argument('--port', default=16633, type=int)
+  parser.add_argument('--messages', default=2000, type=int,
+                      help='echo round trips per measurement')
+  args = parser.parse_args()
+
+  limit = raise_fd_limit()
+
+  of_01.launch(port=args.port, reactor=args.reactor)
+  core.goUp()
+  time.sleep(0.5)
+
+  active = connect(args.port)
+  idle = []
+  print("reactor=%s fd limit=%s" % (args.reactor, limit))
+  print("%10s %14s" % ("switches", "usec/message"))
+  try:
+    for n in sorted(args.counts):
+      while len(idle) < n:
+        idle.append(connect(args.port))
+      t = measure(active, args.messages)
+      print("%10i %14.1f" % (n, t * 1000000))
+      sys.stdout.flush()
+  except Exception as e:
+    print("%10i %14s (%s)" % (len(idle), "failed", e))
+  finally:
+    for s in idle:
+      s.close()
+    active.close()
+    core.quit()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark of_01's Connection.read on a stream of OpenFlow messages
+
+Feeds a large stream (a burst of PacketIns by default, or a raw
+switch-to-controller byte stream given with --stream) through
+Connection.read and reports messages per second and the bytes copied
+around in userspace per message (not counting the copy out of the
+socket itself).  The "legacy" row is the old string-concatenating read
+loop, kept here for comparison.
+
+Invoke from the top level:
+  ./tools/bench/of_01_read.py --read-size=16384
+"""
+
+import sys
+import os
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+import pox.core
+core = pox.core.initialize()
+import pox.openflow.of_01 as of_01
+import pox.openflow.libopenflow_01 as of
+
+
+class StreamSocket (object):
+  """
+  Fake socket which hands out a canned stream
+  """
+  def __init__ (self, data):
+    self.data = data
+    self.offset = 0
+  def recv (self, size):
+    d = self.data[self.offset:self.offset+size]
+    self.offset += len(d)
+    return d
+  def recv_into (self, buf, size):
+    d = self.recv(size)
+    buf[:len(d)] = d
+    return len(d)
+  def send (self, data):
+    return len(data)
+
+
+class NullNexus (object):
+  count = 0
+  def raiseEventNoErrors (self, *args, **kw):
+    self.count += 1
+
+
+class CountingConnection (of_01.Connection):
+  copied = 0
+  def _compact_rbuf (self):
+    n = super(CountingConnection,self)._compact_rbuf()
+    self.copied += n
+    return n
+
+
+class LegacyConnection (of_01.Connection):
+  """
+  The old read loop, with copy accounting
+  """
+  copied = 0
+  buf = ''
+  def read (self):
+    d = self.sock.recv(2048)
+    if len(d) == 0:
+      return False
+    self.copied += len(self.buf) + len(d)
+    self.buf += d
+    buf_len = len(self.buf)
+
+    offset = 0
+    while buf_len - offset >= 8:
+      ofp_type = ord(self.buf[offset+1])
+      msg_length = ord(self.buf[offset+2]) << 8 | ord(self.buf[offset+3])
+      if buf_len - offset < msg_length: break
+      new_offset,msg = of_01.unpackers[ofp_type](self.buf, offset)
+      offset = new_offset
+      of_01.handlers[ofp_type](self, msg)
+
+    if offset != 0:
+      self.copied += buf_len - offset
+      self.buf = self.buf[offset:]
+    return True
+
+
+def make_stream (count):
+  msgs = []
+  for i in xrange(count):
+    # Mix of truncated (miss_send_len) and full-size packet data
+    size = 128 if i % 4 else 1500
+    msgs.append(of.ofp_packet_in(in_port=i % 48 + 1, buffer_id=i,
+                                 data=chr(i % 256) * size).pack())
+  return b''.join(msgs), count
+
+
+def run (cls, data, read_size):
+  cls.read_size = read_size
+  con = cls(StreamSocket(data))
+  con.ofnexus = NullNexus()
+  start = time.time()
+  while con.read():
+    pass
+  elapsed = time.time() - start
+  return con.ofnexus.count, elapsed, con.copied
+
+
+def main ():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument('--stream', help='file with a raw OpenFlow stream')
+  parser.add_argument('--messages', type=int, default=50000,
+                      help='number of PacketIns to generate')
+  parser.add_argument('--read-size', type=int, default=of_01.Connection.read_size)
+  args = parser.parse_args()
+
+  if args.stream:
+    data = open(args.stream, "rb").read()
+  else:
+    data,_ = make_stream(args.messages)
+
+  print("%s bytes of OpenFlow" % (len(data),))
+  print("%-8s %10s %12s %16s" % ("", "read size", "msgs/sec", "copied/msg"))
+  for name,cls,rs in (("legacy", LegacyConnection, 2048),
+                      ("ring", CountingConnection, args.read_size)):
+    count,elapsed,copied = run(cls, data, rs)
+    print("%-8s %10i %12.0f %16.1f" % (name, rs, count / elapsed,
+                                       copied / float(count)))
+
+
+if __name__ == '__main__':
+  main()
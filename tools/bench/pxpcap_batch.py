@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark pxpcap's per-packet dispatch against batch dispatch
+
+Writes a pcap file of synthetic packets, then reads it back with pxpcap
+opened offline (so the numbers don't depend on a live interface) using:
+ packet  - dispatch() with a per-packet callback
+ batch   - next_batch() for various batch sizes, splitting each batch
+           into packets with split_batch() the way PCapSwitch does
+Each pass is repeated and the best time is reported.
+
+Needs pxpcap to be built.
+
+Invoke from the top level:
+  ./tools/bench/pxpcap_batch.py --packets=200000
+"""
+
+import sys
+import os
+import time
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+import pox.core
+core = pox.core.initialize()
+import pox.lib.pxpcap as pxpcap
+from pox.lib.pxpcap.writer import PCapRawWriter
+
+
+def write_file (filename, count, size):
+  frame = b'\xff' * 6 + b'\x02\x00\x00\x00\x00\x01' + b'\x88\xb5'
+  frame += b'x' * (size - len(frame))
+  with open(filename, "wb") as f:
+    w = PCapRawWriter(f)
+    for i in xrange(count):
+      w.write(frame, time = i / 1000000.0)
+
+def read_packets (filename):
+  got = [0]
+  def cb (px, data, sec, usec, length):
+    got[0] += 1
+  p = pxpcap.PCap(callback = cb, start = False)
+  p.open_offline(filename)
+  t = time.time()
+  while pxpcap.pcapc.dispatch(p.pcap, 100, cb, p, False, False) > 0:
+    pass
+  t = time.time() - t
+  p.close()
+  return got[0], t
+
+def read_batches (filename, batch_size):
+  got = 0
+  p = pxpcap.PCap(start = False, batch_size = batch_size)
+  p.open_offline(filename)
+  t = time.time()
+  while True:
+    data,records,rv = p.next_batch(allow_threads = False)
+    if rv <= 0: break
+    got += len(pxpcap.split_batch(data, records))
+  t = time.time() - t
+  p.close()
+  return got, t
+
+def main ():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument('--packets', type=int, default=200000)
+  parser.add_argument('--size', type=int, default=64)
+  parser.add_argument('--repeat', type=int, default=3)
+  parser.add_argument('--batch-sizes', default='16,64,256,1024')
+  args = parser.parse_args()
+
+  if not pxpcap.enabled:
+    print("pxpcap isn't built -- nothing to measure")
+    return
+
+  fd,filename = tempfile.mkstemp(suffix=".pcap")
+  os.close(fd)
+  try:
+    write_file(filename, args.packets, args.size)
+    passes = [("packet", lambda: read_packets(filename))]
+    for n in args.batch_sizes.split(","):
+      passes.append(("batch %s" % (n,),
+                     lambda n=int(n): read_batches(filename, n)))
+
+    print("%-12s %12s" % ("", "packets/s"))
+    for name,f in passes:
+      best = None
+      for i in range(args.repeat):
+        n,t = f()
+        assert n == args.packets, "%s read %s packets" % (name, n)
+        if best is None or t < best: best = t
+      print("%-12s %12.0f" % (name, args.packets / best))
+  finally:
+    os.unlink(filename)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare recoco wakeup latency with and without a SelectHub thread
+
+For each mode (the default threaded SelectHub, and the SelectHub run on
+the scheduler's thread), measures how late Timers fire, how late Sleep()
+returns, and how long it takes a task blocked in Select() to see data
+written to its socket by another thread.  --busy adds tasks which just
+keep yielding, so the scheduler always has something else to run.
+
+Invoke from the top level:
+  ./tools/bench/recoco_latency.py --samples=2000 --busy=2
+"""
+
+import sys
+import os
+import time
+import socket
+import argparse
+import threading
+from Queue import Queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from pox.lib.recoco import Scheduler, BaseTask, Select, Sleep, Timer
+
+
+class GenTask (BaseTask):
+  def __init__ (self, func):
+    self.func = func
+    BaseTask.__init__(self)
+
+  def run (self):
+    return self.func()
+
+
+def spinner ():
+  while True:
+    yield 0
+
+def percentile (values, p):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * p))]
+
+def show (name, values):
+  print("  %-8s median %5.0fus  99th %6.0fus  max %6.0fus"
+        % (name, percentile(values, 0.5) * 1e6,
+           percentile(values, 0.99) * 1e6, max(values) * 1e6))
+
+def timer_lags (sched, samples, delay):
+  lags = []
+  done = threading.Event()
+  state = {}
+  def fire ():
+    lags.append(time.time() - state['deadline'])
+    if len(lags) == samples:
+      done.set()
+      return False
+    state['deadline'] = time.time() + delay
+  state['deadline'] = time.time() + delay
+  Timer(delay, fire, recurring=True, scheduler=sched)
+  done.wait()
+  return lags
+
+def sleep_lags (sched, samples, delay):
+  out = Queue()
+  def sleeper ():
+    lags = []
+    for i in xrange(samples):
+      deadline = time.time() + delay
+      yield Sleep(delay)
+      lags.append(time.time() - deadline)
+    out.put(lags)
+  GenTask(sleeper).start(sched)
+  return out.get()
+
+def socket_lags (sched, samples):
+  a,b = socket.socketpair()
+  out = Queue()
+  def reader ():
+    while True:
+      r,w,x = yield Select([b], [], [])
+      d = b.recv(100)
+      out.put(time.time())
+      if d == "q": break
+  GenTask(reader).start(sched)
+  time.sleep(0.1)
+  lags = []
+  for i in xrange(samples):
+    t = time.time()
+    a.send("x")
+    lags.append(out.get() - t)
+  a.send("q")
+  out.get()
+  a.close()
+  b.close()
+  return lags
+
+def main ():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument('--samples', type=int, default=2000)
+  parser.add_argument('--delay', type=float, default=0.001,
+                      help="Timer and Sleep() interval in seconds")
+  parser.add_argument('--busy', type=int, default=0,
+                      help="Number of always-ready tasks to run")
+  parser.add_argument('--backend', choices=['epoll','select'],
+                      default='epoll')
+  args = parser.parse_args()
+
+  for threaded in (True, False):
+    sched = Scheduler(isDefaultScheduler=False, daemon=True,
+                      useEpoll=args.backend == 'epoll',
+                      threadedSelectHub=threaded)
+    for i in xrange(args.busy):
+      GenTask(spinner).start(sched)
+    print("%s SelectHub:" % ("threaded" if threaded else "unthreaded",))
+    show("Timer", timer_lags(sched, args.samples, args.delay))
+    show("Sleep", sleep_lags(sched, args.samples, args.delay))
+    show("socket", socket_lags(sched, args.samples))
+    sched.quit()
+    sched._thread.join(5)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark the recoco SelectHub with lots of timers and sockets
+
+Starts a scheduler with --timers tasks which sleep for random times
+(so some are always firing) and --sockets tasks which each Select() on
+one end of a socketpair and echo whatever arrives.  The main thread then
+does round trips through randomly chosen sockets.  Reports round trips
+per second, round trip latency, and how late the timers fired.
+
+select() can't handle more than 1024 or so file descriptors, so use the
+epoll backend (the default) with lots of sockets.
+
+Invoke from the top level:
+  ./tools/bench/recoco_selecthub.py --timers=10000 --sockets=5000
+"""
+
+import sys
+import os
+import time
+import random
+import socket
+import resource
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from pox.lib.recoco import Scheduler, BaseTask, Select, Sleep
+
+
+class GenTask (BaseTask):
+  def __init__ (self, func):
+    self.func = func
+    BaseTask.__init__(self)
+
+  def run (self):
+    return self.func()
+
+
+def sleeper (lags, low, high):
+  while True:
+    t = random.uniform(low, high)
+    deadline = time.time() + t
+    yield Sleep(t)
+    lags.append(time.time() - deadline)
+
+def echoer (sock):
+  while True:
+    r,w,x = yield Select([sock], [], [sock], 30)
+    if x: break
+    if not r: continue
+    d = sock.recv(100)
+    if not d: break
+    sock.send(d)
+
+def percentile (values, p):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * p))]
+
+def main ():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument('--timers', type=int, default=10000)
+  parser.add_argument('--sockets', type=int, default=5000)
+  parser.add_argument('--round-trips', type=int, default=20000)
+  parser.add_argument('--backend', choices=['epoll','select'],
+                      default='epoll')
+  args = parser.parse_args()
+
+  need = args.sockets * 2 + 256
+  soft,hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+  if soft < need:
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(need, hard), hard))
+
+  sched = Scheduler(isDefaultScheduler=False, daemon=True,
+                    useEpoll=args.backend == 'epoll')
+
+  lags = []
+  t = time.time()
+  for i in xrange(args.timers):
+    GenTask(lambda: sleeper(lags, 0.5, 5)).start(sched, fast=True)
+  ends = []
+  for i in xrange(args.sockets):
+    a,b = socket.socketpair()
+    ends.append(a)
+    GenTask(lambda b=b: echoer(b)).start(sched, fast=True)
+  print("Started %i timers and %i sockets in %.2fs"
+        % (args.timers, args.sockets, time.time() - t))
+  time.sleep(1) # Let everything settle into waiting
+
+  del lags[:]
+  rtts = []
+  start = time.time()
+  for i in xrange(args.round_trips):
+    s = random.choice(ends)
+    t = time.time()
+    s.send("x")
+    s.recv(100)
+    rtts.append(time.time() - t)
+  elapsed = time.time() - start
+
+  print("%.0f round trips/s" % (args.round_trips / elapsed,))
+  print("round trip  median %.0fus  99th %.0fus  max %.0fus"
+        % (percentile(rtts, 0.5) * 1e6, percentile(rtts, 0.99) * 1e6,
+           max(rtts) * 1e6))
+  if lags:
+    print("timer lag   median %.1fms  99th %.1fms  max %.1fms  (%i fired)"
+          % (percentile(lags, 0.5) * 1e3, percentile(lags, 0.99) * 1e3,
+             max(lags) * 1e3, len(lags)))
+
+  sched.quit()
+  for s in ends: s.close()
+
+
+if __name__ == '__main__':
+  main()
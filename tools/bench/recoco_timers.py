@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark lots of recoco Timers
+
+Starts --timers recurring Timers with random intervals (the way per-entry
+timers for host tracking, ARP tables and so on look) and lets them run
+for --duration seconds.  Reports how long it took to create them, how
+many fired per second, and how late they fired (actual fire time minus
+scheduled time).  Then cancels them all and reports how long that took.
+
+Invoke from the top level:
+  ./tools/bench/recoco_timers.py --timers=50000
+"""
+
+import sys
+import os
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from pox.lib.recoco import Scheduler, Timer
+
+
+def percentile (values, p):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * p))]
+
+def main ():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument('--timers', type=int, default=50000)
+  parser.add_argument('--duration', type=float, default=5)
+  parser.add_argument('--low', type=float, default=0.5)
+  parser.add_argument('--high', type=float, default=5)
+  args = parser.parse_args()
+
+  sched = Scheduler(isDefaultScheduler=False, daemon=True)
+
+  lags = []
+  class Entry (object):
+    def __init__ (self, interval):
+      self.interval = interval
+      self.deadline = time.time() + interval
+    def expire (self):
+      now = time.time()
+      lags.append(now - self.deadline)
+      self.deadline = now + self.interval
+
+  t = time.time()
+  timers = []
+  for i in xrange(args.timers):
+    e = Entry(random.uniform(args.low, args.high))
+    timers.append(Timer(e.interval, e.expire, recurring=True,
+                        scheduler=sched))
+  print("Started %i timers in %.2fs" % (args.timers, time.time() - t))
+
+  time.sleep(args.duration)
+  fired = len(lags)
+  print("%.0f timers fired/s" % (fired / args.duration,))
+  if fired:
+    print("timer lag   median %.1fms  99th %.1fms  max %.1fms"
+          % (percentile(lags, 0.5) * 1e3, percentile(lags, 0.99) * 1e3,
+             max(lags) * 1e3))
+  stats = sched.timers.stats()
+  print("wheel lag   avg %.1fms  max %.1fms  (%i fired, %i pending)"
+        % (stats['lag_avg'] * 1e3, stats['lag_max'] * 1e3,
+           stats['fired'], stats['pending']))
+
+  t = time.time()
+  for timer in timers:
+    timer.cancel()
+  print("Cancelled %i timers in %.2fs" % (args.timers, time.time() - t))
+
+  sched.quit()
+
+
+if __name__ == '__main__':
+  main()
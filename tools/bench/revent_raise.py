@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark revent's raiseEvent() with varying numbers of listeners
+
+For each listener count, raises an event by class (so it's created
+only if there are listeners, like PacketIn) and by instance, with
+handlers which return None, and reports raises per second.  "once"
+adds a listener which removes itself each time (and is re-added), so
+the general path is measured too.
+
+Invoke from the top level:
+  ./tools/bench/revent_raise.py --listeners=1,5,20
+"""
+
+import sys
+import os
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from pox.lib.revent import Event, EventMixin
+
+
+class Ping (Event):
+  def __init__ (self, n):
+    Event.__init__(self)
+    self.n = n
+
+class Source (EventMixin):
+  _eventMixin_events = set([Ping])
+
+
+def handler (event):
+  pass
+
+def rate (f, count):
+  start = time.time()
+  f(count)
+  return count / (time.time() - start)
+
+def main ():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument('--listeners', default="1,5,20")
+  parser.add_argument('--raises', type=int, default=200000)
+  args = parser.parse_args()
+
+  print("listeners      by class   by instance          once")
+  for n in [int(x) for x in args.listeners.split(",")]:
+    source = Source()
+    for i in xrange(n):
+      source.addListener(Ping, handler)
+
+    def by_class (count):
+      raiseEvent = source.raiseEvent
+      for i in xrange(count):
+        raiseEvent(Ping, i)
+
+    def by_instance (count):
+      raiseEvent = source.raiseEvent
+      for i in xrange(count):
+        raiseEvent(Ping(i))
+
+    def once (count):
+      raiseEvent = source.raiseEvent
+      addListener = source.addListener
+      for i in xrange(count):
+        addListener(Ping, handler, once=True)
+        raiseEvent(Ping, i)
+
+    print("%9i  %12.0f  %12.0f  %12.0f"
+          % (n, rate(by_class, args.raises), rate(by_instance, args.raises),
+             rate(once, args.raises // 10)))
+
+
+if __name__ == '__main__':
+  main()
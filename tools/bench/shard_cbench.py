@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+cbench-style PacketIn throughput test for sharded POX
+
+Starts POX running misc.cbench either plainly or sharded across worker
+processes (with the shard component), connects a number of emulated
+switches with distinct DPIDs, and has each keep --window PacketIns
+outstanding (like cbench's throughput mode).  Reports how many flow_mods
+came back per second.
+
+The emulated switches all run in this process, so on a machine with few
+cores they compete with POX for CPU.
+
+Invoke from the top level:
+  ./tools/bench/shard_cbench.py --switches=16 0 1 2 4
+(0 means unsharded.)
+"""
+
+import sys
+import os
+import time
+import socket
+import select
+import struct
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+import pox.openflow.libopenflow_01 as of
+
+TOP = os.path.join(os.path.dirname(__file__), "..", "..")
+
+
+class FakeSwitch (object):
+  def __init__ (self, dpid, port, packet_in):
+    self.dpid = dpid
+    self.packet_in = packet_in
+    self.sock = socket.create_connection(("127.0.0.1", port))
+    self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    self.sock.setblocking(0)
+    self.buf = b''
+    self.up = False
+    self.flow_mods = 0
+    self._send(of.ofp_hello().pack())
+
+  def fileno (self):
+    return self.sock.fileno()
+
+  def _send (self, data):
+    self.sock.setblocking(1)
+    self.sock.sendall(data)
+    self.sock.setblocking(0)
+
+  def read (self):
+    try:
+      d = self.sock.recv(0x10000)
+    except socket.error:
+      return
+    if not d: raise RuntimeError("Switch %i disconnected" % (self.dpid,))
+    buf = self.buf + d
+    out = []
+    got = 0
+    while len(buf) >= 8:
+      _,t,length,xid = struct.unpack_from("!BBHL", buf)
+      if len(buf) < length: break
+      if t == of.OFPT_FLOW_MOD:
+        got += 1
+      elif t == of.OFPT_FEATURES_REQUEST:
+        out.append(of.ofp_features_reply(xid=xid, datapath_id=self.dpid,
+                                         ports=[]).pack())
+      elif t == of.OFPT_BARRIER_REQUEST:
+        out.append(of.ofp_barrier_reply(xid=xid).pack())
+        self.up = True
+      elif t == of.OFPT_ECHO_REQUEST:
+        out.append(buf[0] + chr(of.OFPT_ECHO_REPLY) + buf[2:length])
+      buf = buf[length:]
+    self.buf = buf
+    self.flow_mods += got
+    # Keep the window full
+    out.append(self.packet_in * got)
+    self._send(b''.join(out))
+
+
+def run (args, workers):
+  pox = [sys.executable, os.path.join(TOP, "pox.py"), "log.level",
+         "--WARNING"]
+  if workers:
+    pox += ["shard", "--workers=%i" % (workers,), "--port=%i" % (args.port,),
+            "--reactor=" + args.reactor,
+            "--components=log.level --WARNING misc.cbench"]
+  else:
+    pox += ["openflow.of_01", "--port=%i" % (args.port,),
+            "--reactor=" + args.reactor, "misc.cbench"]
+  proc = subprocess.Popen(pox, stdin=subprocess.PIPE)
+  try:
+    time.sleep(2 + workers * 0.5)
+
+    frame = b'\xff' * 6 + b'\x02' + b'\x00' * 4 + b'\x01' + b'\x08\x00'
+    frame += b'\x00' * (60 - len(frame))
+    packet_in = of.ofp_packet_in(buffer_id=1, in_port=1, data=frame).pack()
+    switches = [FakeSwitch(i + 1, args.port, packet_in)
+                for i in range(args.switches)]
+    ep = select.epoll()
+    fds = {}
+    for s in switches:
+      fds[s.fileno()] = s
+      ep.register(s.fileno(), select.EPOLLIN)
+
+    def loop (until):
+      while time.time() < until:
+        for fd,e in ep.poll(0.1):
+          fds[fd].read()
+
+    deadline = time.time() + 10
+    while not all(s.up for s in switches):
+      loop(time.time() + 0.1)
+      if time.time() > deadline:
+        raise RuntimeError("Only %i switches connected"
+                           % (sum(s.up for s in switches),))
+    loop(time.time() + 0.5)
+
+    for s in switches:
+      s._send(packet_in * args.window)
+    loop(time.time() + 1) # Warm up
+    before = sum(s.flow_mods for s in switches)
+    t = time.time()
+    loop(t + args.duration)
+    t = time.time() - t
+    count = sum(s.flow_mods for s in switches) - before
+    per_switch = [s.flow_mods for s in switches]
+    for s in switches:
+      s.sock.close()
+    return count / t, min(per_switch), max(per_switch)
+  finally:
+    proc.terminate()
+    proc.wait()
+
+
+def main ():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument('workers', metavar='N', type=int, nargs='*',
+                      default=[0, 1, 2],
+                      help='numbers of workers to try (0 is unsharded)')
+  parser.add_argument('--switches', type=int, default=16)
+  parser.add_argument('--window', type=int, default=100)
+  parser.add_argument('--duration', type=float, default=5)
+  parser.add_argument('--port', type=int, default=16633)
+  parser.add_argument('--reactor', default='select',
+                      help='of_01 reactor (select or epoll)')
+  args = parser.parse_args()
+
+  print("%8s %14s %22s" % ("workers", "flow_mods/s", "per switch min/max"))
+  for n in args.workers:
+    rate,lo,hi = run(args, n)
+    print("%8s %14.0f %11i/%i" % (n or "-", rate, lo, hi))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark compiled action programs against the per-action handlers
+
+For a few typical action lists, reports packets per second for running
+the software switch's _action_xxx handlers on a parsed packet (and then
+packing it for output), and for running the compiled program on the raw
+packet.
+
+Invoke from the top level:
+  ./tools/bench/switch_actions.py --seconds=0.5
+"""
+
+import sys
+import os
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+import pox.core
+core = pox.core.initialize()
+import pox.openflow.libopenflow_01 as of
+from pox.datapaths.switch import SoftwareSwitchBase
+from pox.lib.packet import ethernet, ipv4, tcp
+from pox.lib.addresses import EthAddr, IPAddr
+
+
+class NullSwitch (SoftwareSwitchBase):
+  def _output_packet_physical (self, packet, port_no):
+    if isinstance(packet, ethernet):
+      packet.pack()
+
+
+def action_lists ():
+  return [
+    ("output", [of.ofp_action_output(port=2)]),
+    ("set_dl_dst", [of.ofp_action_dl_addr.set_dst(EthAddr("02:00:00:00:00:09")),
+                    of.ofp_action_output(port=2)]),
+    ("nat", [of.ofp_action_nw_addr.set_src(IPAddr("192.168.1.1")),
+             of.ofp_action_tp_port.set_src(40000),
+             of.ofp_action_output(port=2)]),
+    ("vlan", [of.ofp_action_vlan_vid(vlan_vid=10),
+              of.ofp_action_output(port=2)]),
+  ]
+
+def make_packet ():
+  t = tcp(srcport=1234, dstport=80, off=5, payload=b'x' * 64)
+  ip = ipv4(srcip=IPAddr("10.0.0.1"), dstip=IPAddr("10.0.0.2"),
+            protocol=ipv4.TCP_PROTOCOL, next=t)
+  return ethernet(src=EthAddr("02:00:00:00:00:01"),
+                  dst=EthAddr("02:00:00:00:00:02"),
+                  type=ethernet.IP_TYPE, next=ip).pack()
+
+def rate (f, seconds):
+  n = 0
+  start = time.time()
+  end = start + seconds
+  while True:
+    for i in xrange(200):
+      f()
+    n += 200
+    now = time.time()
+    if now >= end: break
+  return n / (now - start)
+
+
+def main ():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument('--seconds', type=float, default=0.5,
+                      help='time to spend on each measurement')
+  args = parser.parse_args()
+
+  s = NullSwitch(1, ports=4)
+  s.log.setLevel("WARNING")
+  data = make_packet()
+
+  print("%-12s %12s %12s" % ("", "handlers/sec", "compiled/sec"))
+  for name,actions in action_lists():
+    program = s._compile_actions(actions)
+    h = rate(lambda: s._process_actions_for_packet(actions, ethernet(data), 1),
+             args.seconds)
+    c = rate(lambda: s._run_program(program, data, 1), args.seconds)
+    print("%-12s %12.0f %12.0f" % (name, h, c))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark SoftwareSwitch.rx_packets against per-packet rx_packet
+
+Uses the same trace and table as switch_microflow.py.  The "single" row
+parses each packet and hands it to rx_packet() the way PCapSwitch used
+to; the "batch" rows hand unparsed packets to rx_packets() in batches of
+the given size.
+
+Invoke from the top level:
+  ./tools/bench/switch_batch.py --flows=1000 --packets=20000
+"""
+
+import sys
+import os
+import time
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+import pox.core
+core = pox.core.initialize()
+from pox.lib.packet import ethernet
+from switch_microflow import write_trace, read_trace, make_switch
+
+
+def replay_single (switch, packets):
+  start = time.time()
+  for data in packets:
+    switch.rx_packet(ethernet(data), 1, data)
+  return len(packets) / (time.time() - start)
+
+def replay_batch (switch, packets, size):
+  batches = [[(None, 1, data) for data in packets[i:i+size]]
+             for i in xrange(0, len(packets), size)]
+  start = time.time()
+  for batch in batches:
+    switch.rx_packets(batch)
+  return len(packets) / (time.time() - start)
+
+
+def main ():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument('--flows', type=int, default=1000)
+  parser.add_argument('--packets', type=int, default=20000)
+  parser.add_argument('--entries', type=int, default=2000)
+  parser.add_argument('--batch', type=int, action='append',
+                      help='batch size (may be repeated)')
+  args = parser.parse_args()
+  sizes = args.batch or [1, 8, 64]
+
+  fd,filename = tempfile.mkstemp(suffix=".pcap")
+  os.close(fd)
+  try:
+    write_trace(filename, args.flows, args.packets)
+    packets = read_trace(filename)
+  finally:
+    os.unlink(filename)
+
+  print("%-10s %12s" % ("", "packets/sec"))
+  switch = make_switch(args.flows, args.entries)
+  replay_single(switch, packets) # Warm up the microflow cache
+  print("%-10s %12.0f" % ("single", replay_single(switch, packets)))
+  for size in sizes:
+    print("%-10s %12.0f" % ("batch %s" % (size,),
+                            replay_batch(switch, packets, size)))
+
+
+if __name__ == '__main__':
+  main()
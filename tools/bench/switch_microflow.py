@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+# Copyright 2013 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark SoftwareSwitch.rx_packet with and without the microflow cache
+
+Writes a pcap trace of packets from a number of UDP flows, replays it
+through a software switch with a few thousand wildcarded flow entries,
+and reports packets per second with the cache disabled and with a warm
+cache.  Pass --pcap to replay an existing trace instead.
+
+Invoke from the top level:
+  ./tools/bench/switch_microflow.py --flows=1000 --packets=20000
+"""
+
+import sys
+import os
+import time
+import random
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+import pox.core
+core = pox.core.initialize()
+import pox.openflow.libopenflow_01 as of
+from pox.openflow.flow_table import TableEntry
+from pox.datapaths.switch import SoftwareSwitch
+from pox.lib.packet import ethernet, ipv4, udp
+from pox.lib.addresses import EthAddr, IPAddr
+from pox.lib.pxpcap.writer import PCapRawWriter
+from pox.lib.pxpcap.parser import PCapParser
+
+
+PORTS = 8
+
+def _mac (n):
+  return EthAddr("02:00:00:00:%02x:%02x" % ((n >> 8) & 0xff, n & 0xff))
+
+def write_trace (filename, flows, packets):
+  rand = random.Random(1)
+  f = open(filename, "wb")
+  w = PCapRawWriter(f)
+  for i in xrange(packets):
+    n = rand.randrange(flows)
+    u = udp(srcport=1000 + n, dstport=9999, payload=b'x' * 64)
+    ip = ipv4(srcip=IPAddr(0x0a000000 + n), dstip=IPAddr(0x0b000000 + n),
+              protocol=ipv4.UDP_PROTOCOL, next=u, id=i & 0xffff)
+    eth = ethernet(src=_mac(n), dst=_mac(n + 1), type=ethernet.IP_TYPE,
+                   next=ip)
+    w.write(eth.pack(), time=i)
+  f.close()
+
+def read_trace (filename):
+  packets = []
+  def cb (data, parser):
+    packets.append(data)
+  PCapParser(cb).feed(open(filename, "rb").read())
+  return packets
+
+def make_switch (flows, entries):
+  s = SoftwareSwitch(1, ports=PORTS)
+  s.log.setLevel("WARNING")
+  for i in xrange(entries):
+    s.table.add_entry(TableEntry(priority=100,
+        match=of.ofp_match(dl_dst=_mac(i + 1)),
+        actions=[of.ofp_action_output(port=i % (PORTS - 1) + 2)]))
+  for i in xrange(entries // 10):
+    s.table.add_entry(TableEntry(priority=200,
+        match=of.ofp_match(dl_type=0x800, nw_proto=17, tp_dst=5000 + i),
+        actions=[of.ofp_action_output(port=2)]))
+  return s
+
+def replay (switch, packets):
+  start = time.time()
+  for data in packets:
+    switch.rx_packet(ethernet(data), 1, data)
+  return len(packets) / (time.time() - start)
+
+
+def main ():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument('--flows', type=int, default=1000)
+  parser.add_argument('--packets', type=int, default=20000)
+  parser.add_argument('--entries', type=int, default=2000)
+  parser.add_argument('--pcap', help='replay this trace instead')
+  args = parser.parse_args()
+
+  if args.pcap:
+    packets = read_trace(args.pcap)
+  else:
+    fd,filename = tempfile.mkstemp(suffix=".pcap")
+    os.close(fd)
+    try:
+      write_trace(filename, args.flows, args.packets)
+      packets = read_trace(filename)
+    finally:
+      os.unlink(filename)
+
+  print("%-10s %12s %8s" % ("", "packets/sec", "hit %"))
+  for name in ("disabled", "warm"):
+    switch = make_switch(args.flows, args.entries)
+    if name == "disabled":
+      switch.microflow_cache_size = 0
+    else:
+      replay(switch, packets) # Warm it up
+      switch.microflow_hits = switch.microflow_misses = 0
+    rate = replay(switch, packets)
+    total = switch.microflow_hits + switch.microflow_misses
+    hits = 100.0 * switch.microflow_hits / total if total else 0
+    print("%-10s %12.0f %8.1f" % (name, rate, hits))
+
+
+if __name__ == '__main__':
+  main()